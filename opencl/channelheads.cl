@@ -24,6 +24,7 @@
 ///                         with @p true = masked, @p false = good
 /// @param[in]  uv_array: flow unit velocity vector grid (padded)
 /// @param[in,out] mapping_array: flag grid recording status of each pixel (padded)
+/// @param[in]  n_seed_points: number of seed points, excluding "padding" seeds
 ///
 /// @returns void
 ///
@@ -32,8 +33,9 @@
 __kernel void map_channel_heads(
         __global const float2 *seed_point_array,
         __global const bool   *mask_array,
-        __global const float2 *uv_array,
-        __global       uint   *mapping_array
+        __global const UV_STORE *uv_array,
+        __global       uint   *mapping_array,
+        const          uint    n_seed_points GRID_PARAM
    )
 {
     // For every non-masked pixel, all of which are temporarily flagged as
@@ -52,7 +54,7 @@ __kernel void map_channel_heads(
                 get_global_size(0u));
     }
 #endif
-    if (global_id>=N_SEED_POINTS) {
+    if (global_id>=n_seed_points) {
         // This is a "padding" seed, so let's bail
         return;
     }
@@ -62,7 +64,7 @@ __kernel void map_channel_heads(
                      vec = seed_point_array[global_id], next_vec;
 
     // Remember here
-    idx = get_array_idx(vec);
+    idx = get_array_idx(vec GRID_ARG);
 //#ifdef DEBUG
 //    printf("Map channel heads (%d) @ %d %g,%g\n",
 //            global_id, idx,vec[0],vec[1]);
@@ -71,16 +73,16 @@ __kernel void map_channel_heads(
     // Integrate downstream one pixel
     while (prev_idx==idx && !mask_array[idx] && n_steps<MAX_N_STEPS) {
         compute_step_vec(dt, uv_array, &dxy1_vec, &dxy2_vec, &uv1_vec, &uv2_vec,
-                         vec, &next_vec, &idx);
+                         vec, &next_vec, &idx GRID_ARG);
         channelheads_runge_kutta_step(&dt, &dl, &dxy1_vec, &dxy2_vec,
-                                      &vec, &next_vec, &n_steps, &idx);
+                                      &vec, &next_vec, &n_steps, &idx GRID_ARG);
     }
     if (n_steps>=MAX_N_STEPS) {
         return;
     }
     // Unset the channel head flag unless we're at a provisional channel head
     if (!mask_array[idx]) {
-        idx = get_array_idx(vec);
+        idx = get_array_idx(vec GRID_ARG);
         if (   ((~mapping_array[idx]) & IS_THINCHANNEL)
             // If here is not channel...
             || (mapping_array[prev_idx] & IS_THINCHANNEL) ) {
@@ -102,7 +104,7 @@ __kernel void map_channel_heads(
 //#define CHECK_ISNOT_CHANNELHEAD(idx) ((mapping_array[idx] & WAS_CHANNELHEAD)==0)
 #define CHECK_IS_MASKED(idx) (mask_array[idx])
 #define CHECK_THINCHANNEL(nbr_vec_x,nbr_vec_y) { \
-           idx = get_array_idx((float2)(nbr_vec_x,nbr_vec_y)); \
+           idx = get_array_idx((float2)(nbr_vec_x,nbr_vec_y) GRID_ARG); \
            flag += ( (CHECK_IS_THINCHANNEL(idx) ) \
                      ); \
         }
@@ -135,6 +137,7 @@ __kernel void map_channel_heads(
 ///                         with @p true = masked, @p false = good
 /// @param[in]  uv_array: flow unit velocity vector grid (padded)
 /// @param[in,out] mapping_array: flag grid recording status of each pixel (padded)
+/// @param[in]  n_seed_points: number of seed points, excluding "padding" seeds
 ///
 /// @returns void
 ///
@@ -143,18 +146,19 @@ __kernel void map_channel_heads(
 __kernel void prune_channel_heads(
         __global const float2 *seed_point_array,
         __global const bool   *mask_array,
-        __global const float2 *uv_array,
-        __global       uint   *mapping_array
+        __global const UV_STORE *uv_array,
+        __global       uint   *mapping_array,
+        const          uint    n_seed_points GRID_PARAM
    )
 {
     // For every provisional channel head pixel...
 
     const uint global_id = get_global_id(0u)+get_global_id(1u)*get_global_size(0u);
-    if (global_id>=N_SEED_POINTS) {
+    if (global_id>=n_seed_points) {
         // This is a "padding" seed, so let's bail
 #ifdef DEBUG
         printf("Bailing @ %d !in [%d-%d]\n",
-                global_id,get_global_offset(0u),N_SEED_POINTS-1);
+                global_id,get_global_offset(0u),n_seed_points-1);
 #endif
         return;
     }
@@ -187,7 +191,7 @@ __kernel void prune_channel_heads(
     // If flag==1, one and only one nbr is a thin channel pixel
     // Otherwise, remove this provisional channel head.
     if (flag!=1u) {
-        idx = get_array_idx(vec);
+        idx = get_array_idx(vec GRID_ARG);
         atomic_and(&mapping_array[idx],~IS_CHANNELHEAD);
         // If there are no thin channel neighbors AT ALL we must be at an isolated pixel.
         // Thus redesignate this pixel as 'not channelized at all'.
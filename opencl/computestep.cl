@@ -25,7 +25,7 @@
 ///    - KERNEL_HILLSLOPE_LENGTHS
 ///
 /// @param[in]      dt: delta time step
-/// @param[in]      uv_array  (float *,  RO): gridded velocity vector components (u,v)
+/// @param[in]      uv_array  (UV_STORE *, RO): gridded velocity vector components (u,v)
 /// @param[in,out]  dxy1_vec: R-K first order delta step vector
 /// @param[in,out]  dxy2_vec: R-K second order delta step vector
 /// @param[in,out]  uv1_vec: flow velocity vector at current coordinate (at @p vec)
@@ -34,26 +34,27 @@
 /// @param[in]      vec: current (x,y) coordinate vector at tip of streamline trajectory
 /// @param[in,out]  next_vec: next (x,y) coordinate vector on streamline trajectory
 /// @param[in,out]  idx: array index of pixel at current (x,y) position
+/// @param[in]      downup_sign: +1 downstream, -1 upstream (only if IS_BIDIRECTIONAL)
 ///
 /// @returns void
 ///
 /// @ingroup trajectoryfns
 ///
 static inline void compute_step_vec(const float dt,
-                                    const __global float2 *uv_array,
+                                    const __global UV_STORE *uv_array,
                                     float2 *dxy1_vec, float2 *dxy2_vec,
                                     float2 *uv1_vec, float2 *uv2_vec,
                                     const float2 vec,
-                                    float2 *next_vec, uint *idx) {
+                                    float2 *next_vec, uint *idx DOWNUP_SIGN_PARAM GRID_PARAM) {
     // Calculate RK2 next pt vector and approx into a fixed-point-res vector.
     // Do this using randomly biased =jittered flow vector field.
     // Then get the next pixel's data array index.
-    *uv1_vec = speed_interpolator(vec,uv_array);
-    *dxy1_vec = approximate(*uv1_vec*COMBO_FACTOR*dt);
-    *uv2_vec = speed_interpolator(vec+*dxy1_vec,uv_array);
-    *dxy2_vec = approximate(0.5f*(*dxy1_vec+*uv2_vec*COMBO_FACTOR*dt));
+    *uv1_vec = speed_interpolator(vec,uv_array GRID_ARG);
+    *dxy1_vec = approximate(*uv1_vec*SIGNED_COMBO_FACTOR*dt);
+    *uv2_vec = speed_interpolator(vec+*dxy1_vec,uv_array GRID_ARG);
+    *dxy2_vec = approximate(0.5f*(*dxy1_vec+*uv2_vec*SIGNED_COMBO_FACTOR*dt));
     *next_vec = vec+*dxy2_vec;
-    *idx = get_array_idx(*next_vec);
+    *idx = get_array_idx(*next_vec GRID_ARG);
 }
 #endif
 
@@ -68,7 +69,7 @@ static inline void compute_step_vec(const float dt,
 /// Compiled if KERNEL_INTEGRATE_FIELDS and IS_RNG_AVAILABLE is defined.
 ///
 /// @param[in]      dt: delta time step
-/// @param[in]      uv_array  (float *,  RO): gridded velocity vector components (u,v)
+/// @param[in]      uv_array  (UV_STORE *, RO): gridded velocity vector components (u,v)
 /// @param[in,out]  rng_state: RNG state (thus initally the seed) and RNG variate
 /// @param[in,out]  dxy1_vec: R-K first order delta step vector
 /// @param[in,out]  dxy2_vec: R-K second order delta step vector
@@ -78,30 +79,31 @@ static inline void compute_step_vec(const float dt,
 /// @param[in]      vec: current (x,y) coordinate vector at tip of streamline trajectory
 /// @param[in,out]  next_vec: next (x,y) coordinate vector on streamline trajectory
 /// @param[in,out]  idx: array index of pixel at current (x,y) position
+/// @param[in]      downup_sign: +1 downstream, -1 upstream (only if IS_BIDIRECTIONAL)
 ///
 /// @returns void
 ///
 /// @ingroup trajectoryfns
 ///
 static inline void compute_step_vec_jittered(const float dt,
-                                             const __global float2 *uv_array,
+                                             const __global UV_STORE *uv_array,
                                              uint *rng_state,
                                              float2 *dxy1_vec, float2 *dxy2_vec,
                                              float2 *uv1_vec,  float2 *uv2_vec,
                                              const float2 vec, float2 *next_vec,
-                                             uint *idx) {
+                                             uint *idx DOWNUP_SIGN_PARAM GRID_PARAM) {
     // Calculate RK2 next pt vector and approx into a fixed-point-res vector.
     // Do this using randomly biased aka jittered flow vector field.
     // Then get the next pixel's data array index.
-    *uv1_vec = speed_interpolator(vec,uv_array);
+    *uv1_vec = speed_interpolator(vec,uv_array GRID_ARG);
     *uv1_vec += lehmer_rand_vec(rng_state)*JITTER_MAGNITUDE;
     *uv1_vec /= fast_length(*uv1_vec);
-    *dxy1_vec = approximate(*uv1_vec*COMBO_FACTOR*dt);
-    *uv2_vec = speed_interpolator(vec+*dxy1_vec,uv_array);
+    *dxy1_vec = approximate(*uv1_vec*SIGNED_COMBO_FACTOR*dt);
+    *uv2_vec = speed_interpolator(vec+*dxy1_vec,uv_array GRID_ARG);
     *uv2_vec += lehmer_rand_vec(rng_state)*JITTER_MAGNITUDE;
     *uv2_vec /= fast_length(*uv2_vec);
-    *dxy2_vec = approximate(0.5f*(*dxy1_vec+*uv2_vec*COMBO_FACTOR*dt));
+    *dxy2_vec = approximate(0.5f*(*dxy1_vec+*uv2_vec*SIGNED_COMBO_FACTOR*dt));
     *next_vec = vec+*dxy2_vec;
-    *idx = get_array_idx(*next_vec);
+    *idx = get_array_idx(*next_vec GRID_ARG);
 }
 #endif
@@ -18,6 +18,7 @@
 ///                            with @p true = masked, @p false = good
 /// @param[in]     uv_array: flow unit velocity vector grid (padded)
 /// @param[in,out] mapping_array: flag grid recording status of each pixel (padded)
+/// @param[in]  n_seed_points: number of seed points, excluding "padding" seeds
 ///
 /// @returns void
 ///
@@ -26,14 +27,15 @@
 __kernel void connect_channels(
         __global const float2 *seed_point_array,
         __global const bool   *mask_array,
-        __global const float2 *uv_array,
-        __global       uint   *mapping_array
+        __global const UV_STORE *uv_array,
+        __global       uint   *mapping_array,
+        const          uint    n_seed_points GRID_PARAM
    )
 {
     // For every non-masked pixel...
 
     const uint global_id = get_global_id(0u)+get_global_id(1u)*get_global_size(0u);
-    if (global_id>=N_SEED_POINTS) {
+    if (global_id>=n_seed_points) {
         // This is a "padding" seed, so let's bail
         return;
     }
@@ -58,17 +60,17 @@ __kernel void connect_channels(
 
     // Remember here
     prev_vec = vec;
-    idx = get_array_idx(vec);
+    idx = get_array_idx(vec GRID_ARG);
     prev_idx = idx;
     // Integrate downstream one pixel
     while (prev_idx==idx && !mask_array[idx] && n_steps!=MAX_N_STEPS) {
         compute_step_vec(dt, uv_array, &dxy1_vec, &dxy2_vec, &uv1_vec, &uv2_vec,
-                         vec, &next_vec, &idx);
+                         vec, &next_vec, &idx GRID_ARG);
         if (!mask_array[idx]) {
             if (connect_runge_kutta_step_record(&dt, &dl, &l_trajectory,
                                                 &dxy1_vec, &dxy2_vec, &vec, &prev_vec,
                                                 &next_vec, &n_steps, &idx, &prev_idx,
-                                                trajectory_vec))
+                                                trajectory_vec GRID_ARG))
                 continue;
         }
     }
@@ -76,12 +78,12 @@ __kernel void connect_channels(
     while ((mapping_array[idx] & IS_CHANNEL)==0 && !mask_array[idx]
                                           && n_steps!=INTERCHANNEL_MAX_N_STEPS) {
         compute_step_vec(dt, uv_array, &dxy1_vec, &dxy2_vec, &uv1_vec, &uv2_vec,
-                         vec, &next_vec, &idx);
+                         vec, &next_vec, &idx GRID_ARG);
         if (!mask_array[idx]) {
             if (connect_runge_kutta_step_record(&dt, &dl, &l_trajectory,
                                                 &dxy1_vec, &dxy2_vec, &vec, &prev_vec,
                                                 &next_vec, &n_steps, &idx, &prev_idx,
-                                                trajectory_vec))
+                                                trajectory_vec GRID_ARG))
                 continue;
         }
     }
@@ -91,7 +93,7 @@ __kernel void connect_channels(
         // Now we need to designate all intervening pixels since the last channel pixel
         //   as 'intervening channel' type=3.
         vec = current_seed_point_vec;
-        idx = get_array_idx(vec);
+        idx = get_array_idx(vec GRID_ARG);
         step = 0u;
         while (!mask_array[idx] && step<n_steps-1) {
             // If this pixel was between channels, flag as both (1=channel; 2=between)
@@ -100,7 +102,7 @@ __kernel void connect_channels(
             }
             // Increment along recorded trajectory, skipping first point
             vec = vec + uncompress(trajectory_vec[step]);
-            idx = get_array_idx(vec);
+            idx = get_array_idx(vec GRID_ARG);
             step++;
         }
     }
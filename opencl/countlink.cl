@@ -26,6 +26,7 @@
 ///                             downstream from dominant channel head (padded)
 /// @param[in,out] link_array: link grid providing the grid array index of the next
 ///                             downstream pixel (padded)
+/// @param[in]  n_seed_points: number of seed points, excluding "padding" seeds
 ///
 /// @returns void
 ///
@@ -34,20 +35,21 @@
 __kernel void count_downchannels(
         __global const float2 *seed_point_array,
         __global const bool   *mask_array,
-        __global const float2 *uv_array,
+        __global const UV_STORE *uv_array,
         __global       uint  *mapping_array,
         __global       uint  *count_array,
-        __global       uint  *link_array
+        __global       uint  *link_array,
+        const          uint    n_seed_points GRID_PARAM
    )
 {
     // For every channel head pixel...
 
     const uint global_id = get_global_id(0u)+get_global_id(1u)*get_global_size(0u);
-    if (global_id>=N_SEED_POINTS) {
+    if (global_id>=n_seed_points) {
         // This is a "padding" seed, so let's bail
 //#ifdef DEBUG
 //        printf("Bailing @ %d !in [%d-%d]\n",
-//                global_id,get_global_offset(0u),N_SEED_POINTS-1);
+//                global_id,get_global_offset(0u),n_seed_points-1);
 //#endif
         return;
     }
@@ -70,7 +72,7 @@ __kernel void count_downchannels(
                      vec = seed_point_array[global_id], next_vec;
 
     // Remember here
-    idx = get_array_idx(vec);
+    idx = get_array_idx(vec GRID_ARG);
     prev_idx = idx;
     // Initialize the TEMPORARY downstream counter - used here to terminate
     //   tracing if we land onto a "superior channel" pixel already traced
@@ -81,9 +83,9 @@ __kernel void count_downchannels(
     // HACK: factor 1000x
     while (!mask_array[idx] && n_steps<1000*(MAX_N_STEPS)) {
         compute_step_vec(dt, uv_array, &dxy1_vec, &dxy2_vec, &uv1_vec, &uv2_vec,
-                         vec, &next_vec, &idx);
+                         vec, &next_vec, &idx GRID_ARG);
         if (countlink_runge_kutta_step(&dt, &dl, &dxy1_vec, &dxy2_vec,
-                                       &vec, &next_vec, &idx, mapping_array)) {
+                                       &vec, &next_vec, &idx, mapping_array GRID_ARG)) {
             break;
         }
         n_steps++;
@@ -126,6 +128,8 @@ __kernel void count_downchannels(
 /// @param[in,out]  mapping_array      (uint *,   RW):
 /// @param[in,out]  count_array        (uint *,   RW):
 /// @param[in,out]  link_array         (uint *,   RW):
+/// @param[in]  n_seed_points: number of seed points, excluding "padding" seeds
+/// @param[in]  grid: grid geometry parameters (see grid_params_t)
 ///
 /// @returns void
 ///
@@ -134,15 +138,16 @@ __kernel void count_downchannels(
 __kernel void flag_downchannels(
         __global const float2 *seed_point_array,
         __global const bool   *mask_array,
-        __global const float2 *uv_array,
+        __global const UV_STORE *uv_array,
         __global        uint  *mapping_array,
         __global        uint  *count_array,
-        __global const  uint  *link_array )
+        __global const  uint  *link_array,
+        const          uint    n_seed_points GRID_PARAM )
 {
     // For every channel head pixel...
 
     const uint global_id = get_global_id(0u)+get_global_id(1u)*get_global_size(0u);
-    if (global_id>=N_SEED_POINTS) {
+    if (global_id>=n_seed_points) {
         // This is a "padding" seed, so let's bail
         return;
     }
@@ -162,7 +167,7 @@ __kernel void flag_downchannels(
     __private float2 vec = seed_point_array[global_id];
 
     // Remember here
-    channelhead_idx = get_array_idx(vec);
+    channelhead_idx = get_array_idx(vec GRID_ARG);
     idx = channelhead_idx;
     prev_idx = idx+1u;
     // Counter=1 at channel head (set by count_downchannels)
@@ -0,0 +1,58 @@
+///
+/// @file dirtyrows.cl
+///
+/// Kernel to flag which rows of a device-resident grid have been changed by a kernel.
+///
+/// @author CPS
+/// @bug No known bugs
+///
+
+///
+/// @defgroup transfers Host-device transfers
+/// Support for minimizing host-device data transfers
+///
+
+#ifdef KERNEL_FLAG_DIRTY_ROWS
+///
+/// Compare each row of a grid with its snapshot taken before a kernel was run,
+///    and flag the row as dirty if any of its elements differ.
+/// Only the dirty rows then need to be copied back to the host.
+///
+/// Compiled if KERNEL_FLAG_DIRTY_ROWS is defined.
+///
+/// @param[in]  array: grid (padded) as written by the kernel, treated as raw 32-bit words
+/// @param[in]  shadow_array: snapshot of the grid taken before the kernel was run
+/// @param[out] dirty_array: flag per row, 1 if changed and 0 if not
+/// @param[in]  n_rows: number of rows in the grid
+/// @param[in]  n_row_words: number of 32-bit words per row
+///
+/// @returns void
+///
+/// @ingroup transfers
+///
+__kernel void flag_dirty_rows(
+        __global const uint   *array,
+        __global const uint   *shadow_array,
+        __global       uchar  *dirty_array,
+        const          uint    n_rows,
+        const          uint    n_row_words
+   )
+{
+    const uint row = get_global_id(0u);
+    if (row>=n_rows) {
+        // This is a "padding" work item, so let's bail
+        return;
+    }
+    const uint offset = row*n_row_words;
+    uint i;
+    uchar is_dirty = 0;
+
+    for (i=0;i<n_row_words;i++) {
+        if (array[offset+i]!=shadow_array[offset+i]) {
+            is_dirty = 1;
+            break;
+        }
+    }
+    dirty_array[row] = is_dirty;
+}
+#endif
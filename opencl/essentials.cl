@@ -8,6 +8,112 @@
 /// Functions used frequently by kernels
 ///
 
+// Grid geometry and related step-size parameters, which vary from chunk to chunk
+//   and (in mapping pass#2) from subsegment to subsegment: they are passed at runtime
+//   in a single __constant struct, built by pocl.grid_params() to match this layout
+//   field for field, so that one program binary serves every grid.
+//   The struct pointer is passed down the tracing functions by appending GRID_ARG
+//   to their argument lists (and GRID_PARAM to their parameter lists)
+typedef struct {
+    uint  pad_width;
+    float pad_width_pp5;
+    uint  nx_padded;
+    uint  ny_padded;
+    uint  nxy_padded;
+    float nxf_mp5;
+    float nyf_mp5;
+    float grid_scale;
+    float combo_factor;
+    float dt_max;
+    uint  uv_tiles_ny;
+    uint  segmentation_threshold;
+} grid_params_t;
+#define GRID_PARAM , __constant const grid_params_t *grid
+#define GRID_ARG , grid
+#define PAD_WIDTH              (grid->pad_width)
+#define PAD_WIDTH_PP5          (grid->pad_width_pp5)
+#define NX_PADDED              (grid->nx_padded)
+#define NY_PADDED              (grid->ny_padded)
+#define NXY_PADDED             (grid->nxy_padded)
+#define NXF_MP5                (grid->nxf_mp5)
+#define NYF_MP5                (grid->nyf_mp5)
+#define GRID_SCALE             (grid->grid_scale)
+#define COMBO_FACTOR           (grid->combo_factor)
+#define DT_MAX                 (grid->dt_max)
+#define UV_TILES_NY            (grid->uv_tiles_ny)
+#define SEGMENTATION_THRESHOLD (grid->segmentation_threshold)
+
+// Sign of integration along the flow (+1 downstream, -1 upstream):
+//   - IS_BIDIRECTIONAL: each work item traces both downstream and upstream in one
+//       kernel launch, so the sign is a runtime argument 'downup_sign', passed down
+//       the tracing functions by appending DOWNUP_SIGN_ARG to their argument lists
+//       (and DOWNUP_SIGN_PARAM to their parameter lists)
+//   - otherwise: the sign is fixed at compile time by DOWNUP_SIGN (and is folded
+//       into the runtime COMBO_FACTOR)
+#ifdef IS_BIDIRECTIONAL
+#define DOWNUP_SIGN_PARAM , const float downup_sign
+#define DOWNUP_SIGN_ARG , downup_sign
+#define SIGNED_DOWNUP (downup_sign)
+#define SIGNED_COMBO_FACTOR (COMBO_FACTOR*downup_sign)
+#else
+#define DOWNUP_SIGN_PARAM
+#define DOWNUP_SIGN_ARG
+#define SIGNED_DOWNUP DOWNUP_SIGN
+#define SIGNED_COMBO_FACTOR COMBO_FACTOR
+#endif
+
+// Storage type of the velocity vector grid, which may be compactly encoded
+//   (see useful.encode_uv_field()):
+//     - UV_IS_HALF:  (u,v) as a pair of halfs, read with vload_half2()
+//     - UV_IS_ANGLE: unit vector direction quantized to 16 bits
+//     - otherwise:   (u,v) as float2
+#ifdef UV_IS_HALF
+#define UV_STORE half
+#elif defined(UV_IS_ANGLE)
+#define UV_STORE ushort
+#define UV_NULL_ANGLE 0xFFFF
+#define UV_ANGLE_SCALE (6.283185307179586f/65535.0f)
+#else
+#define UV_STORE float2
+#endif
+
+// Index of pixel (x,y) of the velocity vector grid, which may be laid out
+//   in square tiles (see useful.tile_grid()):
+//     - UV_IS_TILED: row-major sequence of UV_TILES_NY-wide rows of tiles,
+//                      each a row-major UV_TILE_SIZE x UV_TILE_SIZE block
+//     - otherwise:   row-major, as are all the other grids
+#ifdef UV_IS_TILED
+#define UV_IDX(x,y) ( ((x)/UV_TILE_SIZE*UV_TILES_NY+(y)/UV_TILE_SIZE) \
+                          *(UV_TILE_SIZE*UV_TILE_SIZE) \
+                      + ((x)%UV_TILE_SIZE)*UV_TILE_SIZE+(y)%UV_TILE_SIZE )
+#else
+#define UV_IDX(x,y) (NY_PADDED*(x)+(y))
+#endif
+
+/// Fetch and decode the velocity vector of a grid pixel.
+///
+/// @param[in] idx      (uint, RO): padded grid array index of pixel (see UV_IDX)
+/// @param[in] uv_array (UV_STORE *, RO): gridded velocity vectors, possibly encoded
+///
+/// @returns  velocity vector (u,v) at pixel
+///
+/// @ingroup utilities
+///
+static inline float2 get_uv(const uint idx, __global const UV_STORE *uv_array)
+{
+#ifdef UV_IS_HALF
+    return vload_half2(idx, uv_array);
+#elif defined(UV_IS_ANGLE)
+    const ushort uv_code = uv_array[idx];
+    float cos_angle;
+    const float sin_angle = sincos(uv_code*UV_ANGLE_SCALE-M_PI_F, &cos_angle);
+    return select((float2)(cos_angle,sin_angle), (float2)(0.0f,0.0f),
+                  (int2)(-(uv_code==UV_NULL_ANGLE)));
+#else
+    return uv_array[idx];
+#endif
+}
+
 /// Bilinearly interpolate a velocity vector (choice of row-major or column-major arrays).
 ///
 /// Perform a fast, simple bilinear interpolation at arbitrary position vector
@@ -15,13 +121,16 @@
 ///
 /// @param[in] vec      (float2 *, RO): real-valued vector position (x,y) onto which to
 ///                                     interpolate (u,v)
-/// @param[in] uv_array (float2 *, RO): gridded velocity vector components (u,v)
+/// @param[in] uv_array (UV_STORE *, RO): gridded velocity vector components (u,v),
+///                                       possibly encoded
+/// @param[in] grid     (grid_params_t *, RO): grid geometry parameters
 ///
 /// @returns  normalized velocity vector (u,v) sampled at position vec (x,y)
 ///
 /// @ingroup utilities
 ///
-static float2 speed_interpolator(float2 vec, __global const float2 *uv_array)
+static float2 speed_interpolator(float2 vec, __global const UV_STORE *uv_array
+                                 GRID_PARAM)
 {
     const uint x_lft = min( NX_PADDED-1, (uint)(max(0.0f, vec[0]+PAD_WIDTH_PP5)));
     const uint y_dwn = min( NY_PADDED-1, (uint)(max(0.0f, vec[1]+PAD_WIDTH_PP5)));
@@ -35,10 +144,10 @@ static float2 speed_interpolator(float2 vec, __global const float2 *uv_array)
     const float dy_weight = 1.0f-uy_weight;
 
     // Use to weight the four corner values...
-    const float2 uv_dwn = uv_array[NY_PADDED*x_lft+y_dwn]*lx_weight
-                        + uv_array[NY_PADDED*x_rgt+y_dwn]*rx_weight;
-    const float2 uv_upp = uv_array[NY_PADDED*x_lft+y_upp]*lx_weight
-                        + uv_array[NY_PADDED*x_rgt+y_upp]*rx_weight;
+    const float2 uv_dwn = get_uv(UV_IDX(x_lft,y_dwn),uv_array)*lx_weight
+                        + get_uv(UV_IDX(x_rgt,y_dwn),uv_array)*rx_weight;
+    const float2 uv_upp = get_uv(UV_IDX(x_lft,y_upp),uv_array)*lx_weight
+                        + get_uv(UV_IDX(x_rgt,y_upp),uv_array)*rx_weight;
     // Returns:
     //    interpolated 2d unit speed vector:
     return fast_normalize(uv_dwn*dy_weight+uv_upp*uy_weight);
@@ -47,13 +156,14 @@ static float2 speed_interpolator(float2 vec, __global const float2 *uv_array)
 /// Compute the array index of the padded grid pixel pointed to by
 /// a float2 grid position vector (choice of row-major or column-major arrays).
 ///
-/// @param[in]  vec (float2 *, RO): real-valued vector position (x,y)
+/// @param[in]  vec  (float2 *, RO): real-valued vector position (x,y)
+/// @param[in]  grid (grid_params_t *, RO): grid geometry parameters
 ///
 /// @returns  padded grid array index at position vec (x,y)
 ///
 /// @ingroup utilities
 ///
-static inline uint get_array_idx(float2 vec) {
+static inline uint get_array_idx(float2 vec GRID_PARAM) {
     return          ( min( NY_PADDED-1, (uint)(max(0.0f, vec[1]+PAD_WIDTH_PP5)) )
            +NY_PADDED*min( NX_PADDED-1, (uint)(max(0.0f, vec[0]+PAD_WIDTH_PP5)) ) );
 }
@@ -23,6 +23,7 @@
 ///                             downstream from dominant channel head (padded)
 /// @param[in,out] link_array: link grid providing the grid array index of the next
 ///                             downstream pixel (padded)
+/// @param[in]  n_seed_points: number of seed points, excluding "padding" seeds
 ///
 /// @returns void
 ///
@@ -31,19 +32,20 @@
 __kernel void hillslopes(
         __global const float2 *seed_point_array,
         __global const bool   *mask_array,
-        __global const float2 *uv_array,
+        __global const UV_STORE *uv_array,
         __global       uint   *mapping_array,
         __global const uint   *count_array,
-        __global       uint   *link_array
+        __global       uint   *link_array,
+        const          uint    n_seed_points GRID_PARAM
    )
 {
     const uint global_id = get_global_id(0u)+get_global_id(1u)*get_global_size(0u);
     // For every hillslope aka non-thin-channel pixel...
-    if (global_id>=N_SEED_POINTS) {
+    if (global_id>=n_seed_points) {
         // This is a "padding" seed, so let's bail
 #ifdef DEBUG
         printf("Bailing @ %d !in [%d-%d]\n",
-                global_id,get_global_offset(0u),N_SEED_POINTS-1);
+                global_id,get_global_offset(0u),n_seed_points-1);
 #endif
         return;
     }
@@ -66,16 +68,16 @@ __kernel void hillslopes(
                      vec = seed_point_array[global_id], next_vec;
 
     // Remember here
-    idx = get_array_idx(vec);
+    idx = get_array_idx(vec GRID_ARG);
     prev_idx = idx;
     // Integrate downstream one pixel
     // HACK: factor 100x
     while (prev_idx==idx && !mask_array[idx] && n_steps<100*(MAX_N_STEPS)) {
         prev_idx = idx;
         compute_step_vec(dt, uv_array, &dxy1_vec, &dxy2_vec, &uv1_vec, &uv2_vec,
-                         vec, &next_vec, &idx);
+                         vec, &next_vec, &idx GRID_ARG);
         if (countlink_runge_kutta_step(&dt, &dl, &dxy1_vec, &dxy2_vec,
-                                       &vec, &next_vec, &idx, mapping_array)) {
+                                       &vec, &next_vec, &idx, mapping_array GRID_ARG)) {
 #ifdef DEBUG
             printf("Link hillslopes (%d): stuck @ %d ...bailing\n",global_id,idx);
 #endif
@@ -8,6 +8,11 @@
 
 #define macro flags passed when building
 /// the kernel integrate_trajectory() in integration.cl.
+///
+/// The grid geometry and related step-size parameters (PAD_WIDTH, NX_PADDED, NY_PADDED,
+/// GRID_SCALE, COMBO_FACTOR, DT_MAX, SEGMENTATION_THRESHOLD, etc) are not macros
+/// but runtime fields of the grid_params_t struct defined in essentials.cl,
+/// set by @p pocl.grid_params(), so that one kernel binary serves every grid.
 
 ///
 /// @defgroup kernelflags Kernel instance control options
@@ -55,9 +60,6 @@
 #define ADJUSTED_MAX_ERROR  0.1472243219614029f
 #define MAX_LENGTH  300.0f
 #define INTEGRATION_HALT_THRESHOLD  0.009999999776482582f
-#define GRID_SCALE  200.0f
-#define COMBO_FACTOR  100.0f
-#define DT_MAX  0.004999999888241291f
 #define MAX_N_STEPS  600u
 #define TRAJECTORY_RESOLUTION  128u
 #define INTERCHANNEL_MAX_N_STEPS  200u
@@ -74,14 +76,10 @@
 /// @{
 #define C_ORDER
 #define PIXEL_SIZE  1.0f
-#define PAD_WIDTH  1u
-#define PAD_WIDTH_PP5  1.5f
 #define NX  200u
 #define NY  200u
 #define NXF  200.0f
 #define NYF  200.0f
-#define NX_PADDED  202u
-#define NY_PADDED  202u
 #define X_MAX    199.5f
 #define Y_MAX  199.5f
 /// @}
@@ -128,7 +126,6 @@
 #define IS_LOOP  16384u
 #define IS_BLOCKAGE  32768u
 #define LEFT_FLANK_ADDITION  2147483648u
-#define SEGMENTATION_THRESHOLD  50u
 /// @}
 
 
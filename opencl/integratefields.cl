@@ -40,6 +40,14 @@
 /// by computing a global id and using it to index the @p seed_point_array.
 /// UPDATE: now doing sub-pixel streamlines as a set per seed point... need to doc here
 ///
+/// If IS_BIDIRECTIONAL is defined, each kernel instance traces its streamlines
+/// both downstream and upstream, accumulating into the first and second halves
+/// (each of NXY_PADDED elements) of @p slc_array and @p slt_array respectively;
+/// otherwise it traces in the direction set by DOWNUP_SIGN.
+///
+/// If DO_MEMOIZE_FIELDS is defined, downstream streamlines merge into the resolved
+/// table built on the host by Fields.resolve_memo() (see jittered_trajectory()).
+///
 /// Compiled if KERNEL_INTEGRATE_FIELDS is defined.
 ///
 /// @param[in]  seed_point_array: list of initial streamline point vectors,
@@ -52,6 +60,12 @@
 ///                        steps across each pixel (padded)
 /// @param[out] slt_array: grid recording accumulated count of streamline segment lengths
 ///                        crossing each pixel (padded)
+/// @param[in]  memo_resolved_array: resolved table (only if DO_MEMOIZE_FIELDS)
+/// @param[out] memo_count_array: count of merged streamlines (only if DO_MEMOIZE_FIELDS)
+/// @param[out] memo_length_array: total length of merged streamlines
+///                                (only if DO_MEMOIZE_FIELDS)
+/// @param[in]  n_seed_points: total number of seed points, excluding "padding" seeds
+/// @param[in]  seeds_chunk_offset: index of the first seed point in this chunk
 ///
 /// @returns void
 ///
@@ -59,14 +73,17 @@
 ///
 __kernel void integrate_fields( __global const float2 *seed_point_array,
                                 __global const bool   *mask_array,
-                                __global const float2 *uv_array,
+                                __global const UV_STORE *uv_array,
                                 __global       uint   *mapping_array,
                                 __global       uint   *slc_array,
-                                __global       uint   *slt_array )
+                                __global       uint   *slt_array
+                                                       MEMO_FIELDS_PARAM,
+                                const          uint    n_seed_points,
+                                const          uint    seeds_chunk_offset GRID_PARAM )
 {
-    // global_id plus the chunk SEEDS_CHUNK_OFFSET is a seed point index
+    // global_id plus the chunk seeds_chunk_offset is a seed point index
     const uint global_id = get_global_id(0u)+get_global_id(1u)*get_global_size(0u),
-               seed_idx = (SEEDS_CHUNK_OFFSET)+global_id;
+               seed_idx = (seeds_chunk_offset)+global_id;
 #ifdef VERBOSE
     // Report how kernel instances are distributed
     if (global_id==0 || global_id==get_global_offset(0u)) {
@@ -79,7 +96,7 @@ __kernel void integrate_fields( __global const float2 *seed_point_array,
                 get_global_size(0u));
     }
 #endif
-    if (seed_idx>=N_SEED_POINTS) {
+    if (seed_idx>=n_seed_points) {
         // This is a "padding" seed, so let's bail
         return;
     }
@@ -98,18 +115,30 @@ __kernel void integrate_fields( __global const float2 *seed_point_array,
     lehmer_rand_uint(&initial_rng_state);
     BYTE_REVERSAL(initial_rng_state);
 
-
+#ifdef IS_BIDIRECTIONAL
+    // Trace downstream then upstream, from the same initial RNG state as would
+    //   separate downstream and upstream launches
+    __private uint downup_idx;
+    __private float downup_sign;
+    for (downup_idx=0u;downup_idx<2u;downup_idx++) {
+        downup_sign = (downup_idx==0u) ? 1.0f : -1.0f;
+        const uint downup_offset = downup_idx*NXY_PADDED;
+#else
+    {
+        const uint downup_offset = 0u;
+#endif
     for (j=0u;j<SUBPIXEL_SEED_POINT_DENSITY;j++) {
         for (i=0u;i<SUBPIXEL_SEED_POINT_DENSITY;i++){
             // Trace a jittered streamline from a sub-pixel-offset first point
-            jittered_trajectory(uv_array, mask_array,
-                                mapping_array, slc_array, slt_array,
+            jittered_trajectory(uv_array, mask_array, mapping_array,
+                                &slc_array[downup_offset], &slt_array[downup_offset],
                                 global_id, seed_idx,
                                 current_seed_point_vec + (float2)(
                                     (float)i*SUBPIXEL_SEED_STEP-SUBPIXEL_SEED_HALFSPAN,
                                     (float)j*SUBPIXEL_SEED_STEP-SUBPIXEL_SEED_HALFSPAN ),
-                                initial_rng_state);
+                                initial_rng_state DOWNUP_SIGN_ARG MEMO_FIELDS_ARG GRID_ARG);
         }
     }
+    }
 }
 #endif
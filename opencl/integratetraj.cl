@@ -31,6 +31,10 @@
 /// Each streamline trajectory is returned in the appropriate location
 /// in @p trajectories_array as a list of compressed-into-byte dx,dy values.
 ///
+/// If IS_BIDIRECTIONAL is defined, each kernel instance traces both the downstream
+/// and the upstream trajectory from its seed point, and records them interleaved:
+/// per seed point, the downstream then the upstream trajectory, step count and length.
+///
 /// Compiled if KERNEL_INTEGRATE_TRAJECTORY is defined.
 ///
 /// @param[in]  seed_point_array: list of initial streamline point vectors,
@@ -46,6 +50,8 @@
 ///                                 one per @p seed_point_array vector
 /// @param[out] traj_length_array: list of lengths of each trajectory;
 ///                                 one per @p seed_point_array vector
+/// @param[in]  n_seed_points: total number of seed points, excluding "padding" seeds
+/// @param[in]  seeds_chunk_offset: index of the first seed point in this chunk
 ///
 /// @returns void
 ///
@@ -53,16 +59,17 @@
 ///
 __kernel void integrate_trajectory( __global const float2 *seed_point_array,
                                     __global const bool   *mask_array,
-                                    __global const float2 *uv_array,
+                                    __global const UV_STORE *uv_array,
                                     __global       uint   *mapping_array,
                                     __global       char2  *trajectories_array,
                                     __global       ushort *traj_nsteps_array,
-                                    __global       float  *traj_length_array )
+                                    __global       float  *traj_length_array,
+                                    const          uint    n_seed_points,
+                                    const          uint    seeds_chunk_offset GRID_PARAM )
 {
-    // global_id plus the chunk SEEDS_CHUNK_OFFSET is a seed point index
+    // global_id plus the chunk seeds_chunk_offset is a seed point index
     const uint global_id = get_global_id(0u)+get_global_id(1u)*get_global_size(0u),
-               seed_idx = (SEEDS_CHUNK_OFFSET)+global_id,
-               trajectory_index = global_id*(MAX_N_STEPS);
+               seed_idx = (seeds_chunk_offset)+global_id;
     __global char2 *trajectory_vec;
 
 //    printf("global ids %d %d size %d offset %d\n",
@@ -80,19 +87,31 @@ __kernel void integrate_trajectory( __global const float2 *seed_point_array,
                 get_global_size(0u));
     }
 #endif
-    if (seed_idx>=N_SEED_POINTS) {
+    if (seed_idx>=n_seed_points) {
         // This is a "padding seed", so let's bail
         return;
     }
 
-    // Bug fix: bail BEFORE reading this element, because trajectories_array
-    //   isn't padded and shouldn't be accessed for seed_idx>=N_SEED_POINTS
-    trajectory_vec = &trajectories_array[trajectory_index];
+#ifdef IS_BIDIRECTIONAL
+    // Trace downstream then upstream, recording each in its own (interleaved) slot
+    __private uint downup_idx, trajectory_id;
+    __private float downup_sign;
+    for (downup_idx=0u;downup_idx<2u;downup_idx++) {
+        downup_sign = (downup_idx==0u) ? 1.0f : -1.0f;
+        trajectory_id = 2u*global_id+downup_idx;
+#else
+    {
+        const uint trajectory_id = global_id;
+#endif
+        // Bug fix: bail BEFORE reading this element, because trajectories_array
+        //   isn't padded and shouldn't be accessed for seed_idx>=n_seed_points
+        trajectory_vec = &trajectories_array[trajectory_id*(MAX_N_STEPS)];
 
-    // Trace a "smooth" streamline from the seed point coordinate
-    trajectory_record( uv_array, mask_array,
-                       mapping_array, traj_nsteps_array, traj_length_array,
-                       trajectory_vec, global_id, seed_idx,
-                       seed_point_array[seed_idx] );
+        // Trace a "smooth" streamline from the seed point coordinate
+        trajectory_record( uv_array, mask_array,
+                           mapping_array, traj_nsteps_array, traj_length_array,
+                           trajectory_vec, trajectory_id, seed_idx,
+                           seed_point_array[seed_idx] DOWNUP_SIGN_ARG GRID_ARG );
+    }
 }
 #endif
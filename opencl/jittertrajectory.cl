@@ -12,6 +12,21 @@
 ///
 
 #ifdef KERNEL_INTEGRATE_FIELDS
+// Streamline merging memo (see Fields.resolve_memo()): if DO_MEMOIZE_FIELDS is defined,
+//   a downstream streamline at least MEMO_MIN_LENGTH long stops on entering
+//   a resolved pixel, and deposits its count & length there for the remainder
+//   of its path to be accumulated on the host, via MEMO_FIELDS_PARAM/ARG
+//   appended to the parameter/argument lists as for DOWNUP_SIGN_PARAM/ARG
+#ifdef DO_MEMOIZE_FIELDS
+#define MEMO_FIELDS_PARAM , __global const bool *memo_resolved_array, \
+                            __global       uint *memo_count_array, \
+                            __global       uint *memo_length_array
+#define MEMO_FIELDS_ARG , memo_resolved_array, memo_count_array, memo_length_array
+#else
+#define MEMO_FIELDS_PARAM
+#define MEMO_FIELDS_ARG
+#endif
+
 ///
 /// Integrate a jittered flow path downstream or upstream.
 /// Write the streamline count and lengths to slc, slt arrays.
@@ -30,16 +45,23 @@
 /// @param[in]  global_id: ID of the kernel instance
 /// @param[in]  seed_idx: index of the seed vector in the list seed_point_array;
 ///                       if chunkified, the sequence of indexes is offset from
-///                       @p global_id by @p SEEDS_CHUNK_OFFSET
+///                       @p global_id by @p seeds_chunk_offset
 /// @param[in]  current_seed_point_vec: vector (real, float2) for the current point
 ///                                     along the streamline trajectory
 /// @param[in]  initial_rng_state: RNG state and integer variate
+/// @param[in]  downup_sign: +1 downstream, -1 upstream (only if IS_BIDIRECTIONAL)
+/// @param[in]  memo_resolved_array: resolved table, true where a pixel's downstream
+///                                  remainder is known (only if DO_MEMOIZE_FIELDS)
+/// @param[out] memo_count_array: count of streamlines stopped at each resolved pixel
+///                               (only if DO_MEMOIZE_FIELDS)
+/// @param[out] memo_length_array: total length of streamlines stopped at each
+///                                resolved pixel (only if DO_MEMOIZE_FIELDS)
 ///
 /// @returns void
 ///
 /// @ingroup integrate
 ///
-static inline void jittered_trajectory( __global const float2 *uv_array,
+static inline void jittered_trajectory( __global const UV_STORE *uv_array,
                                         __global const bool   *mask_array,
                                         __global       uint   *mapping_array,
                                         __global       uint   *slc_array,
@@ -47,7 +69,8 @@ static inline void jittered_trajectory( __global const float2 *uv_array,
                                                  const uint    global_id,
                                                  const uint    seed_idx,
                                                  const float2  current_seed_point_vec,
-                                                 const uint    initial_rng_state )
+                                                 const uint    initial_rng_state
+                                                               DOWNUP_SIGN_PARAM MEMO_FIELDS_PARAM GRID_PARAM )
 {
     // Private variables - non-constant within this kernel instance
     __private uint idx, n_steps=0u, rng_state=initial_rng_state;
@@ -55,18 +78,37 @@ static inline void jittered_trajectory( __global const float2 *uv_array,
     __private float2 uv1_vec, uv2_vec, dxy1_vec, dxy2_vec,
                      vec=current_seed_point_vec, prev_vec, next_vec;
     prev_vec = vec;
+#ifdef DO_PRIVATIZE_ACCUMULATION
+    // Private run of writes to the current pixel, flushed on leaving it
+    __private sl_run_t sl_run_data = {0, 0, 0u, 0u};
+    __private sl_run_t *sl_run = &sl_run_data;
+#endif
 
     // Start by recording the seed point
-    idx = get_array_idx(vec);
+    idx = get_array_idx(vec GRID_ARG);
     if (!mask_array[idx])
-        atomic_write_sl_data(&slt_array[idx], &slc_array[idx], l_trajectory);
+        atomic_write_sl_data(&slt_array[idx], &slc_array[idx], l_trajectory
+                             SL_RUN_ARG);
 
     // Loop downstream until the pixel is masked, i.e., we've exited the basin or grid,
     //   or if the streamline is too long (in l_trajectory or n_steps)
     while (idx<NXY_PADDED && !mask_array[idx]
                         && (l_trajectory<MAX_LENGTH && n_steps<MAX_N_STEPS)) {
+#ifdef DO_MEMOIZE_FIELDS
+        const uint prev_idx = idx;
+#endif
         compute_step_vec_jittered(dt, uv_array, &rng_state, &dxy1_vec, &dxy2_vec,
-                                  &uv1_vec, &uv2_vec, vec, &next_vec, &idx);
+                                  &uv1_vec, &uv2_vec, vec, &next_vec, &idx
+                                  DOWNUP_SIGN_ARG GRID_ARG);
+#ifdef DO_MEMOIZE_FIELDS
+        // Merge into the resolved downstream remainder, if any, of the next pixel
+        if (SIGNED_DOWNUP>0.0f && idx!=prev_idx && idx<NXY_PADDED
+                && l_trajectory>=MEMO_MIN_LENGTH && memo_resolved_array[idx]) {
+            atomic_inc(&memo_count_array[idx]);
+            atomic_add(&memo_length_array[idx], (uint)(l_trajectory+0.5f));
+            break;
+        }
+#endif
         if (idx<NXY_PADDED) {
             if (!mask_array[idx])
                 if (runge_kutta_step_write_sl_data(&dt, &dl, &l_trajectory,
@@ -74,16 +116,21 @@ static inline void jittered_trajectory( __global const float2 *uv_array,
                                                    &vec, &prev_vec, next_vec,
                                                    &n_steps, &idx,
                                                    mask_array, mapping_array,
-                                                   slt_array, slc_array)) {
+                                                   slt_array, slc_array
+                                                   SL_RUN_ARG GRID_ARG)) {
                     break;
                 }
             } else {
                 euler_step_write_sl_data(&dt, &dl, &l_trajectory, uv1_vec,
                                          &vec, prev_vec, &n_steps, &idx,
-                                         mask_array, slt_array, slc_array);
+                                         mask_array, slt_array, slc_array
+                                         DOWNUP_SIGN_ARG SL_RUN_ARG GRID_ARG);
                 break;
             }
     }
+#ifdef DO_PRIVATIZE_ACCUMULATION
+    flush_sl_run(sl_run);
+#endif
     return;
 }
 #endif
@@ -10,7 +10,7 @@
 #ifdef KERNEL_LABEL_CONFLUENCES
 
 #define CHECK_INFLOWS(here_idx,nbr_vec) { \
-   nbr_idx = get_array_idx(nbr_vec); \
+   nbr_idx = get_array_idx(nbr_vec GRID_ARG); \
    if ( !mask_array[nbr_idx] && (mapping_array[nbr_idx]&IS_THINCHANNEL) ) { \
        if ( link_array[nbr_idx]==here_idx ) { \
            /* The nbr pixel flows into here */ \
@@ -41,6 +41,8 @@
 /// @param[in,out]  mapping_array      (uint *,   RW):
 /// @param[in]  count_array            (uint *,   RO):
 /// @param[in]  link_array             (uint *,   RO):
+/// @param[in]  n_seed_points: number of seed points, excluding "padding" seeds
+/// @param[in]  grid: grid geometry parameters (see grid_params_t)
 ///
 /// @returns void
 ///
@@ -49,17 +51,18 @@
 __kernel void label_confluences(
         __global const float2 *seed_point_array,
         __global const bool   *mask_array,
-        __global const float2 *uv_array,
+        __global const UV_STORE *uv_array,
         __global const float  *slt_array,
         __global       uint   *mapping_array,
         __global const uint   *count_array,
-        __global const uint   *link_array
+        __global const uint   *link_array,
+        const          uint    n_seed_points GRID_PARAM
    )
 {
     // For every (redesignated) thin channel pixel...
 
     const uint global_id = get_global_id(0u)+get_global_id(1u)*get_global_size(0u);
-    if (global_id>=N_SEED_POINTS) {
+    if (global_id>=n_seed_points) {
         // This is a "padding" seed, so let's bail
         return;
     }
@@ -82,7 +85,7 @@ __kernel void label_confluences(
     __private float2 vec=seed_point_array[global_id];
 
     // Remember here
-    idx = get_array_idx(vec);
+    idx = get_array_idx(vec GRID_ARG);
     // Check upstream neighbors
     CHECK_N_INFLOWS(idx,vec);
     CHECK_S_INFLOWS(idx,vec);
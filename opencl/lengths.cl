@@ -29,6 +29,7 @@
 ///                             this pixel belongs (padded); the MSB is set if left flank
 /// @param[out] traj_length_array: list of lengths of each trajectory;
 ///                                one per @p seed_point_array vector
+/// @param[in]  n_seed_points: number of seed points, excluding "padding" seeds
 ///
 /// @returns void
 ///
@@ -37,10 +38,11 @@
 __kernel void hillslope_lengths(
         __global const float2 *seed_point_array,
         __global const bool   *mask_array,
-        __global const float2 *uv_array,
+        __global const UV_STORE *uv_array,
         __global const uint   *mapping_array,
         __global const uint   *label_array,
-        __global       float  *traj_length_array
+        __global       float  *traj_length_array,
+        const          uint    n_seed_points GRID_PARAM
    )
 {
     // For every mid-slope /or/ ridge pixel
@@ -63,7 +65,7 @@ __kernel void hillslope_lengths(
                 get_global_size(0u));
     }
 #endif
-    if (global_id>=N_SEED_POINTS) {
+    if (global_id>=n_seed_points) {
         // This is a "padding" seed, so let's bail
         return;
     }
@@ -77,11 +79,11 @@ __kernel void hillslope_lengths(
 //    vec[0]*PIXEL_SIZE+2800.0f,vec[1]*PIXEL_SIZE+2800.0f);
 
     // Remember here
-    idx = get_array_idx(vec);
+    idx = get_array_idx(vec GRID_ARG);
     // Integrate downstream until a channel pixel (or masked pixel) is reached
     while (((~mapping_array[idx])&IS_THINCHANNEL) && n_steps<MAX_N_STEPS) {
         compute_step_vec(dt, uv_array, &dxy1_vec, &dxy2_vec, &uv1_vec, &uv2_vec,
-                         vec, &next_vec, &idx);
+                         vec, &next_vec, &idx GRID_ARG);
         if (mask_array[idx]) return;
         if (!moved_off && ((~mapping_array[idx])&from_flag)) {
             // Flag when we've moved off the initial band of mid-slope/ridge pixels
@@ -92,7 +94,7 @@ __kernel void hillslope_lengths(
             return;
         }
         if (lengths_runge_kutta_step(&dt, &dl, &l_trajectory, &dxy1_vec, &dxy2_vec,
-                                     &vec, &prev_vec,  &next_vec, &n_steps, &idx)) {
+                                     &vec, &prev_vec,  &next_vec, &n_steps, &idx GRID_ARG)) {
 #ifdef DEBUG
             printf("Lengths: R-K breaking\n");
 #endif
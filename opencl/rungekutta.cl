@@ -39,6 +39,7 @@
 /// @param[in,out]  prev_idx: array index of pixel at previous (x,y) position
 /// @param[in,out]  trajectory_vec: streamline trajectory record
 ///                                  (2d array of compressed (x,y) vectors)
+/// @param[in]      grid: grid geometry parameters (see grid_params_t)
 ///
 /// @retval bool:
 ///               @p true if stuck (step length less than @p INTEGRATION_HALT_THRESHOLD);
@@ -51,7 +52,7 @@ static inline bool runge_kutta_step_record(float *dt, float  *dl, float *l_traje
                                            float2 *vec, float2 *prev_vec,
                                            float2 *next_vec,
                                            uint *n_steps, uint *idx, uint *prev_idx,
-                                           __global char2 *trajectory_vec)
+                                           __global char2 *trajectory_vec GRID_PARAM)
 {
     const float step_error = fast_length((*dxy2_vec-*dxy1_vec)/GRID_SCALE);
 
@@ -61,7 +62,7 @@ static inline bool runge_kutta_step_record(float *dt, float  *dl, float *l_traje
         *dl = fast_length(*dxy1_vec);
     }
     *vec = *next_vec;
-    *idx = get_array_idx(*next_vec);
+    *idx = get_array_idx(*next_vec GRID_ARG);
     if (*dl<(INTEGRATION_HALT_THRESHOLD)) {
         update_record_trajectory(*dl,l_trajectory,*vec,*prev_vec,n_steps,trajectory_vec);
 //        printf("runge_kutta_step_record: stuck\n");
@@ -94,6 +95,8 @@ static inline bool runge_kutta_step_record(float *dt, float  *dl, float *l_traje
 /// @param[in,out]  n_steps: number of integration steps so far in streamline trajectory
 /// @param[in,out]  trajectory_vec: streamline trajectory record
 ///                                  (2d array of compressed (x,y) vectors)
+/// @param[in]      downup_sign: +1 downstream, -1 upstream (only if IS_BIDIRECTIONAL)
+/// @param[in]      grid: grid geometry parameters (see grid_params_t)
 ///
 /// @retval bool:
 ///               @p true if stuck (step length less than @p INTEGRATION_HALT_THRESHOLD);
@@ -104,9 +107,10 @@ static inline bool runge_kutta_step_record(float *dt, float  *dl, float *l_traje
 static inline void euler_step_record(float *dt, float  *dl,
                                      float *l_trajectory, const float2 uv_vec,
                                      float2 *vec, const float2 prev_vec,
-                                     uint *n_steps, __global char2 *trajectory_vec)
+                                     uint *n_steps, __global char2 *trajectory_vec
+                                     DOWNUP_SIGN_PARAM GRID_PARAM)
 {
-    const float2 sgnd_uv_vec = uv_vec*(float2)(DOWNUP_SIGN,DOWNUP_SIGN);
+    const float2 sgnd_uv_vec = uv_vec*(float2)(SIGNED_DOWNUP,SIGNED_DOWNUP);
     const float dt_x = dt_to_nearest_edge((*vec)[0], sgnd_uv_vec[0]);
     const float dt_y = dt_to_nearest_edge((*vec)[1], sgnd_uv_vec[1]);
 
@@ -153,6 +157,8 @@ static inline void euler_step_record(float *dt, float  *dl,
 ///                           steps across each pixel (padded)
 /// @param[in,out] slt_array: grid recording accumulated count of streamline segment
 ///                           lengths crossing each pixel (padded)
+/// @param[in,out] sl_run: private run of writes to one pixel
+///                        (only if DO_PRIVATIZE_ACCUMULATION)
 ///
 /// @retval bool:
 ///               @p true if stuck (step length less than @p INTEGRATION_HALT_THRESHOLD);
@@ -166,7 +172,7 @@ static inline bool runge_kutta_step_write_sl_data(
                 float2 *vec, float2 *prev_vec, const float2 next_vec,
                 uint *n_steps, uint *idx,
                 __global const bool *mask_array, __global uint *mapping_array,
-                __global uint *slt_array, __global uint *slc_array)
+                __global uint *slt_array, __global uint *slc_array SL_RUN_PARAM GRID_PARAM)
 {
     const float step_error = fast_length((*dxy2_vec-*dxy1_vec)/GRID_SCALE);
 
@@ -174,13 +180,15 @@ static inline bool runge_kutta_step_write_sl_data(
     *vec = next_vec;
     if ((*dl<(INTEGRATION_HALT_THRESHOLD)) ) {
         update_trajectory_write_sl_data(*dl,l_trajectory,*vec,*prev_vec,n_steps,
-                                        idx, mask_array, slt_array, slc_array);
+                                        idx, mask_array, slt_array, slc_array
+                                        SL_RUN_ARG GRID_ARG);
         return true;
     }
     *dt = select( fmin(DT_MAX,(ADJUSTED_MAX_ERROR*(*dt))/(step_error)), DT_MAX,
                  isequal(step_error,0.0f) );
     update_trajectory_write_sl_data(*dl,l_trajectory,*vec,*prev_vec,n_steps,
-                                    idx, mask_array, slt_array, slc_array);
+                                    idx, mask_array, slt_array, slc_array
+                                    SL_RUN_ARG GRID_ARG);
     *prev_vec = *vec;
     return false;
 }
@@ -209,6 +217,9 @@ static inline bool runge_kutta_step_write_sl_data(
 ///                           steps across each pixel (padded)
 /// @param[in,out]  slt_array: grid recording accumulated count of streamline segment
 ///                           lengths crossing each pixel (padded)
+/// @param[in]      downup_sign: +1 downstream, -1 upstream (only if IS_BIDIRECTIONAL)
+/// @param[in,out]  sl_run: private run of writes to one pixel
+///                         (only if DO_PRIVATIZE_ACCUMULATION)
 ///
 /// @retval bool:
 ///               @p true if stuck (step length less than @p INTEGRATION_HALT_THRESHOLD);
@@ -224,12 +235,13 @@ static inline void euler_step_write_sl_data(float *dt, float *dl,
                                             uint *idx,
                                             __global const bool *mask_array,
                                             __global uint *slt_array,
-                                            __global uint *slc_array)
+                                            __global uint *slc_array
+                                            DOWNUP_SIGN_PARAM SL_RUN_PARAM GRID_PARAM)
 {
     __private float2 sgnd_uv_vec;
     __private float dt_x, dt_y;
 
-    sgnd_uv_vec = uv_vec*(float2)(DOWNUP_SIGN,DOWNUP_SIGN);
+    sgnd_uv_vec = uv_vec*(float2)(SIGNED_DOWNUP,SIGNED_DOWNUP);
     dt_x = dt_to_nearest_edge((*vec)[0], sgnd_uv_vec[0]);
     dt_y = dt_to_nearest_edge((*vec)[1], sgnd_uv_vec[1]);
     *dt = minmag(dt_x,dt_y);
@@ -239,7 +251,8 @@ static inline void euler_step_write_sl_data(float *dt, float *dl,
                      fmin(fmax((*vec)[1],-0.5f),NYF_MP5) );
     *dl = fast_length(*vec-prev_vec);
     update_trajectory_write_sl_data(*dl,l_trajectory,*vec,prev_vec,n_steps,
-                                    idx, mask_array, slt_array, slc_array);
+                                    idx, mask_array, slt_array, slc_array
+                                    SL_RUN_ARG GRID_ARG);
  }
 #endif
 
@@ -270,6 +283,7 @@ static inline void euler_step_write_sl_data(float *dt, float *dl,
 /// @param[in,out]  prev_idx: array index of pixel at previous (x,y) position
 /// @param[in,out]  trajectory_vec: streamline trajectory record
 ///                                  (2d array of compressed (x,y) vectors)
+/// @param[in]      grid: grid geometry parameters (see grid_params_t)
 ///
 /// @retval bool:
 ///               @p true if stuck (step length less than @p INTEGRATION_HALT_THRESHOLD);
@@ -284,7 +298,7 @@ static inline bool connect_runge_kutta_step_record(float *dt, float  *dl,
                                                    float2 *next_vec,
                                                    uint *n_steps,
                                                    uint *idx, uint *prev_idx,
-                                                   __private char2 *trajectory_vec)
+                                                   __private char2 *trajectory_vec GRID_PARAM)
 {
     const float step_error = fast_length((*dxy2_vec-*dxy1_vec)/GRID_SCALE);
 
@@ -294,7 +308,7 @@ static inline bool connect_runge_kutta_step_record(float *dt, float  *dl,
         *dl = fast_length(*dxy1_vec);
     }
     *vec = *next_vec;
-    *idx = get_array_idx(*next_vec);
+    *idx = get_array_idx(*next_vec GRID_ARG);
     if (*dl<(INTEGRATION_HALT_THRESHOLD)) {
         update_record_private_trajectory(*dl,l_trajectory,*vec,*prev_vec,n_steps,
                                          trajectory_vec);
@@ -325,6 +339,7 @@ static inline bool connect_runge_kutta_step_record(float *dt, float  *dl,
 /// @param[in,out]  next_vec: next (x,y) coordinate vector on streamline trajectory
 /// @param[in,out]  n_steps: number of integration steps so far in streamline trajectory
 /// @param[in,out]  idx: array index of pixel at current (x,y) position
+/// @param[in]      grid: grid geometry parameters (see grid_params_t)
 ///
 /// @retval bool:
 ///               @p true if stuck (step length less than @p INTEGRATION_HALT_THRESHOLD);
@@ -335,7 +350,7 @@ static inline bool connect_runge_kutta_step_record(float *dt, float  *dl,
 static inline void channelheads_runge_kutta_step(float *dt, float *dl,
                                                  float2 *dxy1_vec, float2 *dxy2_vec,
                                                  float2 *vec, float2 *next_vec,
-                                                 uint *n_steps, uint *idx)
+                                                 uint *n_steps, uint *idx GRID_PARAM)
 {
     const float step_error = fast_length((*dxy2_vec-*dxy1_vec)/GRID_SCALE);
 
@@ -345,7 +360,7 @@ static inline void channelheads_runge_kutta_step(float *dt, float *dl,
         *dl = fast_length(*dxy1_vec);
     }
     *vec = *next_vec;
-    *idx = get_array_idx(*next_vec);
+    *idx = get_array_idx(*next_vec GRID_ARG);
     *n_steps += 1u;
     *dt = select( fmin(DT_MAX,(ADJUSTED_MAX_ERROR*(*dt))/(step_error)), DT_MAX,
                  isequal(step_error,0.0f) );
@@ -382,7 +397,7 @@ static inline void channelheads_runge_kutta_step(float *dt, float *dl,
 static inline bool countlink_runge_kutta_step(float *dt, float *dl,
                                               float2 *dxy1_vec, float2 *dxy2_vec,
                                               float2 *vec, float2 *next_vec, uint *idx,
-                                              __global uint  *mapping_array)
+                                              __global uint  *mapping_array GRID_PARAM)
 {
     const float step_error = fast_length((*dxy2_vec-*dxy1_vec)/GRID_SCALE);
 
@@ -392,7 +407,7 @@ static inline bool countlink_runge_kutta_step(float *dt, float *dl,
         *dl = fast_length(*dxy1_vec);
     }
     *vec = *next_vec;
-    *idx = get_array_idx(*next_vec);
+    *idx = get_array_idx(*next_vec GRID_ARG);
     if (*dl<(INTEGRATION_HALT_THRESHOLD)) {
 #ifdef DEBUG
         printf("Count-link @ %g,%g: stuck\n",(*vec)[0],(*vec)[1]);
@@ -425,6 +440,7 @@ static inline bool countlink_runge_kutta_step(float *dt, float *dl,
 /// @param[in,out]  next_vec: next (x,y) coordinate vector on streamline trajectory
 /// @param[in,out]  n_steps: number of integration steps so far in streamline trajectory
 /// @param[in,out]  idx: array index of pixel at current (x,y) position
+/// @param[in]      grid: grid geometry parameters (see grid_params_t)
 ///
 /// @retval bool:
 ///               @p true if stuck (step length less than @p INTEGRATION_HALT_THRESHOLD);
@@ -435,7 +451,7 @@ static inline bool countlink_runge_kutta_step(float *dt, float *dl,
 static inline bool segment_runge_kutta_step(float *dt, float *dl,
                                             float2 *dxy1_vec, float2 *dxy2_vec,
                                             float2 *vec, float2 *next_vec,
-                                            uint *n_steps, uint *idx)
+                                            uint *n_steps, uint *idx GRID_PARAM)
 {
     const float step_error = fast_length((*dxy2_vec-*dxy1_vec)/GRID_SCALE);
 
@@ -445,7 +461,7 @@ static inline bool segment_runge_kutta_step(float *dt, float *dl,
         *dl = fast_length(*dxy1_vec);
     }
     *vec = *next_vec;
-    *idx = get_array_idx(*next_vec);
+    *idx = get_array_idx(*next_vec GRID_ARG);
     *n_steps += 1u;
     if (*dl<(INTEGRATION_HALT_THRESHOLD)) {
 #ifdef DEBUG
@@ -482,6 +498,7 @@ static inline bool segment_runge_kutta_step(float *dt, float *dl,
 /// @param[in,out]  next_vec: next (x,y) coordinate vector on streamline trajectory
 /// @param[in,out]  n_steps: number of integration steps so far in streamline trajectory
 /// @param[in,out]  idx: array index of pixel at current (x,y) position
+/// @param[in]      grid: grid geometry parameters (see grid_params_t)
 ///
 /// @retval bool:
 ///               @p true if stuck (step length less than @p INTEGRATION_HALT_THRESHOLD);
@@ -493,7 +510,7 @@ static inline bool lengths_runge_kutta_step(float *dt, float  *dl, float *l_traj
                                             float2 *dxy1_vec, float2 *dxy2_vec,
                                             float2 *vec, float2 *prev_vec,
                                             float2 *next_vec,
-                                            uint *n_steps, uint *idx)
+                                            uint *n_steps, uint *idx GRID_PARAM)
 {
     const float step_error = fast_length((*dxy2_vec-*dxy1_vec)/GRID_SCALE);
 
@@ -503,7 +520,7 @@ static inline bool lengths_runge_kutta_step(float *dt, float  *dl, float *l_traj
         *dl = fast_length(*dxy1_vec);
     }
     *vec = *next_vec;
-    *idx = get_array_idx(*next_vec);
+    *idx = get_array_idx(*next_vec GRID_ARG);
     if (*dl<(INTEGRATION_HALT_THRESHOLD)) {
         update_trajectory(*dl,l_trajectory,n_steps);
         return true;
@@ -30,6 +30,7 @@
 ///                             downstream pixel (padded)
 /// @param[in,out] label_array: label grid giving the ID of the subsegment to which
 ///                             this pixel belongs (padded); the MSB is set if left flank
+/// @param[in]  n_seed_points: number of seed points, excluding "padding" seeds
 ///
 /// @returns void
 ///
@@ -38,11 +39,12 @@
 __kernel void segment_downchannels(
         __global const float2 *seed_point_array,
         __global const bool   *mask_array,
-        __global const float2 *uv_array,
+        __global const UV_STORE *uv_array,
         __global       uint   *mapping_array,
         __global const uint   *count_array,
         __global const uint   *link_array,
-        __global       uint   *label_array
+        __global       uint   *label_array,
+        const          uint    n_seed_points GRID_PARAM
    )
 {
     // For every channel head pixel...
@@ -60,7 +62,7 @@ __kernel void segment_downchannels(
                 get_global_size(0u));
     }
 #endif
-    if (global_id>=N_SEED_POINTS) {
+    if (global_id>=n_seed_points) {
         // This is a "padding" seed, so let's bail
         return;
     }
@@ -69,7 +71,7 @@ __kernel void segment_downchannels(
     __private float2 vec = seed_point_array[global_id];
 
     // Remember here
-    prev_idx = get_array_idx(vec);
+    prev_idx = get_array_idx(vec GRID_ARG);
     // Label this stream segment, starting with the head pixel
     segment_label = prev_idx;
     atomic_xchg(&label_array[prev_idx],segment_label);
@@ -125,6 +127,7 @@ __kernel void segment_downchannels(
 ///                             downstream pixel (padded)
 /// @param[in,out] label_array: label grid giving the ID of the subsegment to which
 ///                             this pixel belongs (padded); the MSB is set if left flank
+/// @param[in]  n_seed_points: number of seed points, excluding "padding" seeds
 ///
 /// @returns void
 ///
@@ -133,11 +136,12 @@ __kernel void segment_downchannels(
 __kernel void segment_hillslopes(
         __global const float2 *seed_point_array,
         __global const bool   *mask_array,
-        __global const float2 *uv_array,
+        __global const UV_STORE *uv_array,
         __global const uint   *mapping_array,
         __global const uint   *count_array,
         __global const uint   *link_array,
-        __global       uint   *label_array
+        __global       uint   *label_array,
+        const          uint    n_seed_points GRID_PARAM
    )
 {
     // For every non-thin-channel pixel
@@ -155,7 +159,7 @@ __kernel void segment_hillslopes(
                 get_global_size(0u));
     }
 #endif
-    if (global_id>=N_SEED_POINTS) {
+    if (global_id>=n_seed_points) {
         // This is a "padding" seed, so let's bail
         return;
     }
@@ -165,7 +169,7 @@ __kernel void segment_hillslopes(
                      vec = seed_point_array[global_id], next_vec;
 
     // Remember here
-    idx = get_array_idx(vec);
+    idx = get_array_idx(vec GRID_ARG);
     hillslope_idx = idx;
 //#ifdef DEBUG
 //    printf("%d\n",idx);
@@ -174,9 +178,9 @@ __kernel void segment_hillslopes(
     while (!mask_array[idx] && ((~mapping_array[idx])&IS_THINCHANNEL)
            && n_steps<MAX_N_STEPS) {
         compute_step_vec(dt, uv_array, &dxy1_vec, &dxy2_vec, &uv1_vec, &uv2_vec,
-                         vec, &next_vec, &idx);
+                         vec, &next_vec, &idx GRID_ARG);
         if (segment_runge_kutta_step(&dt, &dl, &dxy1_vec, &dxy2_vec,
-                                     &vec, &next_vec, &n_steps, &idx))
+                                     &vec, &next_vec, &n_steps, &idx GRID_ARG))
             break;
     }
     if (mapping_array[idx]&IS_THINCHANNEL) {
@@ -192,7 +196,7 @@ __kernel void segment_hillslopes(
 ///
 /// TBD
 ///
-static inline uint rotate_left(uint prev_x, uint prev_y, char *dx, char *dy) {
+static inline uint rotate_left(uint prev_x, uint prev_y, char *dx, char *dy GRID_PARAM) {
     __private char rotated_dx=*dx-*dy, rotated_dy=*dx+*dy;
     *dx = rotated_dx/clamp((char)abs(rotated_dx),(char)1,(char)2);
     *dy = rotated_dy/clamp((char)abs(rotated_dy),(char)1,(char)2);
@@ -215,6 +219,7 @@ static inline uint rotate_left(uint prev_x, uint prev_y, char *dx, char *dy) {
 ///                            downstream pixel (padded)
 /// @param[in,out] label_array: label grid giving the ID of the subsegment to which
 ///                             this pixel belongs (padded); the MSB is set if left flank
+/// @param[in]  n_seed_points: number of seed points, excluding "padding" seeds
 ///
 /// @returns void
 ///
@@ -226,11 +231,12 @@ static inline uint rotate_left(uint prev_x, uint prev_y, char *dx, char *dy) {
 __kernel void subsegment_channel_edges(
         __global const float2 *seed_point_array,
         __global const bool   *mask_array,
-        __global const float2 *uv_array,
+        __global const UV_STORE *uv_array,
         __global       uint   *mapping_array,
         __global const uint   *channel_label_array,
         __global const uint   *link_array,
-        __global       uint   *label_array
+        __global       uint   *label_array,
+        const          uint    n_seed_points GRID_PARAM
    )
 {
     // For every subsegment head pixel...
@@ -248,7 +254,7 @@ __kernel void subsegment_channel_edges(
                 get_global_size(0u));
     }
 #endif
-    if (global_id>=N_SEED_POINTS) {
+    if (global_id>=n_seed_points) {
         // This is a "padding" seed, so let's bail
         return;
     }
@@ -259,7 +265,7 @@ __kernel void subsegment_channel_edges(
     __private bool do_label_left;
 
     // Remember here
-    prev_idx = get_array_idx(vec);
+    prev_idx = get_array_idx(vec GRID_ARG);
     segment_label = channel_label_array[prev_idx];
     // Step downstream off subsegment head pixel
     idx = link_array[prev_idx];
@@ -288,7 +294,7 @@ __kernel void subsegment_channel_edges(
         //   not the L flank as required here.
         do_label_left = true;
         while (left_idx!=prev_idx && ++n_turns<=7) {
-            left_idx = rotate_left(prev_x,prev_y,&dx,&dy);
+            left_idx = rotate_left(prev_x,prev_y,&dx,&dy GRID_ARG);
             if (n_turns>=2 && !mask_array[left_idx]
                           && ((mapping_array[left_idx]) & IS_THINCHANNEL)) {
                 if (left_idx==link_array[idx]) {
@@ -311,7 +317,7 @@ __kernel void subsegment_channel_edges(
             // Break if a thin channel pixel nbr is reached.
             // Label as left flank if not a thin channel pixel.
             while (left_idx!=prev_idx && ++n_turns<=4) {
-                left_idx = rotate_left(prev_x,prev_y,&dx,&dy);
+                left_idx = rotate_left(prev_x,prev_y,&dx,&dy GRID_ARG);
                 if (n_turns>=2 && !mask_array[left_idx]) {
                     if ((mapping_array[left_idx]) & IS_THINCHANNEL) {
                             break;
@@ -352,6 +358,7 @@ __kernel void subsegment_channel_edges(
 ///                             downstream pixel (padded)
 /// @param[in,out] label_array: label grid giving the ID of the subsegment to which
 ///                             this pixel belongs (padded); the MSB is set if left flank
+/// @param[in]  n_seed_points: number of seed points, excluding "padding" seeds
 ///
 /// @returns void
 ///
@@ -360,11 +367,12 @@ __kernel void subsegment_channel_edges(
 __kernel void subsegment_flanks(
         __global const float2 *seed_point_array,
         __global const bool   *mask_array,
-        __global const float2 *uv_array,
+        __global const UV_STORE *uv_array,
         __global       uint   *mapping_array,
         __global const uint   *count_array,
         __global const uint   *link_array,
-        __global       uint   *label_array
+        __global       uint   *label_array,
+        const          uint    n_seed_points GRID_PARAM
    )
 {
     // For every non-left-flank hillslope pixel...
@@ -382,7 +390,7 @@ __kernel void subsegment_flanks(
                 get_global_size(0u));
     }
 #endif
-    if (global_id>=N_SEED_POINTS) {
+    if (global_id>=n_seed_points) {
         // This is a "padding" seed, so let's bail
         return;
     }
@@ -392,16 +400,16 @@ __kernel void subsegment_flanks(
                      vec = seed_point_array[global_id], next_vec;
 
     // Remember here
-    idx = get_array_idx(vec);
+    idx = get_array_idx(vec GRID_ARG);
     hillslope_idx = idx;
     // Integrate downstream until thin channel or left-flank pixel is reached
     n_steps = 0u;
     while (!mask_array[idx] && ((~mapping_array[idx])&IS_LEFTFLANK)
             && ((~mapping_array[idx])&IS_THINCHANNEL) && n_steps<MAX_N_STEPS) {
         compute_step_vec(dt, uv_array, &dxy1_vec, &dxy2_vec, &uv1_vec, &uv2_vec,
-                         vec, &next_vec, &idx);
+                         vec, &next_vec, &idx GRID_ARG);
         if (segment_runge_kutta_step(&dt, &dl, &dxy1_vec, &dxy2_vec,
-                                     &vec, &next_vec, &n_steps, &idx))
+                                     &vec, &next_vec, &n_steps, &idx GRID_ARG))
             break;
     }
     if (mapping_array[idx]&IS_LEFTFLANK) {
@@ -433,6 +441,7 @@ __kernel void subsegment_flanks(
 ///                             downstream pixel (padded)
 /// @param[in,out] label_array: label grid giving the ID of the subsegment to which
 ///                             this pixel belongs (padded); the MSB is set if left flank
+/// @param[in]  n_seed_points: number of seed points, excluding "padding" seeds
 ///
 /// @returns void
 ///
@@ -441,11 +450,12 @@ __kernel void subsegment_flanks(
 __kernel void fix_right_flanks(
         __global const float2 *seed_point_array,
         __global const bool   *mask_array,
-        __global const float2 *uv_array,
+        __global const UV_STORE *uv_array,
         __global       uint   *mapping_array,
         __global const uint   *count_array,
         __global const uint   *link_array,
-        __global       uint   *label_array
+        __global       uint   *label_array,
+        const          uint    n_seed_points GRID_PARAM
    )
 {
     // For every right-flank hillslope pixel...
@@ -463,7 +473,7 @@ __kernel void fix_right_flanks(
                 get_global_size(0u));
     }
 #endif
-    if (global_id>=N_SEED_POINTS) {
+    if (global_id>=n_seed_points) {
         // This is a "padding" seed, so let's bail
         return;
     }
@@ -473,20 +483,20 @@ __kernel void fix_right_flanks(
                      vec = seed_point_array[global_id], next_vec;
 
     // Remember here
-    idx = get_array_idx(vec);
+    idx = get_array_idx(vec GRID_ARG);
     hillslope_idx = idx;
     // Integrate downstream until thin channel or left-flank pixel is reached
     n_steps = 0u;
     while (!mask_array[idx] && ((~label_array[idx])&LEFT_FLANK_ADDITION)
             && ((~mapping_array[idx])&IS_THINCHANNEL) && n_steps<MAX_N_STEPS) {
         compute_step_vec(dt, uv_array, &dxy1_vec, &dxy2_vec, &uv1_vec, &uv2_vec,
-                         vec, &next_vec, &idx);
+                         vec, &next_vec, &idx GRID_ARG);
         if ( (label_array[hillslope_idx]&(~LEFT_FLANK_ADDITION))
                     != (label_array[idx]&(~LEFT_FLANK_ADDITION)) ) {
             label_array[hillslope_idx] = label_array[idx];
         }
         if (segment_runge_kutta_step(&dt, &dl, &dxy1_vec, &dxy2_vec,
-                                     &vec, &next_vec, &n_steps, &idx))
+                                     &vec, &next_vec, &n_steps, &idx GRID_ARG))
             break;
     }
     if ( (label_array[hillslope_idx]&(~LEFT_FLANK_ADDITION))
@@ -522,6 +532,7 @@ __kernel void fix_right_flanks(
 ///                             downstream pixel (padded)
 /// @param[in,out] label_array: label grid giving the ID of the subsegment to which
 ///                             this pixel belongs (padded); the MSB is set if left flank
+/// @param[in]  n_seed_points: number of seed points, excluding "padding" seeds
 ///
 /// @returns void
 ///
@@ -530,11 +541,12 @@ __kernel void fix_right_flanks(
 __kernel void fix_left_flanks(
         __global const float2 *seed_point_array,
         __global const bool   *mask_array,
-        __global const float2 *uv_array,
+        __global const UV_STORE *uv_array,
         __global       uint   *mapping_array,
         __global const uint   *count_array,
         __global const uint   *link_array,
-        __global       uint   *label_array
+        __global       uint   *label_array,
+        const          uint    n_seed_points GRID_PARAM
    )
 {
     // For every left-flank hillslope pixel...
@@ -552,7 +564,7 @@ __kernel void fix_left_flanks(
                 get_global_size(0u));
     }
 #endif
-    if (global_id>=N_SEED_POINTS) {
+    if (global_id>=n_seed_points) {
         // This is a "padding" seed, so let's bail
         return;
     }
@@ -562,20 +574,20 @@ __kernel void fix_left_flanks(
                      vec = seed_point_array[global_id], next_vec;
 
     // Remember here
-    idx = get_array_idx(vec);
+    idx = get_array_idx(vec GRID_ARG);
     hillslope_idx = idx;
     // Integrate downstream until thin channel or right-flank pixel is reached
     n_steps = 0u;
     while (!mask_array[idx] && ((label_array[idx])&LEFT_FLANK_ADDITION)
             && ((~mapping_array[idx])&IS_THINCHANNEL) && n_steps<MAX_N_STEPS) {
         compute_step_vec(dt, uv_array, &dxy1_vec, &dxy2_vec, &uv1_vec, &uv2_vec,
-                         vec, &next_vec, &idx);
+                         vec, &next_vec, &idx GRID_ARG);
         if ( (label_array[hillslope_idx]&(~LEFT_FLANK_ADDITION))
                     != (label_array[idx]&(~LEFT_FLANK_ADDITION)) ) {
             label_array[hillslope_idx] = label_array[idx];
         }
         if (segment_runge_kutta_step(&dt, &dl, &dxy1_vec, &dxy2_vec,
-                                     &vec, &next_vec, &n_steps, &idx))
+                                     &vec, &next_vec, &n_steps, &idx GRID_ARG))
             break;
     }
     if ( (label_array[hillslope_idx]&(~LEFT_FLANK_ADDITION))
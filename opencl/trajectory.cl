@@ -30,15 +30,16 @@
 /// @param[in]  global_id: ID of the kernel instance
 /// @param[in]  seed_idx: index of the seed vector in the list seed_point_array;
 ///                       if chunkified, the sequence of indexes is offset from
-///                       @p global_id by @p SEEDS_CHUNK_OFFSET
+///                       @p global_id by @p seeds_chunk_offset
 /// @param[in]  current_seed_point_vec: vector (real, float2) for the current point
 ///                                     along the streamline trajectory
+/// @param[in]  downup_sign: +1 downstream, -1 upstream (only if IS_BIDIRECTIONAL)
 ///
 /// @returns void
 ///
 /// @ingroup integrate
 ///
-static inline void trajectory_record( __global const float2 *uv_array,
+static inline void trajectory_record( __global const UV_STORE *uv_array,
                                       __global const bool   *mask_array,
                                       __global       uint   *mapping_array,
                                       __global       ushort *traj_nsteps_array,
@@ -46,7 +47,8 @@ static inline void trajectory_record( __global const float2 *uv_array,
                                       __global       char2  *trajectory_vec,
                                                const uint    global_id,
                                                const uint    seed_idx,
-                                               const float2  current_seed_point_vec )
+                                               const float2  current_seed_point_vec
+                                                             DOWNUP_SIGN_PARAM GRID_PARAM )
 {
     // Private variables - non-constant within this kernel instance
     __private uint idx, prev_idx, n_steps=0u;
@@ -55,21 +57,22 @@ static inline void trajectory_record( __global const float2 *uv_array,
                      vec=current_seed_point_vec, prev_vec=vec, next_vec;
     // Start
     prev_vec = vec;
-    idx = get_array_idx(vec);
+    idx = get_array_idx(vec GRID_ARG);
     // Loop downstream until the pixel is masked, i.e., we've exited the basin or grid,
     //   or if the streamline is too long (l or n)
     while (!mask_array[idx] && (l_trajectory<MAX_LENGTH && n_steps<MAX_N_STEPS)) {
         compute_step_vec(dt, uv_array, &dxy1_vec, &dxy2_vec, &uv1_vec, &uv2_vec,
-                         vec, &next_vec, &idx);
+                         vec, &next_vec, &idx DOWNUP_SIGN_ARG GRID_ARG);
         if (!mask_array[idx]) {
             if (runge_kutta_step_record(&dt, &dl, &l_trajectory, &dxy1_vec, &dxy2_vec,
-                &vec, &prev_vec, &next_vec, &n_steps, &idx, &prev_idx, trajectory_vec)) {
+                &vec, &prev_vec, &next_vec, &n_steps, &idx, &prev_idx, trajectory_vec GRID_ARG)) {
 //                atomic_or(&mapping_array[idx],IS_STUCK);
                 break;
             }
         } else {
             euler_step_record(&dt, &dl, &l_trajectory, uv1_vec,
-                              &vec, prev_vec, &n_steps, trajectory_vec);
+                              &vec, prev_vec, &n_steps, trajectory_vec
+                              DOWNUP_SIGN_ARG GRID_ARG);
             break;
         }
     }
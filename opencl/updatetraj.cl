@@ -32,6 +32,8 @@
 ///                           steps across each pixel (padded)
 /// @param[in,out]  slt_array: grid recording accumulated count of streamline segment
 ///                           lengths crossing each pixel (padded)
+/// @param[in,out]  sl_run: private run of writes to one pixel
+///                         (only if DO_PRIVATIZE_ACCUMULATION)
 ///
 /// @returns void
 ///
@@ -41,7 +43,7 @@ static inline void update_trajectory_write_sl_data(
         float  dl, float *l_trajectory, float2 vec, float2 prev_vec,
         uint *n_steps, uint *idx,
         __global const bool *mask_array,
-        __global uint *slt_array, __global uint *slc_array) {
+        __global uint *slt_array, __global uint *slc_array SL_RUN_PARAM GRID_PARAM) {
     // Step to next point along streamline, adding to trajectory length
     //   and n_steps counter.
     // Compress step delta vector into fixed-point integer form & record in traj.
@@ -49,9 +51,10 @@ static inline void update_trajectory_write_sl_data(
     *l_trajectory += dl;
     *n_steps += 1u;
     // Current pixel position in data array
-    *idx = get_array_idx(vec);
+    *idx = get_array_idx(vec GRID_ARG);
     check_atomic_write_sl_data(*idx, mask_array[*idx],
-                               &slt_array[*idx], &slc_array[*idx], *l_trajectory);
+                               &slt_array[*idx], &slc_array[*idx], *l_trajectory
+                               SL_RUN_ARG GRID_ARG);
 }
 #endif
 
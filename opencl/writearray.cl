@@ -8,6 +8,86 @@
 ///
 
 #ifdef KERNEL_INTEGRATE_FIELDS
+// Privatized accumulation: if DO_PRIVATIZE_ACCUMULATION is defined, consecutive
+//   writes by a work item to the same pixel are combined in a private "run"
+//   (see sl_run_t), which is flushed to the global slc, slt arrays with one pair of
+//   atomics when the streamline moves on to another pixel, and when it ends.
+//   The run is passed down the tracing functions by appending SL_RUN_ARG to their
+//   argument lists (and SL_RUN_PARAM to their parameter lists).
+// Either way, the sums are of integers, so the results are the same.
+#ifdef DO_PRIVATIZE_ACCUMULATION
+typedef struct {
+    __global uint *slt;
+    __global uint *slc;
+    uint length;
+    uint count;
+} sl_run_t;
+#define SL_RUN_PARAM , sl_run_t *sl_run
+#define SL_RUN_ARG , sl_run
+#else
+#define SL_RUN_PARAM
+#define SL_RUN_ARG
+#endif
+
+// Streamline length as added to slt: scaled by SLT_SCALE and rounded to an integer
+#define SLT_VALUE(l_trajectory) ((uint)((l_trajectory)*SLT_SCALE+0.5f))
+
+#ifdef DO_PRIVATIZE_ACCUMULATION
+///
+/// Flush a private run of slt, slc writes to a pixel into the global arrays,
+///    and empty it.
+///
+/// Compiled if KERNEL_INTEGRATE_FIELDS and DO_PRIVATIZE_ACCUMULATION are defined.
+///
+/// @param[in,out] sl_run: private run of writes to one pixel
+///
+/// @returns void
+///
+/// @ingroup trajectoryfns
+///
+static inline void flush_sl_run(sl_run_t *sl_run) {
+    if (sl_run->count>0u) {
+        atomic_add(sl_run->slt, sl_run->length);
+        atomic_add(sl_run->slc, sl_run->count);
+    }
+    sl_run->length = 0u;
+    sl_run->count = 0u;
+}
+#endif
+
+///
+/// Add a streamline length value to a pixel of the @p slt accumulation array,
+///    and increment the streamline count at the pixel of the @p slc array:
+///    atomically, or in the private run if DO_PRIVATIZE_ACCUMULATION is defined.
+///
+/// Compiled if KERNEL_INTEGRATE_FIELDS is defined.
+///
+/// @param[in,out] slt: pixel of grid of streamline length totals
+/// @param[in,out] slc: pixel of grid of streamline counts
+/// @param[in]     slt_value: scaled & rounded streamline length so far
+/// @param[in,out] sl_run: private run of writes to one pixel
+///                        (only if DO_PRIVATIZE_ACCUMULATION)
+///
+/// @returns void
+///
+/// @ingroup trajectoryfns
+///
+static inline void add_sl_data(__global uint *slt, __global uint *slc,
+                               const uint slt_value SL_RUN_PARAM) {
+#ifdef DO_PRIVATIZE_ACCUMULATION
+    if (slt!=sl_run->slt) {
+        flush_sl_run(sl_run);
+        sl_run->slt = slt;
+        sl_run->slc = slc;
+    }
+    sl_run->length += slt_value;
+    sl_run->count += 1u;
+#else
+    atomic_add(slt, slt_value);
+    atomic_inc(slc);
+#endif
+}
+
 ///
 /// Add the current streamline length (@p l_trajectory) to the current pixel of the
 ///    @p slt accumulation array.
@@ -23,20 +103,21 @@
 /// @param[in,out] slc: grid recording accumulated count of streamline integration
 ///                         steps across each pixel (padded)
 /// @param[in]     l_trajectory: total streamline distance so far
+/// @param[in,out] sl_run: private run of writes to one pixel
+///                        (only if DO_PRIVATIZE_ACCUMULATION)
 ///
 /// @returns void
 ///
 /// @ingroup trajectoryfns
 ///
 static inline void atomic_write_sl_data(__global uint *slt, __global uint *slc,
-                                        const float l_trajectory) {
+                                        const float l_trajectory SL_RUN_PARAM) {
     // Add streamline length-so-far to total slt for this pixel
-    //   - rounding up to & casting as 32bit int
+    //   - scaling by SLT_SCALE, rounding up to & casting as 32bit int
     // There may be issues for short trajectories as a result.
     // Also if step distance is << pixel width.
-    atomic_add(slt, (uint)(l_trajectory+0.5f));
     // Increment the 'visit' counter slc at this pixel.
-    atomic_inc(slc);
+    add_sl_data(slt, slc, SLT_VALUE(l_trajectory) SL_RUN_ARG);
 }
 #endif
 
@@ -62,6 +143,8 @@ static inline void atomic_write_sl_data(__global uint *slt, __global uint *slc,
 /// @param[in,out]  slc: grid recording accumulated count of streamline integration
 ///                         steps across each pixel (padded)
 /// @param[in]      l_trajectory: total streamline distance so far
+/// @param[in,out]  sl_run: private run of writes to one pixel
+///                         (only if DO_PRIVATIZE_ACCUMULATION)
 ///
 /// @returns void
 ///
@@ -69,15 +152,14 @@ static inline void atomic_write_sl_data(__global uint *slt, __global uint *slc,
 ///
 static inline void check_atomic_write_sl_data(const uint idx, const bool mask_flag,
                                               __global uint *slt, __global uint *slc,
-                                              const float l_trajectory) {
+                                              const float l_trajectory SL_RUN_PARAM GRID_PARAM) {
     if (idx<NXY_PADDED && !mask_flag) {
         // Add streamline length-so-far to total slt for this pixel
-        //   - rounding up to & casting as 32bit int
+        //   - scaling by SLT_SCALE, rounding up to & casting as 32bit int
         // There may be issues for short trajectories as a result.
         // Also if step distance is << pixel width.
-        atomic_add(slt, (uint)(l_trajectory+0.5f));
         // Increment the 'visit' counter slc at this pixel.
-        atomic_inc(slc);
+        add_sl_data(slt, slc, SLT_VALUE(l_trajectory) SL_RUN_ARG);
     }
 }
 #endif
@@ -124,8 +124,9 @@ class Analysis(Core):
         if verbose is None:
             verbose=self.verbose
         try:
-            self.compute_marginal_distribn_dslt(data)
-            return self.mpdf_dslt.channel_threshold_x
+            # Use the returned distribution rather than self.mpdf_dslt, 
+            #   which may be overwritten by a concurrent pass#2 worker thread
+            return self.compute_marginal_distribn_dslt(data).channel_threshold_x
         except AttributeError as error:
             self.print('Failed to estimate channel threshold:', error)
             return None
@@ -247,13 +248,15 @@ class Analysis(Core):
         up_down_idx_x, up_down_idx_y = 0, 0
         (logx_min, logx_max, logy_min, logy_max) \
           = self._get_limits(['pdf_slt_min','pdf_slt_max','pdf_sla_min','pdf_sla_max'])
-        self.mpdf_dslt \
+        mpdf_dslt \
             = self.compute_marginal_distribn(x_array,y_array, mask_array,
                                              up_down_idx_x=up_down_idx_x,
                                              up_down_idx_y=up_down_idx_y,
                                              logx_min=logx_min,logy_min=logy_min, 
                                              logx_max=logx_max,logy_max=logy_max)
+        self.mpdf_dslt = mpdf_dslt
         self.print('...done')            
+        return mpdf_dslt
         
     def compute_marginal_distribn_uslt(self, data=None):
         """
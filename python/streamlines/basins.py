@@ -0,0 +1,402 @@
+"""
+---------------------------------------------------------------------
+
+Module to carry out the ``slm`` workflow basin by basin, driven by a drainage
+basins raster.
+
+The basins raster is treated as a label image: the bounding box of each basin
+is found in a single pass over it. The full workflow (preprocess, trace, mapping)
+is then run on each basin in turn, with the ROI clipped to its bounding box
+plus a small "halo" of pixels and with everything but the basin masked off.
+Streamlines do not cross drainage divides, so the halo need only be wide enough
+for the topographic gradient to be computed at the basin edges.
+Small, scattered basins are thus mapped from tight crops rather than
+by tracing and mapping the whole ROI with most of it masked off.
+
+The results of each basin run are written to per-basin GeoTIFF files and are
+merged, basin pixels only, into internally tiled GeoTIFF mosaics of the ROI.
+Basins can be run in parallel on a pool of worker processes
+by switching on batch mode (see :mod:`.scheduler`).
+
+---------------------------------------------------------------------
+
+Requires Python packages/modules:
+  -  :mod:`json`
+  -  :mod:`scipy.ndimage`
+  -  `GDAL`_
+
+Imports :class:`.Core` class and functions from the :mod:`.useful` module.
+
+---------------------------------------------------------------------
+
+.. _gdal: https://www.gdal.org/
+
+"""
+
+import numpy as np
+from scipy.ndimage import find_objects
+from json import loads, dumps
+import gc
+import os
+os.environ['PYTHONUNBUFFERED']='True'
+
+from streamlines.core   import Core
+from streamlines.useful import open_geotiff, read_geotiff_roi, lookup_labels, \
+                               create_tiled_geotiff, write_geotiff_window
+
+__all__ = ['Basins']
+
+pdebug = print
+
+class Basins(Core):
+    """
+    Class providing methods to partition a DTM into per-basin crops,
+    to drive the workflow basin by basin, and to write the per-basin results
+    and their mosaic into GeoTIFF output files.
+
+    """
+    def __init__(self,state,imported_parameters,geodata,trace):
+        """
+        Args:
+            state (obj):
+            imported_parameters (dict):
+            geodata (obj):
+            trace (obj):
+
+        Initialize a Basins class instance.
+
+        Attributes:
+            self.geodata (obj):
+            self.trace (obj):
+            self.windows (list): basin window dicts as generated by :meth:`plan`
+            self.datasets (dict): tiled GeoTIFF mosaic datasets keyed by layer name
+            self.output_files (dict): GeoTIFF mosaic file names keyed by layer name
+
+        """
+        super(Basins,self).__init__(state,imported_parameters)
+        self.geodata  = geodata
+        self.trace    = trace
+        self.windows  = []
+        self.datasets = {}
+        self.output_files = {}
+
+    def do(self, run_basin, **kwargs):
+        """
+        Args:
+            run_basin (function): callable taking workflow keyword arguments,
+                                  creating a :class:`.Streamlining` instance from them,
+                                  carrying out its workflow and returning it
+            **kwargs (list): keyword arguments of the parent run
+
+        Carry out the workflow basin by basin and write the results.
+        """
+        self.print('\n**Basins begin**')
+        self.plan()
+        for window in self.windows:
+            self.print('Basin {0} ({1}/{2}): {3:,} pixels, x={4} y={5}'
+                       .format(window['basin'],window['index']+1,len(self.windows),
+                               window['n_pixels'],
+                               window['halo_x_bounds'],window['halo_y_bounds']))
+            sl = run_basin(**self.basin_kwargs(window, kwargs))
+            self.write_basin(sl, window)
+            # Release the basin workflow before moving on to bound peak memory
+            del sl
+            gc.collect()
+        self.close()
+        self.print('**Basins end**\n')
+
+    def plan(self):
+        """
+        Read the DTM header and the ROI of the basins raster, and find the
+        bounding box of each basin to be mapped in a single pass over the latter.
+
+        The basins mapped are those listed in the geodata "basins" parameter,
+        or, if none are listed, all those in the raster (label zero excepted).
+        Basins smaller than min_basin_size pixels are skipped.
+
+        Raises:
+            ValueError if there is no basins raster or if its size is wrong.
+
+        Attributes:
+            self.basins_array (numpy.ndarray float32): ROI of basins raster
+            self.domain_x_bounds (list): x bounds of ROI in DTM pixels
+            self.domain_y_bounds (list): y bounds of ROI in DTM pixels
+            self.windows (list): one dict per basin giving its label, pixel count,
+                                 and core (bbox) and halo bounds
+        """
+        geodata = self.geodata
+        geodata.read_dtm_header()
+        if geodata.flip_ns:
+            raise ValueError('Per-basin mapping does not support "flip_ns"')
+        if geodata.basins_file=='':
+            raise ValueError('Per-basin mapping needs a "basins_file"')
+        basins_tiff, _ = open_geotiff(geodata.dtm_path,geodata.basins_file)
+        if (basins_tiff.RasterYSize, basins_tiff.RasterXSize)!=geodata.dtm_shape:
+            raise ValueError('DTM grid and basins grid sizes do not match')
+        self.basins_array = read_geotiff_roi(basins_tiff, geodata.roi_read_window())
+        self.domain_x_bounds = list(geodata.roi_x_bounds)
+        self.domain_y_bounds = list(geodata.roi_y_bounds)
+        if len(geodata.basins)>0:
+            labels = np.unique(np.array(geodata.basins, dtype=np.float32))
+        else:
+            labels = np.unique(self.basins_array)
+            labels = labels[(labels!=0) & ~np.isnan(labels)]
+        # Label each pixel by its basin's index in the table (+1, so zero is none)
+        #   and find all the bboxes and pixel counts in one go
+        is_found_array, index_array = lookup_labels(self.basins_array, labels)
+        table_index_array = np.zeros(self.basins_array.shape, dtype=np.int32)
+        table_index_array[is_found_array] = index_array+1
+        n_pixels_array = np.bincount(index_array, minlength=labels.size)
+        bboxes = find_objects(table_index_array, max_label=labels.size)
+        del table_index_array, is_found_array, index_array
+        halo = int(self.basin_halo)
+        x0, y0 = self.domain_x_bounds[0], self.domain_y_bounds[0]
+        self.windows = []
+        for basin, n_pixels, bbox in zip(labels, n_pixels_array, bboxes):
+            if bbox is None or n_pixels<self.min_basin_size:
+                continue
+            core_x_bounds = [x0+bbox[0].start, x0+bbox[0].stop]
+            core_y_bounds = [y0+bbox[1].start, y0+bbox[1].stop]
+            halo_x_bounds = [max(core_x_bounds[0]-halo,self.domain_x_bounds[0]),
+                             min(core_x_bounds[1]+halo,self.domain_x_bounds[1])]
+            halo_y_bounds = [max(core_y_bounds[0]-halo,self.domain_y_bounds[0]),
+                             min(core_y_bounds[1]+halo,self.domain_y_bounds[1])]
+            self.windows += [{'index'         : len(self.windows),
+                              'basin'         : basin.item(),
+                              'n_pixels'      : int(n_pixels),
+                              'core_x_bounds' : core_x_bounds,
+                              'core_y_bounds' : core_y_bounds,
+                              'halo_x_bounds' : halo_x_bounds,
+                              'halo_y_bounds' : halo_y_bounds}]
+        n_roi_pixels = self.basins_array.size
+        n_crop_pixels = sum([(w['halo_x_bounds'][1]-w['halo_x_bounds'][0])
+                             *(w['halo_y_bounds'][1]-w['halo_y_bounds'][0])
+                             for w in self.windows])
+        self.print('Mapping {0} of {1} basins from crops totalling {2:,} pixels'
+                   .format(len(self.windows),labels.size,n_crop_pixels)
+                   +' (ROI is {0:,} pixels) with a halo of {1} pixels'
+                   .format(n_roi_pixels,halo))
+
+    def basin_kwargs(self, window, kwargs):
+        """
+        Args:
+            window (dict): basin window as generated by :meth:`plan`
+            kwargs (dict): keyword arguments of the parent run
+
+        Generate the workflow keyword arguments for a basin run: the parent's
+        arguments plus JSON parameter overrides that clip the ROI to the basin
+        halo window, read only that window, mask off all but the basin, and
+        turn off per-basin plotting, saving, tiling and further basin partitioning.
+
+        Returns:
+            dict:
+            workflow keyword arguments for the basin
+        """
+        if 'override_parameters' in kwargs.keys() \
+                and kwargs['override_parameters'] is not None \
+                and kwargs['override_parameters']!='':
+            override_dict = loads(kwargs['override_parameters'])
+        else:
+            override_dict = {}
+        override_dict.setdefault('geodata',{}).update({
+            'do_clip_roi'        : True,
+            'roi_bounds_units'   : 'pixels',
+            'roi_x_bounds'       : window['halo_x_bounds'],
+            'roi_y_bounds'       : window['halo_y_bounds'],
+            'do_read_roi_window' : True,
+            'do_basin_masking'   : True,
+            'basins'             : [window['basin']]
+            })
+        basin_kwargs = dict(kwargs)
+        basin_kwargs.update({
+            'override_parameters' : dumps(override_dict),
+            'do_basins'           : False,
+            'do_tiling'           : False,
+            'do_plot'             : 'off',
+            'do_save'             : False,
+            'do_display'          : False,
+            'do_git_info'         : False
+            })
+        return basin_kwargs
+
+    def write_basin(self, sl, window):
+        """
+        Args:
+            sl (obj): :class:`.Streamlining` instance whose workflow was carried out
+                      on the basin
+            window (dict): basin window as generated by :meth:`plan`
+
+        Strip the halo from each output grid of a basin run and write it to file
+        and into the mosaic.
+        """
+        self.write_basin_arrays(self.extract_basin(sl, window), window)
+
+    def extract_basin(self, sl, window):
+        """
+        Args:
+            sl (obj): :class:`.Streamlining` instance whose workflow was carried out
+                      on the basin
+            window (dict): basin window as generated by :meth:`plan`
+
+        Strip the halo (and padding) from each output grid of a basin run.
+
+        Returns:
+            dict:
+            basin bbox grids keyed by layer name
+        """
+        pad = int(sl.geodata.pad_width)
+        x0 = pad+window['core_x_bounds'][0]-window['halo_x_bounds'][0]
+        x1 = pad+window['core_x_bounds'][1]-window['halo_x_bounds'][0]
+        y0 = pad+window['core_y_bounds'][0]-window['halo_y_bounds'][0]
+        y1 = pad+window['core_y_bounds'][1]-window['halo_y_bounds'][0]
+        basin_arrays = {}
+        for layer in self.basin_layers:
+            obj = sl.mapping if layer in ('hsl','mapping') else sl.trace
+            array = getattr(obj,layer+'_array',None)
+            if array is None:
+                continue
+            basin_arrays[layer] = array[x0:x1,y0:y1].copy()
+        return basin_arrays
+
+    def write_basin_arrays(self, basin_arrays, window):
+        """
+        Args:
+            basin_arrays (dict): basin bbox grids as generated by :meth:`extract_basin`
+            window (dict): basin window as generated by :meth:`plan`
+
+        Write basin bbox grids to per-basin GeoTIFF files (if do_save_basin_maps
+        is set), and merge their basin pixels into the corresponding windows
+        of the GeoTIFF mosaics, creating the latter if need be.
+
+        Basin bboxes can overlap, so each mosaic window is read back
+        and only the pixels of this basin are replaced: the merge thus
+        does not depend on the order in which basins are completed.
+        """
+        x_offset = window['core_x_bounds'][0]-self.domain_x_bounds[0]
+        y_offset = window['core_y_bounds'][0]-self.domain_y_bounds[0]
+        x_slice = slice(x_offset,window['core_x_bounds'][1]-self.domain_x_bounds[0])
+        y_slice = slice(y_offset,window['core_y_bounds'][1]-self.domain_y_bounds[0])
+        is_basin_array = (self.basins_array[x_slice,y_slice]==window['basin'])
+        for layer, array in basin_arrays.items():
+            if self.do_save_basin_maps:
+                self.write_basin_file(layer, array, window)
+            if layer not in self.datasets.keys():
+                self.create_output(layer, array)
+            mosaic_array = self.read_mosaic_window(self.datasets[layer],
+                                                   x_offset, y_offset,
+                                                   array.shape, array.dtype)
+            mosaic_array[is_basin_array] = array[is_basin_array]
+            write_geotiff_window(self.datasets[layer], mosaic_array,
+                                 x_offset, y_offset)
+
+    def read_mosaic_window(self, dataset, x_offset, y_offset, shape, dtype):
+        """
+        Args:
+            dataset (gdal.Dataset): GeoTIFF mosaic dataset
+            x_offset (int): x pixel offset of the window in the mosaic
+            y_offset (int): y pixel offset of the window in the mosaic,
+                            counted from the bottom (southern) edge as in slm
+            shape (tuple): shape of the window grid in slm orientation, with a
+                           3rd axis if there are several bands
+            dtype (numpy.dtype): type of grid values
+
+        Read a window of a GeoTIFF mosaic (all bands) back into an slm grid.
+
+        Returns:
+            numpy.ndarray:
+            window grid in slm orientation
+        """
+        nx, ny = shape[0], shape[1]
+        y_offset_tiff = dataset.RasterYSize-int(y_offset)-ny
+        array = np.empty(shape, dtype=dtype)
+        array_3d = array if array.ndim==3 else array[:,:,np.newaxis]
+        for band in range(array_3d.shape[2]):
+            array_3d[:,:,band] \
+                = dataset.GetRasterBand(band+1).ReadAsArray(int(x_offset),
+                                                            y_offset_tiff,
+                                                            nx,ny)[::-1].T
+        return array
+
+    def window_geotransform(self, x_bounds, y_bounds):
+        """
+        Args:
+            x_bounds (list): x bounds of window in DTM pixels
+            y_bounds (list): y bounds of window in DTM pixels
+
+        Returns:
+            list:
+            GDAL geotransform of the window
+            (same arithmetic as for :attr:`.Geodata.roi_geotransform`)
+        """
+        geodata = self.geodata
+        geotransform     = list(geodata.tiff.GetGeoTransform())
+        geotransform[0] += x_bounds[0]*geodata.pixel_size
+        geotransform[3] -= geodata.dtm_shape[0]*geodata.pixel_size
+        geotransform[3] += y_bounds[1]*geodata.pixel_size
+        return geotransform
+
+    def file_stem(self):
+        """
+        Returns:
+            str:
+            path and stem of GeoTIFF output files
+        """
+        return os.path.realpath(os.path.join(*self.geodata.export_maps_path,
+                                             self.state.parameters_file))
+
+    def write_basin_file(self, layer, array, window):
+        """
+        Args:
+            layer (str): name of output grid, e.g., 'slc'
+            array (numpy.ndarray): basin bbox grid
+            window (dict): basin window as generated by :meth:`plan`
+
+        Write a basin bbox grid to its own GeoTIFF file.
+        """
+        file_name = self.file_stem()+'_basin_{0:g}_{1}.tif'.format(window['basin'],
+                                                                   layer)
+        npd = array.shape[2] if array.ndim==3 else 1
+        dataset = create_tiled_geotiff(
+                        file_name, array.shape[0], array.shape[1], npd,
+                        array.dtype if array.dtype!=np.bool else np.uint8,
+                        self.window_geotransform(window['core_x_bounds'],
+                                                 window['core_y_bounds']),
+                        self.geodata.tiff.GetProjection(),
+                        block_size=self.basin_block_size )
+        write_geotiff_window(dataset, array, 0, 0)
+        dataset.FlushCache()
+        # GDAL only completes writing when the dataset is dereferenced
+        del dataset
+
+    def create_output(self, layer, array):
+        """
+        Args:
+            layer (str): name of output grid, e.g., 'slc'
+            array (numpy.ndarray): example (basin) grid giving type and number of bands
+
+        Create an internally tiled GeoTIFF mosaic file covering the whole ROI,
+        into which basins of the named grid will be merged.
+        """
+        file_name = self.file_stem()+'_basins_'+layer+'.tif'
+        npd = array.shape[2] if array.ndim==3 else 1
+        self.print('Writing basins mosaic of "{0}" to "{1}"'.format(layer,file_name))
+        self.datasets[layer] = create_tiled_geotiff(
+                                    file_name,
+                                    self.domain_x_bounds[1]-self.domain_x_bounds[0],
+                                    self.domain_y_bounds[1]-self.domain_y_bounds[0],
+                                    npd, array.dtype if array.dtype!=np.bool
+                                                     else np.uint8,
+                                    self.window_geotransform(self.domain_x_bounds,
+                                                             self.domain_y_bounds),
+                                    self.geodata.tiff.GetProjection(),
+                                    block_size=self.basin_block_size )
+        self.output_files[layer] = file_name
+
+    def close(self):
+        """
+        Flush and close the GeoTIFF mosaic files.
+        """
+        for dataset in self.datasets.values():
+            dataset.FlushCache()
+        # GDAL only completes writing when the dataset is dereferenced
+        self.datasets = {}
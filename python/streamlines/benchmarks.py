@@ -0,0 +1,421 @@
+"""
+---------------------------------------------------------------------
+
+Benchmarks of performance options of the ``slm`` workflow.
+
+Each benchmark runs the workflow up to and including trace, once per setting of
+the option being benchmarked, on the DTM given by a parameters file, and
+tabulates the throughput of streamline tracing and the fidelity of the
+resulting slc, slt and sla grids relative to those of the reference setting.
+
+For example::
+
+    from streamlines.benchmarks import benchmark_uv_encodings
+    benchmark_df = benchmark_uv_encodings('../tests/IndianCreek_Test2.json')
+
+Approximations (e.g., streamline merging, flow accumulation) are validated against the 
+brute-force reference in the same way.
+
+Options that only reorder work (e.g., seed orderings) change which random 
+jitter each seed receives, so their fidelity figures measure sampling 
+noise rather than error.
+
+---------------------------------------------------------------------
+
+Requires Python packages/modules:
+  -  :mod:`json`
+  -  :mod:`pandas`
+
+Imports :class:`Streamlining <streamlines.streamlining.Streamlining>` class.
+
+---------------------------------------------------------------------
+
+"""
+
+import numpy as np
+import pandas as pd
+from json import dumps, loads
+import time
+import os
+os.environ['PYTHONUNBUFFERED']='True'
+
+from streamlines.streamlining import Streamlining
+from streamlines.useful       import decode_uv_field
+
+__all__ = ['benchmark_uv_encodings', 'benchmark_seed_orders', 
+           'benchmark_fields_memo', 'benchmark_fields_engines', 
+           'benchmark_accumulation', 'benchmark_fields_progressive',
+           'run_to_trace', 'compare_fields']
+
+pdebug = print
+
+def run_to_trace(override_dict=None, n_repeats=2, **kwargs):
+    """
+    Args:
+        override_dict (dict): parameter overrides by workflow class, merged
+                              into any given as ``override_parameters``
+        n_repeats (int): number of times to carry out trace
+        **kwargs (dict): keyword arguments as for :func:`.slm.run`
+
+    Carry out the geodata, preprocess and trace workflow steps, timing trace.
+    Trace is repeated, and the fastest time taken, so that 
+    OpenCL program builds and Numba compilation are not timed.
+
+    Returns:
+        tuple:
+            :class:`.Streamlining` instance, trace wall time in seconds
+    """
+    override_parameters = kwargs.get('override_parameters',None)
+    merged_dict = loads(override_parameters) if override_parameters else {}
+    for item in (override_dict or {}).items():
+        merged_dict.setdefault(item[0],{}).update(item[1])
+    kwargs.update({'override_parameters' : dumps(merged_dict),
+                   'do_plot' : 'off', 'do_save' : False, 'do_display' : False,
+                   'do_tiling' : False, 'do_basins' : False, 'do_batch' : False,
+                   'do_profile' : False, 'do_cache_stages' : False})
+    sl = Streamlining(**kwargs)
+    sl.geodata.do()
+    sl.preprocess.do()
+    trace_times = []
+    for repeat in range(max(1,n_repeats)):
+        t_start = time.perf_counter()
+        sl.trace.do()
+        trace_times += [time.perf_counter()-t_start]
+    return sl, min(trace_times)
+
+def compare_fields(sl, reference_sl):
+    """
+    Args:
+        sl (obj): :class:`.Streamlining` instance after trace
+        reference_sl (obj): reference :class:`.Streamlining` instance after trace
+
+    Measure the discrepancies of slc, slt and sla (downstream & upstream) from
+    the reference, over pixels traversed by reference streamlines.
+
+    Returns:
+        dict:
+            relative rms and relative maximum errors by grid
+    """
+    errors_dict = {}
+    is_traced_array = reference_sl.trace.slc_array>0
+    for name in ['slc','slt','sla']:
+        array = getattr(sl.trace,name+'_array')[is_traced_array].astype(np.float64)
+        reference_array \
+            = getattr(reference_sl.trace,name+'_array')[is_traced_array].astype(np.float64)
+        if reference_array.size==0:
+            continue
+        error_array = array-reference_array
+        reference_rms = max(np.sqrt(np.mean(reference_array**2)),np.finfo(np.float32).tiny)
+        errors_dict.update({
+            name+'_rel_rms_error' : np.sqrt(np.mean(error_array**2))/reference_rms,
+            name+'_rel_max_error' : np.max(np.abs(error_array))/reference_rms
+            })
+    return errors_dict
+
+def benchmark_uv_encodings(parameters_file, encodings=('float32','half','angle'),
+                           n_repeats=2, **kwargs):
+    """
+    Args:
+        parameters_file (str): name of slm JSON parameters file
+        encodings (list): uv encodings to compare (the first is the reference)
+        n_repeats (int): number of times to carry out trace per encoding
+        **kwargs (dict): further keyword arguments as for :func:`.slm.run`
+
+    Compare the throughput of streamline tracing and the fidelity of its slc,
+    slt and sla grids for each compact encoding of the uv vector field
+    (see :func:`.useful.encode_uv_field`).
+
+    Also reports the footprint of the uv grid and the maximum error in
+    flow direction introduced by its encoding.
+
+    Returns:
+        pandas.DataFrame:
+            benchmark results, one row per encoding
+    """
+    rows = []
+    reference_sl = None
+    for encoding in encodings:
+        sl, trace_time = run_to_trace({'preprocess' : {'uv_encoding' : encoding}},
+                                      n_repeats=n_repeats,
+                                      parameters_file=parameters_file, **kwargs)
+        uv_array = sl.preprocess.uv_array
+        decoded_uv_array = decode_uv_field(sl.preprocess.uv_code_array, encoding)
+        is_unmasked_array = ~sl.state.merge_active_masks()
+        angle_error_array \
+            = np.arctan2(decoded_uv_array[:,:,1],decoded_uv_array[:,:,0]) \
+              -np.arctan2(uv_array[:,:,1],uv_array[:,:,0])
+        angle_error_array = np.abs(np.angle(np.exp(1j*angle_error_array)))
+        n_streamlines = 2*sl.trace.seed_point_array.shape[0]
+        row = {'uv_encoding'         : encoding,
+               'uv_bytes'            : sl.preprocess.uv_code_array.nbytes,
+               'uv_max_angle_error'  : np.rad2deg(
+                                          np.max(angle_error_array[is_unmasked_array])),
+               'trace_time'          : trace_time,
+               'streamlines_per_sec' : n_streamlines/trace_time}
+        if reference_sl is None:
+            reference_sl = sl
+        else:
+            row.update(compare_fields(sl, reference_sl))
+        rows += [row]
+    benchmark_df = pd.DataFrame(rows).set_index('uv_encoding')
+    pdebug(benchmark_df.to_string())
+    return benchmark_df
+
+# Seed point orderings: (do_shuffle_seed_points, seed_point_curve)
+SEED_ORDERS = {'shuffle' : (True,  'none'),
+               'raster'  : (False, 'none'),
+               'morton'  : (True,  'morton'),
+               'hilbert' : (True,  'hilbert')}
+
+def benchmark_seed_orders(parameters_file, orders=('shuffle','raster','morton','hilbert'),
+                          uv_tile_sizes=(0,8), n_repeats=2, **kwargs):
+    """
+    Args:
+        parameters_file (str): name of slm JSON parameters file
+        orders (list): seed point orderings to compare, from those in SEED_ORDERS
+                       (the first is the reference)
+        uv_tile_sizes (list): uv grid tile widths to compare, 
+                              with 0 meaning row-major (the first is the reference)
+        n_repeats (int): number of times to carry out trace per layout
+        **kwargs (dict): further keyword arguments as for :func:`.slm.run`
+
+    Compare the throughput of streamline tracing and the fidelity of its slc,
+    slt and sla grids for each combination of seed point ordering (random,
+    raster, or along a Morton or Hilbert space-filling curve, 
+    see :func:`.useful.create_seeds`) and uv grid memory layout
+    (row-major or tiled, see :func:`.useful.tile_grid`).
+
+    Returns:
+        pandas.DataFrame:
+            benchmark results, one row per ordering and layout
+    """
+    rows = []
+    reference_sl = None
+    for order in orders:
+        if order not in SEED_ORDERS.keys():
+            raise ValueError('Unknown seed point ordering "{}"'.format(order))
+        do_shuffle, curve = SEED_ORDERS[order]
+        for uv_tile_size in uv_tile_sizes:
+            sl, trace_time = run_to_trace({'trace' : 
+                                              {'do_shuffle_seed_points' : do_shuffle,
+                                               'seed_point_curve'       : curve,
+                                               'uv_tile_size'           : uv_tile_size}},
+                                          n_repeats=n_repeats,
+                                          parameters_file=parameters_file, **kwargs)
+            n_streamlines = 2*sl.trace.seed_point_array.shape[0]
+            row = {'seed_order'          : order,
+                   'uv_tile_size'        : uv_tile_size,
+                   'trace_time'          : trace_time,
+                   'streamlines_per_sec' : n_streamlines/trace_time}
+            if reference_sl is None:
+                reference_sl = sl
+            else:
+                row.update(compare_fields(sl, reference_sl))
+            rows += [row]
+    benchmark_df = pd.DataFrame(rows).set_index(['seed_order','uv_tile_size'])
+    benchmark_df['speedup'] = benchmark_df['trace_time'].iloc[0]/benchmark_df['trace_time']
+    pdebug(benchmark_df.to_string())
+    return benchmark_df
+
+def benchmark_fields_memo(parameters_file, memo_min_lengths=(400.0,200.0,100.0,50.0),
+                          n_repeats=2, **kwargs):
+    """
+    Args:
+        parameters_file (str): name of slm JSON parameters file
+        memo_min_lengths (list): minimum streamline lengths (in meters) before
+                                 merging, i.e., tolerances, to compare
+        n_repeats (int): number of times to carry out trace per tolerance
+        **kwargs (dict): further keyword arguments as for :func:`.slm.run`
+
+    Validate streamline merging in the integration of the slc, slt and sla grids
+    (see :meth:`.Fields.resolve_memo`) against brute-force integration, which 
+    is the reference, for each merging tolerance: compare the throughput of 
+    streamline tracing and the discrepancies of the grids from the reference. 
+    Only downstream grids are affected.
+
+    Returns:
+        pandas.DataFrame:
+            benchmark results, one row per tolerance (NaN for the reference)
+    """
+    rows = []
+    reference_sl = None
+    for memo_min_length in [None]+list(memo_min_lengths):
+        if memo_min_length is None:
+            override_dict = {'trace' : {'do_memoize_fields' : False}}
+        else:
+            override_dict = {'trace' : {'do_memoize_fields' : True,
+                                        'memo_min_length'   : memo_min_length}}
+        sl, trace_time = run_to_trace(override_dict, n_repeats=n_repeats,
+                                      parameters_file=parameters_file, **kwargs)
+        n_streamlines = 2*sl.trace.seed_point_array.shape[0]
+        row = {'memo_min_length'     : (np.nan if memo_min_length is None 
+                                        else memo_min_length),
+               'trace_time'          : trace_time,
+               'streamlines_per_sec' : n_streamlines/trace_time}
+        if reference_sl is None:
+            reference_sl = sl
+        else:
+            row.update(compare_fields(sl, reference_sl))
+        rows += [row]
+    benchmark_df = pd.DataFrame(rows).set_index('memo_min_length')
+    benchmark_df['speedup'] = benchmark_df['trace_time'].iloc[0]/benchmark_df['trace_time']
+    pdebug(benchmark_df.to_string())
+    return benchmark_df
+
+def benchmark_fields_engines(parameters_file, engines=('streamlines','dinf','mfd'),
+                             n_repeats=2, **kwargs):
+    """
+    Args:
+        parameters_file (str): name of slm JSON parameters file
+        engines (list): fields engines to compare (the first is the reference)
+        n_repeats (int): number of times to compute the fields per engine
+        **kwargs (dict): further keyword arguments as for :func:`.slm.run`
+
+    Report the fidelity of the slc, slt and sla grids approximated by flow 
+    accumulation (see :mod:`.flowaccumulation`), with each flow partition scheme,
+    relative to those integrated by streamline tracing, along with the time
+    taken to compute the fields alone (i.e., not counting trajectories). 
+
+    Returns:
+        pandas.DataFrame:
+            benchmark results, one row per engine
+    """
+    rows = []
+    reference_sl = None
+    for engine in engines:
+        sl, trace_time = run_to_trace({'trace' : {'fields_engine' : engine}},
+                                      n_repeats=1,
+                                      parameters_file=parameters_file, **kwargs)
+        fields_times = []
+        for repeat in range(max(1,n_repeats)):
+            t_start = time.perf_counter()
+            sl.trace.compute_fields()
+            fields_times += [time.perf_counter()-t_start]
+        row = {'fields_engine' : engine,
+               'fields_time'   : min(fields_times),
+               'pixels_per_sec': np.count_nonzero(sl.trace.slc_array[:,:,0]>0)
+                                 /min(fields_times)}
+        if reference_sl is None:
+            reference_sl = sl
+        else:
+            row.update(compare_fields(sl, reference_sl))
+        rows += [row]
+    benchmark_df = pd.DataFrame(rows).set_index('fields_engine')
+    benchmark_df['speedup'] = benchmark_df['fields_time'].iloc[0]/benchmark_df['fields_time']
+    pdebug(benchmark_df.to_string())
+    return benchmark_df
+
+# Streamline field workloads: seed point orderings, as in SEED_ORDERS, 
+#   that either spread the pixels written concurrently (balanced) or 
+#   concentrate them, since neighboring work items trace neighboring,
+#   converging streamlines (contention-heavy)
+ACCUMULATION_WORKLOADS = {'balanced'   : 'shuffle',
+                          'contention' : 'raster'}
+
+def benchmark_accumulation(parameters_file, workloads=('balanced','contention'),
+                           slt_scales=(1.0,), n_repeats=2, **kwargs):
+    """
+    Args:
+        parameters_file (str): name of slm JSON parameters file
+        workloads (list): workloads to compare, from those in ACCUMULATION_WORKLOADS
+        slt_scales (list): scalings of streamline lengths accumulated as integers
+                           into slt to compare (the first is the reference)
+        n_repeats (int): number of times to compute the fields per setting
+        **kwargs (dict): further keyword arguments as for :func:`.slm.run`
+
+    Compare the time taken to integrate the slc, slt and sla grids with 
+    atomic accumulation into global memory at every integration step versus
+    privatized accumulation (see :meth:`.Fields.gpu_integrate`), for a balanced 
+    and a contention-heavy workload, and for each slt scaling.
+    Also reports the fidelity of each setting relative to atomic 
+    accumulation with the first scaling for the same workload.
+
+    Returns:
+        pandas.DataFrame:
+            benchmark results, one row per workload, scaling and mode
+    """
+    rows = []
+    for workload in workloads:
+        if workload not in ACCUMULATION_WORKLOADS.keys():
+            raise ValueError('Unknown accumulation workload "{}"'.format(workload))
+        do_shuffle, curve = SEED_ORDERS[ACCUMULATION_WORKLOADS[workload]]
+        reference_sl, reference_time = None, None
+        for slt_scale in slt_scales:
+            for do_privatize in (False,True):
+                sl, trace_time = run_to_trace({'trace' : 
+                                      {'do_shuffle_seed_points'    : do_shuffle,
+                                       'seed_point_curve'          : curve,
+                                       'do_privatize_accumulation' : do_privatize,
+                                       'slt_scale'                 : slt_scale}},
+                                      n_repeats=1,
+                                      parameters_file=parameters_file, **kwargs)
+                fields_times = []
+                for repeat in range(max(1,n_repeats)):
+                    t_start = time.perf_counter()
+                    sl.trace.compute_fields()
+                    fields_times += [time.perf_counter()-t_start]
+                row = {'workload'         : workload,
+                       'slt_scale'        : slt_scale,
+                       'is_privatized'    : do_privatize,
+                       'fields_time'      : min(fields_times)}
+                if reference_sl is None:
+                    reference_sl, reference_time = sl, min(fields_times)
+                else:
+                    row.update(compare_fields(sl, reference_sl))
+                row['speedup'] = reference_time/min(fields_times)
+                rows += [row]
+    benchmark_df = pd.DataFrame(rows).set_index(['workload','slt_scale','is_privatized'])
+    pdebug(benchmark_df.to_string())
+    return benchmark_df
+
+def benchmark_fields_progressive(parameters_file, tolerances=(0.2,0.1,0.05,0.02),
+                                 n_rounds=16, n_repeats=2, **kwargs):
+    """
+    Args:
+        parameters_file (str): name of slm JSON parameters file
+        tolerances (list): relative error tolerances of progressive field estimation
+        n_rounds (int): number of rounds into which to split the seed points
+        n_repeats (int): number of times to compute the fields per tolerance
+        **kwargs (dict): further keyword arguments as for :func:`.slm.run`
+
+    Report the time taken to estimate the slc, slt and sla grids progressively
+    (see :meth:`.Trace.estimate_fields`) to within each tolerance, 
+    the number of rounds this took and the estimated relative error, along with
+    the fidelity of the estimates relative to the fields integrated in full.
+
+    Returns:
+        pandas.DataFrame:
+            benchmark results, one row per tolerance (the first for full integration)
+    """
+    rows = []
+    reference_sl, reference_time = None, None
+    for tolerance in (None,)+tuple(tolerances):
+        if tolerance is None:
+            override_dict = {'trace' : {'do_progressive_fields' : False}}
+        else:
+            override_dict = {'trace' : {'do_progressive_fields' : True,
+                                        'progressive_n_rounds'  : n_rounds,
+                                        'progressive_tolerance' : tolerance,
+                                        'progressive_time_budget' : 0.0}}
+        sl, trace_time = run_to_trace(override_dict, n_repeats=1,
+                                      parameters_file=parameters_file, **kwargs)
+        fields_times = []
+        for repeat in range(max(1,n_repeats)):
+            t_start = time.perf_counter()
+            sl.trace.compute_fields()
+            fields_times += [time.perf_counter()-t_start]
+        row = {'tolerance'     : tolerance if tolerance is not None else 0.0,
+               'fields_time'   : min(fields_times),
+               'n_rounds'      : getattr(sl.trace,'fields_n_rounds',1) 
+                                    if tolerance is not None else 1,
+               'est_rel_error' : getattr(sl.trace,'fields_rel_error',0.0)
+                                    if tolerance is not None else 0.0}
+        if reference_sl is None:
+            reference_sl, reference_time = sl, min(fields_times)
+        else:
+            row.update(compare_fields(sl, reference_sl))
+        row['speedup'] = reference_time/min(fields_times)
+        rows += [row]
+    benchmark_df = pd.DataFrame(rows).set_index('tolerance')
+    pdebug(benchmark_df.to_string())
+    return benchmark_df
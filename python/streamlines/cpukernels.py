@@ -0,0 +1,434 @@
+"""
+---------------------------------------------------------------------
+
+CPU (Numba) versions of the streamline integration kernels.
+
+Provides ``numba.njit(parallel=True)`` counterparts of the OpenCL kernels
+``integrate_trajectory`` and ``integrate_fields`` (see ``integratetraj.cl``,
+``integratefields.cl``, ``trajectory.cl``, ``jittertrajectory.cl``,
+``rungekutta.cl``, ``computestep.cl``, ``essentials.cl`` and ``rng.cl``),
+so that streamlines can be traced on many-core hosts without a GPU or
+an OpenCL ICD.
+
+The step logic mirrors the OpenCL code line for line, but is computed in double
+precision. Compile-time macros of the OpenCL build are passed instead as a tuple
+of kernel parameters generated by :func:`set_kernel_parameters`.
+
+Streamline counts and lengths (slc, slt) are accumulated without atomics:
+each block of seed points writes to its own private pair of grids, and these are
+summed at the end.
+
+---------------------------------------------------------------------
+
+Requires Python packages/modules:
+  - :ref:`numba <numba:install_frontpage>` (:ref:`search <numba:search>`)
+
+---------------------------------------------------------------------
+
+.. _numba: https://numba.pydata.org/
+
+"""
+
+from numba import njit, prange, config
+import numpy as np
+import os
+os.environ['PYTHONUNBUFFERED']='True'
+
+__all__ = ['set_kernel_parameters', 'host_memory_size', 'n_accumulator_blocks',
+           'integrate_trajectory', 'integrate_fields', 'reduce_blocks']
+
+pdebug = print
+
+def set_kernel_parameters(info, downup_sign):
+    """
+    Args:
+        info (obj): container for myriad parameters controlling
+            trace() workflow and kernel operation
+        downup_sign (float): +1 for downstream and -1 for upstream integration
+
+    Gather the parameters passed to the OpenCL integration kernels as compiler
+    macros and grid parameters (see :func:`.pocl.set_compile_options` and 
+    :func:`.pocl.grid_params`) into a tuple for the Numba kernels.
+
+    Returns:
+        tuple:
+            kernel parameters
+    """
+    nxf = np.float64(info.nx)
+    nyf = np.float64(info.ny)
+    grid_scale = np.sqrt(nxf*nyf)
+    return (int(info.nx_padded),
+            int(info.ny_padded),
+            float(info.pad_width),
+            float(info.pad_width)+0.5,
+            nxf-0.5,
+            nyf-0.5,
+            float(np.sign(downup_sign)),
+            grid_scale,
+            grid_scale*float(info.integrator_step_factor)*float(np.sign(downup_sign)),
+            min(min(1.0/nxf,1.0/nyf),0.1),
+            float(info.adjusted_max_error),
+            float(info.integration_halt_threshold),
+            float(info.max_length),
+            int(info.max_n_steps),
+            float(info.trajectory_resolution),
+            int(info.subpixel_seed_point_density),
+            float(info.subpixel_seed_halfspan),
+            float(info.subpixel_seed_step),
+            float(info.jitter_magnitude),
+            float(info.slt_scale))
+
+def host_memory_size():
+    """
+    Fetch the size of physical memory of the host.
+
+    Returns:
+        int:
+            memory size in bytes (None if unknown)
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, AttributeError, OSError):
+        return None
+
+def n_accumulator_blocks(grid_nbytes, memory_limit_pc):
+    """
+    Args:
+        grid_nbytes (int): size of one pair of private slc, slt accumulator grids
+        memory_limit_pc (int): percentage of host memory they may take up
+
+    Choose the number of blocks of seed points whose streamlines are integrated
+    in parallel, each writing to its own private accumulator grids:
+    one per Numba thread, unless their grids would not fit in host memory.
+
+    Returns:
+        int:
+            number of blocks
+    """
+    n_blocks = int(config.NUMBA_NUM_THREADS)
+    memory_size = host_memory_size()
+    if memory_size is not None:
+        n_blocks = min(n_blocks, (int(memory_size)*int(memory_limit_pc))//100
+                                 //max(grid_nbytes,1))
+    return max(1,n_blocks)
+
+@njit(cache=False)
+def _to_byte(x):
+    """
+    Convert a float to a signed byte as (char) does on the OpenCL device,
+    i.e., truncate towards zero and keep the low 8 bits.
+    """
+    return ((int(x)+128) & 255)-128
+
+@njit(cache=False)
+def _approximate(x, resolution):
+    """
+    Approximate a float at the resolution of a scaled byte (see essentials.cl).
+    """
+    return _to_byte(x*resolution)/resolution
+
+@njit(cache=False)
+def _get_array_idx(x, y, parameters):
+    """
+    Compute the (flattened) index of the padded grid pixel at a position
+    (see essentials.cl).
+    """
+    nxp, nyp, pad_pp5 = parameters[0], parameters[1], parameters[3]
+    return ( min(nyp-1, int(max(0.0, y+pad_pp5)))
+            +nyp*min(nxp-1, int(max(0.0, x+pad_pp5))) )
+
+@njit(cache=False)
+def _speed_interpolator(x, y, uv_array, parameters):
+    """
+    Bilinearly interpolate and normalize the flow velocity vector at a position
+    (see essentials.cl).
+    """
+    nxp, nyp, pad, pad_pp5 = parameters[0], parameters[1], parameters[2], parameters[3]
+    x_lft = min(nxp-1, int(max(0.0, x+pad_pp5)))
+    y_dwn = min(nyp-1, int(max(0.0, y+pad_pp5)))
+    x_rgt = min(nxp-1, x_lft+1)
+    y_upp = min(nyp-1, y_dwn+1)
+    rx_weight = x-x_lft+pad
+    lx_weight = 1.0-rx_weight
+    uy_weight = y-y_dwn+pad
+    dy_weight = 1.0-uy_weight
+    u_dwn = uv_array[nyp*x_lft+y_dwn,0]*lx_weight+uv_array[nyp*x_rgt+y_dwn,0]*rx_weight
+    v_dwn = uv_array[nyp*x_lft+y_dwn,1]*lx_weight+uv_array[nyp*x_rgt+y_dwn,1]*rx_weight
+    u_upp = uv_array[nyp*x_lft+y_upp,0]*lx_weight+uv_array[nyp*x_rgt+y_upp,0]*rx_weight
+    v_upp = uv_array[nyp*x_lft+y_upp,1]*lx_weight+uv_array[nyp*x_rgt+y_upp,1]*rx_weight
+    u = u_dwn*dy_weight+u_upp*uy_weight
+    v = v_dwn*dy_weight+v_upp*uy_weight
+    speed = np.sqrt(u*u+v*v)
+    if speed>0.0:
+        return u/speed, v/speed
+    return u, v
+
+@njit(cache=False)
+def _dt_to_nearest_edge(x, u):
+    """
+    Compute the delta time needed to step onto the nearest pixel edge
+    (see essentials.cl).
+    """
+    dt = 0.0
+    if u>0.0:
+        dt = (int(x+1.5)-(x+0.5))/u
+    if u<0.0:
+        dt = -((x+0.5)-int(x+0.5))/u
+    return dt
+
+@njit(cache=False)
+def _minmag(a, b):
+    """
+    Return whichever argument is smaller in magnitude, as OpenCL minmag().
+    """
+    if abs(a)<abs(b):
+        return a
+    if abs(b)<abs(a):
+        return b
+    return min(a,b)
+
+@njit(cache=False)
+def _lehmer_rand_uint(rng_state):
+    """
+    Generate the next Lehmer RNG state aka 32-bit random variate (see rng.cl).
+    """
+    return (((rng_state+1) & 0xffffffff)*279470273) % 0xfffffffb
+
+@njit(cache=False)
+def _byte_reversal(rng_state):
+    """
+    Reverse the bytes of a 32-bit RNG state (see integratefields.cl).
+    """
+    return ( ((rng_state>>24) & 0xff) | ((rng_state>>8) & 0xff00)
+            | ((rng_state<<8) & 0xff0000) | ((rng_state<<24) & 0xff000000) )
+
+@njit(cache=False)
+def _compute_step_vec(dt, x, y, uv_array, parameters):
+    """
+    Compute a 2nd-order Runge-Kutta integration step (see computestep.cl).
+    """
+    combo_factor, resolution = parameters[8], parameters[14]
+    u1,v1 = _speed_interpolator(x, y, uv_array, parameters)
+    dx1 = _approximate(u1*combo_factor*dt, resolution)
+    dy1 = _approximate(v1*combo_factor*dt, resolution)
+    u2,v2 = _speed_interpolator(x+dx1, y+dy1, uv_array, parameters)
+    dx2 = _approximate(0.5*(dx1+u2*combo_factor*dt), resolution)
+    dy2 = _approximate(0.5*(dy1+v2*combo_factor*dt), resolution)
+    return u1,v1, dx1,dy1, dx2,dy2
+
+@njit(cache=False)
+def _compute_step_vec_jittered(dt, x, y, uv_array, rng_state, parameters):
+    """
+    Compute a jittered 2nd-order Runge-Kutta integration step (see computestep.cl).
+    """
+    combo_factor, resolution, jitter = parameters[8], parameters[14], parameters[18]
+    u1,v1 = _speed_interpolator(x, y, uv_array, parameters)
+    rng_state = _lehmer_rand_uint(rng_state)
+    u1 += (rng_state/0xfffffffb-0.5)*jitter
+    rng_state = _lehmer_rand_uint(rng_state)
+    v1 += (rng_state/0xfffffffb-0.5)*jitter
+    speed = np.sqrt(u1*u1+v1*v1)
+    u1,v1 = u1/speed, v1/speed
+    dx1 = _approximate(u1*combo_factor*dt, resolution)
+    dy1 = _approximate(v1*combo_factor*dt, resolution)
+    u2,v2 = _speed_interpolator(x+dx1, y+dy1, uv_array, parameters)
+    rng_state = _lehmer_rand_uint(rng_state)
+    u2 += (rng_state/0xfffffffb-0.5)*jitter
+    rng_state = _lehmer_rand_uint(rng_state)
+    v2 += (rng_state/0xfffffffb-0.5)*jitter
+    speed = np.sqrt(u2*u2+v2*v2)
+    u2,v2 = u2/speed, v2/speed
+    dx2 = _approximate(0.5*(dx1+u2*combo_factor*dt), resolution)
+    dy2 = _approximate(0.5*(dy1+v2*combo_factor*dt), resolution)
+    return u1,v1, dx1,dy1, dx2,dy2, rng_state
+
+@njit(cache=False)
+def _next_dt(dt, step_error, parameters):
+    """
+    Adapt the delta time step to the Runge-Kutta step error (see rungekutta.cl).
+    """
+    dt_max, adjusted_max_error = parameters[9], parameters[10]
+    if step_error==0.0:
+        return dt_max
+    return min(dt_max, (adjusted_max_error*dt)/step_error)
+
+@njit(cache=False)
+def _trajectory_record(x, y, mask_array, uv_array, trajectory_array, parameters):
+    """
+    Integrate a streamline downstream or upstream and record its trajectory
+    (see trajectory.cl and rungekutta.cl).
+
+    Returns:
+        int, float:
+            number of steps and length of the trajectory
+    """
+    downup_sign, grid_scale = parameters[6], parameters[7]
+    nxf_mp5, nyf_mp5 = parameters[4], parameters[5]
+    dt_max, halt_threshold = parameters[9], parameters[11]
+    max_length, max_n_steps, resolution = parameters[12], parameters[13], parameters[14]
+    n_steps = 0
+    l_trajectory = 0.0
+    dt = dt_max
+    prev_x, prev_y = x, y
+    idx = _get_array_idx(x, y, parameters)
+    while not mask_array[idx] and (l_trajectory<max_length and n_steps<max_n_steps):
+        u1,v1, dx1,dy1, dx2,dy2 = _compute_step_vec(dt, x, y, uv_array, parameters)
+        next_x, next_y = x+dx2, y+dy2
+        idx = _get_array_idx(next_x, next_y, parameters)
+        if not mask_array[idx]:
+            # Runge-Kutta step
+            step_error = np.sqrt((dx2-dx1)**2+(dy2-dy1)**2)/grid_scale
+            dl = np.sqrt(dx2*dx2+dy2*dy2)
+            if dl<halt_threshold:
+                next_x, next_y = x+dx1, y+dy1
+                dl = np.sqrt(dx1*dx1+dy1*dy1)
+            x, y = next_x, next_y
+            idx = _get_array_idx(x, y, parameters)
+            is_stuck = dl<halt_threshold
+            if not is_stuck:
+                dt = _next_dt(dt, step_error, parameters)
+            l_trajectory += dl
+            trajectory_array[n_steps,0] = _to_byte((x-prev_x)*resolution)
+            trajectory_array[n_steps,1] = _to_byte((y-prev_y)*resolution)
+            n_steps += 1
+            if is_stuck:
+                break
+            prev_x, prev_y = x, y
+        else:
+            # Euler step onto the edge of the masked pixel
+            su, sv = u1*downup_sign, v1*downup_sign
+            dt = _minmag(_dt_to_nearest_edge(x, su), _dt_to_nearest_edge(y, sv))
+            x = _approximate(x+su*dt, resolution)
+            y = _approximate(y+sv*dt, resolution)
+            x = min(max(x,-0.5),nxf_mp5)
+            y = min(max(y,-0.5),nyf_mp5)
+            dl = np.sqrt((x-prev_x)**2+(y-prev_y)**2)
+            l_trajectory += dl
+            trajectory_array[n_steps,0] = _to_byte((x-prev_x)*resolution)
+            trajectory_array[n_steps,1] = _to_byte((y-prev_y)*resolution)
+            n_steps += 1
+            break
+    return n_steps, l_trajectory
+
+@njit(parallel=True, cache=False)
+def integrate_trajectory(seed_point_array, mask_array, uv_array,
+                         trajcs_array, nsteps_array, length_array,
+                         n_chunk_seeds, seeds_chunk_offset, parameters):
+    """
+    Args:
+        seed_point_array (numpy.ndarray): seed point positions
+        mask_array (numpy.ndarray): flattened grid pixel mask (padded)
+        uv_array (numpy.ndarray): flattened flow unit velocity vector grid (padded)
+        trajcs_array (numpy.ndarray): chunk trajectories as byte step vectors
+        nsteps_array (numpy.ndarray): chunk trajectory step counts
+        length_array (numpy.ndarray): chunk trajectory lengths
+        n_chunk_seeds (int): number of seed points in this chunk
+        seeds_chunk_offset (int): index of the first seed point in this chunk
+        parameters (tuple): as generated by :func:`set_kernel_parameters`
+
+    Trace and record a streamline from each seed point of a chunk, in parallel
+    (see integratetraj.cl).
+    """
+    for global_id in prange(n_chunk_seeds):
+        seed_idx = seeds_chunk_offset+global_id
+        n_steps, l_trajectory \
+            = _trajectory_record(np.float64(seed_point_array[seed_idx,0]),
+                                 np.float64(seed_point_array[seed_idx,1]),
+                                 mask_array, uv_array, trajcs_array[global_id],
+                                 parameters)
+        nsteps_array[global_id] = n_steps
+        length_array[global_id] = l_trajectory
+
+@njit(cache=False)
+def _write_sl_data(idx, mask_array, slc_array, slt_array, l_trajectory):
+    """
+    Add to the streamline count and length totals at a pixel (see writearray.cl).
+    """
+    if idx<mask_array.shape[0] and not mask_array[idx]:
+        slt_array[idx] += np.uint32(int(l_trajectory+0.5) & 0xffffffff)
+        slc_array[idx] += np.uint32(1)
+
+@njit(cache=False)
+def _jittered_trajectory(x, y, mask_array, uv_array, slc_array, slt_array,
+                         rng_state, parameters):
+    """
+    Integrate a jittered streamline downstream or upstream and add its passage
+    to the streamline count and length grids (see jittertrajectory.cl).
+    """
+    grid_scale, dt_max, halt_threshold = parameters[7], parameters[9], parameters[11]
+    max_length, max_n_steps, slt_scale = parameters[12], parameters[13], parameters[19]
+    n_steps = 0
+    l_trajectory = 0.0
+    dt = dt_max
+    idx = _get_array_idx(x, y, parameters)
+    _write_sl_data(idx, mask_array, slc_array, slt_array, l_trajectory*slt_scale)
+    while not mask_array[idx] and (l_trajectory<max_length and n_steps<max_n_steps):
+        u1,v1, dx1,dy1, dx2,dy2, rng_state \
+            = _compute_step_vec_jittered(dt, x, y, uv_array, rng_state, parameters)
+        idx = _get_array_idx(x+dx2, y+dy2, parameters)
+        if mask_array[idx]:
+            # As on the OpenCL device, no Euler tail step is taken here
+            break
+        step_error = np.sqrt((dx2-dx1)**2+(dy2-dy1)**2)/grid_scale
+        dl = np.sqrt(dx2*dx2+dy2*dy2)
+        x, y = x+dx2, y+dy2
+        is_stuck = dl<halt_threshold
+        if not is_stuck:
+            dt = _next_dt(dt, step_error, parameters)
+        l_trajectory += dl
+        n_steps += 1
+        idx = _get_array_idx(x, y, parameters)
+        _write_sl_data(idx, mask_array, slc_array, slt_array, l_trajectory*slt_scale)
+        if is_stuck:
+            break
+
+@njit(parallel=True, cache=False)
+def integrate_fields(seed_point_array, mask_array, uv_array,
+                     slc_blocks_array, slt_blocks_array, n_seed_points, parameters):
+    """
+    Args:
+        seed_point_array (numpy.ndarray): seed point positions
+        mask_array (numpy.ndarray): flattened grid pixel mask (padded)
+        uv_array (numpy.ndarray): flattened flow unit velocity vector grid (padded)
+        slc_blocks_array (numpy.ndarray): private streamline count grid of each block
+        slt_blocks_array (numpy.ndarray): private streamline length grid of each block
+        n_seed_points (int): number of seed points
+        parameters (tuple): as generated by :func:`set_kernel_parameters`
+
+    Trace a set of jittered streamlines from a grid of sub-pixel positions
+    around each seed point (see integratefields.cl).
+    Seed points are dealt out to blocks, each processed by one thread and
+    accumulating into its own slc, slt grids, so no atomic operations are needed.
+    """
+    density, halfspan, step = parameters[15], parameters[16], parameters[17]
+    n_blocks = slc_blocks_array.shape[0]
+    for block in prange(n_blocks):
+        slc_array = slc_blocks_array[block]
+        slt_array = slt_blocks_array[block]
+        for seed_idx in range(block, n_seed_points, n_blocks):
+            initial_rng_state = _byte_reversal(
+                                    _lehmer_rand_uint(_byte_reversal(seed_idx)))
+            x0 = np.float64(seed_point_array[seed_idx,0])
+            y0 = np.float64(seed_point_array[seed_idx,1])
+            for j in range(density):
+                for i in range(density):
+                    _jittered_trajectory(x0+i*step-halfspan, y0+j*step-halfspan,
+                                         mask_array, uv_array, slc_array, slt_array,
+                                         initial_rng_state, parameters)
+
+@njit(parallel=True, cache=False)
+def reduce_blocks(blocks_array, total_array):
+    """
+    Args:
+        blocks_array (numpy.ndarray): private accumulator grids, one per block
+        total_array (numpy.ndarray): grid to which their sum is written
+
+    Sum private per-block accumulator grids (with uint32 wrap-around,
+    as for atomic_add on the OpenCL device).
+    """
+    n_blocks = blocks_array.shape[0]
+    for idx in prange(total_array.shape[0]):
+        total = 0
+        for block in range(n_blocks):
+            total += blocks_array[block,idx]
+        total_array[idx] = np.uint32(total & 0xffffffff)
@@ -7,9 +7,13 @@ Provides PyOpenCL-accelerated functions to integrate streamlines using
 2nd-order Runge-Kutta and (streamline tail-step only) Euler methods.
 Basins of interest can be delimited by masking. 
 
-Requires `PyOpenCL`_.
+Requires `PyOpenCL`_, unless the CPU (Numba) backend is chosen.
 
-Imports streamlines module :doc:`pocl`.
+Alternatively, approximates the streamline fields by flow accumulation
+(see :doc:`flowaccumulation`).
+
+Imports streamlines modules :doc:`pocl`, :doc:`cpukernels` 
+and :doc:`flowaccumulation`.
 Imports functions from streamlines module :doc:`useful`.
 
 
@@ -24,14 +28,13 @@ import pyopencl as cl
 import numpy    as np
 from os import environ
 environ['PYTHONUNBUFFERED']='True'
-environ['PYOPENCL_NO_CACHE']='True'
 environ['PYOPENCL_COMPILER_OUTPUT']='0'
-from streamlines        import pocl
-from streamlines.useful import neatly, vprint, create_seeds
+from streamlines        import pocl, cpukernels, flowaccumulation, profiling
+from streamlines.useful import neatly, vprint, create_seeds, decode_uv_field, \
+                               untile_grid
 
 __all__ = ['Fields']
 
-import warnings
 pdebug = print
 
 class Fields():
@@ -42,7 +45,8 @@ class Fields():
                     info                = None,
                     data                = None,
                     verbose             = False,
-                    gpu_verbose         = False ):
+                    gpu_verbose         = False,
+                    compute_backend     = 'opencl' ):
         """
         Initialize.
         
@@ -54,10 +58,15 @@ class Fields():
             data (obj):
             verbose (bool):
             gpu_verbose (bool):
+            compute_backend (str): 'opencl' (GPU/OpenCL device) or 'numba' (CPU)
         """
-        self.platform, self.device, self.context \
-            = pocl.prepare_cl_context(which_cl_platform, which_cl_device)
-        self.queue = cl.CommandQueue(self.context,
+        if compute_backend not in ('opencl','numba'):
+            raise ValueError('Unknown compute backend "{}"'.format(compute_backend))
+        self.compute_backend = compute_backend
+        if compute_backend=='opencl':
+            self.platform, self.device, self.context \
+                = pocl.prepare_cl_context(which_cl_platform, which_cl_device)
+            self.queue = cl.CommandQueue(self.context,
                                 properties=cl.command_queue_properties.PROFILING_ENABLE)
         self.cl_src_path         = cl_src_path
         self.info                = info
@@ -66,8 +75,15 @@ class Fields():
         self.gpu_verbose         = gpu_verbose
         self.vprogress           = verbose
         
-    def integrate(self):
+    def integrate(self, seed_point_array=None, do_postprocess=True):
         """
+        Args:
+            seed_point_array (numpy.ndarray): optional subset of seed points 
+                                              (see :func:`.useful.create_seeds`)
+                                              to trace instead of all of them
+            do_postprocess (bool): flag whether to post-process the raw
+                                   slc, slt fields (see :meth:`postprocess`)
+        
         Trace each streamline from its corresponding seed point using 2nd-order 
         Runge-Kutta integration of the topographic gradient vector field.
         
@@ -82,9 +98,15 @@ class Fields():
         The tasks undertaken by this function are to:
            1) prepare the OpenCL context, device and kernel source string
            2) calculate how to split the streamline tracing into chunks
-           3) invoke the GPU/OpenCL device computation
+           3) invoke the GPU/OpenCL device computation - or, if info.fields_engine
+              is 'dinf' or 'mfd', the flow accumulation approximation
            4) post-process the streamline total length (slt) array (scale, sqrt)
               and compute streamline trajectories statistics
+        
+        Skipping step 4 leaves the raw step count & length sums in 
+        data.slc_array & data.slt_array: these are additive over subsets of
+        seed points, which is what :meth:`.Trace.compute_fields` relies on to
+        estimate the fields progressively.
         """
         vprint(self.verbose,'Integrating streamline fields...')
         
@@ -94,21 +116,15 @@ class Fields():
         mask_array          = self.data.mask_array
         uv_array            = self.data.uv_array
         mapping_array       = self.data.mapping_array
-        traj_stats_df       = self.data.traj_stats_df
 
-        # Prepare CL essentials
-        device        = self.device
-        context       = self.context
-        queue         = self.queue
-        cl_kernel_source \
-            = pocl.read_kernel_source(cl_src_path,['rng.cl','essentials.cl',
-                    'writearray.cl','updatetraj.cl','computestep.cl',
-                    'rungekutta.cl','jittertrajectory.cl','integratefields.cl'])
         n_padded_seed_points = info.n_padded_seed_points
     
         # Memory check - not really needed 
-        gpu_traj_memory_limit = (device.get_info(cl.device_info.GLOBAL_MEM_SIZE) 
-                                 *info.gpu_memory_limit_pc)//100
+        if self.compute_backend=='opencl':
+            memory_size = self.device.get_info(cl.device_info.GLOBAL_MEM_SIZE)
+        else:
+            memory_size = cpukernels.host_memory_size() or 2**33
+        gpu_traj_memory_limit = (int(memory_size)*int(info.gpu_memory_limit_pc))//100
         full_traj_memory_request = (mask_array.shape[0]*mask_array.shape[1]
                                     *np.dtype(np.float32).itemsize*2*3)    
         vprint(self.verbose,
@@ -123,10 +139,19 @@ class Fields():
         n_work_items             = info.n_work_items
         do_shuffle               = info.do_shuffle
         shuffle_rng_seed         = info.shuffle_rng_seed
-        (self.data.seed_point_array, info.n_seed_points, info.n_padded_seed_points) \
-            = create_seeds(mask_array, pad_width, n_work_items, 
-                           do_shuffle=do_shuffle, rng_seed=shuffle_rng_seed,
-                           verbose=self.verbose)
+        if seed_point_array is None:
+            (self.data.seed_point_array, info.n_seed_points, info.n_padded_seed_points) \
+                = create_seeds(mask_array, pad_width, n_work_items, 
+                               do_shuffle=do_shuffle, rng_seed=shuffle_rng_seed,
+                               curve=info.seed_point_curve,
+                               verbose=self.verbose)
+        else:
+            n_seed_points = seed_point_array.shape[0]
+            pad_length = (np.uint32(np.round(n_seed_points/n_work_items+0.5))
+                          *n_work_items-n_seed_points)
+            self.data.seed_point_array = seed_point_array
+            info.n_seed_points = n_seed_points
+            info.n_padded_seed_points = n_seed_points+pad_length
         
         # Prep for GPU compute
         n_global = info.n_padded_seed_points
@@ -138,8 +163,37 @@ class Fields():
                  .format(n_work_items, n_global, n_global+pad_length))
         n_global += pad_length
         
-        # Do integrations on the GPU
-        self.gpu_integrate(device, context, queue, cl_kernel_source, n_global)
+        # Do integrations on the GPU - or on the CPU - or approximate them
+        if info.fields_engine!='streamlines':
+            self.accumulate_integrate()
+        elif self.compute_backend=='opencl':
+            # Prepare CL essentials
+            cl_kernel_source \
+                = pocl.read_kernel_source(cl_src_path,['rng.cl','essentials.cl',
+                        'writearray.cl','updatetraj.cl','computestep.cl',
+                        'rungekutta.cl','jittertrajectory.cl','integratefields.cl'])
+            self.gpu_integrate(self.device, self.context, self.queue, 
+                               cl_kernel_source, n_global)
+        else:
+            self.cpu_integrate()
+        
+        if do_postprocess:
+            self.postprocess()
+    
+        # Done
+        vprint(self.verbose,'...done')
+
+    def postprocess(self):
+        """
+        Compute the average streamline lengths (sla) from the raw slc, slt fields,
+        and then scale the raw step lengths (slt) and counts (slc) into 
+        sqrt(area)-like quantities.
+        """
+        # Shorthand
+        info                = self.info
+        traj_stats_df       = self.data.traj_stats_df
+
+        self.compute_sla()
         
         # Streamline stats
         pixel_size = info.pixel_size
@@ -162,9 +216,6 @@ class Fields():
         self.data.slc_array \
             = np.sqrt(2.0)*np.power(self.data.slc_array
                                     /info.subpixel_seed_point_density**2,2/3)
-    
-        # Done
-        vprint(self.verbose,'...done')
 
     def gpu_integrate(self, device, context, queue, cl_kernel_source, n_global):
         """
@@ -176,6 +227,24 @@ class Fields():
             2) iterate over each OpenCL computation chunk
             3) postprocess the streamline count and length arrays
            
+        If info.do_trace_bidirectional is set, each work item integrates both
+        downstream and upstream in a single pass (one program build, one set of
+        kernel launches) into a two-plane slc, slt buffer pair; otherwise 
+        downstream and upstream are integrated in separate passes.
+        The results are the same either way.
+        
+        If info.do_privatize_accumulation is set, each work item combines its 
+        consecutive slc, slt writes to the same pixel before adding them
+        atomically, which cuts contention for the atomics where streamlines 
+        converge. The results are again the same. 
+        The slt lengths are accumulated as integers after scaling by info.slt_scale,
+        which is undone here.
+        
+        If info.do_memoize_fields is set, downstream streamlines are merged into
+        a table of pixels whose downstream remainder is resolved 
+        (see :meth:`resolve_memo`) and their remainders accumulated on the host
+        (see :meth:`add_memo_remainders`).
+    
         Chunk iteration involves:
             1) building the CL program
             2) preparing the CL kernel
@@ -205,8 +274,16 @@ class Fields():
 #         pdebug('mask_array',mask_array.shape)
 #         pdebug('uv_array',uv_array.shape)
 #         pdebug('mapping_array',mapping_array.shape)
-        slc_array     = np.zeros((roi_nxy[0],roi_nxy[1]), dtype=np.uint32)
-        slt_array     = np.zeros((roi_nxy[0],roi_nxy[1]), dtype=np.uint32)
+        is_bidirectional = bool(info.do_trace_bidirectional)
+        if is_bidirectional:
+            # One pass integrating downstream & upstream into slc, slt planes 0 & 1
+            downup_list = [[[0,1],+1.0]]
+        else:
+            # Downstream pass then upstream pass
+            downup_list = [[[0],+1.0],[[1],-1.0]]
+        n_planes = len(downup_list[0][0])
+        slc_array = np.zeros((n_planes,roi_nxy[0],roi_nxy[1]), dtype=np.uint32)
+        slt_array = np.zeros((n_planes,roi_nxy[0],roi_nxy[1]), dtype=np.uint32)
         self.data.slc_array = np.zeros((roi_nxy[0],roi_nxy[1],2), dtype=np.uint32)
         # Note the returned slt array is FLOAT32 but the GPU computes are done on UINT32
         self.data.slt_array = np.zeros((roi_nxy[0],roi_nxy[1],2), dtype=np.float32)
@@ -217,6 +294,15 @@ class Fields():
                        'mapping':    {'array': mapping_array,    'rwf': 'RW'}, 
                        'slc':        {'array': slc_array,        'rwf': 'RW'}, 
                        'slt':        {'array': slt_array,        'rwf': 'RW'} }
+        if info.do_memoize_fields:
+            memo_flow_dict = self.resolve_memo()
+            memo_count_array  = np.zeros(roi_nxy, dtype=np.uint32)
+            memo_length_array = np.zeros(roi_nxy, dtype=np.uint32)
+            array_dict.update({
+                       'memo_resolved': {'array': memo_flow_dict['is_resolved'], 
+                                         'rwf': 'RO'}, 
+                       'memo_count':    {'array': memo_count_array,  'rwf': 'RW'}, 
+                       'memo_length':   {'array': memo_length_array, 'rwf': 'RW'} })
         buffer_dict =  pocl.prepare_buffers(context, array_dict, self.verbose)
     
         # Downstream and upstream passes aka streamline integrations from
@@ -229,36 +315,41 @@ class Fields():
         vprint(self.verbose,
                'Seed point buffer size = {}*8 bytes'.
                format(buffer_dict['seed_point'].size/8))
-        # Downstream then upstream loop
-        downup_list = [[0,+1.0],[1,-1.0]]
-        for downup_idx, downup_sign in downup_list:
+        # Downstream then upstream loop - or a single bidirectional pass
+        for pass_idx, (downup_idxs, downup_sign) in enumerate(downup_list):
             info.downup_sign = downup_sign
             
             ##################################
             
-            # Compile the CL code
+            # Compile the CL code - or fetch it from the program cache
             compile_options = pocl.set_compile_options(info, 'INTEGRATE_FIELDS', 
-                                                       downup_sign=downup_sign)
+                                                       downup_sign=downup_sign,
+                                                       is_bidirectional=is_bidirectional)
             vprint(self.gpu_verbose,'Compile options:\n',compile_options)
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                program = cl.Program(context,
-                                     cl_kernel_source).build(options=compile_options)
+            program = pocl.build_program(context, device, cl_kernel_source, 
+                                         compile_options,
+                                         cache_size=info.cl_program_cache_size,
+                                         cache_dir=info.cl_program_cache_dir,
+                                         verbose=self.gpu_verbose)
             pocl.report_build_log(program, device, self.gpu_verbose)
             
             # Set the GPU kernel
-            kernel = program.integrate_fields
+            kernel = cl.Kernel(program, 'integrate_fields')
             
-            # Designate buffered arrays
-            kernel.set_args(*list(buffer_dict.values()))
-            kernel.set_scalar_arg_dtypes( [None]*len(buffer_dict) )
+            # Designate buffered arrays, then the seed count & chunk offset scalars,
+            #   then the grid geometry
+            grid_buffer = pocl.prepare_grid_params_buffer(context, info, 
+                                                          downup_sign=downup_sign)
+            kernel.set_scalar_arg_dtypes( [None]*len(buffer_dict)+[np.uint32]*2+[None] )
+            kernel.set_args(*list(buffer_dict.values()), 
+                            info.n_seed_points, info.seeds_chunk_offset, grid_buffer)
             
             # Trace the streamlines on the GPU
             vprint(self.gpu_verbose,
                    '#### GPU/OpenCL computation: {0} work items... ####'
                    .format(global_size[0]))
             pocl.report_kernel_info(device,kernel,self.gpu_verbose)
-            downup_step = (downup_idx,len(downup_list))
+            downup_step = (pass_idx,len(downup_list))
             elapsed_time \
                 = pocl.adaptive_enqueue_nd_range_kernel(
                                                 queue, kernel, global_size, 
@@ -278,15 +369,18 @@ class Fields():
             queue.finish()   
             cl.enqueue_copy(queue, slt_array, buffer_dict['slt'])
             queue.finish()   
+            profiling.record_transfer('d2h', slc_array.nbytes+slt_array.nbytes)
                     
             ##################################
                     
             # Copy out the slc, slt results for this pass only
-            # Count of streamlines entering per pixel width: n/meter
-            self.data.slc_array[:,:,downup_idx] += slc_array
-            # Average streamline length of streamlines entering each pixel: meters
-            self.data.slt_array[:,:,downup_idx] += slt_array.astype(np.float32)
-            if downup_idx==0:
+            for plane_idx, downup_idx in enumerate(downup_idxs):
+                # Count of streamlines entering per pixel width: n/meter
+                self.data.slc_array[:,:,downup_idx] += slc_array[plane_idx]
+                # Average streamline length of streamlines entering each pixel: meters
+                self.data.slt_array[:,:,downup_idx] \
+                    += slt_array[plane_idx].astype(np.float32)/info.slt_scale
+            if pass_idx<len(downup_list)-1:
                 # Zero the GPU slt, slc arrays before using in the next pass
                 slc_array.fill(0)
                 slt_array.fill(0.0)
@@ -294,10 +388,212 @@ class Fields():
                 queue.finish()   
                 cl.enqueue_copy(queue, buffer_dict['slt'],slt_array)
                 queue.finish()   
+                profiling.record_transfer('h2d', slc_array.nbytes+slt_array.nbytes)
     
         cl.enqueue_copy(queue, mapping_array,  buffer_dict['mapping'])
         queue.finish()   
+        profiling.record_transfer('d2h', mapping_array.nbytes)
+        
+        if info.do_memoize_fields:
+            cl.enqueue_copy(queue, memo_count_array,  buffer_dict['memo_count'])
+            cl.enqueue_copy(queue, memo_length_array, buffer_dict['memo_length'])
+            queue.finish()   
+            profiling.record_transfer('d2h', 
+                                      memo_count_array.nbytes+memo_length_array.nbytes)
+            self.add_memo_remainders(memo_flow_dict, memo_count_array, memo_length_array)
+        
+    def resolve_memo(self):
+        """
+        Build the table of pixels whose downstream remainder is resolved, for
+        streamline merging in :meth:`gpu_integrate`.
+        
+        The flow velocity field is partitioned between neighbors by the 
+        D-infinity ('dinf') or multiple-flow-direction ('mfd') scheme chosen 
+        by info.memo_flow_scheme, using :func:`.flowaccumulation.flow_partition`,
+        so that merged streamlines disperse downstream as traced ones do,
+        rather than collapsing onto single-pixel chains.
+        A pixel is resolved if its entire downstream flow graph is acyclic 
+        (see :func:`.flowaccumulation.resolve_flow`).
+        
+        Raises:
+            ValueError if the flow partition scheme is not recognized.
+        
+        Returns:
+            dict:
+                flow partition weights, flow path lengths across pixels,
+                topological order and resolved table
+        """
+        info = self.info
+        mask_array = self.data.mask_array
+        roi_nxy = mask_array.shape
+        if info.memo_flow_scheme not in flowaccumulation.FLOW_SCHEMES.keys():
+            raise ValueError('Unknown flow partition scheme "{}"'
+                             .format(info.memo_flow_scheme))
+        vprint(self.verbose,'Resolving streamline merging memo table ({})...'
+               .format(info.memo_flow_scheme))
+        uv_array = self.data.uv_array
+        if info.uv_is_tiled:
+            uv_array = untile_grid(uv_array, roi_nxy[0], roi_nxy[1])
+        uv_array = decode_uv_field(uv_array, info.uv_encoding)
+        mask_array = np.ascontiguousarray(mask_array)
+        with profiling.span('kernel', 'resolve_memo', backend='numba'):
+            weight_array, hop_array \
+                = flowaccumulation.flow_partition(np.ascontiguousarray(uv_array), 
+                                mask_array, 
+                                flowaccumulation.FLOW_SCHEMES[info.memo_flow_scheme],
+                                np.float64(info.mfd_exponent))
+            order_array = flowaccumulation.topological_order(weight_array, mask_array)
+            is_resolved_array = flowaccumulation.resolve_flow(order_array, weight_array, 
+                                                              hop_array)
+        vprint(self.verbose,'...resolved {0} of {1} unmasked pixels'
+               .format(np.count_nonzero(is_resolved_array), order_array.shape[0]))
+        return {'weight' : weight_array, 'hop' : hop_array, 'order' : order_array,
+                'is_resolved' : is_resolved_array}
+        
+    def add_memo_remainders(self, memo_flow_dict, memo_count_array, memo_length_array):
+        """
+        Add to the downstream slc, slt grids the remainders of the streamlines 
+        merged into the resolved table by :meth:`gpu_integrate`, by carrying them
+        over the flow graph built by :meth:`resolve_memo`,
+        using :func:`.flowaccumulation.propagate_flow`.
+        
+        Args:
+            memo_flow_dict (dict): flow graph and resolved table
+            memo_count_array (numpy.ndarray): count of streamlines merged at each pixel
+            memo_length_array (numpy.ndarray): total length of streamlines merged 
+                                               at each pixel
+        """
+        roi_nxy = memo_count_array.shape
+        ds = self.integration_step_length()
+        slc_array = np.zeros(roi_nxy, dtype=np.float64)
+        slt_array = np.zeros(roi_nxy, dtype=np.float64)
+        vprint(self.verbose,'Merged {} downstream streamlines'
+               .format(int(np.sum(memo_count_array,dtype=np.int64))))
+        with profiling.span('kernel', 'propagate_memo', backend='numba'):
+            flowaccumulation.propagate_flow(memo_flow_dict['order'], 
+                                            memo_flow_dict['weight'], 
+                                            memo_flow_dict['hop'],
+                                            memo_count_array.astype(np.float64),
+                                            memo_length_array.astype(np.float64),
+                                            np.float64(ds), slc_array, slt_array)
+        self.data.slc_array[:,:,0] += np.round(slc_array).astype(np.uint32)
+        self.data.slt_array[:,:,0] += np.round(slt_array).astype(np.float32)
+        
+    def cpu_integrate(self):
+        """
+        Carry out CPU (Numba) computations, in the same way as
+        :meth:`gpu_integrate`, using the parallel kernel
+        :func:`.cpukernels.integrate_fields`.
+        
+        Each of a set of blocks of seed points is integrated into its own private
+        slc, slt accumulator grids, which are summed once all are done. 
+        The number of blocks is the number of Numba threads, reduced if need be
+        for the accumulators to fit into the host memory limit.
+        """
+        # Shorthand
+        info                = self.info
+        seed_point_array    = self.data.seed_point_array
+        mask_array          = np.ascontiguousarray(self.data.mask_array).ravel()
+        # A compactly encoded uv field is decoded once, up front
+        uv_array            = np.ascontiguousarray(decode_uv_field(self.data.uv_array,
+                                                  info.uv_encoding)).reshape(-1,2)
+        roi_nxy             = self.data.mapping_array.shape
         
+        # Prepare memory
+        self.data.slc_array = np.zeros((roi_nxy[0],roi_nxy[1],2), dtype=np.uint32)
+        self.data.slt_array = np.zeros((roi_nxy[0],roi_nxy[1],2), dtype=np.float32)
+        self.data.sla_array = np.zeros((roi_nxy[0],roi_nxy[1],2), dtype=np.float32)
+        nxy = roi_nxy[0]*roi_nxy[1]
+        n_blocks = cpukernels.n_accumulator_blocks(nxy*np.dtype(np.uint32).itemsize*2,
+                                                   info.gpu_memory_limit_pc)
+        slc_blocks_array = np.zeros((n_blocks,nxy), dtype=np.uint32)
+        slt_blocks_array = np.zeros((n_blocks,nxy), dtype=np.uint32)
+        slc_array = np.zeros(nxy, dtype=np.uint32)
+        slt_array = np.zeros(nxy, dtype=np.uint32)
+        vprint(self.verbose,
+               'CPU/Numba accumulation in {0} blocks: size={1}'.format(n_blocks,
+                neatly(slc_blocks_array.nbytes+slt_blocks_array.nbytes)))
+        
+        # Downstream then upstream loop
+        downup_list = [[0,+1.0],[1,-1.0]]
+        for downup_idx, downup_sign in downup_list:
+            info.downup_sign = downup_sign
+            parameters = cpukernels.set_kernel_parameters(info, downup_sign)
+            if downup_idx>0:
+                slc_blocks_array.fill(0)
+                slt_blocks_array.fill(0)
+            with profiling.span('kernel', 'integrate_fields', backend='numba'):
+                cpukernels.integrate_fields(seed_point_array, mask_array, uv_array,
+                                            slc_blocks_array, slt_blocks_array,
+                                            int(info.n_seed_points), parameters)
+            cpukernels.reduce_blocks(slc_blocks_array, slc_array)
+            cpukernels.reduce_blocks(slt_blocks_array, slt_array)
+            self.data.slc_array[:,:,downup_idx] += slc_array.reshape(roi_nxy)
+            self.data.slt_array[:,:,downup_idx] \
+                += slt_array.reshape(roi_nxy).astype(np.float32)/info.slt_scale
+
+    def accumulate_integrate(self):
+        """
+        Approximate the streamline fields of :meth:`gpu_integrate` by flow
+        accumulation, using :func:`.flowaccumulation.accumulate_fields` with 
+        the D-infinity ('dinf') or multiple-flow-direction ('mfd') flow partition 
+        scheme chosen by info.fields_engine. 
+        
+        Every unmasked pixel is a source, as every pixel seeds streamlines.
+        """
+        # Shorthand
+        info                = self.info
+        mask_array          = self.data.mask_array
+        roi_nxy             = mask_array.shape
+        uv_array            = self.data.uv_array
+        if info.uv_is_tiled:
+            uv_array = untile_grid(uv_array, roi_nxy[0], roi_nxy[1])
+        uv_array = decode_uv_field(uv_array, info.uv_encoding)
+        
+        # Prepare memory
+        self.data.slc_array = np.zeros((roi_nxy[0],roi_nxy[1],2), dtype=np.uint32)
+        self.data.slt_array = np.zeros((roi_nxy[0],roi_nxy[1],2), dtype=np.float32)
+        self.data.sla_array = np.zeros((roi_nxy[0],roi_nxy[1],2), dtype=np.float32)
+        n_streamlines_per_seed = info.subpixel_seed_point_density**2
+        ds = self.integration_step_length()
+        
+        # Downstream then upstream accumulation
+        downup_list = [[0,+1.0,'downstream'],[1,-1.0,'upstream']]
+        for downup_idx, downup_sign, downup_label in downup_list:
+            vprint(self.verbose,'Accumulating {0} flow ({1})...'
+                   .format(downup_label,info.fields_engine))
+            with profiling.span('kernel', 'accumulate_fields', backend='numba'):
+                slc_array, slt_array \
+                    = flowaccumulation.accumulate_fields(uv_array*downup_sign, mask_array,
+                                                         ds, scheme=info.fields_engine,
+                                                         mfd_exponent=info.mfd_exponent)
+            self.data.slc_array[:,:,downup_idx] \
+                = np.round(slc_array*n_streamlines_per_seed).astype(np.uint32)
+            self.data.slt_array[:,:,downup_idx] \
+                = (slt_array*n_streamlines_per_seed).astype(np.float32)
+
+    def integration_step_length(self):
+        """
+        Nominal length in pixels of a streamline integration step, i.e., that of 
+        a step at the maximum time step DT_MAX (see :func:`.pocl.grid_params`),
+        which is the step length almost everywhere.
+        
+        Returns:
+            float:
+                step length in pixels
+        """
+        info = self.info
+        nxf = np.float32(info.nx)
+        nyf = np.float32(info.ny)
+        dt_max = min(min(1.0/nxf,1.0/nyf),0.1)
+        return float(np.sqrt(nxf*nyf)*info.integrator_step_factor*dt_max)
+
+    def compute_sla(self):
+        """
+        Compute average streamline lengths (sla) from the total lengths (slt) 
+        and counts (slc) integrated on the GPU or CPU.
+        """
+        info = self.info
         # Compute average streamline lengths (sla) from total lengths (slt) & counts (slc)
         # Shorthand
         (slc,sla,slt) = (self.data.slc_array, self.data.sla_array, self.data.slt_array)
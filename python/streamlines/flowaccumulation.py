@@ -0,0 +1,346 @@
+"""
+---------------------------------------------------------------------
+
+Approximate streamline count and length fields by flow accumulation.
+
+Provides ``numba.njit`` functions that estimate the grids of streamline counts
+and lengths (slc, slt) integrated by the kernels ``integrate_fields``
+(see :mod:`.fields`) without tracing any streamlines. Instead, the flow
+velocity vector field is turned into a graph of weighted pixel-to-neighbor flow
+partitions, either D-infinity (flow split between the two neighbors
+bracketing the flow direction) or multiple-flow-direction (MFD: flow split
+between all downslope neighbors), and a unit source at every pixel is
+accumulated over this graph in topological order.
+
+The cost is O(pixels), independent of streamline lengths and of the subpixel
+seed point density, which makes this engine suitable for regional screening;
+the accuracy is that of the flow partition scheme.
+
+Streamlines are treated as entering each pixel, traversing it along its flow
+vector over a path h=1/max(|u|,|v|) long, and then dividing between neighbors.
+The count & length totals at each pixel are converted into the integration
+step counts & step lengths that the kernels would have written, given
+the mean streamline integration step length ds.
+
+The same propagation carries on the remainders of traced streamlines merged
+into the flow graph, when the fields are memoized (see :meth:`.Fields.resolve_memo`).
+
+---------------------------------------------------------------------
+
+Requires Python packages/modules:
+  - :ref:`numba <numba:install_frontpage>` (:ref:`search <numba:search>`)
+
+---------------------------------------------------------------------
+
+.. _numba: https://numba.pydata.org/
+
+"""
+
+from numba import njit, prange
+import numpy as np
+import os
+os.environ['PYTHONUNBUFFERED']='True'
+
+__all__ = ['FLOW_SCHEMES', 'flow_partition', 'cut_mutual_flows', 'topological_order',
+           'accumulate_flow', 'propagate_flow', 'resolve_flow', 'accumulate_fields']
+
+pdebug = print
+
+# Flow partition schemes
+FLOW_SCHEMES = {'dinf' : 0, 'mfd' : 1}
+
+# Neighbor offsets (dx,dy), in order of direction angle k*pi/4 anticlockwise from +x
+_NEIGHBOR_DX = np.array([1,1,0,-1,-1,-1,0,1], dtype=np.int64)
+_NEIGHBOR_DY = np.array([0,1,1,1,0,-1,-1,-1], dtype=np.int64)
+
+@njit(parallel=True, cache=False)
+def flow_partition(uv_array, mask_array, scheme, mfd_exponent):
+    """
+    Args:
+        uv_array (numpy.ndarray): flow velocity vector grid, shape (nx,ny,2)
+        mask_array (numpy.ndarray): grid pixel mask, with True = masked
+        scheme (int): flow partition scheme, from FLOW_SCHEMES
+        mfd_exponent (float): power to which the cosine of the angle between flow
+                              and neighbor directions is raised to weight MFD partitions
+
+    Partition the outflow of each unmasked pixel between its eight neighbors.
+    Flow into a masked neighbor, or off the grid, leaves the graph.
+    Pixels with null flow vectors have no outflow.
+    
+    Where two pixels flow into each other, as they do on either side of a valley
+    axis, the weaker of the two flows is cut (see :func:`cut_mutual_flows`).
+
+    Returns:
+        numpy.ndarray, numpy.ndarray:
+            flow partition weights, shape (nx,ny,8); flow path lengths across pixels
+    """
+    nx, ny = mask_array.shape
+    weight_array = np.zeros((nx,ny,8), dtype=np.float64)
+    hop_array = np.zeros((nx,ny), dtype=np.float64)
+    for x in prange(nx):
+        for y in range(ny):
+            if mask_array[x,y]:
+                continue
+            u = np.float64(uv_array[x,y,0])
+            v = np.float64(uv_array[x,y,1])
+            uv_max = max(abs(u),abs(v))
+            if uv_max==0.0:
+                continue
+            hop_array[x,y] = np.sqrt(u*u+v*v)/uv_max
+            angle = np.arctan2(v,u)/(np.pi/4)
+            if angle<0.0:
+                angle += 8.0
+            if scheme==0:
+                k = int(angle)%8
+                fraction = angle-int(angle)
+                weight_array[x,y,k] = 1.0-fraction
+                weight_array[x,y,(k+1)%8] = fraction
+            else:
+                total = 0.0
+                for k in range(8):
+                    cosine = np.cos((angle-k)*(np.pi/4))
+                    if cosine>0.0:
+                        weight_array[x,y,k] = cosine**mfd_exponent
+                        total += weight_array[x,y,k]
+                for k in range(8):
+                    weight_array[x,y,k] /= total
+            for k in range(8):
+                next_x = x+_NEIGHBOR_DX[k]
+                next_y = y+_NEIGHBOR_DY[k]
+                if (next_x<0 or next_x>=nx or next_y<0 or next_y>=ny
+                        or mask_array[next_x,next_y]):
+                    weight_array[x,y,k] = 0.0
+    return cut_mutual_flows(weight_array), hop_array
+
+@njit(parallel=True, cache=False)
+def cut_mutual_flows(weight_array):
+    """
+    Args:
+        weight_array (numpy.ndarray): flow partition weights, shape (nx,ny,8)
+
+    Cut the weaker of each pair of flows between two pixels in opposite directions
+    (the first in row-major order if equal), passing its weight on to the
+    remaining outflows of its pixel, if any, so that such 2-cycles neither 
+    stall the topological sort nor lose flow. 
+
+    Returns:
+        numpy.ndarray:
+            flow partition weights, shape (nx,ny,8)
+    """
+    nx, ny = weight_array.shape[0], weight_array.shape[1]
+    cut_weight_array = weight_array.copy()
+    for x in prange(nx):
+        for y in range(ny):
+            total = 0.0
+            cut_total = 0.0
+            for k in range(8):
+                weight = weight_array[x,y,k]
+                if weight==0.0:
+                    continue
+                total += weight
+                next_x, next_y = x+_NEIGHBOR_DX[k], y+_NEIGHBOR_DY[k]
+                back_weight = weight_array[next_x,next_y,(k+4)%8]
+                if (back_weight>weight 
+                        or (back_weight==weight and next_x*ny+next_y<x*ny+y)):
+                    cut_weight_array[x,y,k] = 0.0
+                else:
+                    cut_total += weight
+            if cut_total>0.0:
+                for k in range(8):
+                    cut_weight_array[x,y,k] *= total/cut_total
+            else:
+                for k in range(8):
+                    cut_weight_array[x,y,k] = weight_array[x,y,k]
+    return cut_weight_array
+
+@njit(cache=False)
+def topological_order(weight_array, mask_array):
+    """
+    Args:
+        weight_array (numpy.ndarray): flow partition weights, shape (nx,ny,8)
+        mask_array (numpy.ndarray): grid pixel mask, with True = masked
+
+    Sort the unmasked pixels so that each comes after all those flowing into it
+    (Kahn's algorithm). Loops in the flow graph (e.g., across flats) are broken
+    by taking the first pixel in row-major order that is still waiting on
+    inflow, so that every unmasked pixel is sorted exactly once.
+
+    Returns:
+        numpy.ndarray:
+            flat (row-major) indexes of unmasked pixels, upstream first
+    """
+    nx, ny = mask_array.shape
+    n_inflows_array = np.zeros((nx,ny), dtype=np.int64)
+    for x in range(nx):
+        for y in range(ny):
+            for k in range(8):
+                if weight_array[x,y,k]>0.0:
+                    n_inflows_array[x+_NEIGHBOR_DX[k],y+_NEIGHBOR_DY[k]] += 1
+    is_queued_array = mask_array.copy()
+    order_array = np.empty(nx*ny-np.count_nonzero(mask_array), dtype=np.int64)
+    n_queued = 0
+    for idx in range(nx*ny):
+        x, y = idx//ny, idx%ny
+        if not is_queued_array[x,y] and n_inflows_array[x,y]==0:
+            is_queued_array[x,y] = True
+            order_array[n_queued] = idx
+            n_queued += 1
+    head, loop_idx = 0, 0
+    while head<order_array.shape[0]:
+        if head==n_queued:
+            # Stalled on a loop: break it at the next pixel waiting on inflow
+            while is_queued_array[loop_idx//ny,loop_idx%ny]:
+                loop_idx += 1
+            is_queued_array[loop_idx//ny,loop_idx%ny] = True
+            order_array[n_queued] = loop_idx
+            n_queued += 1
+        idx = order_array[head]
+        head += 1
+        x, y = idx//ny, idx%ny
+        for k in range(8):
+            if weight_array[x,y,k]>0.0:
+                next_x, next_y = x+_NEIGHBOR_DX[k], y+_NEIGHBOR_DY[k]
+                n_inflows_array[next_x,next_y] -= 1
+                if n_inflows_array[next_x,next_y]==0 and not is_queued_array[next_x,next_y]:
+                    is_queued_array[next_x,next_y] = True
+                    order_array[n_queued] = next_x*ny+next_y
+                    n_queued += 1
+    return order_array
+
+@njit(cache=False)
+def accumulate_flow(order_array, weight_array, hop_array, ds, slc_array, slt_array):
+    """
+    Args:
+        order_array (numpy.ndarray): flat indexes of unmasked pixels, upstream first
+        weight_array (numpy.ndarray): flow partition weights, shape (nx,ny,8)
+        hop_array (numpy.ndarray): flow path lengths across pixels
+        ds (float): mean streamline integration step length, in pixels
+        slc_array (numpy.ndarray): grid to which streamline step counts are written
+        slt_array (numpy.ndarray): grid to which streamline step lengths are written
+
+    Accumulate one streamline from every unmasked pixel in topological order
+    (see :func:`propagate_flow`), crediting each pixel with the seed point 
+    of its own streamline.
+    """
+    nx, ny = hop_array.shape
+    count_array  = np.ones((nx,ny), dtype=np.float64)
+    length_array = np.zeros((nx,ny), dtype=np.float64)
+    propagate_flow(order_array, weight_array, hop_array, count_array, length_array,
+                   ds, slc_array, slt_array)
+    for idx in order_array:
+        slc_array[idx//ny,idx%ny] += 1.0
+
+@njit(cache=False)
+def propagate_flow(order_array, weight_array, hop_array, count_array, length_array,
+                   ds, slc_array, slt_array):
+    """
+    Args:
+        order_array (numpy.ndarray): flat indexes of pixels, upstream first
+        weight_array (numpy.ndarray): flow partition weights, shape (nx,ny,8)
+        hop_array (numpy.ndarray): flow path lengths across pixels
+        count_array (numpy.ndarray): (fractional) count of streamlines entering 
+                                     each pixel (overwritten)
+        length_array (numpy.ndarray): total length of streamlines entering 
+                                      each pixel (overwritten)
+        ds (float): mean streamline integration step length, in pixels
+        slc_array (numpy.ndarray): grid to which streamline step counts are added
+        slt_array (numpy.ndarray): grid to which streamline step lengths are added
+
+    Carry the count and total length of streamlines entering each pixel,
+    in topological order, on to its neighbors in proportion to its flow 
+    partition weights.
+    A pixel whose flow path is h long is credited with h/ds steps
+    of each streamline crossing it, at lengths increasing by ds per step.
+    """
+    ny = hop_array.shape[1]
+    for idx in order_array:
+        x, y = idx//ny, idx%ny
+        count  = count_array[x,y]
+        if count==0.0:
+            continue
+        length = length_array[x,y]
+        n_steps = hop_array[x,y]/ds
+        slc_array[x,y] += count*n_steps
+        slt_array[x,y] += n_steps*length+count*ds*n_steps*(n_steps+1)/2
+        length += count*hop_array[x,y]
+        for k in range(8):
+            weight = weight_array[x,y,k]
+            if weight>0.0:
+                next_x, next_y = x+_NEIGHBOR_DX[k], y+_NEIGHBOR_DY[k]
+                count_array[next_x,next_y]  += weight*count
+                length_array[next_x,next_y] += weight*length
+
+@njit(cache=False)
+def resolve_flow(order_array, weight_array, hop_array):
+    """
+    Args:
+        order_array (numpy.ndarray): flat indexes of unmasked pixels, upstream first
+        weight_array (numpy.ndarray): flow partition weights, shape (nx,ny,8)
+        hop_array (numpy.ndarray): flow path lengths across pixels
+
+    Find the pixels whose entire downstream flow graph is acyclic, i.e., those from
+    which :func:`propagate_flow` carries flow all the way off the graph, 
+    working upstream from the end of the topological order.
+    Pixels with null flow vectors, and pixels flowing into a loop broken by
+    :func:`topological_order`, are left unresolved.
+
+    Returns:
+        numpy.ndarray:
+            grid flagging resolved pixels
+    """
+    nx, ny = hop_array.shape
+    rank_array = np.full((nx,ny), -1, dtype=np.int64)
+    for rank in range(order_array.shape[0]):
+        idx = order_array[rank]
+        rank_array[idx//ny,idx%ny] = rank
+    is_resolved_array = np.zeros((nx,ny), dtype=np.bool_)
+    for rank in range(order_array.shape[0]-1,-1,-1):
+        idx = order_array[rank]
+        x, y = idx//ny, idx%ny
+        if hop_array[x,y]==0.0:
+            continue
+        is_resolved = True
+        for k in range(8):
+            if weight_array[x,y,k]>0.0:
+                next_x, next_y = x+_NEIGHBOR_DX[k], y+_NEIGHBOR_DY[k]
+                if (rank_array[next_x,next_y]<=rank 
+                        or not is_resolved_array[next_x,next_y]):
+                    is_resolved = False
+                    break
+        is_resolved_array[x,y] = is_resolved
+    return is_resolved_array
+
+def accumulate_fields(uv_array, mask_array, ds, scheme='dinf', mfd_exponent=4.0):
+    """
+    Args:
+        uv_array (numpy.ndarray): flow velocity vector grid, shape (nx,ny,2),
+                                  pointing the way to accumulate,
+                                  i.e., negated for upstream
+        mask_array (numpy.ndarray): grid pixel mask, with True = masked
+        ds (float): mean streamline integration step length, in pixels
+        scheme (str): flow partition scheme, 'dinf' or 'mfd'
+        mfd_exponent (float): weighting exponent for the 'mfd' scheme
+
+    Estimate the streamline step count (slc) and step length (slt) grids that
+    the kernel ``integrate_fields`` would integrate, per streamline seeded at
+    each unmasked pixel, by flow accumulation.
+
+    Raises:
+        ValueError if the flow partition scheme is not recognized.
+
+    Returns:
+        numpy.ndarray, numpy.ndarray:
+            slc, slt grids (float64)
+    """
+    if scheme not in FLOW_SCHEMES.keys():
+        raise ValueError('Unknown flow partition scheme "{}"'.format(scheme))
+    mask_array = np.ascontiguousarray(mask_array)
+    weight_array, hop_array = flow_partition(np.ascontiguousarray(uv_array), mask_array,
+                                             FLOW_SCHEMES[scheme],
+                                             np.float64(mfd_exponent))
+    order_array = topological_order(weight_array, mask_array)
+    slc_array = np.zeros(mask_array.shape, dtype=np.float64)
+    slt_array = np.zeros(mask_array.shape, dtype=np.float64)
+    accumulate_flow(order_array, weight_array, hop_array, np.float64(ds),
+                    slc_array, slt_array)
+    return slc_array, slt_array
@@ -26,7 +26,8 @@ import json
 pdebug=print
 
 from streamlines.core   import Core
-from streamlines.useful import read_geotiff, dilate
+from streamlines.useful import open_geotiff, read_geotiff_window, read_geotiff_roi, \
+                               dilate, decimate_grid
 
 __all__ = ['Geodata']
 
@@ -62,33 +63,19 @@ class Geodata(Core):
         
         self.print('**Geodata end**\n')  
 
-    def read_dtm_file(self):
+    def read_dtm_header(self):
         """
-        Read GeoTIFF-format DTM file into numpy array and parse out important metadata, 
-        e.g., pixel grid dimensions and pixel size in meters [TBD!!]. 
-        Extract region of interest (ROI) as specified in parameters 
-        (default is to take entire grid). 
-        In the process, flip array orientation (up-down).
+        Open the GeoTIFF-format DTM file and parse out its metadata 
+        and the region of interest (ROI) bounds, without reading the DTM grid itself.
 
         Attributes:
-            self.roi_nx (int):  number of x pixels in ROI
-            self.roi_ny (int):  number of y pixels in ROI
-            self.roi_x_origin (numpy.float32): x coordinate of bottom-left pixel center
-            self.roi_y_origin (numpy.float32): y coordinate of bottom-left pixel center
+            self.dtm_path (str): absolute path to DTM file
+            self.tiff (gdal.Dataset): open DTM GeoTIFF dataset
             self.pixel_size (float): size (in meters from GeoTIFF) of pixels 
                                      (assuming equant)
-            self.roi_pixel_size (float): size (in meters from GeoTIFF) of pixels in ROI 
-                                         (could be downsampled)
+            self.dtm_shape (tuple): full DTM grid shape in GeoTIFF orientation
             self.roi_x_bounds (list): x bounds on ROI (in grid pixels, not coordinates)
             self.roi_y_bounds (list): y bounds on ROI (in grid pixels, not coordinates)
-            self.dtm_array (numpy.ndarray float32): DTM topographic grid 
-                                                    read from GeoTIFF file
-            self.roi_array (numpy.ndarray float32): region of interest (ROI) of DTM grid
-            self.x_roi_n_pixel_centers (numpy.ndarray float32): meshgrid vector of 
-                                                    x coordinates of ROI pixel centers
-            self.y_roi_n_pixel_centers (numpy.ndarray float32): meshgrid vector of 
-                                                    y coordinates of ROI pixel centers
-
         """
         try:
             self.dtm_path
@@ -102,15 +89,16 @@ class Geodata(Core):
 
         self.print('Reading DTM from GeoTIFF file "%s/%s"'
               % (self.dtm_path,self.dtm_file))
-        self.dtm_array, self.tiff, self.pixel_size \
-             = read_geotiff(self.dtm_path, self.dtm_file)
+        self.tiff, self.pixel_size = open_geotiff(self.dtm_path, self.dtm_file)
+        # Full DTM grid shape (in GeoTIFF orientation) without reading the grid itself
+        self.dtm_shape = (self.tiff.RasterYSize, self.tiff.RasterXSize)
         geotransform = self.tiff.GetGeoTransform()
         self.x_easting_bottomleft  = geotransform[0]
         self.y_northing_bottomleft = geotransform[3] \
-                                     +geotransform[5]*self.dtm_array.shape[0]
+                                     +geotransform[5]*self.dtm_shape[0]
         self.print('DTM size: {0} x {1} = {2:,} pixels'.format(
-              self.dtm_array.shape[1],self.dtm_array.shape[0],
-              self.dtm_array.shape[1]*self.dtm_array.shape[0]) )
+              self.dtm_shape[1],self.dtm_shape[0],
+              self.dtm_shape[1]*self.dtm_shape[0]) )
         self.print('DTM pixel size: {0}m'.format(self.pixel_size))
         self.print('DTM origin:')
         self.print('  - bottom-left pixel center: [{0:0.2f}mE, {1:0.2f}mN]'
@@ -118,19 +106,16 @@ class Geodata(Core):
         self.print('  - bottom-left pixel corner: [{0:0.2f}mE, {1:0.2f}mN]'
               .format(self.x_easting_bottomleft-self.pixel_size/2, 
                       self.y_northing_bottomleft-self.pixel_size/2))
-
-        for self.no_data_value in self.no_data_values:
-            self.dtm_array[self.dtm_array==self.no_data_value] = np.nan
             
         # Handle empty ROI bounds which imply full DTM
         if not self.do_clip_roi or (self.roi_x_bounds==[] 
                                     and self.roi_x_bounds_meters==[]):
-            self.roi_x_bounds = [0,self.dtm_array.shape[1]]
-            self.roi_x_bounds_meters = [0,self.dtm_array.shape[1]*self.pixel_size]
+            self.roi_x_bounds = [0,self.dtm_shape[1]]
+            self.roi_x_bounds_meters = [0,self.dtm_shape[1]*self.pixel_size]
         if not self.do_clip_roi or (self.roi_y_bounds==[]
                                     and self.roi_y_bounds_meters==[]):
-            self.roi_y_bounds = [0,self.dtm_array.shape[0]]
-            self.roi_y_bounds_meters = [0,self.dtm_array.shape[0]*self.pixel_size]
+            self.roi_y_bounds = [0,self.dtm_shape[0]]
+            self.roi_y_bounds_meters = [0,self.dtm_shape[0]*self.pixel_size]
             
         if self.do_clip_roi and self.roi_bounds_units=='meters':
             self.roi_x_bounds \
@@ -147,32 +132,82 @@ class Geodata(Core):
 
         # Trap ROI bounds error
         if np.any(np.array(self.roi_x_bounds)
-                  !=np.clip(np.array(self.roi_x_bounds),0,self.dtm_array.shape[1])):
+                  !=np.clip(np.array(self.roi_x_bounds),0,self.dtm_shape[1])):
             msg = ("ROI out of bounds in x: "
-                   +str(np.array(self.roi_x_bounds))+' > '+str(self.dtm_array.shape[1]))
+                   +str(np.array(self.roi_x_bounds))+' > '+str(self.dtm_shape[1]))
             raise ValueError(msg)        
         if np.any(np.array(self.roi_y_bounds)
-                  !=np.clip(np.array(self.roi_y_bounds),0,self.dtm_array.shape[0])):
+                  !=np.clip(np.array(self.roi_y_bounds),0,self.dtm_shape[0])):
             msg = ("ROI out of bounds in y: "
-                   +str(np.array(self.roi_y_bounds))+' > '+str(self.dtm_array.shape[0]))
+                   +str(np.array(self.roi_y_bounds))+' > '+str(self.dtm_shape[0]))
             raise ValueError(msg)    
+
+    def read_dtm_file(self):
+        """
+        Read GeoTIFF-format DTM file into numpy array and parse out important metadata, 
+        e.g., pixel grid dimensions and pixel size in meters [TBD!!]. 
+        Extract region of interest (ROI) as specified in parameters 
+        (default is to take entire grid). 
+        In the process, flip array orientation (up-down).
+
+        Attributes:
+            self.roi_nx (int):  number of x pixels in ROI
+            self.roi_ny (int):  number of y pixels in ROI
+            self.roi_x_origin (numpy.float32): x coordinate of bottom-left pixel center
+            self.roi_y_origin (numpy.float32): y coordinate of bottom-left pixel center
+            self.pixel_size (float): size (in meters from GeoTIFF) of pixels 
+                                     (assuming equant)
+            self.roi_pixel_size (float): size (in meters from GeoTIFF) of pixels in ROI 
+                                         (larger than pixel_size if downsampled 
+                                         by roi_decimation_factor)
+            self.roi_x_bounds (list): x bounds on ROI (in grid pixels, not coordinates)
+            self.roi_y_bounds (list): y bounds on ROI (in grid pixels, not coordinates)
+            self.dtm_array (numpy.ndarray float32): DTM topographic grid 
+                                                    read from GeoTIFF file,
+                                                    in GeoTIFF orientation
+                                                    (just the ROI window, 
+                                                    as a view of roi_array, 
+                                                    unless do_read_roi_window
+                                                    is off when clipping)
+            self.roi_array (numpy.ndarray float32): region of interest (ROI) of DTM grid
+            self.x_roi_n_pixel_centers (numpy.ndarray float32): meshgrid vector of 
+                                                    x coordinates of ROI pixel centers
+            self.y_roi_n_pixel_centers (numpy.ndarray float32): meshgrid vector of 
+                                                    y coordinates of ROI pixel centers
+
+        """
+        self.read_dtm_header()
         
-        # Generate roi array and x,y index vectors now because we'll need them later
-        self.roi_array = np.zeros((self.roi_x_bounds[1]-self.roi_x_bounds[0],
-                                   self.roi_y_bounds[1]-self.roi_y_bounds[0]),
-                                   dtype=np.float32)
-        self.roi_array = (np.flipud(self.dtm_array)[
-                                        self.roi_y_bounds[0]:self.roi_y_bounds[1],
-                                        self.roi_x_bounds[0]:self.roi_x_bounds[1]]
-                                        ).T.copy()
+        # Read just the ROI window straight into the ROI grid, unless the whole 
+        #   DTM has been asked for as well (do_read_roi_window off while clipping)
+        #   - memory use is then bounded by ROI size, e.g., when tiling
+        if self.roi_window() is not None or not self.do_clip_roi:
+            self.roi_array = read_geotiff_roi(self.tiff, self.roi_read_window(),
+                                              no_data_values=self.no_data_values)
+            self.dtm_array = np.flipud(self.roi_array.T)
+        else:
+            self.dtm_array = read_geotiff_window(self.tiff)
+            for no_data_value in self.no_data_values:
+                self.dtm_array[self.dtm_array==no_data_value] = np.nan
+            self.roi_array = self.extract_roi(self.dtm_array)
+        # Downsample the ROI if required, e.g., for a coarse pyramid level
+        #   - each ROI pixel then spans factor x factor DTM pixels
+        factor = self.decimation_factor()
+        if factor>1:
+            self.roi_array = decimate_grid(self.roi_array, factor)
+            self.dtm_array = np.flipud(self.roi_array.T)
+            self.print('ROI downsampled by a factor of {}'.format(factor))
+
+        # Generate x,y index vectors now because we'll need them later
         # Remember that np.array range extractions exclude last cell 
         #   such that self.roi_x_bounds[1]-1 is last x cell index
-        self.x_roi_n_pixel_centers = np.linspace(self.roi_x_bounds[0]+0.5,
-                                                 self.roi_x_bounds[1]-0.5, 
-                                          self.roi_array.shape[0], dtype=np.float32)
-        self.y_roi_n_pixel_centers = np.linspace(self.roi_y_bounds[0]+0.5,
-                                                 self.roi_y_bounds[1]-0.5, 
-                                          self.roi_array.shape[1], dtype=np.float32)
+        # Pixel centers are in DTM pixel units, spaced by the decimation factor
+        self.x_roi_n_pixel_centers \
+            = (self.roi_x_bounds[0]
+               +(np.arange(self.roi_array.shape[0])+0.5)*factor).astype(np.float32)
+        self.y_roi_n_pixel_centers \
+            = (self.roi_y_bounds[0]
+               +(np.arange(self.roi_array.shape[1])+0.5)*factor).astype(np.float32)
         self.roi_nx = len(self.x_roi_n_pixel_centers)
         self.roi_ny = len(self.y_roi_n_pixel_centers)        
         self.print('ROI meters bounds: ',[[self.roi_x_bounds_meters[0],
@@ -195,8 +230,7 @@ class Geodata(Core):
         ######################################################
         self.roi_x_origin = self.x_roi_n_pixel_centers[0]
         self.roi_y_origin = self.y_roi_n_pixel_centers[0]
-        # Allow for future downsampling of ROI
-        self.roi_pixel_size = self.pixel_size
+        self.roi_pixel_size = self.pixel_size*factor
         
         roi_width  = self.x_roi_n_pixel_centers[-1]-self.x_roi_n_pixel_centers[0]
         roi_height = self.y_roi_n_pixel_centers[-1]-self.y_roi_n_pixel_centers[0]
@@ -220,10 +254,13 @@ class Geodata(Core):
             self.dtm_array = np.fliplr(self.dtm_array)
             
         # GeoTIFF metadata needed for writing
-        self.roi_geotransform     = list(geotransform)
+        self.roi_geotransform     = list(self.tiff.GetGeoTransform())
         self.roi_geotransform[0] += self.roi_x_bounds[0]*self.pixel_size
-        self.roi_geotransform[3] -= self.dtm_array.shape[0]*self.pixel_size
-        self.roi_geotransform[3] += self.roi_y_bounds[1]*self.pixel_size
+        self.roi_geotransform[3] -= self.dtm_shape[0]*self.pixel_size
+        self.roi_geotransform[3] += (self.roi_y_bounds[0]
+                                     +self.roi_ny*factor)*self.pixel_size
+        self.roi_geotransform[1] *= factor
+        self.roi_geotransform[5] *= factor
         
     def read_basins_file(self):
         """
@@ -234,21 +271,82 @@ class Geodata(Core):
         """ 
         self.print('Reading basins from GeoTIFF file "%s/%s"'
               % (self.dtm_path,self.basins_file))
-        basins_array, pixel_size, self.geotransform \
-             = read_geotiff(self.dtm_path,self.basins_file)
+        basins_tiff, pixel_size = open_geotiff(self.dtm_path,self.basins_file)
+        self.geotransform = basins_tiff.GetGeoTransform()
         # Check size
-        if (self.dtm_array.shape[1]!=basins_array.shape[1] 
-            or self.dtm_array.shape[0]!=basins_array.shape[0]):
+        basins_shape = (basins_tiff.RasterYSize, basins_tiff.RasterXSize)
+        if self.dtm_shape!=basins_shape:
             raise ValueError(
                 'DTM grid and basins grid sizes do not match - DTM: %s, basins=%s' 
-                             % (str(self.dtm_array.shape),str(basins_array)))
+                             % (str(self.dtm_shape),str(basins_shape)))
         # Match orientations                      
-        self.basins_array = (np.flipud(basins_array)[
-              self.roi_y_bounds[0]:self.roi_y_bounds[1],
-              self.roi_x_bounds[0]:self.roi_x_bounds[1]]).T.copy()
+        if self.roi_window() is not None or not self.do_clip_roi:
+            self.basins_array = read_geotiff_roi(basins_tiff, self.roi_read_window())
+        else:
+            self.basins_array = self.extract_roi(read_geotiff_window(basins_tiff))
+        self.basins_array = decimate_grid(self.basins_array, self.decimation_factor(),
+                                          method='nearest')
         if self.flip_ns:
             self.basins_array = np.fliplr(self.basins_array)
 
+    def decimation_factor(self):
+        """
+        Returns:
+            int: 
+            factor by which the ROI is downsampled (1 if not)
+        """ 
+        return max(1,int(self.roi_decimation_factor))
+
+    def roi_window(self):
+        """
+        Convert the ROI bounds into a GeoTIFF read window, 
+        if windowed reading of the ROI has been requested.
+        
+        Returns:
+            list: 
+            read window [x_offset, y_offset, x_size, y_size] in GeoTIFF pixel
+            coordinates, or None if the whole grid is to be read
+        """ 
+        if not (self.do_clip_roi and self.do_read_roi_window):
+            return None
+        return self.roi_read_window()
+
+    def roi_read_window(self):
+        """
+        Convert the ROI bounds (which span the whole DTM if not clipping)
+        into a GeoTIFF read window.
+        
+        Returns:
+            list: 
+            read window [x_offset, y_offset, x_size, y_size] in GeoTIFF pixel
+            coordinates
+        """ 
+        # GeoTIFF rows run north to south, whereas ROI y bounds run south to north
+        return [self.roi_x_bounds[0], 
+                self.dtm_shape[0]-self.roi_y_bounds[1],
+                self.roi_x_bounds[1]-self.roi_x_bounds[0],
+                self.roi_y_bounds[1]-self.roi_y_bounds[0]]
+
+    def extract_roi(self, array):
+        """
+        Args:
+            array (numpy.ndarray): grid read from GeoTIFF, either whole or just
+                                   the ROI window
+        
+        Flip a GeoTIFF-oriented grid up-down, clip it to the ROI 
+        (unless only the ROI window was read) and transpose it into slm orientation.
+        
+        Returns:
+            numpy.ndarray: 
+            ROI grid in slm [x,y] orientation
+        """ 
+        if self.roi_window() is None:
+            array = np.flipud(array)[self.roi_y_bounds[0]:self.roi_y_bounds[1],
+                                     self.roi_x_bounds[0]:self.roi_x_bounds[1]]
+        else:
+            array = np.flipud(array)
+        return array.T.copy()
+
     def make_dtm_mask(self):
         """
         Create a raw 'DTM' mask array that masks off NaNs, sub-threshold elevations,
@@ -282,9 +380,8 @@ class Geodata(Core):
         """ 
         self.print('Mask out all but basin numbers {}'.format(str(self.basins)))
         # Generate boolean grid with True at unmasked basin pixels
-        basin_mask_unpadded_array = np.zeros_like(self.basins_array,dtype=np.bool8)
-        for basin in self.basins:
-            basin_mask_unpadded_array[self.basins_array==basin] = True
+        #   - in one pass over the basins grid rather than one per basin
+        basin_mask_unpadded_array = np.isin(self.basins_array, self.basins)
         # True = masked out; False = data we want to see
         basin_mask_unpadded_array    = np.invert(basin_mask_unpadded_array)    
             
@@ -16,6 +16,8 @@ Requires Python packages/modules:
   -  :mod:`scipy.stats`
   -  :mod:`scipy.interpolate`
   -  :mod:`skfmm`
+  -  :mod:`threading`
+  -  :mod:`concurrent.futures`
 
 Imports ``slm`` modules:
   -  :mod:`.connect`
@@ -25,6 +27,7 @@ Imports ``slm`` modules:
   -  :mod:`.segment`
   -  :mod:`.hillslopes`
   -  :mod:`.lengths`
+  -  :mod:`.profiling`
 
 Imports the :class:`.Core` class.
 
@@ -51,21 +54,25 @@ from sklearn.preprocessing import normalize
 from skimage.morphology    import skeletonize, thin, medial_axis, disk
 from skimage.filters       import gaussian
 from skimage.filters.rank  import mean, median
-from scipy.ndimage            import gaussian_filter
+from scipy.ndimage            import gaussian_filter, find_objects
 from scipy.ndimage.morphology import binary_fill_holes, grey_dilation, \
-                                     binary_dilation, binary_erosion, \
+                                     binary_dilation, \
                                      generate_binary_structure
 from scipy.stats import ks_2samp, mannwhitneyu, ranksums, ttest_ind
 from scipy.interpolate import interp1d 
 import skfmm
 import warnings
-from os import environ
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from json import loads, dumps
+from os import environ, cpu_count, path
 environ['PYTHONUNBUFFERED']='True'
 
 from streamlines        import connect, channelheads, countlink, label, \
-                               segment, hillslopes, lengths
+                               segment, hillslopes, lengths, profiling
 from streamlines.core   import Core
-from streamlines.useful import Data, Info, vprint, dilate, get_bbox, npamem
+from streamlines.useful import Data, Info, vprint, dilate, get_bbox, npamem, \
+                               lookup_labels, compute_label_stats
 from streamlines.pocl   import Initialize_cl
 
 __all__ = ['Mapping']
@@ -100,6 +107,8 @@ class Mapping(Core):
             coarsely subsegmented catchment index 
         coarse_subsegments_list_array (numpy.ndarray): sorted list of int32
             coarsely subsegmented catchment indexes
+        coarse_subsegment_bbox_dict (dict): x,y slices bounding each 
+            coarsely subsegmented catchment
         n_coarse_subsegments (int): number of unique values of
             coarsely subsegmented catchment indexes
 
@@ -157,7 +166,10 @@ class Mapping(Core):
 
         Provides hooks to key classes in :mod:`.geodata`, :mod:`.preprocess`, 
         :mod:`.trace`, and :mod:`.analysis` modules.
-        Initializes the OpenCL device and a context, and creates a command queue.
+        The OpenCL device, context and command queue are only initialized when 
+        first needed by a mapping kernel (see :attr:`cl_state`), so that a workflow 
+        that doesn't map, e.g., one using the Numba compute backend, can run
+        without an OpenCL device.
         Initializes (nulls) HSL statistics attributes.
         
 
@@ -168,9 +180,9 @@ class Mapping(Core):
         self.preprocess = preprocess
         self.trace = trace
         self.analysis = analysis
-        self.cl_state = Initialize_cl(self.state.cl_src_path, 
-                                      self.state.cl_platform, 
-                                      self.state.cl_device )
+        # Pass#2 worker threads each have their own OpenCL state (see cl_state)
+        self._thread_local = threading.local()
+        self.cl_state = None
         self.verbose = self.state.verbose
         self.vbackup = self.state.verbose
         self.vprogress = self.state.verbose
@@ -185,6 +197,26 @@ class Mapping(Core):
         self.hsl_ns_min         = None
         self.hsl_ns_max         = None
     
+    @property
+    def cl_state(self):
+        """
+        OpenCL state (context, command queue, buffer pool, current kernel) 
+        of the calling thread: each pass#2 worker thread has its own, 
+        whereas all other callers share the main one, which is created on first use.
+        """
+        cl_state = getattr(self._thread_local,'cl_state',None)
+        if cl_state is not None:
+            return cl_state
+        if self._cl_state is None:
+            self._cl_state = Initialize_cl(self.state.cl_src_path, 
+                                           self.state.cl_platform, 
+                                           self.state.cl_device )
+        return self._cl_state
+
+    @cl_state.setter
+    def cl_state(self, cl_state):
+        self._cl_state = cl_state
+
     def _augment(self, plot):
         """
         Args:
@@ -226,6 +258,9 @@ class Mapping(Core):
             self.pass2()
         if self.do_pass3:
             self.pass3()
+        # Free the device-resident grids held over from the last subsegment
+        if self._cl_state is not None:
+            self._cl_state.buffer_pool.release()
         self.print('**Mapping end**\n')  
 
     def pass1(self):
@@ -245,6 +280,9 @@ class Mapping(Core):
             3) Generate a mask that includes all coarse subsegment pixels
             4) Map mid-slope and ridge pixels using sla values only
 
+        If do_pyramid_pass1 is set, step 2 is carried out on a DTM downsampled by
+        pyramid_decimation_factor instead (see :meth:`map_pyramid_coarse_subsegments`).
+
         """
         vprint(self.vprogress,'\n**Pass#1 begin**')
 #         self._switch_to_quiet_mode()
@@ -277,7 +315,7 @@ class Mapping(Core):
         data = Data( info=info, bbox=bbox, pad=pad,
                      mapping_array = self.mapping_array,
                      mask_array    = mask_array,
-                     uv_array      = self.preprocess.uv_array,
+                     uv_array      = self.preprocess.uv_code_array,
                      slc_array     = self.trace.slc_array,
                      slt_array     = self.trace.slt_array,
                      sla_array     = self.trace.sla_array )
@@ -288,7 +326,13 @@ class Mapping(Core):
         # Make sure all the flag values are recorded for posterity
         info.set_flags(self)
         
-        if self.do_map_channels_segments:
+        if self.do_map_channels_segments and self.do_pyramid_pass1:
+            # Do the coarse channel mapping & subsegmentation on a downsampled DTM
+            #   and upsample the subsegment labels & their bboxes to full resolution
+            #   - only the midslope & ridge flags are mapped at full resolution
+            self.map_pyramid_coarse_subsegments(mask_array)
+            self.mapping_array[data.bounds_grid] = data.mapping_array
+        elif self.do_map_channels_segments:
             # Do the forced coarse channel mapping & subsegmentation
             #   - the flag 'do_map_channels_from_scratch' will default to true
             if not self.map_channels_segments(info, data):
@@ -298,14 +342,18 @@ class Mapping(Core):
             #   - inserted into full size grid arrays using the data.bounds_grid slice
             self.mapping_array[data.bounds_grid]           = data.mapping_array
             self.coarse_subsegment_array[data.bounds_grid] = data.label_array
+        if self.do_map_channels_segments:
             # Make a list of all the subsegments with enough ridge/midslope pixels for HSL
-            coarse_subsegments = np.unique(data.label_array[~data.mask_array])
+            coarse_subsegments = np.unique(self.coarse_subsegment_array[~mask_array])
             self.coarse_subsegments_list_array \
                 = np.sort(coarse_subsegments[coarse_subsegments!=0])
             self.n_coarse_subsegments = self.coarse_subsegments_list_array.shape[0]
             # Make a mask to select all coarse subsegments
-            for label in self.coarse_subsegments_list_array:
-                self.merged_coarse_mask_array[self.coarse_subsegment_array==label] = False
+            self.merged_coarse_mask_array \
+                = ~np.isin(self.coarse_subsegment_array, 
+                           self.coarse_subsegments_list_array)
+            if not self.do_pyramid_pass1:
+                self.find_coarse_subsegment_bboxes()
             # Copy the coarse subsegments so they can be readily visualized
         #         self.label_array = self.coarse_subsegment_array.copy()
         #         self._switch_back_to_verbose_mode()
@@ -345,6 +393,133 @@ class Mapping(Core):
         vprint(self.vprogress,'**Pass#1 end**') 
 
 
+    def map_pyramid_coarse_subsegments(self, mask_array):
+        """
+        Args:
+            mask_array (numpy.ndarray): full-resolution merged mask grid
+        
+        Carry out the coarse channel mapping & subsegmentation of pass#1 on a 
+        DTM downsampled by pyramid_decimation_factor, and upsample the resulting
+        coarse subsegment labels and their bounding boxes to full resolution.
+        
+        The downsampled level is run as a separate, minimal workflow 
+        (geodata, preprocess, trace and mapping pass#1 only; see
+        :meth:`pyramid_level_kwargs`), so that preprocessing, tracing and 
+        segmentation all cost roughly 1/factor^2 of their full-resolution cost.
+        Labels are upsampled by nearest-neighbor lookup and then clipped to
+        the full-resolution mask.
+        
+        Attributes:
+            self.coarse_subsegment_array (numpy.ndarray): 
+            self.coarse_subsegment_bbox_dict (dict): 
+        """
+        # Deferred to avoid a circular import
+        from streamlines.streamlining import Streamlining
+        factor = max(1,int(self.pyramid_decimation_factor))
+        self.print('Pyramid pass#1: coarse subsegmentation at 1/{} resolution'
+                   .format(factor))
+        sl = Streamlining(**self.pyramid_level_kwargs(factor))
+        sl.geodata.do()
+        sl.stagecache.run('preprocess', sl.preprocess.do)
+        sl.stagecache.run('trace', sl.trace.do)
+        sl.mapping.pass1()
+        coarse_mapping = sl.mapping
+        # Shorthand
+        pad = self.geodata.pad_width
+        nxp = self.geodata.roi_nx+pad*2
+        nyp = self.geodata.roi_ny+pad*2
+        nxc = sl.geodata.roi_nx
+        nyc = sl.geodata.roi_ny
+        # Index of the coarse pixel covering each full-resolution pixel
+        #   - pad pixels map onto the coarse edge pixels, but are masked anyway
+        ix = np.clip((np.arange(nxp)-pad)//factor, 0, nxc-1)+pad
+        iy = np.clip((np.arange(nyp)-pad)//factor, 0, nyc-1)+pad
+        self.coarse_subsegment_array \
+            = coarse_mapping.coarse_subsegment_array[np.ix_(ix,iy)]
+        self.coarse_subsegment_array[mask_array] = 0
+        # Scale up the coarse bboxes, which thus bound the upsampled labels
+        def upsample(bounds, n):
+            return slice(max(pad,(bounds.start-pad)*factor+pad),
+                         min(n-pad,(bounds.stop-pad)*factor+pad))
+        self.coarse_subsegment_bbox_dict \
+            = {label : (upsample(bounds_x,nxp),upsample(bounds_y,nyp))
+               for label,(bounds_x,bounds_y)
+               in coarse_mapping.coarse_subsegment_bbox_dict.items()}
+        del sl, coarse_mapping
+        
+    def pyramid_level_kwargs(self, factor):
+        """
+        Args:
+            factor (int): decimation factor of the pyramid level
+            
+        Generate the workflow keyword arguments for a pyramid level run:
+        the same JSON parameters (and overrides) as this run, plus overrides
+        that downsample the ROI, rescale the coarse thresholds to the coarse 
+        pixel size, and turn off everything but pass#1 of mapping.
+        
+        Both the coarse channel threshold (compared with slt, which scales as 
+        the square root of area in pixels) and the coarse segmentation threshold 
+        (a count of channel pixels) scale as 1/factor.
+
+        Returns:
+            dict:
+            workflow keyword arguments for the pyramid level
+        """
+        state = self.state
+        override_parameters = getattr(state,'override_parameters',None)
+        if override_parameters is not None and override_parameters!='':
+            override_dict = loads(override_parameters)
+        else:
+            override_dict = {}
+        override_dict.setdefault('geodata',{}).update({
+            'roi_decimation_factor' : factor*self.geodata.decimation_factor()
+            })
+        override_dict.setdefault('mapping',{}).update({
+            'do_pyramid_pass1'  : False,
+            'do_map_hsl'        : False,
+            'do_pass2'          : False,
+            'do_pass3'          : False,
+            'coarse_channel_threshold' : self.coarse_channel_threshold/factor,
+            'coarse_segmentation_threshold' 
+                : max(1,int(np.round(self.coarse_segmentation_threshold/factor)))
+            })
+        level_kwargs = {
+            'parameters_file'     : path.join(state.parameters_path,
+                                              state.parameters_file),
+            'override_parameters' : dumps(override_dict),
+            'do_tiling'           : False,
+            'do_batch'            : False,
+            'do_profile'          : False,
+            'do_plot'             : 'off',
+            'do_save'             : False,
+            'do_display'          : False,
+            'do_git_info'         : False
+            }
+        # Run on the same device & backend as this run, using its stage cache
+        for key in ['verbose','cl_platform','cl_device','compute_backend',
+                    'do_cache_stages']:
+            level_kwargs[key] = getattr(state,key,None)
+        return level_kwargs
+
+    def find_coarse_subsegment_bboxes(self):
+        """
+        Find the bounding box of each coarse subsegment in a single pass 
+        over the coarse subsegment label grid.
+        
+        Attributes:
+            self.coarse_subsegment_bbox_dict (dict): x,y slices of the bbox 
+                                                     of each coarse subsegment
+        """
+        labels = self.coarse_subsegments_list_array
+        is_found_array, index_array = lookup_labels(self.coarse_subsegment_array, 
+                                                    labels)
+        table_index_array = np.zeros_like(self.coarse_subsegment_array)
+        table_index_array[is_found_array] = index_array+1
+        self.coarse_subsegment_bbox_dict \
+            = {label : bounds for label,bounds 
+               in zip(labels,find_objects(table_index_array, max_label=labels.size))
+               if bounds is not None}
+
     def make_coarse_subsegment_masks(self, coarse_subsegment, is_left_or_right,
                                      raw_mask, dilated_mask):
         """
@@ -365,24 +540,36 @@ class Mapping(Core):
             list, int, int:
             bbox_dilated_mask, nxd,nyd 
         """
-        # Initialize raw mask with masked everywhere
-        raw_mask.fill(True)
-        # Unmask this coarse segment
-        raw_mask[self.coarse_subsegment_array==coarse_subsegment] = False
+        # Shorthand
+        pad = self.geodata.pad_width
+        nxp, nyp = self.coarse_subsegment_array.shape
         # Dilate this coarse segment mask by 2 if left or 1 if right flank
         #   - cos left dilation needs to grow to cover right-flank channel pixels
         n = (2 if is_left_or_right=='left' else 1)
-        dilate(~raw_mask,n_iterations=n, out=dilated_mask)
-        np.invert(dilated_mask, out=dilated_mask)
-        # Shorthand
-        pad = self.geodata.pad_width
+        # Work only in a window around the subsegment's bbox (if known) 
+        #   that is wide enough to contain its dilation
+        bbox = getattr(self,'coarse_subsegment_bbox_dict',{}).get(coarse_subsegment)
+        if bbox is None:
+            window = (slice(0,nxp),slice(0,nyp))
+        else:
+            window = (slice(max(0,bbox[0].start-n),min(nxp,bbox[0].stop+n)),
+                      slice(max(0,bbox[1].start-n),min(nyp,bbox[1].stop+n)))
+        # Initialize raw mask with masked everywhere
+        raw_mask.fill(True)
+        # Unmask this coarse segment
+        raw_mask[window][self.coarse_subsegment_array[window]==coarse_subsegment] \
+            = False
+        dilated_mask.fill(True)
+        dilated_mask[window] = ~dilate(~raw_mask[window],n_iterations=n)
         # Ensure dilated unmask does not encroach on boundary mask
         dilated_mask[:pad,:]  = True
         dilated_mask[:,:pad]  = True
         dilated_mask[-pad:,:] = True
         dilated_mask[:,-pad:] = True
         # Define bbox and dimensions of the dilated mask
-        bbox_dilated_mask, nxd,nyd = get_bbox(~dilated_mask)
+        (x_min,x_max,y_min,y_max), nxd,nyd = get_bbox(~dilated_mask[window])
+        bbox_dilated_mask = (x_min+window[0].start, x_max+window[0].start,
+                             y_min+window[1].start, y_max+window[1].start)
         return bbox_dilated_mask, nxd,nyd
 
     def pass2(self):
@@ -395,6 +582,16 @@ class Mapping(Core):
           - measure HSL from either ridges or midslopes to channels
           - merge the HSL and (TBD) channel mapping into "global" results grid(s)
 
+        The coarse subsegments are mapped in turn, each starting from the 
+        mapping grid into which the channels of the previous ones have been merged.
+        If n_pass2_workers is not 1 (the default), they are farmed out to a pool 
+        of n_pass2_workers threads (0 meaning one per CPU core), each with its own 
+        OpenCL command queue, but with the same dependencies: a subsegment is only
+        started once every previous one whose merge could reach its mapping window
+        has been merged (see :meth:`find_pass2_dependencies`), and results are 
+        merged in coarse subsegment order. 
+        The results are thus the same as serial ones, whatever the number of 
+        workers and whatever the order in which subsegments complete.
         """
         vprint(self.vprogress,'\n**Pass#2 begin**') 
         self._switch_to_quiet_mode()
@@ -402,162 +599,270 @@ class Mapping(Core):
         pad = self.geodata.pad_width
         nxp = self.geodata.roi_nx+pad*2
         nyp = self.geodata.roi_ny+pad*2
-        pixel_size = self.geodata.roi_pixel_size
         # Count how many coarse subsegments need to be iterated over
         n_segments = self.n_coarse_subsegments
         self.print('Subsegment labels: {}'.format(n_segments))
         # Mask off all but these coarse subsegments
         self.state.add_active_mask({'merged_coarse': self.merged_coarse_mask_array})
-        # Initialize the full ROI-scale HSL grid and a buffer
-        # Also a mapping array for channels etc
-        raw_mask_array      = np.zeros((nxp,nyp), dtype=np.bool)
-        dilated_mask_array  = np.zeros((nxp,nyp), dtype=np.bool)
-        merged_mask_array   = np.zeros((nxp,nyp), dtype=np.bool)
+        # Revert to 'dtm', 'basin' (if set), and 'uv' masks only
+        #   - these are common to all the coarse subsegments
+        self.state.reset_active_masks()
+        base_mask_array = self.state.merge_active_masks()
+        # Initialize the full ROI-scale HSL grid
         self.hsl_array      = np.zeros((nxp,nyp), dtype=np.float32)
         self.hsl_mean_array = np.array([], dtype=np.float32)
         self.hsl_stats_df   = None
 
         # Iterate over the coarse subsegments
-        for idx,coarse_subsegment in enumerate(self.coarse_subsegments_list_array):
-#         for idx,coarse_subsegment in enumerate([71]):
-            if idx>0:
-                merged_mask_array.fill(False)
-#             if (coarse_subsegment)!=-4 and (coarse_subsegment)!=-3:
-#                 continue
-            # Report % progress
-            self.report_progress(idx, n_segments, subsegment=coarse_subsegment)
-            # Revert to 'dtm', 'basin' (if set), and 'uv' masks only
-            self.state.reset_active_masks()
-            # Flag if this coarse subsegment is left or right flank
-            #   - important because a left flank subseg omits the channel pixels
-            is_left_or_right = ('left' if coarse_subsegment<0 else 'right')
-            # Convert this coarse subsegment-labeled pixels into a mask
-            #    - also dilate this pixel set and generate a wider mask 
-            #      to ensure flank-adjacent channel pixels are incorporated 
-            #    - dilate by 1 for R flank and by 2 for L flank to ensure this
-            bbox, nxb,nyb \
-                = self.make_coarse_subsegment_masks(coarse_subsegment, is_left_or_right,
-                                                    raw_mask_array, dilated_mask_array)
-            # Create metadata container for this coarse subsegment
-            info = Info(self.state,self.trace, pixel_size, mapping=self, 
-                        coarse_label=coarse_subsegment)
-            info.set_xy(nxb,nyb, pad)
-            self.print('--- Mapping HSL on subsegment §{0} = {1}/{2} ({3})'
-                       .format(coarse_subsegment,idx+1,n_segments,is_left_or_right))
-            # Deploy the dilated coarse-subsegment mask
-            self.state.add_active_mask({'dilated_segment': dilated_mask_array})
-            self.state.merge_active_masks(out=merged_mask_array)
-            self.print('Dilated coarse subsegment mask bounding box: {}'.format(bbox))
-
-            data = Data( info=info, bbox=bbox, pad=pad,
-                         mapping_array = self.mapping_array,
-                         mask_array    = merged_mask_array,
-                         uv_array      = self.preprocess.uv_array,
-                         slc_array     = self.trace.slc_array,
-                         slt_array     = self.trace.slt_array,
-                         sla_array     = self.trace.sla_array )
-
-            # Compute slt pdf and estimate channel threshold from it
-            data.channel_threshold \
-                = self.analysis.estimate_channel_threshold(data, verbose=self.vbackup)
-            # Don't HSL map if there's a problem with channel threshold estimation here
-            if data.channel_threshold is None:
-                data.channel_threshold = self.guess_channel_threshold
-#                 vprint(self.vprogress,'   ---')
-#                 continue
-            elif data.channel_threshold>self.max_channel_threshold: 
-                data.channel_threshold = self.guess_channel_threshold
-#                 vprint(self.vprogress,'   ---')
-#                 continue
-            elif data.channel_threshold<self.min_channel_threshold: 
-                data.channel_threshold = self.guess_channel_threshold/2
-#                 vprint(self.vprogress,'   ---')
-#                 continue
-            info.set_thresholds(channel_threshold=data.channel_threshold,
-                                segmentation_threshold=self.fine_segmentation_threshold)
-            
-            # Big step - map subsegments using above channel threshold
-            if not self.map_channels_segments(info, data):
-                del data
-                vprint(self.vprogress,'   --- (problem mapping channels & subsegments)')
-                continue
-            
-            data.mapping_array[(data.mapping_array & info.is_channelhead
-                                ==info.is_channelhead )] \
-                |= info.was_channelhead
-            
-            
-            # Map using FMM
-            self.select_subsegments(info, data, do_restrict=False)
-            if not self.measure_hsl_fmm(info, data) \
-                  or not self.parse_hsl(info, data) \
-                  or not self.remap_hsl(info, data, n_hsl_averaging_threshold=0):
-                del data
-                vprint(self.vprogress,'   --- (problem measuring HSL using FM)')
-                continue
-            
-#             # Map using streamlines
-#             self.select_subsegments(info, data)
-#             if not self.measure_hsl_traced(info, data) \
-#                      or not self.parse_hsl(info, data) \
-#                      or not self.remap_hsl(info, data):
-#                 del data
-#                 vprint(self.vprogress,'   ---')
-#                 continue
-            
-#             if (coarse_subsegment)==-4 or (coarse_subsegment)==-3:
-#                 self.plot.plot_distributions()
-            
-            vprint(self.vprogress,
-                   '\nChannel threshold = {0:0.1f}m'.format(data.channel_threshold))
-            vprint(self.vprogress,
-                   'FMM mean HSL   = {0:0.1f}m'.format(data.fmm_mean_hsl))
-            vprint(self.vprogress,
-                   'Trace mean HSL = {0:0.1f}m'.format(data.trace_mean_hsl))
-            # Inefficient but simple
-            self.hsl_mean_array = np.append(self.hsl_mean_array,data.trace_mean_hsl)
-            # Eliminate almost certainly spurious count=1 HSL mean values
-#             data.hsl_stats_df = data.hsl_stats_df[data.hsl_stats_df['count']>1]
-            if self.hsl_stats_df is None:
-                self.hsl_stats_df = data.hsl_stats_df[
-                    (data.hsl_stats_df['count']>1) 
-                    & (data.hsl_stats_df['mean [m]']>5.0)
-                    ].copy()
-            else:
-                self.hsl_stats_df = self.hsl_stats_df.append(
-                    data.hsl_stats_df[
-                    (data.hsl_stats_df['count']>1) 
-                    & (data.hsl_stats_df['mean [m]']>5.0)
-                    ])
-            
-            # Remove this iteration's dilated coarse-subsegment mask
-            self.state.remove_active_mask('dilated_segment')
-            # Deploy this coarse subsegment's HSL data to the 'global' HSL map
-            self.print('Merging hillslope lengths...',end='')
-            # Use raw coarse mask to only keep HSL values actually on coarse subsegment
-            self.state.add_active_mask({'raw_segment': raw_mask_array})
-            self.state.merge_active_masks(out=merged_mask_array)
-            # Merge this coarse subsegment's HSL values into the 'global' HSL map
-            bounds = data.bounds_grid
-            data.hsl_array[np.isnan(data.hsl_array)] = 0.0
-            self.hsl_array[bounds][~merged_mask_array[bounds]] \
-                = data.hsl_array[~merged_mask_array[bounds]]
-            # Merge the channel mapping results for this coarse subsegment
-            #   - which will allow recomputation of the entire channel network
-            #     during pass#3
-            self.mapping_array[bounds][~merged_mask_array[bounds]] \
-                |= data.mapping_array[~merged_mask_array[bounds]]
-#             self.mapping_array[bounds] |= data.mapping_array & info.is_channel
-            # Delete this iteration's raw coarse mask from the active list
-            self.state.remove_active_mask('raw_segment')
-            # Erase the working instance of data to ensure 
-            #   that the next iteration starts fresh
-            del data
+        n_workers = int(self.n_pass2_workers) if self.n_pass2_workers>0 \
+                    else cpu_count()
+        if n_workers>1 and n_segments>1:
+            self.print('Mapping {0} coarse subsegments on {1} threads'
+                       .format(n_segments,n_workers))
+            last_dependency_array = self.find_pass2_dependencies()
+            self._pass2_cl_states = []
+            with ThreadPoolExecutor(max_workers=n_workers,
+                                    initializer=self._init_pass2_worker) as executor:
+                futures = {}
+                for idx,coarse_subsegment \
+                        in enumerate(self.coarse_subsegments_list_array):
+                    # Start every subsegment whose dependencies have all been merged
+                    #   - each is mapped from the mapping grid as merged so far, 
+                    #     as it would be if mapped serially
+                    for jdx in np.where(last_dependency_array<idx)[0]:
+                        if jdx>=idx and jdx not in futures:
+                            futures[jdx] = executor.submit(
+                                self.map_coarse_subsegment, 
+                                self.coarse_subsegments_list_array[jdx], jdx, 
+                                n_segments, base_mask_array, self.mapping_array)
+                    # Merge in coarse subsegment order, as each result becomes available
+                    self.merge_coarse_subsegment(coarse_subsegment, idx, n_segments,
+                                                 futures.pop(idx).result())
+            # Free the worker threads' device-resident grids
+            for cl_state in self._pass2_cl_states:
+                cl_state.buffer_pool.release()
+            del self._pass2_cl_states
+        else:
+            # Each coarse subsegment is mapped from the mapping grid as merged so far
+            for idx,coarse_subsegment in enumerate(self.coarse_subsegments_list_array):
+                self.merge_coarse_subsegment(coarse_subsegment, idx, n_segments,
+                                             self.map_coarse_subsegment(
+                                                 coarse_subsegment, idx, n_segments,
+                                                 base_mask_array, self.mapping_array))
                
         self.hsl_array[np.isnan(self.hsl_array)] = 0.0
         self._switch_back_to_verbose_mode()
-        self.report_progress(idx+1, n_segments)
+        self.report_progress(n_segments, n_segments)
         vprint(self.vprogress,'\n**Pass#2 end**') 
+
+    def find_pass2_dependencies(self):
+        """
+        Find, for each coarse subsegment, the last previous one on whose merged 
+        results its pass#2 mapping may depend.
+        
+        A coarse subsegment is mapped from the mapping grid within the padded bbox 
+        of its dilated mask, and its merge only modifies pixels of that subsegment.
+        So it depends on a previous subsegment if its bbox, widened by the dilation
+        and the padding, overlaps the bbox of that previous subsegment. 
+        A subsegment with no known bbox is taken to depend on all previous ones.
+        
+        Returns:
+            numpy.ndarray:
+            index of the last dependency of each coarse subsegment (-1 if none)
+        """
+        # Shorthand
+        pad = self.geodata.pad_width
+        nxp, nyp = self.coarse_subsegment_array.shape
+        bbox_dict = getattr(self,'coarse_subsegment_bbox_dict',{})
+        labels = self.coarse_subsegments_list_array
+        # Bboxes as [x_start,x_stop,y_start,y_stop], and mapping windows likewise
+        empty, full = [0,0,0,0], [0,nxp,0,nyp]
+        bbox_array = np.array([[bbox_dict[label][0].start, bbox_dict[label][0].stop,
+                                bbox_dict[label][1].start, bbox_dict[label][1].stop]
+                               if label in bbox_dict else empty 
+                               for label in labels], dtype=np.int64).reshape(-1,4)
+        # Left flanks are dilated by 2, right flanks by 1
+        n_array = np.where(labels<0,2,1)+pad
+        window_array = np.clip(bbox_array+np.outer(n_array,[-1,1,-1,1]), 0,
+                               [nxp,nxp,nyp,nyp])
+        window_array[[label not in bbox_dict for label in labels]] = full
+        last_dependency_array = np.full(labels.size, -1, dtype=np.int64)
+        for idx in range(1,labels.size):
+            is_overlap_array \
+                = (  (bbox_array[:idx,0]<window_array[idx,1])
+                   & (window_array[idx,0]<bbox_array[:idx,1])
+                   & (bbox_array[:idx,2]<window_array[idx,3])
+                   & (window_array[idx,2]<bbox_array[:idx,3]) )
+            if np.any(is_overlap_array):
+                last_dependency_array[idx] = np.where(is_overlap_array)[0][-1]
+        return last_dependency_array
+
+    def _init_pass2_worker(self):
+        """
+        Give a pass#2 worker thread its own OpenCL command queue and buffer pool
+        (on the shared context).
+        """
+        self._thread_local.cl_state = Initialize_cl(self.state.cl_src_path, 
+                                                    self.state.cl_platform, 
+                                                    self.state.cl_device )
+        self._pass2_cl_states.append(self._thread_local.cl_state)
+
+    def map_coarse_subsegment(self, coarse_subsegment, idx, n_segments,
+                              base_mask_array, mapping_array):
+        """
+        Args:
+            coarse_subsegment (int): label of coarse catchment subsegment
+            idx (int): index of coarse subsegment in coarse_subsegments_list_array
+            n_segments (int): number of coarse subsegments
+            base_mask_array (numpy.ndarray): merged 'dtm', 'basin' and 'uv' masks
+            mapping_array (numpy.ndarray): mapping grid to start from (not modified)
+        
+        Map channels, subsegments and HSL on one coarse subsegment.
+        Nothing shared is modified here, so this may be run in a worker thread.
+
+        Returns:
+            dict:
+            bounds, merge selection and grids needed by 
+            :meth:`merge_coarse_subsegment`, or None if HSL could not be mapped
+        """
+        with profiling.span('pass2', 'subsegment', index=idx,
+                            label=int(coarse_subsegment)) as event:
+            result = self._map_coarse_subsegment(coarse_subsegment, idx, n_segments,
+                                                 base_mask_array, mapping_array)
+            event['is_mapped'] = result is not None
+        return result
+
+    def _map_coarse_subsegment(self, coarse_subsegment, idx, n_segments,
+                               base_mask_array, mapping_array):
+        """
+        Map channels, subsegments and HSL on one coarse subsegment:
+        see :meth:`map_coarse_subsegment`.
+        """
+        # Shorthand
+        pad = self.geodata.pad_width
+        pixel_size = self.geodata.roi_pixel_size
+        nxp, nyp = base_mask_array.shape
+        raw_mask_array      = np.zeros((nxp,nyp), dtype=np.bool)
+        dilated_mask_array  = np.zeros((nxp,nyp), dtype=np.bool)
+        # Flag if this coarse subsegment is left or right flank
+        #   - important because a left flank subseg omits the channel pixels
+        is_left_or_right = ('left' if coarse_subsegment<0 else 'right')
+        # Convert this coarse subsegment-labeled pixels into a mask
+        #    - also dilate this pixel set and generate a wider mask 
+        #      to ensure flank-adjacent channel pixels are incorporated 
+        #    - dilate by 1 for R flank and by 2 for L flank to ensure this
+        bbox, nxb,nyb \
+            = self.make_coarse_subsegment_masks(coarse_subsegment, is_left_or_right,
+                                                raw_mask_array, dilated_mask_array)
+        # Create metadata container for this coarse subsegment
+        info = Info(self.state,self.trace, pixel_size, mapping=self, 
+                    coarse_label=coarse_subsegment)
+        info.set_xy(nxb,nyb, pad)
+        self.print('--- Mapping HSL on subsegment §{0} = {1}/{2} ({3})'
+                   .format(coarse_subsegment,idx+1,n_segments,is_left_or_right))
+        # Deploy the dilated coarse-subsegment mask
+        merged_mask_array = base_mask_array | dilated_mask_array
+        self.print('Dilated coarse subsegment mask bounding box: {}'.format(bbox))
+
+        data = Data( info=info, bbox=bbox, pad=pad,
+                     mapping_array = mapping_array,
+                     mask_array    = merged_mask_array,
+                     uv_array      = self.preprocess.uv_code_array,
+                     slc_array     = self.trace.slc_array,
+                     slt_array     = self.trace.slt_array,
+                     sla_array     = self.trace.sla_array )
+
+        # Compute slt pdf and estimate channel threshold from it
+        data.channel_threshold \
+            = self.analysis.estimate_channel_threshold(data, verbose=self.vbackup)
+        # Don't HSL map if there's a problem with channel threshold estimation here
+        if data.channel_threshold is None:
+            data.channel_threshold = self.guess_channel_threshold
+        elif data.channel_threshold>self.max_channel_threshold: 
+            data.channel_threshold = self.guess_channel_threshold
+        elif data.channel_threshold<self.min_channel_threshold: 
+            data.channel_threshold = self.guess_channel_threshold/2
+        info.set_thresholds(channel_threshold=data.channel_threshold,
+                            segmentation_threshold=self.fine_segmentation_threshold)
+        
+        # Big step - map subsegments using above channel threshold
+        if not self.map_channels_segments(info, data):
+            del data
+            vprint(self.vprogress,'   --- (problem mapping channels & subsegments)')
+            return None
+        
+        data.mapping_array[(data.mapping_array & info.is_channelhead
+                            ==info.is_channelhead )] \
+            |= info.was_channelhead
+        
+        # Map using FMM
+        self.select_subsegments(info, data, do_restrict=False)
+        if not self.measure_hsl_fmm(info, data) \
+              or not self.parse_hsl(info, data) \
+              or not self.remap_hsl(info, data, n_hsl_averaging_threshold=0):
+            del data
+            vprint(self.vprogress,'   --- (problem measuring HSL using FM)')
+            return None
+        
+        vprint(self.vprogress,
+               '\nChannel threshold = {0:0.1f}m'.format(data.channel_threshold))
+        vprint(self.vprogress,
+               'FMM mean HSL   = {0:0.1f}m'.format(data.fmm_mean_hsl))
+        vprint(self.vprogress,
+               'Trace mean HSL = {0:0.1f}m'.format(data.trace_mean_hsl))
+        
+        # Use raw coarse mask to only keep HSL values actually on coarse subsegment
+        bounds = data.bounds_grid
+        np.bitwise_or(base_mask_array, raw_mask_array, out=merged_mask_array)
+        data.hsl_array[np.isnan(data.hsl_array)] = 0.0
+        return {'bounds'         : bounds,
+                'keep_array'     : ~merged_mask_array[bounds],
+                'hsl_array'      : data.hsl_array,
+                'mapping_array'  : data.mapping_array,
+                'trace_mean_hsl' : data.trace_mean_hsl,
+                'hsl_stats_df'   : data.hsl_stats_df}
+
+    def merge_coarse_subsegment(self, coarse_subsegment, idx, n_segments, result):
+        """
+        Args:
+            coarse_subsegment (int): label of coarse catchment subsegment
+            idx (int): index of coarse subsegment in coarse_subsegments_list_array
+            n_segments (int): number of coarse subsegments
+            result (dict): as returned by :meth:`map_coarse_subsegment` 
+        
+        Merge the HSL statistics, HSL grid and channel mapping of one coarse 
+        subsegment into the 'global' results. 
+        Must be called in coarse subsegment order.
+        """
+        # Report % progress
+        self.report_progress(idx, n_segments, subsegment=coarse_subsegment)
+        if result is None:
+            return
+        # Inefficient but simple
+        self.hsl_mean_array = np.append(self.hsl_mean_array,result['trace_mean_hsl'])
+        # Eliminate almost certainly spurious count=1 HSL mean values
+        hsl_stats_df = result['hsl_stats_df']
+        if self.hsl_stats_df is None:
+            self.hsl_stats_df = hsl_stats_df[
+                (hsl_stats_df['count']>1) 
+                & (hsl_stats_df['mean [m]']>5.0)
+                ].copy()
+        else:
+            self.hsl_stats_df = self.hsl_stats_df.append(
+                hsl_stats_df[
+                (hsl_stats_df['count']>1) 
+                & (hsl_stats_df['mean [m]']>5.0)
+                ])
+        # Deploy this coarse subsegment's HSL data to the 'global' HSL map
+        self.print('Merging hillslope lengths...',end='')
+        bounds = result['bounds']
+        keep_array = result['keep_array']
+        # Merge this coarse subsegment's HSL values into the 'global' HSL map
+        self.hsl_array[bounds][keep_array] = result['hsl_array'][keep_array]
+        # Merge the channel mapping results for this coarse subsegment
+        #   - which will allow recomputation of the entire channel network
+        #     during pass#3
+        self.mapping_array[bounds][keep_array] |= result['mapping_array'][keep_array]
                 
     def pass3(self):   
         """
@@ -580,7 +885,7 @@ class Mapping(Core):
         data = Data( info=info, bbox=bbox, pad=pad,
                      mapping_array = self.mapping_array,
                      mask_array    = mask_array,
-                     uv_array      = self.preprocess.uv_array,
+                     uv_array      = self.preprocess.uv_code_array,
                      slc_array     = self.trace.slc_array,
                      slt_array     = self.trace.slt_array,
                      sla_array     = self.trace.sla_array )
@@ -839,32 +1144,102 @@ class Mapping(Core):
         self.print('...done')  
                                 
     def fmm_lengths(self, info, data):
+        """
+        Measure the hillslope length of each selected subsegment as twice the 
+        mean eikonal (fast-marching) distance from its thin channel pixels 
+        over the subsegment dilated by one pixel.
+        
+        Each subsegment is cropped to its bounding box plus a margin, found 
+        for all subsegments at once, and the eikonal solves are farmed out 
+        in batches to n_fmm_workers threads (skfmm releases the GIL).
+        
+        Returns:
+            bool:
+            True if any subsegment HSL could be measured
+        """
         data.subsegment_hsl_array = np.zeros_like(data.selected_subsegments_array)
-        for idx,subsegment in enumerate(data.selected_subsegments_array):
-            phi_bool = np.zeros_like(data.label_array,dtype=np.bool)
-            phi_mod  = np.zeros_like(data.label_array,dtype=np.int32)
-            mask     = np.zeros_like(data.label_array,dtype=np.bool)
-            phi_bool[np.abs(data.label_array)==np.abs(subsegment)]=True
-            n_phi_pixels = phi_bool[phi_bool==True].size
-            n_erosions = 0
-            if n_erosions>0:
-                erosion_structure = generate_binary_structure(2, 1)
-                phi_bool_eroded = binary_erosion(phi_bool, structure=erosion_structure, 
-                                                           iterations=n_erosions)
-                phi_bool = phi_bool_eroded
-            n_dilations = 1
-            if n_dilations>0:
-                dilation_structure = generate_binary_structure(2, 1)
-                phi_bool_dilated = binary_dilation(phi_bool, structure=dilation_structure, 
-                                                   iterations=n_dilations)
-                phi_bool = phi_bool_dilated
-            phi_mod = phi_bool.astype(np.float32)
-            phi_mod[((data.mapping_array & info.is_thinchannel)==info.is_thinchannel)
-                    & (np.abs(data.label_array)==np.abs(subsegment))]=-1
-            mask[phi_bool_dilated==0]=True
-            phi_mod  = np.ma.MaskedArray(phi_mod, mask)
-
-            n_channel_pixels = phi_mod[phi_mod==-1].size
+        # Subsegments are matched by absolute label
+        abs_labels_array, inverse_array \
+            = np.unique(np.abs(data.selected_subsegments_array), return_inverse=True)
+        n_labels = abs_labels_array.size
+        # Relabel the grid 1...n_labels so that all bboxes are found in one pass
+        is_labeled_array, index_array = lookup_labels(np.abs(data.label_array), 
+                                                      abs_labels_array)
+        index_grid_array = np.zeros_like(data.label_array, dtype=np.int32)
+        index_grid_array[is_labeled_array] = index_array+1
+        bbox_list = find_objects(index_grid_array, max_label=n_labels)
+        is_channel_array = ((data.mapping_array & info.is_thinchannel)
+                            ==info.is_thinchannel)
+        hsl_array = np.zeros((n_labels,), dtype=data.subsegment_hsl_array.dtype)
+        n_workers = int(self.n_fmm_workers) if self.n_fmm_workers>0 else cpu_count()
+        n_workers = max(1,min(n_workers,n_labels))
+        batches = np.array_split(np.arange(n_labels), n_workers)
+        fmm_args = (index_grid_array, is_channel_array, bbox_list, hsl_array)
+        if n_workers>1:
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                list(executor.map(lambda batch: self.fmm_lengths_batch(batch,*fmm_args),
+                                  batches))
+        else:
+            self.fmm_lengths_batch(batches[0],*fmm_args)
+        data.subsegment_hsl_array[:] = hsl_array[inverse_array]
+        
+        hsl_array = data.subsegment_hsl_array
+        
+#         hsl_array = hsl_array[hsl_array>0.0]
+        if hsl_array[hsl_array>0.0].size>0:
+            data.fmm_mean_hsl = np.mean(hsl_array[hsl_array>0.0])
+#             pdebug('FMM  HSL = {:.1f}m'.format(fmm_mean_hsl))
+            return True
+        else:
+            return False
+        
+    def fmm_lengths_batch(self, batch_array, index_grid_array, is_channel_array, 
+                          bbox_list, hsl_array):
+        """
+        Args:
+            batch_array (numpy.ndarray): indexes of the subsegments in this batch
+            index_grid_array (numpy.ndarray): grid of subsegment index+1 (0 if none)
+            is_channel_array (numpy.ndarray): grid flagging thin channel pixels 
+            bbox_list (list): bounding box slices of each subsegment
+            hsl_array (numpy.ndarray): HSL of each subsegment (written here)
+        
+        Measure the hillslope lengths of a batch of subsegments, 
+        each in its own bounding box crop. 
+        Scratch grids are allocated once per batch and reused.
+        """
+        n_dilations = 1
+        dilation_structure = generate_binary_structure(2, 1)
+        # Margin needed to keep the dilated subsegment clear of the crop edges
+        margin = n_dilations+1
+        nx,ny = index_grid_array.shape
+        crops = {}
+        for idx in batch_array:
+            bbox = bbox_list[idx]
+            if bbox is not None:
+                crops[idx] = np.index_exp[max(bbox[0].start-margin,0):
+                                          min(bbox[0].stop+margin,nx),
+                                          max(bbox[1].start-margin,0):
+                                          min(bbox[1].stop+margin,ny)]
+        if len(crops)==0:
+            return
+        nxc = max(crop[0].stop-crop[0].start for crop in crops.values())
+        nyc = max(crop[1].stop-crop[1].start for crop in crops.values())
+        phi_bool_buffer = np.zeros((nxc,nyc), dtype=np.bool)
+        dilated_buffer  = np.zeros((nxc,nyc), dtype=np.bool)
+        for idx,crop in crops.items():
+            shape = np.index_exp[:crop[0].stop-crop[0].start,
+                                 :crop[1].stop-crop[1].start]
+            phi_bool = phi_bool_buffer[shape]
+            phi_bool_dilated = dilated_buffer[shape]
+            np.equal(index_grid_array[crop], idx+1, out=phi_bool)
+            n_phi_pixels = np.count_nonzero(phi_bool)
+            binary_dilation(phi_bool, structure=dilation_structure, 
+                            iterations=n_dilations, output=phi_bool_dilated)
+            phi_mod = phi_bool_dilated.astype(np.float32)
+            phi_mod[is_channel_array[crop] & phi_bool]=-1
+            phi_mod  = np.ma.MaskedArray(phi_mod, ~phi_bool_dilated)
+
+            n_channel_pixels = np.count_nonzero(phi_mod.data==-1)
             if n_channel_pixels==0:
                 continue
             ratio_phi_channel = n_phi_pixels/n_channel_pixels
@@ -874,30 +1249,9 @@ class Mapping(Core):
 #                 hsl = np.max(distance)
                 hsl = np.mean(distance)*2.0
                 if ratio_phi_channel>4.0:
-                    data.subsegment_hsl_array[idx] = hsl
+                    hsl_array[idx] = hsl
             except:
                 pass
-            
-#             self.plot.plot_gridded_data(phi_mod,'jet', #'randomized',
-#                                         do_colorbar=True, #mask_array=mask,
-#                                         do_balance_cmap=False, do_shaded_relief=False,
-#                                         extent=[0,phi_mod.shape[0],0,phi_mod.shape[1]],
-#                                         window_size_factor=2)
-#             self.plot.plot_gridded_data(distance,'jet', #mask_array=mask,
-#                                         do_colorbar=True,
-#                                         do_balance_cmap=False, do_shaded_relief=False,
-#                                         extent=[0,distance.shape[0],0,distance.shape[1]],
-#                                         window_size_factor=2)
-#         pdebug(data.subsegment_label_array.size,data.subsegment_hsl_array.size)
-        hsl_array = data.subsegment_hsl_array
-        
-#         hsl_array = hsl_array[hsl_array>0.0]
-        if hsl_array[hsl_array>0.0].size>0:
-            data.fmm_mean_hsl = np.mean(hsl_array[hsl_array>0.0])
-#             pdebug('FMM  HSL = {:.1f}m'.format(fmm_mean_hsl))
-            return True
-        else:
-            return False
       
     def measure_hsl_fmm(self, info, data):
         self.print('Measuring hillslope lengths using eikonal distance...')
@@ -919,23 +1273,24 @@ class Mapping(Core):
         
     def parse_hsl(self, info, data):
         self.print('Parsing hillslope lengths...')
-        n = data.subsegment_hsl_array.shape[0]
-        df = pd.DataFrame(np.zeros((n,), dtype=[('fine', np.int32), 
-                                                ('length', np.float32)]))
-        df['fine']   = data.subsegment_label_array
-        df['length'] = data.subsegment_hsl_array
-#         pdebug(df)
-        df = df[df.fine!=0]
+        # Per-subsegment HSL count, mean & stddev in one pass of bin counts
+        #   - labels 0 (unlabeled) are not among the selected subsegments
         try:
-            stats_df = pd.DataFrame(data.selected_subsegments_array,columns=['fine'])
-            stats_list = ( ('count','count'), ('mean','mean [m]'), ('std','stddev [m]') )
-            for stat in stats_list:
-                stats_df = stats_df.join( getattr(df.groupby('fine'),stat[0])(),
-                                          on='fine')
-                stats_df.rename(index=str, columns={'length':stat[1]}, inplace=True)
+            is_present_array, count_array, mean_array, stddev_array \
+                = compute_label_stats(data.subsegment_label_array,
+                                      data.subsegment_hsl_array,
+                                      data.selected_subsegments_array)
         except:
             self.print('Problem constructing HSL stats dataframe')
             return False
+        # Subsegments with no HSL measurements get NaN stats
+        if not np.all(is_present_array):
+            count_array = count_array.astype(np.float64)
+            count_array[~is_present_array] = np.nan
+        stats_df = pd.DataFrame({'fine':       data.selected_subsegments_array,
+                                 'count':      count_array,
+                                 'mean [m]':   mean_array,
+                                 'stddev [m]': stddev_array})
         stats_df['coarse']=info.coarse_label
         stats_df.set_index(['fine','coarse'],inplace=True)
         data.hsl_stats_df = stats_df
@@ -951,12 +1306,16 @@ class Mapping(Core):
         nxp = info.nx_padded
         nyp = info.ny_padded
         try:   
+            # Per-subsegment HSL, zeroed if too few measurements to average
+            hsl_lookup_array = np.where(
+                stats_df['count'].values>=n_hsl_averaging_threshold,
+                stats_df['mean [m]'].values, 0.0 ).astype(np.float32)
+            # Paint the HSL grid with one gather of per-pixel subsegment HSLs
+            is_labeled_array, index_array \
+                = lookup_labels(data.label_array, 
+                                stats_df.index.get_level_values('fine').values)
             data.hsl_array = np.zeros((nxp,nyp), dtype=np.float32)
-            for idx,row in stats_df.iterrows():
-                if row['count']>=n_hsl_averaging_threshold:
-                    data.hsl_array[data.label_array==idx[0]] = row['mean [m]']
-                else:
-                    data.hsl_array[data.label_array==idx[0]] = 0
+            data.hsl_array[is_labeled_array] = hsl_lookup_array[index_array]
         except:
             self.print('Problem with HSL stats dataframe')
             return False
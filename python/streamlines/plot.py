@@ -1373,11 +1373,11 @@ class Plot(Core):
         """
         if do_down:
             up_or_down_str = 'down'
-            streamline_arrays_list = self.trace.streamline_arrays_list[0]
+            streamline_set = self.trace.streamline_arrays_list[0]
             color = self.downstreamline_color
         else:
             up_or_down_str = 'up'
-            streamline_arrays_list = self.trace.streamline_arrays_list[1]
+            streamline_set = self.trace.streamline_arrays_list[1]
             color = self.upstreamline_color
         marker = self.streamline_point_marker   
         size = self.streamline_point_size
@@ -1385,7 +1385,7 @@ class Plot(Core):
         alpha = self.streamline_point_alpha
         
         try:
-            n_streamlines = len(streamline_arrays_list)
+            n_streamlines = len(streamline_set)
         except:
             return
         idx_list = list(range(n_streamlines))
@@ -1411,8 +1411,9 @@ class Plot(Core):
         else:
             self.print_interval = max(1,todo//10)
         for sidx in range(todo): 
+            # Zero-copy view of this streamline's steps in the CSR store
             trajectory = np.concatenate((np.array([[0,0]],dtype=np.float32),
-                        streamline_arrays_list[idx_list[sidx]].astype(np.float32)
+                        streamline_set[idx_list[sidx]].astype(np.float32)
                                     /np.float32(self.trace.trajectory_resolution)))
             seed_point = self.trace.seed_point_array[idx_list[sidx],:]
             x_vec = ( self.geodata.roi_x_origin
@@ -22,22 +22,38 @@ import pyopencl       as cl
 import pyopencl.tools as cltools
 import numpy as np
 import os
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from streamlines.useful import neatly, vprint
+from streamlines import profiling
 import warnings
 
 os.environ['PYOPENCL_COMPILER_OUTPUT']='0'
 
-__all__ = ['Initialize_cl',
+__all__ = ['Initialize_cl', 'BufferPool',
            'prepare_cl_context','choose_platform_and_device',
            'prepare_cl_queue', 'prepare_cl',
            'make_cl_dtype',
-           'set_compile_options', 
+           'set_compile_options', 'GRID_PARAMS_DTYPE', 'grid_params',
+           'prepare_grid_params_buffer',
+           'program_cache_key', 'build_program', 'clear_program_cache',
            'report_kernel_info', 'report_device_info', 'report_build_log',
            'adaptive_enqueue_nd_range_kernel',
            'prepare_buffers', 'gpu_compute']
 
 pdebug = print
 
+# In-memory LRU cache of built programs, keyed by program_cache_key()
+_program_cache = OrderedDict()
+# Programs may be built concurrently by worker threads, e.g., in mapping pass#2
+_program_cache_lock = threading.Lock()
+
+# One context per platform & device per process, e.g., per scheduler worker
+_context_cache = {}
+_context_cache_lock = threading.Lock()
+
 class Initialize_cl():     
     """
     TBD
@@ -72,11 +88,204 @@ class Initialize_cl():
         self.src_path      = cl_src_path
         self.kernel_source = None
         self.kernel_fn     = ''
+        self.buffer_pool   = BufferPool(self.context, self.device, self.queue, 
+                                        cl_src_path)
+
+class BufferPool():
+    """
+    Pool of device-resident buffers that persist across GPU/OpenCL kernel calls.
+    
+    The pooled grids (by default ``uv``, ``mask`` and ``mapping``) are uploaded 
+    once per host array, i.e., once per :class:`.Data` instance, and thereafter 
+    are only transferred in part:
+      - rows of a grid changed on the host since the last transfer are 
+        found by comparison with a host-side shadow copy and only they are uploaded
+      - rows changed on the device by a kernel are found by comparison with a 
+        device-side snapshot (see ``dirtyrows.cl``) and only they are copied back
+    
+    Static grids (by default ``uv`` and ``mask``) are assumed not to be altered 
+    on the host while pooled; use :meth:`mark_dirty` if they are.
+    
+    Args:
+        context (pyopencl.Context):
+        device (pyopencl.Device):
+        queue (pyopencl.CommandQueue):
+        cl_src_path (str): path to OpenCL source files
+        pooled (tuple): names (``array_dict`` keys) of pooled grids
+        static (tuple): names of pooled grids not changed by host or kernels
+    """
+    def __init__(self, context, device, queue, cl_src_path, 
+                 pooled=('uv','mask','mapping'), static=('uv','mask')):
+        self.context     = context
+        self.device      = device
+        self.queue       = queue
+        self.src_path    = cl_src_path
+        self.pooled      = pooled
+        self.static      = static
+        self.entries     = {}
+        self.h2d_bytes   = 0
+        self.d2h_bytes   = 0
+        self.dirty_kernel = None
+
+    def get_buffer(self, name, array, rwf):
+        """
+        Fetch the device buffer for a pooled grid, uploading only what is needed.
+        
+        Args:
+            name (str): ``array_dict`` key of the grid
+            array (numpy.ndarray): host grid
+            rwf (str): kernel access to the grid, 'RO', 'RW' or 'WO'
+        
+        Returns:
+            pyopencl.Buffer:
+                device buffer
+        """
+        entry = self.entries.get(name)
+        if entry is None or entry['array'] is not array:
+            # New host grid (e.g. new Data instance): release old, upload whole grid
+            self.release(name)
+            flags = cl.mem_flags.READ_WRITE | cl.mem_flags.COPY_HOST_PTR
+            entry = {'array':  array,
+                     'buffer': cl.Buffer(self.context, flags, hostbuf=array),
+                     'shadow': None if name in self.static else array.copy(),
+                     'device_shadow': None}
+            self.entries.update({name: entry})
+            self._count_transfer('h2d', array.nbytes)
+        elif entry['shadow'] is not None:
+            # Upload only the span of rows changed on the host since the last transfer
+            rows = self._changed_rows(array, entry['shadow'])
+            if rows is not None:
+                self._upload_rows(entry, *rows)
+        if 'W' in rwf and entry['shadow'] is not None:
+            # Snapshot device grid so that changed rows can be found after the kernel
+            if entry['device_shadow'] is None:
+                entry['device_shadow'] = cl.Buffer(self.context, cl.mem_flags.READ_WRITE,
+                                                   array.nbytes)
+            cl.enqueue_copy(self.queue, entry['device_shadow'], entry['buffer'])
+        return entry['buffer']
+
+    def fetch(self, name):
+        """
+        Copy back to the host only the span of rows of a pooled grid that
+        a kernel has changed.
+        
+        Args:
+            name (str): ``array_dict`` key of the grid
+        """
+        entry = self.entries[name]
+        array = entry['array']
+        n_rows = array.shape[0]
+        row_nbytes = array.nbytes//max(n_rows,1)
+        if entry['device_shadow'] is None or row_nbytes%4!=0:
+            cl.enqueue_copy(self.queue, array, entry['buffer'])
+            self._count_transfer('d2h', array.nbytes)
+        else:
+            rows = self._dirty_rows(entry, n_rows, row_nbytes)
+            if rows is not None:
+                x0,x1 = rows
+                cl.enqueue_copy(self.queue, array[x0:x1], entry['buffer'],
+                                src_offset=x0*row_nbytes)
+                self._count_transfer('d2h', (x1-x0)*row_nbytes)
+        if entry['shadow'] is not None:
+            entry['shadow'][...] = array
+
+    def mark_dirty(self, name, rows=None):
+        """
+        Flag that a pooled grid has been changed on the host, 
+        so that (the given span of rows of) it is uploaded before the next kernel.
+        
+        Args:
+            name (str): ``array_dict`` key of the grid
+            rows (tuple): (first, last+1) span of changed rows; default is all rows
+        """
+        entry = self.entries.get(name)
+        if entry is None:
+            return
+        if rows is None:
+            rows = (0, entry['array'].shape[0])
+        self._upload_rows(entry, *rows)
+
+    def release(self, name=None):
+        """
+        Release the device buffers of one or (by default) all pooled grids.
+        
+        Args:
+            name (str): ``array_dict`` key of the grid
+        """
+        names = list(self.entries.keys()) if name is None else [name]
+        for name in names:
+            entry = self.entries.pop(name, None)
+            if entry is None:
+                continue
+            for buffer in [entry['buffer'], entry['device_shadow']]:
+                if buffer is not None:
+                    buffer.release()
+
+    def _count_transfer(self, direction, n_bytes):
+        """
+        Tally a host-to-device ('h2d') or device-to-host ('d2h') transfer,
+        also reporting it to the profiler (if recording).
+        """
+        if direction=='h2d':
+            self.h2d_bytes += n_bytes
+        else:
+            self.d2h_bytes += n_bytes
+        profiling.record_transfer(direction, n_bytes)
+
+    def _changed_rows(self, array, shadow):
+        """
+        Find the span of rows in which a host grid differs from its shadow copy.
+        """
+        changed = np.flatnonzero((array!=shadow).reshape(array.shape[0],-1).any(axis=1))
+        if changed.shape[0]==0:
+            return None
+        return int(changed[0]), int(changed[-1]+1)
+
+    def _upload_rows(self, entry, x0, x1):
+        """
+        Upload a span of rows of a host grid to its device buffer.
+        """
+        array = entry['array']
+        row_nbytes = array.nbytes//max(array.shape[0],1)
+        cl.enqueue_copy(self.queue, entry['buffer'], array[x0:x1], 
+                        dst_offset=x0*row_nbytes)
+        self._count_transfer('h2d', (x1-x0)*row_nbytes)
+        if entry['shadow'] is not None:
+            entry['shadow'][x0:x1] = array[x0:x1]
+
+    def _dirty_rows(self, entry, n_rows, row_nbytes):
+        """
+        Find on the device the span of rows changed by a kernel.
+        """
+        if self.dirty_kernel is None:
+            kernel_source = read_kernel_source(self.src_path,['dirtyrows.cl'])
+            program = build_program(self.context, self.device, kernel_source, 
+                                    ['-D','KERNEL_FLAG_DIRTY_ROWS'])
+            self.dirty_kernel = cl.Kernel(program, 'flag_dirty_rows')
+            self.dirty_kernel.set_scalar_arg_dtypes([None,None,None,
+                                                     np.uint32,np.uint32])
+        dirty_array  = np.zeros(n_rows, dtype=np.uint8)
+        dirty_buffer = cl.Buffer(self.context, cl.mem_flags.WRITE_ONLY, 
+                                 dirty_array.nbytes)
+        self.dirty_kernel.set_args(entry['buffer'], entry['device_shadow'], dirty_buffer,
+                                   n_rows, row_nbytes//4)
+        cl.enqueue_nd_range_kernel(self.queue, self.dirty_kernel, [n_rows], None)
+        cl.enqueue_copy(self.queue, dirty_array, dirty_buffer)
+        dirty_buffer.release()
+        self._count_transfer('d2h', dirty_array.nbytes)
+        dirty = np.flatnonzero(dirty_array)
+        if dirty.shape[0]==0:
+            return None
+        return int(dirty[0]), int(dirty[-1]+1)
 
 def prepare_cl_context(cl_platform=0, cl_device=2):
     """
     Prepare PyOpenCL platform, device and context.
     
+    The context is created once per platform & device in each process and then
+    reused, so that all workflow objects in a process (e.g., a scheduler worker 
+    running many tiles) share it along with its cache of built programs.
+    
     Args:
         cl_platform (int):
         cl_device (int):
@@ -86,11 +295,14 @@ def prepare_cl_context(cl_platform=0, cl_device=2):
             PyOpenCL platform, PyOpenCL device, PyOpenCL context
     """
     cl_platform, cl_device = choose_platform_and_device(cl_platform,cl_device)
-    platform = cl.get_platforms()[cl_platform]
-    devices = platform.get_devices()
-    device = devices[cl_device]
-    context = cl.Context([device])
-    return platform, device, context
+    key = (os.getpid(), int(cl_platform), int(cl_device))
+    with _context_cache_lock:
+        if key not in _context_cache.keys():
+            platform = cl.get_platforms()[cl_platform]
+            devices = platform.get_devices()
+            device = devices[cl_device]
+            _context_cache[key] = (platform, device, cl.Context([device]))
+        return _context_cache[key]
 
 def choose_platform_and_device(cl_platform='env',cl_device='env'):
     """
@@ -133,8 +345,8 @@ def prepare_cl_queue(context=None, kernel_source=None, compile_options=[]):
 #                        '-cl-unsafe-math-optimizations',
 #                        '-cl-no-signed-zeros',
 #                        '-cl-finite-math-only']
-    program = cl.Program(context, kernel_source).build(cache_dir=False,
-                                                          options=compile_options)
+    program = build_program(context, context.devices[0], kernel_source, 
+                            compile_options)
     queue = cl.CommandQueue(context)
     return program, queue
 
@@ -175,7 +387,7 @@ def make_cl_dtype(device,name,dtype):
     processed_dtype, c_decl = cltools.match_dtype_to_c_struct(device, name, dtype)
     return processed_dtype, cltools.get_or_register_dtype(name, processed_dtype), c_decl
 
-def set_compile_options(info, kernel_def, downup_sign=1,
+def set_compile_options(info, kernel_def, downup_sign=1, is_bidirectional=False,
                         job_type='integration'):
     """
     Convert info obj data into a list of '-D' compiler macros.
@@ -187,6 +399,9 @@ def set_compile_options(info, kernel_def, downup_sign=1,
             is used by #ifdef kernel-wrapper commands in the OpenCL codes
         downup_sign (bool): flag used to indicate desired sense of streamline integration,
                with +1 for downstream and -1 for upstream ['integration' mode]
+        is_bidirectional (bool): flag used to indicate that each work item integrates
+               both downstream and upstream in a single launch, in which case
+               downup_sign should be +1 ['integration' mode]
         job_type (str): switch between 'integration' (default) and 'kde'
         
     Returns:
@@ -222,36 +437,20 @@ def set_compile_options(info, kernel_def, downup_sign=1,
             rtn_list += list_item
 
     else:
-        pad = np.uint32(info.pad_width)
-        nxp = np.uint32(info.nx_padded)
-        nyp = np.uint32(info.ny_padded)
-        nxf = np.float32(info.nx)
-        nyf = np.float32(info.ny)
-        grid_scale   = np.float32(np.sqrt(nxf*nyf))
-        combo_factor = np.float32(grid_scale*info.integrator_step_factor)
-        dt_max       = np.float32(min(min(1.0/nxf,1.0/nyf),0.1))
+        # NB: n_seed_points and seeds_chunk_offset are passed as runtime kernel args,
+        #   and the grid geometry as a runtime struct (see grid_params()),
+        #   so that one program binary serves every chunk, seed list & subsegment
         compile_options_dict = {
-            'n_seed_points' :               ('u',''),
-            'downup_sign' :                 ('u', np.int8(downup_sign)),
+            # NB: a float, lest -1 become the unsigned -1u (i.e., 2^32-1)
+            'downup_sign' :                 ('f', np.float32(downup_sign)),
             'integrator_step_factor' :      ('f',''),
             'max_integration_step_error' :  ('f',''),
             'adjusted_max_error' :          ('f',''),
             'integration_halt_threshold' :  ('f',''),
             'max_length' :                  ('f',''),
             'pixel_size' :                  ('f',''),
-            'pad_width' :                   ('u', pad),
-            'pad_width_pp5' :               ('f', np.float32(pad)+0.5),
-            'nx_padded' :                   ('u', nxp),
-            'ny_padded' :                   ('u', nyp),
-            'nxy_padded' :                  ('u', np.uint32(nxp*nyp)),
-            'nxf_mp5' :                     ('f', nxf-0.5),
-            'nyf_mp5' :                     ('f', nyf-0.5),
-            'grid_scale' :                  ('f', grid_scale),
-            'combo_factor' :                ('f', combo_factor*downup_sign),
-            'dt_max' :                      ('f', dt_max),
             'max_n_steps' :                 ('u',''),
             'trajectory_resolution' :       ('u',''),
-            'seeds_chunk_offset' :          ('u',''),
             'subpixel_seed_point_density' : ('u',''),
             'subpixel_seed_halfspan' :      ('f',''),
             'subpixel_seed_step' :          ('f',''),
@@ -276,12 +475,17 @@ def set_compile_options(info, kernel_def, downup_sign=1,
             'is_loop' :                     ('u',''),
             'is_blockage' :                 ('u',''),
             'do_measure_hsl_from_ridges' :  ('flag',''),
+            'uv_is_half' :                  ('flag',''),
+            'uv_is_angle' :                 ('flag',''),
+            'uv_is_tiled' :                 ('flag',''),
+            'uv_tile_size' :                ('u',''),
+            'do_memoize_fields' :           ('flag',''),
+            'memo_min_length' :             ('f',''),
+            'do_privatize_accumulation' :   ('flag',''),
+            'slt_scale' :                   ('f',''),
             'debug' :                       ('flag',''),
             'verbose' :                     ('flag','')
         }
-        if info.segmentation_threshold>0:
-            compile_options_dict.update({'segmentation_threshold' : ('u','')})            
-
         rtn_list = ['-D','KERNEL_{}'.format(kernel_def.upper())]
         for item in compile_options_dict.items():
             if item[1][0]=='flag':
@@ -295,9 +499,196 @@ def set_compile_options(info, kernel_def, downup_sign=1,
                 list_item = ['-D', 
                              '{0}={1}{2}'.format(item[0].upper(),value,item[1][0])]
             rtn_list += list_item
+        if is_bidirectional:
+            rtn_list += ['-D','IS_BIDIRECTIONAL']
 
     return rtn_list
 
+# Layout of the runtime grid geometry parameters: must match grid_params_t
+#   field for field (see essentials.cl)
+GRID_PARAMS_DTYPE = np.dtype([
+    ('pad_width',              np.uint32),
+    ('pad_width_pp5',          np.float32),
+    ('nx_padded',              np.uint32),
+    ('ny_padded',              np.uint32),
+    ('nxy_padded',             np.uint32),
+    ('nxf_mp5',                np.float32),
+    ('nyf_mp5',                np.float32),
+    ('grid_scale',             np.float32),
+    ('combo_factor',           np.float32),
+    ('dt_max',                 np.float32),
+    ('uv_tiles_ny',            np.uint32),
+    ('segmentation_threshold', np.uint32)
+])
+
+def grid_params(info, downup_sign=1):
+    """
+    Pack the grid geometry and related step-size parameters into a record
+    to be passed to the CL kernels as a runtime __constant struct.
+    
+    These values change with every chunk of a chunked DTM and with every 
+    subsegment bbox in mapping pass#2: passing them at runtime rather than as 
+    compiler macros means one program binary serves every grid.
+    
+    Args:
+        info (obj): kernel parameters object
+        downup_sign (int): +1 for downstream and -1 for upstream integration, 
+            folded into combo_factor
+        
+    Returns:
+        numpy.ndarray:
+            single record of dtype :data:`GRID_PARAMS_DTYPE`
+    """
+    pad = np.uint32(info.pad_width)
+    nxp = np.uint32(info.nx_padded)
+    nyp = np.uint32(info.ny_padded)
+    nxf = np.float32(info.nx)
+    nyf = np.float32(info.ny)
+    grid_scale   = np.float32(np.sqrt(nxf*nyf))
+    combo_factor = np.float32(grid_scale*info.integrator_step_factor)
+    dt_max       = np.float32(min(min(1.0/nxf,1.0/nyf),0.1))
+    segmentation_threshold = getattr(info,'segmentation_threshold',0)
+    params = np.zeros(1, dtype=GRID_PARAMS_DTYPE)
+    params['pad_width']     = pad
+    params['pad_width_pp5'] = np.float32(pad)+0.5
+    params['nx_padded']     = nxp
+    params['ny_padded']     = nyp
+    params['nxy_padded']    = np.uint32(nxp*nyp)
+    params['nxf_mp5']       = nxf-0.5
+    params['nyf_mp5']       = nyf-0.5
+    params['grid_scale']    = grid_scale
+    params['combo_factor']  = combo_factor*np.float32(downup_sign)
+    params['dt_max']        = dt_max
+    params['uv_tiles_ny']   = np.uint32(np.ceil(nyp/max(1,info.uv_tile_size)))
+    params['segmentation_threshold'] = max(0,segmentation_threshold)
+    return params
+
+def prepare_grid_params_buffer(context, info, downup_sign=1):
+    """
+    Upload the grid parameters record (see :func:`grid_params`) to a read-only
+    buffer, to be passed as the last arg of a CL kernel.
+    
+    Args:
+        context (pyopencl.Context):
+        info (obj): kernel parameters object
+        downup_sign (int): +1 for downstream and -1 for upstream integration
+        
+    Returns:
+        pyopencl.Buffer:
+            grid parameters buffer
+    """
+    params = grid_params(info, downup_sign=downup_sign)
+    profiling.record_transfer('h2d', params.nbytes)
+    return cl.Buffer(context, cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR,
+                     hostbuf=params)
+
+def program_cache_key(device, kernel_source, compile_options):
+    """
+    Generate a hash key identifying a built program.
+    
+    The key combines the kernel source, the compile options (as generated by
+    :func:`set_compile_options`) and the device, platform & driver versions, 
+    so that a cached binary is never reused across devices or driver updates.
+    
+    Args:
+        device (pyopencl.Device):
+        kernel_source (str): OpenCL kernel code string
+        compile_options (list): '-D' compiler macros etc
+    
+    Returns:
+        str:
+            hex digest cache key
+    """
+    sha = hashlib.sha1()
+    for item in [device.name, device.platform.version, device.driver_version,
+                 kernel_source, ' '.join(compile_options)]:
+        sha.update(item.encode('utf-8'))
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+def build_program(context, device, kernel_source, compile_options,
+                  cache_size=64, cache_dir=None, verbose=False):
+    """
+    Build PyOpenCL program, or fetch it from the program cache if available.
+    
+    Programs are cached in memory in an LRU list of up to ``cache_size`` entries.
+    If ``cache_dir`` is given, program binaries are also written to and read from 
+    that directory so that they persist across runs.
+    
+    Args:
+        context (pyopencl.Context): GPU/OpenCL device context
+        device (pyopencl.Device):
+        kernel_source (str): OpenCL kernel code string
+        compile_options (list): '-D' compiler macros etc
+        cache_size (int): max number of programs held in memory; 0 disables caching
+        cache_dir (str): path to on-disk binary cache; None or '' disables it
+        verbose (bool):
+    
+    Returns:
+        pyopencl.Program:
+            built program
+    """
+    t_start = time.perf_counter()
+    kernel_name = profiling.kernel_name_from_options(compile_options)
+    key = program_cache_key(device, kernel_source, compile_options)
+    # Programs are bound to a context, so key the in-memory cache on it too
+    memory_key = (context.int_ptr, key)
+    with _program_cache_lock:
+        if memory_key in _program_cache:
+            _program_cache.move_to_end(memory_key)
+            program = _program_cache[memory_key]
+            profiling.record_span('build', kernel_name, t_start, 
+                                  time.perf_counter()-t_start, is_cached=True)
+            return program
+    
+    program = None
+    is_binary = False
+    if cache_dir:
+        binary_file = os.path.join(cache_dir, key+'.bin')
+        if os.path.isfile(binary_file):
+            with open(binary_file, 'rb') as fp:
+                binary = fp.read()
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    program = cl.Program(context, [device], [binary]) \
+                                .build(options=compile_options)
+                vprint(verbose,'Loaded CL program binary from cache: {}'
+                       .format(binary_file))
+                is_binary = True
+            except (cl.Error, OSError):
+                # Stale or corrupt binary: rebuild from source below
+                program = None
+    if program is None:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            program = cl.Program(context, kernel_source).build(options=compile_options)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            binary_file = os.path.join(cache_dir, key+'.bin')
+            # Write then rename so that concurrent runs never read a partial binary
+            tmp_file = binary_file+'.{}.{}.tmp'.format(os.getpid(),
+                                                       threading.get_ident())
+            with open(tmp_file, 'wb') as fp:
+                fp.write(program.get_info(cl.program_info.BINARIES)[0])
+            os.replace(tmp_file, binary_file)
+    profiling.record_span('build', kernel_name, t_start, time.perf_counter()-t_start,
+                          is_cached=False, is_binary=is_binary)
+    
+    if cache_size>0:
+        with _program_cache_lock:
+            _program_cache[memory_key] = program
+            while len(_program_cache)>cache_size:
+                _program_cache.popitem(last=False)
+    return program
+
+def clear_program_cache():
+    """
+    Empty the in-memory program cache (the on-disk cache is left untouched).
+    """
+    with _program_cache_lock:
+        _program_cache.clear()
+
 def report_kernel_info(device,kernel,verbose):
     """
     Fetch and print GPU/OpenCL kernel info.
@@ -414,6 +805,7 @@ def adaptive_enqueue_nd_range_kernel(queue, kernel, global_size, local_size,
     cumulative_time = 0.0
     time_per_item   = 0.0
     while work_left>0:
+        t_start = time.perf_counter()
 #         event = cl.enqueue_nd_range_kernel(queue, kernel, [chunk_size+offset,1], 
         event = cl.enqueue_nd_range_kernel(queue, kernel, [chunk_size,1], 
                                            local_size,global_work_offset=[offset,0])
@@ -434,6 +826,9 @@ def adaptive_enqueue_nd_range_kernel(queue, kernel, global_size, local_size,
         except:
             vprint(verbose, '...profiling failed')
             continue
+        profiling.record_span('kernel', kernel.function_name, t_start,
+                              time.perf_counter()-t_start, device_time=elapsed_time,
+                              n_work_items=int(chunk_size))
         cumulative_time += elapsed_time
         time_per_item    = elapsed_time/chunk_size
         chunk_size = n_work_items*(min(
@@ -444,6 +839,68 @@ def adaptive_enqueue_nd_range_kernel(queue, kernel, global_size, local_size,
                     downup_step=downup_step, end='\n')
     return cumulative_time
 
+def enqueue_nd_range_kernel_split(queue, kernel, global_size, local_size,
+                                  n_work_items, launch_size, wait_for=None):
+    """
+    Enqueue a kernel over a range of work items as a sequence of launches
+    of at most launch_size work items, without waiting for any of them to complete.
+    
+    Unlike :func:`adaptive_enqueue_nd_range_kernel`, which waits on each launch so 
+    as to time it and size the next, this lets the host get on with other work 
+    (e.g., transfers and post-processing of a previous chunk) while the kernel runs. 
+    The launch size should therefore be set from timings of earlier launches
+    (see :func:`kernel_launch_size`).
+    
+    Args:
+        queue (pyopencl.CommandQueue):
+        kernel (pyopencl.Kernel):
+        global_size (list): number of work items
+        local_size (list): work group size
+        n_work_items (int): work group size, to which launch sizes are rounded
+        launch_size (int): maximum number of work items per launch
+        wait_for (list): events the first launch must wait for
+        
+    Returns:
+        list:
+            kernel launch events
+    """
+    work_size   = n_work_items*int(np.ceil(global_size[0]/n_work_items))
+    launch_size = max(n_work_items, n_work_items*(int(launch_size)//n_work_items))
+    events = []
+    for offset in range(0, work_size, launch_size):
+        events += [cl.enqueue_nd_range_kernel(queue, kernel, 
+                                              [min(launch_size,work_size-offset),1],
+                                              local_size, global_work_offset=[offset,0],
+                                              wait_for=wait_for if offset==0 else None)]
+    return events
+
+def kernel_launch_size(events, n_items, n_work_items, max_time_per_kernel, 
+                       default_size):
+    """
+    Size kernel launches to take about max_time_per_kernel each, given the
+    profiled events of completed launches.
+    
+    Args:
+        events (list): completed launch events
+        n_items (int): total number of work items of these launches
+        n_work_items (int): work group size, to which the launch size is rounded
+        max_time_per_kernel (float): target launch duration in seconds
+        default_size (int): launch size to return if there are no timings
+        
+    Returns:
+        int:
+            number of work items per launch
+    """
+    try:
+        elapsed_time = 1e-9*sum([event.profile.end-event.profile.start 
+                                 for event in events])
+    except:
+        return default_size
+    if elapsed_time<=0 or n_items==0:
+        return default_size
+    time_per_item = elapsed_time/n_items
+    return n_work_items*max(1,int(max_time_per_kernel/(time_per_item*n_work_items)))
+
 def read_kernel_source(cl_src_path, cl_files):    
     """
     TBD
@@ -463,14 +920,18 @@ def read_kernel_source(cl_src_path, cl_files):
             kernel_source += fp.read()
     return kernel_source
 
-def prepare_buffers(context, array_dict, verbose):
+def prepare_buffers(context, array_dict, verbose, buffer_pool=None):
     """
     Create PyOpenCL buffers and np-workalike arrays to allow CPU-GPU data transfer.
     
+    Grids named in the buffer pool (if given) are taken from it rather than 
+    freshly created and uploaded.
+    
     Args:
         context (pyopencl.Context):
         array_dict (dict):
         verbose (bool):
+        buffer_pool (:class:`BufferPool`):
         
     Returns:
         dict: buffer_dict
@@ -483,7 +944,14 @@ def prepare_buffers(context, array_dict, verbose):
     #   rather harder to read in that form
     buffer_dict = {}
     for array_info in array_dict.items():
-        if 'R' in array_info[1]['rwf']:
+        if buffer_pool is not None and array_info[0] in buffer_pool.pooled \
+                and array_info[1]['rwf']!='NB':
+            buffer_dict.update({
+                array_info[0]: buffer_pool.get_buffer(array_info[0], 
+                                                      array_info[1]['array'], 
+                                                      array_info[1]['rwf'])
+            })
+        elif 'R' in array_info[1]['rwf']:
             if array_info[1]['rwf']=='RO':
                 flags = COPY_READ_ONLY
             elif array_info[1]['rwf']=='RW':
@@ -491,6 +959,7 @@ def prepare_buffers(context, array_dict, verbose):
             buffer_dict.update({
                 array_info[0]: cl.Buffer(context, flags, hostbuf=array_info[1]['array'])
             })
+            profiling.record_transfer('h2d', array_info[1]['array'].nbytes)
         elif array_info[1]['rwf']=='WO':
             flags = WRITE_ONLY
             buffer_dict.update({
@@ -518,25 +987,29 @@ def gpu_compute(cl_state, info, array_dict, verbose):
     kernel_source = cl_state.kernel_source
     kernel_fn     = cl_state.kernel_fn
     
-    # Prepare memory, buffers 
-    buffer_dict = prepare_buffers(context, array_dict, verbose)    
+    buffer_pool   = getattr(cl_state,'buffer_pool',None)
+    
+    # Prepare memory, buffers - pooled grids are only uploaded if changed
+    buffer_dict = prepare_buffers(context, array_dict, verbose, buffer_pool=buffer_pool)
 
     # Specify size (# of workitems) and number of workgroups
     global_size = [info.n_seed_points,1]
     local_size  = [info.n_work_items,1]
 
-    # Compile the CL code
+    # Compile the CL code - or fetch it from the program cache
     compile_options = set_compile_options(info, kernel_fn, downup_sign=1)
 #     vprint(verbose,'Compile options:\n', compile_options)
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        program = cl.Program(context, kernel_source).build(options=compile_options)
+    program = build_program(context, device, kernel_source, compile_options,
+                            cache_size=info.cl_program_cache_size,
+                            cache_dir=info.cl_program_cache_dir, verbose=verbose)
     report_build_log(program, device, verbose)
     # Set the GPU kernel
-    kernel = getattr(program, kernel_fn)
-    # Designate buffered arrays
-    kernel.set_args(*list(buffer_dict.values()))
-    kernel.set_scalar_arg_dtypes( [None]*len(buffer_dict) )
+    kernel = cl.Kernel(program, kernel_fn)
+    # Designate buffered arrays, then the seed point count as a scalar arg,
+    #   then the grid geometry
+    grid_buffer = prepare_grid_params_buffer(context, info)
+    kernel.set_scalar_arg_dtypes( [None]*len(buffer_dict)+[np.uint32,None] )
+    kernel.set_args(*list(buffer_dict.values()), info.n_seed_points, grid_buffer)
     
     # Do the GPU compute
     vprint(verbose,
@@ -554,7 +1027,13 @@ def gpu_compute(cl_state, info, array_dict, verbose):
     queue.finish()   
     
     # Fetch the data back from the GPU and finish
+    #   - only the changed rows of pooled grids are copied back
     for array_info in array_dict.items():
         if 'W' in array_info[1]['rwf']:
-            cl.enqueue_copy(queue, array_info[1]['array'], buffer_dict[array_info[0]])
+            if buffer_pool is not None and array_info[0] in buffer_pool.entries:
+                buffer_pool.fetch(array_info[0])
+            else:
+                cl.enqueue_copy(queue, array_info[1]['array'], 
+                                buffer_dict[array_info[0]])
+                profiling.record_transfer('d2h', array_info[1]['array'].nbytes)
             queue.finish()   
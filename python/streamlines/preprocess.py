@@ -13,7 +13,6 @@ These include:
 Requires Python packages/modules:
   - :ref:`numba <numba:install_frontpage>` (:ref:`search <numba:search>`)
   - :mod:`numpy` (linalg.eigvals)
-  - :mod:`scipy.ndimage`
   - :mod:`dateutil.tz`
   
   
@@ -26,15 +25,16 @@ Imports :class:`.Core` class.
 """
 
 from numba.decorators import njit
+from numba import prange
 import numpy as np
 from numpy.linalg import eigvals
-from scipy.ndimage.filters import generic_filter
 from os import environ
 environ['PYTHONUNBUFFERED']='True'
 environ['NUMBA_WARNINGS']='1'
 environ['NUMBA_DEBUG_ARRAY_OPT_STATS']='1'
 
 from streamlines.core import Core
+from streamlines.useful import encode_uv_field
 
 pdebug= print
 
@@ -44,7 +44,8 @@ __all__ = ['Preprocess',
            'normalize_velocity_field', 'unnormalize_velocity_field',
            'compute_gradient_velocity_field', 'get_flow_vector',
            'check_has_loop', 'break_out_of_loop','find_and_fix_loops',
-           'fix_blockages','has_one_diagonal_outflow','upstream_of_diagonal_outflow'
+           'fix_blockages','has_one_diagonal_outflow','upstream_of_diagonal_outflow',
+           'find_blockages_stencil'
            ]
 
 # Not numbarizable
@@ -300,6 +301,66 @@ def break_out_of_loop(pt,
     v_array[x,y] = vec[1]/vec_len
 
 @njit(cache=False)
+def _loop_metrics(x,y,u,v):    
+    """
+    Args:
+        x (int): cell x index (of its SW corner pixel)
+        y (int): cell y index (of its SW corner pixel)
+        u (numpy.ndarray): x components of gradient vector field
+        v (numpy.ndarray): y components of gradient vector field
+    
+    Allocation-free, scalar equivalent of :func:`check_has_loop`.
+
+    Returns:
+        float, numpy.float32, numpy.float32:
+        speed (magnitude of mean vector), divergence and curl of the 
+        cell between pixels x,y and x+1,y+1
+    """
+    u00, v00 = np.float32(u[x,y]),     np.float32(v[x,y])
+    u10, v10 = np.float32(u[x+1,y]),   np.float32(v[x+1,y])
+    u11, v11 = np.float32(u[x+1,y+1]), np.float32(v[x+1,y+1])
+    u01, v01 = np.float32(u[x,y+1]),   np.float32(v[x,y+1])
+    velocity_x = (np.float64(u00)+u10+u11+u01)/4.0
+    velocity_y = (np.float64(v00)+v10+v11+v01)/4.0
+    speed = np.float32(np.sqrt(velocity_x*velocity_x+velocity_y*velocity_y))
+    divergence = (-u00-v00) + (u10-v10) + (u11+v11) + (-u01+v01)
+    curl       = (u00-v00) + (u10+v10) + (-u11+v11) + (-u01-v01)
+    return speed,divergence,curl
+
+@njit(cache=False)
+def _fix_loop_pixel(x,y, u_array,v_array, roi_array, roi_nx,roi_ny):    
+    """
+    Args:
+        x (int): pixel x index
+        y (int): pixel y index
+        u_array (numpy.ndarray): x components of gradient vector field
+        v_array (numpy.ndarray): y components of gradient vector field
+        roi_array (numpy.ndarray): DTM ROI grid
+        roi_nx (int): grid x size
+        roi_ny (int): grid y size
+    
+    Allocation-free equivalent of :func:`break_out_of_loop`: point the
+    gradient vector of a pixel at its lowest neighbor 
+    (first found in W, E, S, N, SW, SE, NW, NE order), 
+    unless the pixel lies on the grid edge.
+    
+    The fix depends only on the DTM, so fixes of distinct pixels do not 
+    interact, and fixes of the same pixel are identical.
+    """
+    if x<1 or x>roi_nx-2 or y<1 or y>roi_ny-2:
+        return
+    h_min = np.finfo(np.float32).max
+    dx_min, dy_min = -1, 0
+    for nn in (1,2,4,8,16,32,64,128):
+        dx,dy = get_flow_vector(nn)
+        if h_min>roi_array[x+dx,y+dy]:
+            h_min = roi_array[x+dx,y+dy]
+            dx_min, dy_min = dx, dy
+    vec_len = np.hypot(dx_min,dy_min)
+    u_array[x,y] = dx_min/vec_len
+    v_array[x,y] = dy_min/vec_len
+
+@njit(cache=False, parallel=True)
 def find_and_fix_loops(roi_array,
                        u_array, v_array,
                        x_roi_n_pixel_centers,
@@ -308,45 +369,91 @@ def find_and_fix_loops(roi_array,
                        vecsum_threshold,
                        divergence_threshold,
                        curl_threshold,
-                       verbose):    
+                       verbose,
+                       chunk_width=32):    
     """
-    TBD
-    
     Args:
-        TBD (TBD): 
-    
-    TBD
+        roi_array (numpy.ndarray): DTM ROI grid
+        u_array (numpy.ndarray): x components of gradient vector field 
+                                 (modified in place)
+        v_array (numpy.ndarray): y components of gradient vector field 
+                                 (modified in place)
+        x_roi_n_pixel_centers (numpy.ndarray): x pixel centers (unused)
+        y_roi_n_pixel_centers (numpy.ndarray): y pixel centers (unused)
+        roi_nx (int): grid x size
+        roi_ny (int): grid y size
+        vecsum_threshold (float): cell is a loop if its mean vector magnitude 
+                                  is less than this...
+        divergence_threshold (float): ...and its divergence is at most this...
+        curl_threshold (float): ...and its absolute curl is at least this
+        verbose (bool): print progress
+        chunk_width (int): number of grid columns processed per parallel task
+    
+    Find all 2x2-pixel cells of the gradient vector field that form loops 
+    (sinks or vortices), and fix them by pointing the vectors of the four 
+    pixels around each one downhill to their lowest neighbor.
+    
+    Loop detection is done in parallel over chunks of columns, with speed, 
+    divergence and curl computed inline with scalar math. Each chunk first 
+    counts its loop cells; the counts are then prefix-summed so that each chunk 
+    can fill its own compact slice of the exactly sized list of loop pixels.
+    All loops are found before any is fixed, as before.
+    Fixes are then applied in parallel, chunk by chunk: each chunk's fixes 
+    touch only its columns and the first column of the next chunk, so even- 
+    and odd-numbered chunks are fixed in turn to keep them from overlapping.
 
     Returns:
-        TBD: 
-        TBD
+        numpy.ndarray, int:
+        x,y indexes of the pixels around each loop cell (four per cell, 
+        so possibly repeated), and their number
     """
     if verbose:
         print('Finding and fixing loops...')
-        
-    n_loops = np.uint32(0);
-    # HACK: this malloc needs to be reined in and controlled more precisely
-    where_looped_array = np.zeros((roi_nx*roi_ny,2),dtype=np.uint32)
-    for xi,x in enumerate(x_roi_n_pixel_centers):
-        for yi,y in enumerate(y_roi_n_pixel_centers):
-            vecsum,divergence,curl = check_has_loop(xi,yi,u_array,v_array)
-            if (vecsum<vecsum_threshold 
-                    and divergence<=divergence_threshold 
-                        and np.abs(curl)>=curl_threshold):
-                where_looped_array[n_loops+0] = [xi,yi]
-                where_looped_array[n_loops+1] = [xi+1,yi]
-                where_looped_array[n_loops+2] = [xi,yi+1]
-                where_looped_array[n_loops+3] = [xi+1,yi+1]
-                n_loops += 4
-    for idx in range(n_loops):
-        break_out_of_loop(where_looped_array[idx],
-                          u_array,v_array,
-                          roi_array,
-                          roi_nx, roi_ny
-                          )
+    # Cells lie between pixel columns x,x+1 and rows y,y+1
+    n_cells_x, n_cells_y = roi_nx-1, roi_ny-1
+    n_chunks = max(0,(n_cells_x+chunk_width-1)//chunk_width)
+    # Count the loop cells in each chunk
+    n_chunk_loops_array = np.zeros(n_chunks+1, dtype=np.int64)
+    for chunk in prange(n_chunks):
+        n = 0
+        for x in range(chunk*chunk_width, min((chunk+1)*chunk_width,n_cells_x)):
+            for y in range(n_cells_y):
+                vecsum,divergence,curl = _loop_metrics(x,y,u_array,v_array)
+                if (vecsum<vecsum_threshold 
+                        and divergence<=divergence_threshold 
+                            and np.abs(curl)>=curl_threshold):
+                    n += 1
+        n_chunk_loops_array[chunk+1] = n
+    n_chunk_loops_array = np.cumsum(n_chunk_loops_array)
+    n_loops = 4*n_chunk_loops_array[n_chunks]
+    # Fill each chunk's slice of the list of loop pixels
+    where_looped_array = np.empty((n_loops,2), dtype=np.uint32)
+    for chunk in prange(n_chunks):
+        idx = 4*n_chunk_loops_array[chunk]
+        if idx==4*n_chunk_loops_array[chunk+1]:
+            continue
+        for x in range(chunk*chunk_width, min((chunk+1)*chunk_width,n_cells_x)):
+            for y in range(n_cells_y):
+                vecsum,divergence,curl = _loop_metrics(x,y,u_array,v_array)
+                if (vecsum<vecsum_threshold 
+                        and divergence<=divergence_threshold 
+                            and np.abs(curl)>=curl_threshold):
+                    where_looped_array[idx+0,0], where_looped_array[idx+0,1] = x,  y
+                    where_looped_array[idx+1,0], where_looped_array[idx+1,1] = x+1,y
+                    where_looped_array[idx+2,0], where_looped_array[idx+2,1] = x,  y+1
+                    where_looped_array[idx+3,0], where_looped_array[idx+3,1] = x+1,y+1
+                    idx += 4
+    # Fix the loops: even chunks first, then odd chunks
+    for parity in range(2):
+        for half_chunk in prange((n_chunks+1-parity)//2):
+            chunk = 2*half_chunk+parity
+            for idx in range(4*n_chunk_loops_array[chunk],
+                             4*n_chunk_loops_array[chunk+1]):
+                _fix_loop_pixel(where_looped_array[idx,0], where_looped_array[idx,1],
+                                u_array,v_array, roi_array, roi_nx,roi_ny)
     if verbose:
         print('...done')
-    return where_looped_array[:n_loops], n_loops
+    return where_looped_array, n_loops
         
 @njit(cache=False)
 def fix_blockages(where_blockages_array,
@@ -472,6 +579,170 @@ def upstream_of_diagonal_outflow(pixel_neighborhood):
         nn += 128
     return nn
 
+@njit(cache=False)
+def _blockage_code(roi_array, x, y, nx, ny):
+    """
+    Args:
+        roi_array (numpy.ndarray): DTM ROI grid in slm [x,y] orientation
+        x (int): pixel x index
+        y (int): pixel y index
+        nx (int): grid x size
+        ny (int): grid y size
+    
+    Inline equivalent of :func:`has_one_diagonal_outflow` for pixel x,y,
+    with neighbor indexes clamped to the grid (as for the default
+    'reflect' mode of scipy.ndimage.generic_filter).
+
+    Returns:
+        numpy.uint8: 
+        flags of lower neighbors if all are diagonal, zero otherwise
+    """
+    xm, xp = max(x-1,0), min(x+1,nx-1)
+    ym, yp = max(y-1,0), min(y+1,ny-1)
+    h = roi_array[x,y]
+    nn = 0
+    if roi_array[xm,ym]<h:  # SW
+        nn |= 16
+    if roi_array[x,ym]<h:   # S
+        nn |= 4
+    if roi_array[xp,ym]<h:  # SE
+        nn |= 32
+    if roi_array[xm,y]<h:   # W
+        nn |= 1
+    if roi_array[xp,y]<h:   # E
+        nn |= 2
+    if roi_array[xm,yp]<h:  # NW
+        nn |= 64
+    if roi_array[x,yp]<h:   # N
+        nn |= 8
+    if roi_array[xp,yp]<h:  # NE
+        nn |= 128
+    # Check whether any of the outflows is cardinal
+    if (nn & (1+2+4+8))!=0:
+        return np.uint8(0)
+    return np.uint8(nn)
+
+@njit(cache=False)
+def _blocked_neighbor_code(codes_w, codes, codes_e, y, ny):
+    """
+    Args:
+        codes_w (numpy.ndarray): blockage codes of the column to the west
+        codes (numpy.ndarray): blockage codes of the pixel's column
+        codes_e (numpy.ndarray): blockage codes of the column to the east
+        y (int): pixel y index
+        ny (int): grid y size
+    
+    Inline equivalent of :func:`upstream_of_diagonal_outflow` for pixel y 
+    of a column, with neighbor indexes clamped to the grid.
+
+    Returns:
+        numpy.uint8: 
+        flags of neighbors whose only (diagonal) outflow runs past this pixel
+    """
+    ym, yp = max(y-1,0), min(y+1,ny-1)
+    nn = 0
+    if codes_w[ym]==16:                      # SW => SW
+        nn |= 16
+    if codes[ym]==16 or codes[ym]==32:       # S => SW, SE
+        nn |= 4
+    if codes_e[ym]==32:                      # SE => SE
+        nn |= 32
+    if codes_w[y]==16 or codes_w[y]==64:     # W => SW, NW
+        nn |= 1
+    if codes_e[y]==128 or codes_e[y]==32:    # E => NE, SE
+        nn |= 2
+    if codes_w[yp]==64:                      # NW => NW
+        nn |= 64
+    if codes[yp]==64 or codes[yp]==128:      # N => NW, NE
+        nn |= 8
+    if codes_e[yp]==128:                     # NE => NE
+        nn |= 128
+    return np.uint8(nn)
+
+@njit(cache=False, parallel=True)
+def find_blockages_stencil(roi_array, chunk_width=32):
+    """
+    Args:
+        roi_array (numpy.ndarray): DTM ROI grid in slm [x,y] orientation
+        chunk_width (int): number of grid columns processed per parallel task
+    
+    Compiled, parallel 3x3 stencil engine that maps blockages 
+    (pixels whose only outflows are diagonal, flagged as in 
+    :func:`has_one_diagonal_outflow`) and their blocked neighbors 
+    (flagged as in :func:`upstream_of_diagonal_outflow`)
+    in one fused pass over the grid in its native orientation.
+    
+    The grid is split into chunks of columns, each swept by one thread.
+    Blockage codes are computed a column ahead into a 3-column ring buffer, 
+    from which the blocked-neighbor codes of the column behind are computed 
+    straight away; only the two edge columns of each chunk are computed twice.
+    Nonzero codes are counted per column as they are found, 
+    so that their x,y indexes can then be written straight into 
+    exactly sized lists (in the same order as :func:`numpy.where`).
+
+    Returns:
+        numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray:
+        uint8 grids of blockage codes and blocked-neighbor codes,
+        and uint32 x,y index lists of the nonzero elements of each
+    """
+    nx, ny = roi_array.shape
+    blockages_array = np.zeros((nx,ny), dtype=np.uint8)
+    blocked_neighbors_array = np.zeros((nx,ny), dtype=np.uint8)
+    n_blockages_array = np.zeros(nx+1, dtype=np.int64)
+    n_blocked_neighbors_array = np.zeros(nx+1, dtype=np.int64)
+    n_chunks = (nx+chunk_width-1)//chunk_width
+    for chunk in prange(n_chunks):
+        x0 = chunk*chunk_width
+        x1 = min(x0+chunk_width,nx)
+        ring_array = np.zeros((3,ny), dtype=np.uint8)
+        for x in range(x0-1,x1+1):
+            # Blockage codes of column x (clamped to the grid) 
+            xc = min(max(x,0),nx-1)
+            codes = ring_array[(x-x0+1)%3]
+            n = 0
+            for y in range(ny):
+                codes[y] = _blockage_code(roi_array, xc,y, nx,ny)
+                if x>=x0 and x<x1 and codes[y]!=0:
+                    blockages_array[x,y] = codes[y]
+                    n += 1
+            if x>=x0 and x<x1:
+                n_blockages_array[x+1] = n
+            # Blocked-neighbor codes of column x-1, now that its neighbors are known
+            xb = x-1
+            if xb>=x0 and xb<x1:
+                codes_w = ring_array[(xb-x0)%3]
+                codes_b = ring_array[(xb-x0+1)%3]
+                n = 0
+                for y in range(ny):
+                    nn = _blocked_neighbor_code(codes_w, codes_b, codes, y, ny)
+                    if nn!=0:
+                        blocked_neighbors_array[xb,y] = nn
+                        n += 1
+                n_blocked_neighbors_array[xb+1] = n
+    # Offsets of each column's entries in the index lists
+    n_blockages_array = np.cumsum(n_blockages_array)
+    n_blocked_neighbors_array = np.cumsum(n_blocked_neighbors_array)
+    where_blockages_array \
+        = np.empty((n_blockages_array[nx],2), dtype=np.uint32)
+    where_blocked_neighbors_array \
+        = np.empty((n_blocked_neighbors_array[nx],2), dtype=np.uint32)
+    for x in prange(nx):
+        idx = n_blockages_array[x]
+        jdx = n_blocked_neighbors_array[x]
+        if idx==n_blockages_array[x+1] and jdx==n_blocked_neighbors_array[x+1]:
+            continue
+        for y in range(ny):
+            if blockages_array[x,y]!=0:
+                where_blockages_array[idx,0] = x
+                where_blockages_array[idx,1] = y
+                idx += 1
+            if blocked_neighbors_array[x,y]!=0:
+                where_blocked_neighbors_array[jdx,0] = x
+                where_blocked_neighbors_array[jdx,1] = y
+                jdx += 1
+    return (blockages_array, blocked_neighbors_array, 
+            where_blockages_array, where_blocked_neighbors_array)
+
 class Preprocess(Core):
     """
     Class providing set of methods to prepare raw DTM data for streamline tracing.
@@ -526,6 +797,7 @@ class Preprocess(Core):
             self.raw_gradient_vector_field()
         # POSSIBLE BUG - may want to leave flat pixels (zero u & v) unmasked
         self.mask_nan_uv()
+        self.encode_uv()
         self.print('**Preprocess end**\n')  
   
     def conditioned_gradient_vector_field(self):
@@ -562,7 +834,7 @@ class Preprocess(Core):
             
         self.roi_gradx_array, self.roi_grady_array \
             = compute_topo_gradient_field(self.geodata.roi_array.astype(np.float32),
-                                          self.geodata.pixel_size)
+                                          self.geodata.roi_pixel_size)
         u_array, v_array, raw_speed_array \
             = compute_gradient_velocity_field(self.roi_gradx_array, self.roi_grady_array)
         
@@ -578,10 +850,10 @@ class Preprocess(Core):
                                    self.curl_threshold,
                                    self.state.verbose)
         if do_fixes:
-            fix_blockages(self.where_blockages_array.astype(np.uint32),
-                          self.blockages_array.astype(np.uint8),
-                          self.where_blocked_neighbors_array.astype(np.uint32),
-                          self.blocked_neighbors_array.astype(np.uint8),
+            fix_blockages(self.where_blockages_array,
+                          self.blockages_array,
+                          self.where_blocked_neighbors_array,
+                          self.blocked_neighbors_array,
                           u_array, v_array,
                           self.state.verbose)
          
@@ -620,6 +892,28 @@ class Preprocess(Core):
         self.uv_array[uv_mask_array] = [0.0,0.0]
         self.print('done')
         
+    def encode_uv(self):
+        """
+        Encode the uv vector field compactly, as set by ``uv_encoding``, for the
+        tracing and mapping kernels (see :func:`.useful.encode_uv_field`).
+        The float32 uv_array is kept for plotting etc.
+        
+        Attributes:
+            uv_code_array (numpy.ndarray): encoded uv field, or uv_array itself
+                                           if uv_encoding is 'float32'
+
+        Raises:
+            ValueError if angle encoding is chosen for a non-unit vector field.
+        """
+        if self.uv_encoding=='angle' and self.state.do_condition \
+                and not self.do_normalize_speed:
+            raise ValueError('uv encoding "angle" requires do_normalize_speed')
+        self.uv_code_array = encode_uv_field(self.uv_array, self.uv_encoding)
+        if self.uv_encoding!='float32':
+            self.print('Encoded uv field as "{0}": {1} => {2} bytes'
+                       .format(self.uv_encoding, self.uv_array.nbytes,
+                               self.uv_code_array.nbytes))
+        
     def raw_gradient_vector_field(self):
         """
         TBD
@@ -658,32 +952,13 @@ class Preprocess(Core):
             TBD
         """
         self.print('Finding blockages...', end='')
-        # Create a blank array - will flag where blockages lie
-        self.blockages_array = np.zeros_like(self.geodata.roi_array.T, dtype=np.uint8)
-        self.blocked_neighbors_array = np.zeros_like(self.geodata.roi_array.T,
-                                                     dtype=np.uint8)
-        # Use a fast filter technique to process whole DTM to find blockages
-        #   i.e., to find all pixels whose diagonal neighbor is the only outflow pixel
-        generic_filter(self.geodata.roi_array.T, 
-                        has_one_diagonal_outflow, 
-                        output=self.blockages_array,
-                        size=3)
-        generic_filter(self.blockages_array, 
-                        upstream_of_diagonal_outflow, 
-                        output=self.blocked_neighbors_array,
-                        size=3)
-        self.blockages_array = self.blockages_array.T
-        self.blocked_neighbors_array = self.blocked_neighbors_array.T
-        # Having mapped the blockages as a 'directions' array,
-        #   generate a simple vector of their x,y locations
-        self.where_blockages_array = np.where(self.blockages_array)
-        self.where_blockages_array \
-            = np.stack((self.where_blockages_array[0],
-                        self.where_blockages_array[1])).T
-        self.where_blocked_neighbors_array = np.where(self.blocked_neighbors_array)
-        self.where_blocked_neighbors_array \
-            = np.stack((self.where_blocked_neighbors_array[0],
-                        self.where_blocked_neighbors_array[1])).T
+        # Process whole DTM in one compiled stencil pass to find blockages,
+        #   i.e., all pixels whose diagonal neighbor is the only outflow pixel,
+        #   and their blocked neighbors - as 'directions' arrays and 
+        #   as simple vectors of their x,y locations
+        (self.blockages_array, self.blocked_neighbors_array, 
+         self.where_blockages_array, self.where_blocked_neighbors_array) \
+            = find_blockages_stencil(self.geodata.roi_array)
         self.print('found {}'.format(self.where_blockages_array.shape[0]), end='')
         if self.state.noisy:
             if self.where_blockages_array.shape[1]!=0:
@@ -0,0 +1,389 @@
+"""
+---------------------------------------------------------------------
+
+Module providing a structured profiler for the ``slm`` workflow.
+
+While a :class:`Profiler` is recording, the following are logged as timed events:
+  - each workflow stage (geodata, preprocess, trace, mapping, etc), along with
+    its peak and final resident set size (RSS) and the bytes it transferred
+    between host and GPU/OpenCL device
+  - each OpenCL program build, and each kernel execution, by kernel name
+  - each coarse subsegment mapped in :meth:`.Mapping.pass2`
+
+Events are recorded via the module-level functions :func:`span`,
+:func:`record_span` and :func:`record_transfer`, which do nothing if no profiler
+is recording, so that they can be left in place in the :mod:`.pocl`,
+:mod:`.mapping`, etc, code. They are thread-safe.
+
+The record is written, alongside the analysis results, either as a JSON summary
+or as a `Chrome trace`_ (viewable in ``chrome://tracing`` or Perfetto).
+
+---------------------------------------------------------------------
+
+Requires Python packages/modules:
+  -  :mod:`json`
+  -  :mod:`resource`
+  -  :mod:`threading`
+
+Imports :class:`.Core` class.
+
+---------------------------------------------------------------------
+
+.. _Chrome trace: https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+
+"""
+
+from contextlib import contextmanager
+from json import dump
+import threading
+import time
+import resource
+import os
+os.environ['PYTHONUNBUFFERED']='True'
+
+from streamlines.core import Core
+
+__all__ = ['Profiler', 'span', 'record_span', 'record_transfer',
+           'kernel_name_from_options']
+
+pdebug = print
+
+# Profiler currently recording, if any
+_active_profiler = None
+
+class Profiler(Core):
+    """
+    Class providing methods to record stage, kernel and subsegment timings,
+    memory use and host-device transfer volumes during an slm workflow run,
+    and to write them to file.
+
+    """
+    def __init__(self,state,imported_parameters,geodata):
+        """
+        Args:
+            state (obj):
+            imported_parameters (dict):
+            geodata (obj):
+
+        Initialize a Profiler class instance.
+
+        Attributes:
+            self.geodata (obj):
+            self.events (list): timed event dicts
+            self.h2d_bytes (int): total bytes transferred host-to-device
+            self.d2h_bytes (int): total bytes transferred device-to-host
+            self.output_file (str): name of profile file written by :meth:`write`
+        """
+        super(Profiler,self).__init__(state,imported_parameters)
+        self.geodata = geodata
+        self.lock = threading.Lock()
+        self.output_file = None
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the record.
+        """
+        self.events    = []
+        self.h2d_bytes = 0
+        self.d2h_bytes = 0
+        self.thread_ids = {}
+        self.t0 = time.perf_counter()
+        self.start_time = time.time()
+
+    def start(self):
+        """
+        Clear the record and make this profiler the one recording.
+        """
+        global _active_profiler
+        self.reset()
+        _active_profiler = self
+
+    def stop(self):
+        """
+        Stop recording (the record is kept).
+        """
+        global _active_profiler
+        if _active_profiler is self:
+            _active_profiler = None
+
+    def is_recording(self):
+        """
+        Returns:
+            bool:
+            True if this profiler is recording
+        """
+        return _active_profiler is self
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Args:
+            name (str): name of workflow stage, e.g., 'trace'
+
+        Context manager timing a workflow stage and recording its memory use
+        and host-device transfers. Does nothing if the profiler is not recording.
+        """
+        if not self.is_recording():
+            yield
+            return
+        _reset_peak_rss()
+        h2d_bytes, d2h_bytes = self.h2d_bytes, self.d2h_bytes
+        t_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter()-t_start
+            self.add_event('stage', name, t_start, duration,
+                           {'peak_rss'  : _peak_rss(),
+                            'rss'       : _current_rss(),
+                            'h2d_bytes' : self.h2d_bytes-h2d_bytes,
+                            'd2h_bytes' : self.d2h_bytes-d2h_bytes})
+            self.print('Profile: {0} took {1:.3f}s'.format(name,duration))
+
+    def add_event(self, category, name, t_start, duration, args=None):
+        """
+        Args:
+            category (str): 'stage', 'build', 'kernel', 'pass2', etc
+            name (str): event name, e.g., kernel name
+            t_start (float): :func:`time.perf_counter` time at event start
+            duration (float): event duration in seconds
+            args (dict): further event data
+
+        Record a timed event.
+        """
+        thread_ident = threading.get_ident()
+        with self.lock:
+            thread_id = self.thread_ids.setdefault(thread_ident, len(self.thread_ids))
+            self.events += [{'category' : category,
+                             'name'     : name,
+                             'start'    : t_start-self.t0,
+                             'duration' : duration,
+                             'thread'   : thread_id,
+                             'args'     : args or {}}]
+
+    def add_transfer(self, direction, n_bytes):
+        """
+        Args:
+            direction (str): 'h2d' or 'd2h'
+            n_bytes (int): bytes transferred
+
+        Record a host-to-device or device-to-host transfer.
+        """
+        with self.lock:
+            if direction=='h2d':
+                self.h2d_bytes += int(n_bytes)
+            else:
+                self.d2h_bytes += int(n_bytes)
+
+    def summarize(self):
+        """
+        Summarize the record: stage timings etc, per-kernel build and execution
+        times, and pass#2 per-subsegment timings.
+
+        Returns:
+            dict:
+            profile summary
+        """
+        with self.lock:
+            events = list(self.events)
+        kernels = {}
+        for event in events:
+            if event['category'] not in ('build','kernel'):
+                continue
+            kernel = kernels.setdefault(event['name'], {'n_builds'     : 0,
+                                                        'build_time'   : 0.0,
+                                                        'n_cache_hits' : 0,
+                                                        'n_launches'   : 0,
+                                                        'exec_time'    : 0.0})
+            if event['category']=='build':
+                if event['args'].get('is_cached',False):
+                    kernel['n_cache_hits'] += 1
+                else:
+                    kernel['n_builds']   += 1
+                    kernel['build_time'] += event['duration']
+            else:
+                kernel['n_launches'] += 1
+                kernel['exec_time']  += event['args'].get('device_time',
+                                                          event['duration'])
+        return {'parameters_file' : self.state.parameters_file,
+                'start_time'  : time.strftime('%Y-%m-%dT%H:%M:%S',
+                                              time.localtime(self.start_time)),
+                'wall_time'   : time.perf_counter()-self.t0,
+                'peak_rss'    : _max_rss(),
+                'h2d_bytes'   : self.h2d_bytes,
+                'd2h_bytes'   : self.d2h_bytes,
+                'stages'      : [dict(name=event['name'], start=event['start'],
+                                      wall_time=event['duration'], **event['args'])
+                                 for event in events if event['category']=='stage'],
+                'kernels'     : kernels,
+                'subsegments' : [dict(start=event['start'],
+                                      wall_time=event['duration'],
+                                      thread=event['thread'], **event['args'])
+                                 for event in events if event['category']=='pass2']}
+
+    def chrome_trace(self):
+        """
+        Convert the record into Chrome trace "complete" events, one track per thread.
+
+        Returns:
+            dict:
+            Chrome trace
+        """
+        with self.lock:
+            events = list(self.events)
+        pid = os.getpid()
+        trace_events = [{'name' : event['name'],
+                         'cat'  : event['category'],
+                         'ph'   : 'X',
+                         'ts'   : event['start']*1e6,
+                         'dur'  : event['duration']*1e6,
+                         'pid'  : pid,
+                         'tid'  : event['thread'],
+                         'args' : event['args']} for event in events]
+        trace_events += [{'name' : 'thread_name', 'ph' : 'M', 'pid' : pid,
+                          'tid'  : thread_id,
+                          'args' : {'name' : 'main' if thread_id==0
+                                             else 'worker {}'.format(thread_id)}}
+                          for thread_id in self.thread_ids.values()]
+        return {'traceEvents' : trace_events, 'displayTimeUnit' : 'ms',
+                'otherData'   : {'h2d_bytes' : self.h2d_bytes,
+                                 'd2h_bytes' : self.d2h_bytes,
+                                 'peak_rss'  : _max_rss()}}
+
+    def write(self, file_stem=None):
+        """
+        Args:
+            file_stem (str): path and stem of profile file; defaults to that
+                             of the analysis results file
+
+        Write the record to a JSON file, either as a summary or as a Chrome trace
+        (according to ``profile_format``), alongside the analysis results.
+        """
+        if file_stem is None:
+            file_stem = os.path.realpath(os.path.join(*self.geodata.export_analyses_path,
+                                                      self.state.parameters_file))
+        if self.profile_format=='chrome':
+            record, suffix = self.chrome_trace(), '_trace'
+        elif self.profile_format=='json':
+            record, suffix = self.summarize(), ''
+        else:
+            raise ValueError('Unknown profile format "{}"'.format(self.profile_format))
+        file_name = file_stem.replace('.json','')+self.profile_suffix+suffix+'.json'
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        self.print('Writing profile to "{}"'.format(file_name))
+        with open(file_name,'w') as json_file:
+            dump(record, json_file, indent=4)
+        self.output_file = file_name
+
+@contextmanager
+def span(category, name, **kwargs):
+    """
+    Args:
+        category (str): 'build', 'kernel', 'pass2', etc
+        name (str): event name, e.g., kernel name
+        **kwargs (dict): further event data
+
+    Context manager timing an event if a profiler is recording.
+    Yields the event data dict, to which results may be added.
+    """
+    profiler = _active_profiler
+    if profiler is None:
+        yield kwargs
+        return
+    t_start = time.perf_counter()
+    try:
+        yield kwargs
+    finally:
+        profiler.add_event(category, name, t_start, time.perf_counter()-t_start,
+                           kwargs)
+
+def record_span(category, name, t_start, duration, **kwargs):
+    """
+    Args:
+        category (str): 'build', 'kernel', 'pass2', etc
+        name (str): event name, e.g., kernel name
+        t_start (float): :func:`time.perf_counter` time at event start
+        duration (float): event duration in seconds
+        **kwargs (dict): further event data
+
+    Record an already timed event if a profiler is recording.
+    """
+    profiler = _active_profiler
+    if profiler is not None:
+        profiler.add_event(category, name, t_start, duration, kwargs)
+
+def record_transfer(direction, n_bytes):
+    """
+    Args:
+        direction (str): 'h2d' or 'd2h'
+        n_bytes (int): bytes transferred
+
+    Record a host-to-device or device-to-host transfer if a profiler is recording.
+    """
+    profiler = _active_profiler
+    if profiler is not None:
+        profiler.add_transfer(direction, n_bytes)
+
+def kernel_name_from_options(compile_options):
+    """
+    Args:
+        compile_options (list): '-D' compiler macros as generated by
+                                :func:`.pocl.set_compile_options`
+
+    Infer the name of the kernel a program is built for from its
+    '-D KERNEL_...' compile option.
+
+    Returns:
+        str:
+        kernel name (lower case), or 'unknown'
+    """
+    for option in compile_options:
+        if option.startswith('KERNEL_'):
+            return option[len('KERNEL_'):].lower()
+    return 'unknown'
+
+def _read_proc_status(field):
+    """
+    Read a memory size (in bytes) from /proc/self/status (Linux only).
+    """
+    try:
+        with open('/proc/self/status','r') as fp:
+            for line in fp:
+                if line.startswith(field+':'):
+                    return int(line.split()[1])*1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def _reset_peak_rss():
+    """
+    Reset the peak RSS of the process, if possible (Linux only),
+    so that it can be measured per stage.
+    """
+    try:
+        with open('/proc/self/clear_refs','w') as fp:
+            fp.write('5')
+    except OSError:
+        pass
+
+def _max_rss():
+    """
+    Peak RSS of the process over its lifetime, in bytes.
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kB on Linux, bytes on macOS
+    return max_rss if os.uname().sysname=='Darwin' else max_rss*1024
+
+def _peak_rss():
+    """
+    Peak RSS of the process since the last reset, in bytes.
+    """
+    peak_rss = _read_proc_status('VmHWM')
+    return peak_rss if peak_rss is not None else _max_rss()
+
+def _current_rss():
+    """
+    Current RSS of the process, in bytes.
+    """
+    return _read_proc_status('VmRSS')
@@ -6,6 +6,7 @@ Module providing tools to write results, grids, data to output files.
 Requires Python packages/modules:
   -  :mod:`matplotlib.pyplot`
   -  :mod:`json`
+  -  :mod:`concurrent.futures`
 
 
 Imports :class:`.Core` class and functions from the :mod:`.useful` module.
@@ -21,6 +22,7 @@ import numpy  as np
 from matplotlib.pyplot import savefig, figure
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 from streamlines.core   import Core
 from streamlines.useful import write_geotiff
@@ -191,13 +193,14 @@ class Save(Core):
     def save_maps(self, fig_name=None, file_stem=None):  
         """
         Args:
-            TBD (TBD): 
+            fig_name (str): not used
+            file_stem (str): path and stem of GeoTIFF files
         
-        TBD
-    
-        Returns:
-            TBD: 
-            TBD
+        Write each ROI-sized grid to a tiled, compressed GeoTIFF file 
+        (with internal overviews if requested), and optionally bundle a list of 
+        grids as the bands of a single GeoTIFF file.
+        Files are written concurrently by a pool of n_save_threads threads,
+        while GDAL compresses each with maps_n_threads threads.
         """  
         self.print('Saving maps...') 
         if file_stem is None:
@@ -210,25 +213,67 @@ class Save(Core):
         nxp = nx+pad*2
         nyp = ny+pad*2
         pslice = np.index_exp[pad:-pad,pad:-pad]
-        pdebug(type(pslice))
         format = 'tif'
+        # Find the (padded) ROI-sized grids
+        grids_dict = {}
         for obj in obj_list:
             for item in obj.__dict__:
                 ref = getattr(obj,item)
                 if type(ref) is np.ndarray: # or type(ref) is np.ma.core.MaskedArray:
                     array_shape = ref.shape
-                    if array_shape[0]==nxp and array_shape[1]==nyp:
-                        file_name = file_stem+'_'+item.replace('_array','')+'.'+format
-                        print(file_name, array_shape)
-                        if len(array_shape)==3:
-                            npd = array_shape[2]
-                        else:
-                            npd = 1
-                        if npd==1:
-                            write_geotiff(file_stem, file_name, ref, nx,ny,npd, pslice,
-                                          self.geodata)
+                    if len(array_shape)>=2 \
+                            and array_shape[0]==nxp and array_shape[1]==nyp:
+                        grids_dict[item.replace('_array','')] = ref
+        # One file per grid, plus one bundling several grids if required
+        write_list = []
+        for name, ref in grids_dict.items():
+            npd = ref.shape[2] if ref.ndim==3 else 1
+            write_list += [(file_stem+'_'+name+'.'+format, ref, npd, None)]
+        if self.do_save_maps_bundle:
+            bundle_list = [name for name in self.maps_bundle if name in grids_dict]
+            band_names = [name if grids_dict[name].ndim==2 
+                          else '{0}_{1}'.format(name,idx)
+                          for name in bundle_list 
+                          for idx in range(grids_dict[name].shape[-1]
+                                           if grids_dict[name].ndim==3 else 1)]
+            write_list += [(file_stem+'_bundle.'+format,
+                            [grids_dict[name] for name in bundle_list],
+                            len(band_names), band_names)]
+        n_threads = int(self.n_save_threads) if self.n_save_threads>0 \
+                    else os.cpu_count()
+        with ThreadPoolExecutor(max_workers=max(1,min(n_threads,len(write_list)))) \
+                as executor:
+            futures = [executor.submit(self.save_map, file_name, ref, nx,ny,npd,
+                                       pslice, band_names)
+                       for file_name, ref, npd, band_names in write_list]
+            for future in futures:
+                future.result()
         self.print('...done') 
         
+    def save_map(self, file_name, array, nx,ny,npd, pslice, band_names=None):
+        """
+        Args:
+            file_name (str): GeoTIFF file name (full path)
+            array (numpy.ndarray or list): padded grid, or list of grids to bundle
+            nx (int): x dimension of ROI
+            ny (int): y dimension of ROI
+            npd (int): number of bands
+            pslice (tuple): of form np.index_exp[xmin:xmax,ymin:ymax]
+            band_names (list): band descriptions
+        
+        Write one grid (or bundle of grids) to a GeoTIFF file using 
+        the maps export options.
+        """  
+        self.print('Writing "{}"'.format(file_name))
+        write_geotiff(None, file_name, array, nx,ny,npd, pslice, self.geodata,
+                      compress=self.maps_compress,
+                      predictor=self.maps_predictor,
+                      block_size=self.maps_block_size,
+                      n_threads=self.maps_n_threads,
+                      overview_levels=self.maps_overview_levels,
+                      overview_resampling=self.maps_overview_resampling,
+                      band_names=band_names)
+
     def save_figs(self, fig_name=None, file_stem=None, file_format_list=None):
         """
         Args:
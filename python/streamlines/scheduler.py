@@ -0,0 +1,298 @@
+"""
+---------------------------------------------------------------------
+
+Module to schedule batches of ``slm`` workflow jobs across CPU cores.
+
+A batch consists of the job's own JSON parameters file plus, optionally, a list
+of further JSON parameters files (e.g., one per DTM). Each is run as a single job,
+or, if tiling is switched on in its parameters, is partitioned into one job per
+tile (see :mod:`.tiling`), or, if per-basin mapping is switched on, into one job
+per drainage basin (see :mod:`.basins`). Jobs are dispatched to a pool of worker processes,
+each of which creates and keeps its own OpenCL context. Failed jobs are retried,
+including those lost to a crashed worker, and tile or basin results are merged
+into tiled GeoTIFF outputs by the parent process as they arrive.
+
+---------------------------------------------------------------------
+
+Requires Python packages/modules:
+  -  :mod:`multiprocessing`
+  -  :mod:`concurrent.futures`
+
+Imports :class:`.Core` class.
+
+---------------------------------------------------------------------
+
+"""
+
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import traceback
+import os
+os.environ['PYTHONUNBUFFERED']='True'
+
+from streamlines.core import Core
+
+__all__ = ['Scheduler']
+
+pdebug = print
+
+# Per-worker-process keyword arguments added to each job, e.g., its OpenCL device
+_worker_kwargs = {}
+
+class Scheduler(Core):
+    """
+    Class providing methods to partition a batch of DTMs into jobs (per DTM, 
+    per tile or per basin), to run them on a pool of worker processes, 
+    and to merge their results.
+
+    """
+    def __init__(self,state,imported_parameters,tiling,basins):
+        """
+        Args:
+            state (obj):
+            imported_parameters (dict):
+            tiling (obj):
+            basins (obj):
+
+        Initialize a Scheduler class instance.
+
+        Attributes:
+            self.tiling (obj):
+            self.basins (obj):
+            self.jobs (list): job dicts as generated by :meth:`make_jobs`
+            self.partitions (list): :class:`.Tiling` or :class:`.Basins` instance 
+                                    of each job group
+        """
+        super(Scheduler,self).__init__(state,imported_parameters)
+        self.tiling  = tiling
+        self.basins  = basins
+        self.jobs    = []
+        self.partitions = []
+
+    def do(self, **kwargs):
+        """
+        Args:
+            **kwargs (list): keyword arguments of the parent run
+
+        Partition the batch into jobs, run them, and merge their results.
+        """
+        self.print('\n**Scheduler begin**')
+        self.make_jobs(**kwargs)
+        self.run_jobs()
+        for partition in self.partitions:
+            if partition is not None:
+                partition.close()
+        n_failed = len([job for job in self.jobs if job['status']=='failed'])
+        self.print('Completed {0} of {1} jobs'.format(len(self.jobs)-n_failed,
+                                                      len(self.jobs)))
+        if n_failed>0:
+            self.print('Failed jobs:',
+                       [(job['parameters_file'],job['tile'] is not None
+                         and job['tile']['index'])
+                        for job in self.jobs if job['status']=='failed'])
+        self.print('**Scheduler end**\n')
+
+    def make_jobs(self, **kwargs):
+        """
+        Args:
+            **kwargs (list): keyword arguments of the parent run
+
+        Generate one job per JSON parameters file in the batch, or one job per 
+        basin of its DTM if per-basin mapping is switched on for it, 
+        or one job per tile if tiling is.
+        Each job group (parameters file) keeps a :class:`.Basins` or 
+        :class:`.Tiling` instance to merge its basins or tiles.
+
+        Attributes:
+            self.jobs (list): job dicts
+            self.partitions (list): :class:`.Basins` or :class:`.Tiling` instance 
+                                    (or None) per job group
+        """
+        # Deferred to avoid a circular import
+        from streamlines.streamlining import Streamlining
+        parameters_file = kwargs['parameters_file'] \
+                          if 'parameters_file' in kwargs.keys() else None
+        self.jobs    = []
+        self.partitions = []
+        for group, batch_file in enumerate([parameters_file]+self.parameters_files):
+            file_kwargs = dict(kwargs)
+            file_kwargs.update({'parameters_file' : batch_file, 'do_batch' : False})
+            if group==0:
+                state, tiling, basins = self.state, self.tiling, self.basins
+            else:
+                # Parameters file-specific workflow object, used to set up 
+                #   basin partitioning or tiling
+                sl = Streamlining(**file_kwargs)
+                state, tiling, basins = sl.state, sl.tiling, sl.basins
+            if state.do_basins:
+                partition = basins
+                basins.plan()
+                job_kwargs_list = [(window, basins.basin_kwargs(window, file_kwargs))
+                                   for window in basins.windows]
+            elif state.do_tiling:
+                partition = tiling
+                tiling.plan()
+                job_kwargs_list = [(tile, tiling.tile_kwargs(tile, file_kwargs))
+                                   for tile in tiling.tiles]
+            else:
+                partition = None
+                job_kwargs_list = [(None, file_kwargs)]
+            self.partitions += [partition]
+            for tile, job_kwargs in job_kwargs_list:
+                job_kwargs['do_batch'] = False
+                self.jobs += [{'index'           : len(self.jobs),
+                               'group'           : group,
+                               'parameters_file' : batch_file,
+                               'tile'            : tile,
+                               'kwargs'          : job_kwargs,
+                               'attempts'        : 0,
+                               'errors'          : [],
+                               'status'          : 'pending'}]
+        self.print('Scheduled {0} jobs from {1} parameters file(s)'
+                   .format(len(self.jobs),len(self.partitions)))
+
+    def run_jobs(self):
+        """
+        Run the jobs on a pool of worker processes, merging results as they arrive
+        and retrying failed jobs up to max_retries times each.
+
+        Worker processes are started afresh ("spawned") rather than forked,
+        so that each one creates its own OpenCL context.
+        If a worker dies, the pool is rebuilt and its unfinished jobs are rerun.
+        """
+        n_workers = int(self.n_workers) if self.n_workers>0 else os.cpu_count()
+        n_workers = max(1,min(n_workers,len(self.jobs)))
+        mp_context = get_context('spawn')
+        queue = list(self.jobs)
+        while len(queue)>0:
+            self.print('Running {0} jobs on {1} worker processes'
+                       .format(len(queue),n_workers))
+            worker_counter = mp_context.Value('i',0)
+            executor = ProcessPoolExecutor(max_workers=n_workers,
+                                           mp_context=mp_context,
+                                           initializer=_init_worker,
+                                           initargs=(worker_counter,
+                                                     list(self.cl_devices),
+                                                     int(self.threads_per_worker)))
+            running = {executor.submit(_run_job, job['kwargs'], job['tile']) : job
+                       for job in queue}
+            queue = []
+            is_broken = False
+            while len(running)>0:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool as error:
+                        is_broken = True
+                        result = {'tile_arrays' : None,
+                                  'error' : 'Worker process died: {}'.format(error)}
+                    if result['error'] is None:
+                        self.merge_job(job, result)
+                    elif self.retry_job(job, result['error']):
+                        try:
+                            if is_broken:
+                                raise BrokenProcessPool
+                            running[executor.submit(_run_job,
+                                                    job['kwargs'],job['tile'])] = job
+                        except BrokenProcessPool:
+                            # Rerun on a rebuilt pool
+                            is_broken = True
+                            queue += [job]
+            executor.shutdown(wait=True)
+
+    def retry_job(self, job, error):
+        """
+        Args:
+            job (dict): failed job
+            error (str): error message/traceback
+
+        Record a job failure and decide whether to retry it.
+
+        Returns:
+            bool:
+            True if the job is to be retried
+        """
+        job['attempts'] += 1
+        job['errors']   += [error]
+        if job['attempts']<=self.max_retries:
+            self.print('Job {0} failed - retrying (attempt {1} of {2})'
+                       .format(job['index'],job['attempts'],self.max_retries))
+            return True
+        job['status'] = 'failed'
+        self.print('Job {0} failed - giving up:\n{1}'.format(job['index'],error))
+        return False
+
+    def merge_job(self, job, result):
+        """
+        Args:
+            job (dict): completed job
+            result (dict): job result returned by its worker
+
+        Merge a completed job's results: tile core (or basin) grids are written 
+        into their windows of the tiled GeoTIFF outputs of the job group.
+        Tile cores do not overlap, and only basin pixels are merged from 
+        basin grids, so the merge does not depend on completion order.
+        """
+        if job['tile'] is None:
+            pass
+        elif 'basin' in job['tile'].keys():
+            self.partitions[job['group']].write_basin_arrays(result['tile_arrays'],
+                                                             job['tile'])
+        else:
+            self.partitions[job['group']].write_tile_arrays(result['tile_arrays'],
+                                                            job['tile'])
+        job['status'] = 'done'
+        self.print('Job {0} done'.format(job['index']))
+
+def _init_worker(worker_counter, cl_devices, threads_per_worker):
+    """
+    Args:
+        worker_counter (multiprocessing.Value): shared count of started workers
+        cl_devices (list): OpenCL devices to assign to workers round-robin
+                           (empty list: use the device set in the parameters file)
+        threads_per_worker (int): cap on CPU threads used by each worker's
+                                  OpenCL runtime (0: no cap)
+
+    Initialize a scheduler worker process.
+    """
+    global _worker_kwargs
+    with worker_counter.get_lock():
+        worker_index = worker_counter.value
+        worker_counter.value += 1
+    if len(cl_devices)>0:
+        _worker_kwargs = {'cl_device' : cl_devices[worker_index%len(cl_devices)]}
+    if threads_per_worker>0:
+        # Stop each worker's CPU OpenCL runtime from claiming every core
+        os.environ['POCL_MAX_PTHREAD_COUNT'] = str(threads_per_worker)
+        os.environ['OMP_NUM_THREADS'] = str(threads_per_worker)
+
+def _run_job(job_kwargs, tile):
+    """
+    Args:
+        job_kwargs (dict): workflow keyword arguments of the job
+        tile (dict): tile or basin window of the job (None if unpartitioned)
+
+    Carry out the workflow of a job in a scheduler worker process.
+
+    Returns:
+        dict:
+        tile core or basin grids (if partitioned) and error traceback 
+        (None if successful)
+    """
+    # Deferred to avoid a circular import
+    from streamlines.streamlining import Streamlining
+    from streamlines.slm import _run_workflow
+    try:
+        sl = _run_workflow(Streamlining(**dict(job_kwargs,**_worker_kwargs)))
+        if tile is None:
+            tile_arrays = None
+        elif 'basin' in tile.keys():
+            tile_arrays = sl.basins.extract_basin(sl, tile)
+        else:
+            tile_arrays = sl.tiling.extract_tile(sl, tile)
+        return {'tile_arrays' : tile_arrays, 'error' : None}
+    except Exception:
+        return {'tile_arrays' : None, 'error' : traceback.format_exc()}
@@ -33,10 +33,13 @@ from argparse import ArgumentParser,ArgumentTypeError,ArgumentDefaultsHelpFormat
 from pprint   import pprint
 from streamlines.streamlining import Streamlining
 
-__all__ = ['run','_str2bool','_parse_cmd_line_args']
+__all__ = ['run','_run_workflow','_progressive_refresh','_str2bool','_parse_cmd_line_args']
 
 pdebug = print
 
+# Workflow stages that can be rerun between rounds of progressive field estimation
+PROGRESSIVE_REFRESH_STAGES = ('analysis','mapping','plot')
+
 def run(**kwargs):
     """
     Main function to drive slm analysis workflow when 
@@ -55,6 +58,38 @@ def run(**kwargs):
     # those parameters relevant to the corresponding workflow step.
     sl = Streamlining(**kwargs)
     
+    # Batches of DTMs, tiles and/or basins can be farmed out to a pool of worker processes
+    if sl.state.do_batch:
+        sl.scheduler.do(**kwargs)
+        return sl
+    
+    # Drainage basins can be mapped one by one from tight crops of the DTM, 
+    #   each basin having its own (short-lived) slm workflow object
+    if sl.state.do_basins:
+        sl.basins.do(lambda **basin_kwargs: _run_workflow(Streamlining(**basin_kwargs)),
+                     **kwargs)
+        return sl
+    
+    # Large DTMs can be processed out-of-core, tile by tile, each tile having
+    #   its own (short-lived) slm workflow object
+    if sl.state.do_tiling:
+        sl.tiling.do(lambda **tile_kwargs: _run_workflow(Streamlining(**tile_kwargs)),
+                     **kwargs)
+        return sl
+    
+    return _run_workflow(sl)
+
+def _run_workflow(sl):
+    """
+    Carry out the slm analysis workflow steps selected in the state of an
+    slm workflow object.
+    
+    Args:
+        sl (obj): instance of :class:`.Streamlining` class
+    
+    Return:
+        obj:  instance of :class:`.Streamlining` class
+    """
     # Execute the slm workflow
     #   => geodata  - read DTM
     #    => preprocess - compute uv vector field
@@ -63,24 +98,41 @@ def run(**kwargs):
     #        => plot - graphs & maps
     #         => save state (currently defunct)
     #          => export - write plots to files
+    # Each step is timed etc by the profiler, if switched on;
+    #   preprocess & trace outputs are reused from the stage cache, if switched on
+    profiler = sl.profiler
+    if sl.state.do_profile:
+        profiler.start()
     if sl.state.do_geodata:
-        sl.geodata.do()
+        with profiler.stage('geodata'):
+            sl.geodata.do()
     if sl.state.do_preprocess:
-        sl.preprocess.do()
+        with profiler.stage('preprocess'):
+            sl.stagecache.run('preprocess', sl.preprocess.do)
     if sl.state.do_trace:
-        sl.trace.do()
+        sl.trace.fields_round_callback = _progressive_refresh(sl)
+        with profiler.stage('trace'):
+            sl.stagecache.run('trace', sl.trace.do)
 #     if sl.state.do_analysis:
 #         sl.analysis.do()
     if sl.state.do_analysis:
-        sl.analysis.do()
+        with profiler.stage('analysis'):
+            sl.analysis.do()
     if sl.state.do_mapping:
-        sl.mapping.do()
+        with profiler.stage('mapping'):
+            sl.mapping.do()
     if sl.state.do_extra:
-        sl.analysis.extra()
+        with profiler.stage('extra'):
+            sl.analysis.extra()
     if sl.state.do_plot:
-        sl.plot.do()
+        with profiler.stage('plot'):
+            sl.plot.do()
     if sl.state.do_save:
-        sl.save.do(sl)
+        with profiler.stage('save'):
+            sl.save.do(sl)
+    if sl.state.do_profile:
+        profiler.stop()
+        profiler.write()
     if sl.state.do_plot:
         if sl.state.do_display:
             try:
@@ -90,6 +142,38 @@ def run(**kwargs):
         
     return sl
              
+def _progressive_refresh(sl):
+    """
+    Make the callback that refreshes the downstream workflow steps listed in 
+    the trace parameter progressive_refresh_stages, in workflow order, after each
+    round of progressive field estimation (see :meth:`.Trace.estimate_fields`),
+    so that the intermediate slc, slt, sla grids are analyzed, mapped and/or plotted.
+    Steps not selected in the workflow state are skipped.
+    
+    Args:
+        sl (obj): instance of :class:`.Streamlining` class
+    
+    Raises:
+        ValueError if a listed step cannot be refreshed.
+    
+    Return:
+        function:  callback taking the :class:`.Trace` instance, or None if there
+        is nothing to refresh
+    """
+    refresh_stages = list(sl.trace.progressive_refresh_stages)
+    for stage in refresh_stages:
+        if stage not in PROGRESSIVE_REFRESH_STAGES:
+            raise ValueError('Cannot refresh workflow step "{}" between rounds'
+                             .format(stage))
+    refresh_stages = [stage for stage in PROGRESSIVE_REFRESH_STAGES 
+                      if stage in refresh_stages and getattr(sl.state,'do_'+stage)]
+    if not sl.trace.do_progressive_fields or not refresh_stages:
+        return None
+    def refresh(trace):
+        for stage in refresh_stages:
+            getattr(sl,stage).do()
+    return refresh
+
 def _str2bool(arg):
     """
     Convert string to boolean during command line argument parsing.
@@ -125,6 +209,21 @@ def _parse_cmd_line_args():
                         metavar='analysis_flag',
                         help='analyze streamline patterns, distributions')
                         
+    parser.add_argument('-b', '--batch', dest='do_batch',
+                        default=None, type=_str2bool,  action="store", 
+                        metavar='batch_flag',
+                        help='run batch of DTMs/tiles on a pool of worker processes')
+                        
+    parser.add_argument('--basins', dest='do_basins',
+                        default=None, type=_str2bool,  action="store", 
+                        metavar='basins_flag',
+                        help='map drainage basin by basin from cropped DTM windows')
+                        
+    parser.add_argument('--backend', dest='compute_backend',
+                        default=None, type=str,  action="store",  
+                        metavar='opencl/numba',
+                        help='compute streamline integrations with OpenCL or Numba')
+    
     parser.add_argument('-c', '--condition', dest='do_condition',
                         default=None, type=_str2bool,  action="store",  
                         metavar='condition_flag',
@@ -171,6 +270,16 @@ def _parse_cmd_line_args():
                         metavar='maps/pdfs/all',
                         help='carry out all plotting set in parameters files')
     
+    parser.add_argument('--profile', dest='do_profile',
+                        default=None, type=_str2bool,  action="store",  
+                        metavar='profile_flag',
+                        help='profile workflow stages, kernels & transfers')
+    
+    parser.add_argument('--cache', dest='do_cache_stages',
+                        default=None, type=_str2bool,  action="store",  
+                        metavar='cache_flag',
+                        help='load/store preprocess & trace outputs in stage cache')
+    
     parser.add_argument('-q', '--display', dest='do_display',
                         default=None, type=_str2bool,  action="store", 
                         metavar='display_flag',
@@ -181,6 +290,11 @@ def _parse_cmd_line_args():
                         metavar='save_flag',
                         help='save state, figs, map grids')
     
+    parser.add_argument('--tiling', dest='do_tiling',
+                        default=None, type=_str2bool,  action="store",  
+                        metavar='tiling_flag',
+                        help='process DTM out-of-core, tile by tile')
+    
     parser.add_argument('-t', '--trace', dest='do_trace',
                         default=None, type=_str2bool,  action="store",  
                         metavar='trace_flag',
@@ -0,0 +1,353 @@
+"""
+---------------------------------------------------------------------
+
+Module providing a content-addressed cache of the outputs of the
+expensive ``slm`` workflow stages, namely preprocess and trace.
+
+Each stage's outputs are stored under a key that hashes everything the stage
+depends on:
+  - the contents of the DTM (and basins, if masking) GeoTIFF files
+  - the ROI and the other ``geodata`` parameters
+  - the parameter sub-dict of the stage (and of the stages it depends on),
+    as parsed by :func:`.parameters.read_json_file`, along with the few
+    state parameters the stage reads
+
+so that a rerun in which, say, only ``mapping`` or ``plot`` parameters have changed
+loads these outputs rather than recomputing them.
+Grids are stored as ``.npy`` files and are memory-mapped (copy-on-write)
+when loaded. The cache is bounded in size: whenever a new entry is stored,
+the least recently used entries are evicted as need be.
+
+---------------------------------------------------------------------
+
+Requires Python packages/modules:
+  -  :mod:`hashlib`
+  -  :mod:`json`
+  -  :mod:`pickle`
+  -  :mod:`shutil`
+
+Imports :class:`.Core` class and the :class:`.StreamlineSet` class.
+
+---------------------------------------------------------------------
+
+"""
+
+import numpy as np
+from json import dump, dumps, load
+import hashlib
+import pickle
+import shutil
+import time
+import os
+os.environ['PYTHONUNBUFFERED']='True'
+
+from streamlines.core   import Core
+from streamlines.useful import StreamlineSet
+
+__all__ = ['StageCache']
+
+pdebug = print
+
+# Bump this whenever a change to preprocess or trace changes their outputs
+CACHE_VERSION = 2
+
+class StageCache(Core):
+    """
+    Class providing methods to key, store, load and evict cached
+    preprocess and trace stage outputs.
+
+    """
+    # Stage output grids, where present, by stage
+    stage_arrays = {'preprocess' : ['uv_array','slope_array',
+                                    'blockages_array','blocked_neighbors_array',
+                                    'where_blockages_array',
+                                    'where_blocked_neighbors_array',
+                                    'where_looped_array'],
+                    'trace'      : ['seed_point_array',
+                                    'slc_array','slt_array','sla_array',
+                                    'slc_variance_array','slt_variance_array',
+                                    'sla_variance_array']}
+    # State parameters read by each stage
+    stage_state_parameters = {'preprocess' : ['do_condition'],
+                              'trace'      : ['compute_backend','n_work_items',
+                                              'chunk_size_factor',
+                                              'gpu_memory_limit_pc']}
+    # Geodata parameters that do not affect stage outputs
+    ignored_geodata_parameters = ['title','data_path','dtm_file','basins_file',
+                                  'export_maps_path','export_figs_path',
+                                  'export_analyses_path']
+
+    def __init__(self,state,imported_parameters,geodata,preprocess,trace):
+        """
+        Args:
+            state (obj):
+            imported_parameters (dict):
+            geodata (obj):
+            preprocess (obj):
+            trace (obj):
+
+        Initialize a StageCache class instance.
+
+        Attributes:
+            self.geodata (obj):
+            self.preprocess (obj):
+            self.trace (obj):
+            self.imported_parameters (dict): parameters dict, used in stage keys
+            self.keys (dict): stage keys computed so far, by stage
+        """
+        super(StageCache,self).__init__(state,imported_parameters)
+        self.geodata    = geodata
+        self.preprocess = preprocess
+        self.trace      = trace
+        self.imported_parameters = imported_parameters
+        self.keys = {}
+
+    def run(self, stage, do_stage):
+        """
+        Args:
+            stage (str): 'preprocess' or 'trace'
+            do_stage (function): callable carrying out the stage
+
+        Load the outputs of a workflow stage from the cache if they are there,
+        otherwise carry out the stage and store its outputs in the cache.
+        Just carry out the stage if caching is switched off
+        (state do_cache_stages) or if the stage is not in cached_stages.
+
+        Returns:
+            bool:
+            True if the stage outputs were loaded from the cache
+        """
+        if not self.state.do_cache_stages or stage not in self.cached_stages:
+            do_stage()
+            return False
+        key = self.stage_key(stage)
+        if self.load(stage, key):
+            return True
+        do_stage()
+        self.store(stage, key)
+        self.evict()
+        return False
+
+    def cache_dir(self):
+        """
+        Returns:
+            str:
+            absolute path of cache directory
+        """
+        return os.path.realpath(os.path.join(*self.cache_path))
+
+    def entry_dir(self, stage, key):
+        """
+        Args:
+            stage (str): 'preprocess' or 'trace'
+            key (str): stage key
+
+        Returns:
+            str:
+            absolute path of cache entry directory
+        """
+        return os.path.join(self.cache_dir(), '{0}_{1}'.format(stage,key))
+
+    def stage_key(self, stage):
+        """
+        Args:
+            stage (str): 'preprocess' or 'trace'
+
+        Hash the inputs and parameters of a stage into its cache key.
+        The trace key includes the preprocess key, since trace depends
+        on preprocess outputs.
+        Must be called after the DTM has been read (so that the ROI is known).
+
+        Returns:
+            str:
+            stage key (hex digest)
+        """
+        if stage in self.keys.keys():
+            return self.keys[stage]
+        geodata = self.geodata
+        if stage=='preprocess':
+            basins_file = None
+            if geodata.do_basin_masking:
+                basins_file = self.file_hash(os.path.join(geodata.dtm_path,
+                                                          geodata.basins_file))
+            key_dict = {'version'  : CACHE_VERSION,
+                        'dtm_file' : self.file_hash(os.path.join(geodata.dtm_path,
+                                                                 geodata.dtm_file)),
+                        'basins_file' : basins_file,
+                        'roi'      : [list(geodata.roi_x_bounds),
+                                      list(geodata.roi_y_bounds)],
+                        'geodata'  : {name : value for name,value
+                                      in self.imported_parameters['geodata'].items()
+                                      if name not in self.ignored_geodata_parameters}}
+        elif stage=='trace':
+            key_dict = {'preprocess_key' : self.stage_key('preprocess')}
+        else:
+            raise ValueError('Cannot cache outputs of stage "{}"'.format(stage))
+        key_dict.update({'stage'  : stage,
+                         stage    : self.imported_parameters[stage],
+                         'state'  : {name : getattr(self.state,name,None) for name
+                                     in self.stage_state_parameters[stage]}})
+        self.keys[stage] = hashlib.sha256(dumps(key_dict, sort_keys=True,
+                                                default=str).encode()).hexdigest()
+        return self.keys[stage]
+
+    def file_hash(self, file_name):
+        """
+        Args:
+            file_name (str): path of input file, e.g., DTM GeoTIFF
+
+        Hash the contents of an input file.
+        Hashes are remembered in the cache directory against the file's path, size
+        and modification time, so that large files are only read when they change.
+
+        Returns:
+            str:
+            file contents hash (hex digest)
+        """
+        file_name = os.path.realpath(file_name)
+        file_stat = os.stat(file_name)
+        file_id = '{0}|{1}|{2}'.format(file_name,file_stat.st_size,
+                                       file_stat.st_mtime_ns)
+        index_file = os.path.join(self.cache_dir(),'file_hashes.json')
+        try:
+            with open(index_file,'r') as json_file:
+                file_hashes = load(json_file)
+        except (OSError, ValueError):
+            file_hashes = {}
+        if file_id in file_hashes.keys():
+            return file_hashes[file_id]
+        file_hash = hashlib.sha256()
+        with open(file_name,'rb') as fp:
+            for block in iter(lambda: fp.read(1<<24), b''):
+                file_hash.update(block)
+        file_hashes[file_id] = file_hash.hexdigest()
+        os.makedirs(self.cache_dir(), exist_ok=True)
+        self._write_atomically(index_file, lambda fp: dump(file_hashes, fp, indent=1),
+                               mode='w')
+        return file_hashes[file_id]
+
+    def store(self, stage, key):
+        """
+        Args:
+            stage (str): 'preprocess' or 'trace'
+            key (str): stage key
+
+        Write the outputs of a stage to a new cache entry.
+        The entry is written to a temporary directory which is then renamed,
+        so that concurrent runs (e.g., scheduler workers) never see a partial entry.
+        """
+        entry_dir = self.entry_dir(stage, key)
+        if os.path.isdir(entry_dir):
+            return
+        tmp_dir = entry_dir+'.tmp{}'.format(os.getpid())
+        os.makedirs(tmp_dir, exist_ok=True)
+        obj = getattr(self,stage)
+        meta = {'stage' : stage, 'arrays' : [], 'created' : time.time()}
+        for name in self.stage_arrays[stage]:
+            array = getattr(obj,name,None)
+            if isinstance(array,np.ndarray):
+                np.save(os.path.join(tmp_dir,name+'.npy'), array)
+                meta['arrays'] += [name]
+        if stage=='preprocess':
+            np.save(os.path.join(tmp_dir,'uv_mask_array.npy'),
+                    self.state.active_masks_dict['uv'])
+            meta['n_loops'] = int(getattr(obj,'n_loops',0))
+        else:
+            for idx,streamline_set in enumerate(obj.streamline_arrays_list):
+                np.save(os.path.join(tmp_dir,'streamlines{}_steps.npy'.format(idx)),
+                        streamline_set.steps_array)
+                np.save(os.path.join(tmp_dir,'streamlines{}_offsets.npy'.format(idx)),
+                        streamline_set.offsets_array)
+            with open(os.path.join(tmp_dir,'traj_stats_df.pkl'),'wb') as fp:
+                pickle.dump(obj.traj_stats_df, fp)
+        # Written last: its presence marks a complete entry; its mtime the last use
+        with open(os.path.join(tmp_dir,'meta.json'),'w') as json_file:
+            dump(meta, json_file)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another run stored this entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        self.print('Stored "{0}" outputs in stage cache "{1}"'.format(stage,entry_dir))
+
+    def load(self, stage, key):
+        """
+        Args:
+            stage (str): 'preprocess' or 'trace'
+            key (str): stage key
+
+        Load the outputs of a stage from its cache entry, if there is one,
+        memory-mapping the grids copy-on-write.
+
+        Returns:
+            bool:
+            True if the stage outputs were loaded
+        """
+        entry_dir = self.entry_dir(stage, key)
+        meta_file = os.path.join(entry_dir,'meta.json')
+        try:
+            with open(meta_file,'r') as json_file:
+                meta = load(json_file)
+        except (OSError, ValueError):
+            return False
+        def _load(name):
+            return np.load(os.path.join(entry_dir,name+'.npy'), mmap_mode='c')
+        obj = getattr(self,stage)
+        for name in meta['arrays']:
+            setattr(obj, name, _load(name))
+        if stage=='preprocess':
+            obj.n_loops = meta['n_loops']
+            # Cheaply derived, so re-encoded rather than cached
+            obj.encode_uv()
+            self.state.add_active_mask({'uv': np.array(_load('uv_mask_array'))})
+        else:
+            obj.streamline_arrays_list \
+                = [StreamlineSet(_load('streamlines{}_steps'.format(idx)),
+                                 _load('streamlines{}_offsets'.format(idx)))
+                   for idx in [0,1]]
+            with open(os.path.join(entry_dir,'traj_stats_df.pkl'),'rb') as fp:
+                obj.traj_stats_df = pickle.load(fp)
+        # Mark as most recently used
+        os.utime(meta_file)
+        self.print('Loaded "{0}" outputs from stage cache "{1}"'
+                   .format(stage,entry_dir))
+        return True
+
+    def evict(self):
+        """
+        Evict least recently used cache entries until the cache is no larger
+        than max_cache_size_mb.
+        """
+        cache_dir = self.cache_dir()
+        entries = []
+        for entry in os.listdir(cache_dir):
+            entry_dir = os.path.join(cache_dir,entry)
+            meta_file = os.path.join(entry_dir,'meta.json')
+            if '.tmp' in entry or not os.path.isfile(meta_file):
+                continue
+            size = sum([os.path.getsize(os.path.join(entry_dir,file_name))
+                        for file_name in os.listdir(entry_dir)])
+            entries += [(os.path.getmtime(meta_file), size, entry_dir)]
+        cache_size = sum([entry[1] for entry in entries])
+        max_cache_size = self.max_cache_size_mb*1024**2
+        for _, size, entry_dir in sorted(entries):
+            if cache_size<=max_cache_size:
+                break
+            self.print('Evicting stage cache entry "{}"'.format(entry_dir))
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            cache_size -= size
+
+    def _write_atomically(self, file_name, write, mode='wb'):
+        """
+        Args:
+            file_name (str): path of file
+            write (function): callable writing to an open file object
+            mode (str): file open mode
+
+        Write a file via a temporary file and a rename.
+        """
+        tmp_file = file_name+'.tmp{}'.format(os.getpid())
+        with open(tmp_file, mode) as fp:
+            write(fp)
+        os.replace(tmp_file, file_name)
@@ -171,27 +171,24 @@ class State(Core):
 
         return total_usage
     
-    def get_streamlines_dict(self, array_list):
+    def get_streamlines_dict(self, streamline_set):
         """
-        Collect list of streamline numpy arrays 
+        Collect the CSR steps & offsets arrays of a set of streamlines 
         
         Args:
-            TBD (TBD): 
-        
-        TBD
+            streamline_set (:class:`.StreamlineSet`): 
     
         Returns:
-            TBD: 
-            TBD
+            dict: 
+                'steps' and 'offsets' numpy arrays
         """   
-        return dict(ChainMap(*[{str(idx):arr} 
-                               for idx,arr in enumerate(array_list)]))
+        return streamline_set.to_dict()
         
-    def get_streamlines_sizes(self, array_list):
+    def get_streamlines_sizes(self, streamline_set):
         """
-        Collect list of streamline numpy arrays 
+        Measure memory used by a set of streamlines 
         """   
-        return sum([true_size(arr) for arr in array_list])
+        return streamline_set.nbytes()
         
     def save_state(self):
         """
@@ -266,15 +263,15 @@ class State(Core):
 
         # Downstreamline and upstreamline lists of arrays
         total_streamlines_usage = 0
-        for up_or_down_str,array_list in [['downstreamline',
+        for up_or_down_str,streamline_set in [['downstreamline',
                                             self.trace.streamline_arrays_list[0]],
                                           ['upstreamline',
                                             self.trace.streamline_arrays_list[1]]]:
             filename = filestem+'_'+up_or_down_str
             self.print('Saving '+up_or_down_str+'lines to: "'+filename+'.npz'+'"...', 
                       end='')
-            streamlines_dict = self.get_streamlines_dict(array_list)
-            total_streamlines_usage += self.get_streamlines_sizes(array_list)
+            streamlines_dict = self.get_streamlines_dict(streamline_set)
+            total_streamlines_usage += self.get_streamlines_sizes(streamline_set)
             np.savez_compressed(filename, **streamlines_dict)
             del(streamlines_dict)
             self.print('...done')
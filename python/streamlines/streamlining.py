@@ -31,6 +31,11 @@ Imports the folllowing classes:
  - :class:`.Mapping`
  - :class:`.Plot`
  - :class:`.Save`
+ - :class:`.Tiling`
+ - :class:`.Basins`
+ - :class:`.Scheduler`
+ - :class:`.Profiler`
+ - :class:`.StageCache`
 
 Imports functions from :mod:`useful <streamlines.useful>`.
 
@@ -58,6 +63,11 @@ from streamlines.analysis   import Analysis
 from streamlines.mapping    import Mapping
 from streamlines.plot       import Plot
 from streamlines.save       import Save
+from streamlines.tiling     import Tiling
+from streamlines.basins     import Basins
+from streamlines.scheduler  import Scheduler
+from streamlines.profiling  import Profiler
+from streamlines.stagecache import StageCache
 
 __all__ = ['Streamlining']
 
@@ -96,6 +106,9 @@ class Streamlining(Core):
          - :class:`Mapping <.Mapping>` 
          - :class:`Plot <.Plot>` 
          - :class:`Save <.Save>` 
+         - :class:`Tiling <.Tiling>` 
+         - :class:`Basins <.Basins>` 
+         - :class:`Scheduler <.Scheduler>` 
 
     
 
@@ -287,8 +300,17 @@ class Streamlining(Core):
         self.mapping._augment(self.plot)
         self.analysis._augment(self.mapping)
         self.save       = Save(self.state,imported_parameters,
-                               self.geodata, self.preprocess, self.analysis, 
-                               self.trace, self.mapping, self.plot)
+                               self.geodata, self.preprocess, self.trace, 
+                               self.analysis, self.mapping, self.plot)
+        self.tiling     = Tiling(self.state,imported_parameters,
+                                 self.geodata, self.trace)
+        self.basins     = Basins(self.state,imported_parameters,
+                                 self.geodata, self.trace)
+        self.scheduler  = Scheduler(self.state,imported_parameters,
+                                    self.tiling, self.basins)
+        self.profiler   = Profiler(self.state,imported_parameters,self.geodata)
+        self.stagecache = StageCache(self.state,imported_parameters,
+                                     self.geodata, self.preprocess, self.trace)
         # Used by State.save_state()
         self.state.trace = self.trace
                              
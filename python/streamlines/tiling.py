@@ -0,0 +1,288 @@
+"""
+---------------------------------------------------------------------
+
+Module to carry out the ``slm`` workflow out-of-core, tile by tile, on DTMs
+too large to be processed in one go.
+
+The DTM (or its ROI) is partitioned into a grid of square tiles.
+Each tile is read from the GeoTIFF as a window expanded by a "halo" of pixels,
+which is sized to contain any streamline that could reach into the tile core.
+The full workflow (preprocess, trace, mapping) is run on each tile in turn,
+the halo is stripped, and the tile core of each output grid is written into
+the corresponding window of an internally tiled GeoTIFF.
+Peak memory is thus bounded by tile size rather than DTM size.
+
+---------------------------------------------------------------------
+
+Requires Python packages/modules:
+  -  :mod:`json`
+  -  `GDAL`_
+
+Imports :class:`.Core` class and functions from the :mod:`.useful` module.
+
+---------------------------------------------------------------------
+
+.. _gdal: https://www.gdal.org/
+
+"""
+
+import numpy as np
+from json import loads, dumps
+import gc
+import os
+os.environ['PYTHONUNBUFFERED']='True'
+
+from streamlines.core   import Core
+from streamlines.useful import create_tiled_geotiff, write_geotiff_window
+
+__all__ = ['Tiling']
+
+pdebug = print
+
+class Tiling(Core):
+    """
+    Class providing methods to partition a DTM into overlapping tiles,
+    to drive the workflow tile by tile, and to stitch the per-tile results
+    into tiled GeoTIFF output files.
+
+    """
+    def __init__(self,state,imported_parameters,geodata,trace):
+        """
+        Args:
+            state (obj):
+            imported_parameters (dict):
+            geodata (obj):
+            trace (obj):
+
+        Initialize a Tiling class instance.
+
+        Attributes:
+            self.geodata (obj):
+            self.trace (obj):
+            self.tiles (list): tile dicts as generated by :meth:`plan`
+            self.datasets (dict): tiled GeoTIFF output datasets keyed by layer name
+            self.output_files (dict): tiled GeoTIFF output file names keyed by layer name
+
+        """
+        super(Tiling,self).__init__(state,imported_parameters)
+        self.geodata  = geodata
+        self.trace    = trace
+        self.tiles    = []
+        self.datasets = {}
+        self.output_files = {}
+
+    def do(self, run_tile, **kwargs):
+        """
+        Args:
+            run_tile (function): callable taking workflow keyword arguments,
+                                 creating a :class:`.Streamlining` instance from them,
+                                 carrying out its workflow and returning it
+            **kwargs (list): keyword arguments of the parent (untiled) run
+
+        Carry out the workflow tile by tile and stitch the results.
+        """
+        self.print('\n**Tiling begin**')
+        self.plan()
+        for tile in self.tiles:
+            self.print('Tile {0}/{1}: core x={2} y={3}, halo x={4} y={5}'
+                       .format(tile['index']+1,len(self.tiles),
+                               tile['core_x_bounds'],tile['core_y_bounds'],
+                               tile['halo_x_bounds'],tile['halo_y_bounds']))
+            sl = run_tile(**self.tile_kwargs(tile, kwargs))
+            self.write_tile(sl, tile)
+            # Release the tile workflow before moving on to bound peak memory
+            del sl
+            gc.collect()
+        self.close()
+        self.print('**Tiling end**\n')
+
+    def plan(self):
+        """
+        Read the DTM header (but not its grid), figure out the halo width and
+        partition the ROI into tiles.
+
+        The halo must be wide enough that every streamline reaching the tile core
+        is traced in full: by default it is the maximum streamline length in pixels
+        plus the pad width.
+
+        Raises:
+            ValueError if the halo cannot be determined.
+
+        Attributes:
+            self.halo (int): halo width in pixels
+            self.domain_x_bounds (list): x bounds of tiled region in DTM pixels
+            self.domain_y_bounds (list): y bounds of tiled region in DTM pixels
+            self.tiles (list): one dict per tile giving its core and halo bounds
+        """
+        geodata = self.geodata
+        geodata.read_dtm_header()
+        if geodata.flip_ns:
+            raise ValueError('Tiling does not support "flip_ns"')
+        if self.tile_halo>0:
+            self.halo = int(self.tile_halo)
+        else:
+            max_length = self.trace.max_length
+            if max_length<=0.0:
+                raise ValueError('Tiling needs "tile_halo" to be set if '
+                                 +'"max_length" is unlimited')
+            self.halo = int(np.ceil(max_length/geodata.pixel_size)) \
+                        +int(geodata.pad_width)
+        self.domain_x_bounds = list(geodata.roi_x_bounds)
+        self.domain_y_bounds = list(geodata.roi_y_bounds)
+        tile_size = int(self.tile_size)
+        self.tiles = []
+        for y0 in range(self.domain_y_bounds[0],self.domain_y_bounds[1],tile_size):
+            for x0 in range(self.domain_x_bounds[0],self.domain_x_bounds[1],tile_size):
+                core_x_bounds = [x0,min(x0+tile_size,self.domain_x_bounds[1])]
+                core_y_bounds = [y0,min(y0+tile_size,self.domain_y_bounds[1])]
+                halo_x_bounds = [max(core_x_bounds[0]-self.halo,
+                                     self.domain_x_bounds[0]),
+                                 min(core_x_bounds[1]+self.halo,
+                                     self.domain_x_bounds[1])]
+                halo_y_bounds = [max(core_y_bounds[0]-self.halo,
+                                     self.domain_y_bounds[0]),
+                                 min(core_y_bounds[1]+self.halo,
+                                     self.domain_y_bounds[1])]
+                self.tiles += [{'index' : len(self.tiles),
+                                'core_x_bounds' : core_x_bounds,
+                                'core_y_bounds' : core_y_bounds,
+                                'halo_x_bounds' : halo_x_bounds,
+                                'halo_y_bounds' : halo_y_bounds}]
+        self.print('Tiling {0} x {1} pixels into {2} tiles of up to {3} x {3} pixels'
+                   .format(self.domain_x_bounds[1]-self.domain_x_bounds[0],
+                           self.domain_y_bounds[1]-self.domain_y_bounds[0],
+                           len(self.tiles),tile_size)
+                   +' with a halo of {} pixels'.format(self.halo))
+
+    def tile_kwargs(self, tile, kwargs):
+        """
+        Args:
+            tile (dict): tile as generated by :meth:`plan`
+            kwargs (dict): keyword arguments of the parent (untiled) run
+
+        Generate the workflow keyword arguments for a tile run: the parent's
+        arguments plus JSON parameter overrides that clip the ROI to the tile
+        halo window, read only that window, and turn off per-tile plotting, saving
+        and further tiling.
+
+        Returns:
+            dict:
+            workflow keyword arguments for the tile
+        """
+        if 'override_parameters' in kwargs.keys() \
+                and kwargs['override_parameters'] is not None \
+                and kwargs['override_parameters']!='':
+            override_dict = loads(kwargs['override_parameters'])
+        else:
+            override_dict = {}
+        override_dict.setdefault('geodata',{}).update({
+            'do_clip_roi'        : True,
+            'roi_bounds_units'   : 'pixels',
+            'roi_x_bounds'       : tile['halo_x_bounds'],
+            'roi_y_bounds'       : tile['halo_y_bounds'],
+            'do_read_roi_window' : True
+            })
+        tile_kwargs = dict(kwargs)
+        tile_kwargs.update({
+            'override_parameters' : dumps(override_dict),
+            'do_tiling'           : False,
+            'do_plot'             : 'off',
+            'do_save'             : False,
+            'do_display'          : False,
+            'do_git_info'         : False
+            })
+        return tile_kwargs
+
+    def write_tile(self, sl, tile):
+        """
+        Args:
+            sl (obj): :class:`.Streamlining` instance whose workflow was carried out
+                      on the tile
+            tile (dict): tile as generated by :meth:`plan`
+
+        Strip the halo from each output grid of a tile run and write the tile core
+        into the corresponding window of its tiled GeoTIFF output file.
+        """
+        self.write_tile_arrays(self.extract_tile(sl, tile), tile)
+
+    def extract_tile(self, sl, tile):
+        """
+        Args:
+            sl (obj): :class:`.Streamlining` instance whose workflow was carried out
+                      on the tile
+            tile (dict): tile as generated by :meth:`plan`
+
+        Strip the halo (and padding) from each output grid of a tile run.
+
+        Returns:
+            dict:
+            tile core grids keyed by layer name
+        """
+        pad = int(sl.geodata.pad_width)
+        x0 = pad+tile['core_x_bounds'][0]-tile['halo_x_bounds'][0]
+        x1 = pad+tile['core_x_bounds'][1]-tile['halo_x_bounds'][0]
+        y0 = pad+tile['core_y_bounds'][0]-tile['halo_y_bounds'][0]
+        y1 = pad+tile['core_y_bounds'][1]-tile['halo_y_bounds'][0]
+        tile_arrays = {}
+        for layer in self.tile_layers:
+            obj = sl.mapping if layer in ('hsl','mapping') else sl.trace
+            array = getattr(obj,layer+'_array',None)
+            if array is None:
+                continue
+            tile_arrays[layer] = array[x0:x1,y0:y1].copy()
+        return tile_arrays
+
+    def write_tile_arrays(self, tile_arrays, tile):
+        """
+        Args:
+            tile_arrays (dict): tile core grids as generated by :meth:`extract_tile`
+            tile (dict): tile as generated by :meth:`plan`
+
+        Write tile core grids into the corresponding windows of their tiled GeoTIFF
+        output files, creating the latter if need be.
+        """
+        for layer, array in tile_arrays.items():
+            if layer not in self.datasets.keys():
+                self.create_output(layer, array)
+            write_geotiff_window(self.datasets[layer], array,
+                                 tile['core_x_bounds'][0]-self.domain_x_bounds[0],
+                                 tile['core_y_bounds'][0]-self.domain_y_bounds[0])
+
+    def create_output(self, layer, array):
+        """
+        Args:
+            layer (str): name of output grid, e.g., 'slc'
+            array (numpy.ndarray): example (tile) grid giving type and number of bands
+
+        Create an internally tiled GeoTIFF file covering the whole tiled region,
+        into which tile cores of the named grid will be written.
+        """
+        geodata = self.geodata
+        file_stem = os.path.realpath(os.path.join(*geodata.export_maps_path,
+                                                  self.state.parameters_file))
+        file_name = file_stem+'_tiled_'+layer+'.tif'
+        # Same arithmetic as for Geodata.roi_geotransform
+        geotransform     = list(geodata.tiff.GetGeoTransform())
+        geotransform[0] += self.domain_x_bounds[0]*geodata.pixel_size
+        geotransform[3] -= geodata.dtm_shape[0]*geodata.pixel_size
+        geotransform[3] += self.domain_y_bounds[1]*geodata.pixel_size
+        npd = array.shape[2] if array.ndim==3 else 1
+        self.print('Writing tiled "{0}" to "{1}"'.format(layer,file_name))
+        self.datasets[layer] = create_tiled_geotiff(
+                                    file_name,
+                                    self.domain_x_bounds[1]-self.domain_x_bounds[0],
+                                    self.domain_y_bounds[1]-self.domain_y_bounds[0],
+                                    npd, array.dtype if array.dtype!=np.bool
+                                                     else np.uint8,
+                                    geotransform, geodata.tiff.GetProjection(),
+                                    block_size=self.tile_block_size )
+        self.output_files[layer] = file_name
+
+    def close(self):
+        """
+        Flush and close the tiled GeoTIFF output files.
+        """
+        for dataset in self.datasets.values():
+            dataset.FlushCache()
+        # GDAL only completes writing when the dataset is dereferenced
+        self.datasets = {}
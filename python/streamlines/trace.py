@@ -13,6 +13,7 @@ Imports the following:
     - :class:`.Fields` class
     - :class:`.Data` and :class:`.Info` classes, as well as functions, 
         from the :mod:`.useful` module
+    - :mod:`time`
 
 ---------------------------------------------------------------------
 
@@ -23,6 +24,7 @@ Imports the following:
 """
 
 import sys
+import time
 import numpy  as np
 from os import environ
 environ['PYTHONUNBUFFERED']='True'
@@ -30,7 +32,7 @@ environ['PYTHONUNBUFFERED']='True'
 from streamlines.core         import Core
 from streamlines.trajectories import Trajectories
 from streamlines.fields       import Fields
-from streamlines.useful       import Data, Info, get_bbox
+from streamlines.useful       import Data, Info, get_bbox, create_seeds, stratify_seeds
 
 __all__ = ['Trace']
 
@@ -63,6 +65,8 @@ class Trace(Core):
             self.preprocess (obj):
             self.seed_point_array (numpy.ndarray):
             self.perform_RungeKutta2_integration (function):
+            self.fields_round_callback (function): optionally called with this
+                instance after each round of progressive field estimation
             
         """
         super(Trace,self).__init__(state,imported_parameters)  
@@ -70,6 +74,10 @@ class Trace(Core):
         self.preprocess = preprocess
         self.mapping_array = None
         self.seed_point_array = None
+        self.slc_variance_array = None
+        self.slt_variance_array = None
+        self.sla_variance_array = None
+        self.fields_round_callback = None
         
     def do(self):
         """
@@ -78,13 +86,16 @@ class Trace(Core):
             
         Attributes:
             seed_point_array (numpy.ndarray):
-            streamline_arrays_list (list):
+            streamline_arrays_list (list): downstream & upstream :class:`.StreamlineSet`
             traj_nsteps_array (numpy.ndarray):
             traj_length_array (numpy.ndarray):
             traj_stats_df (pandas.DataFrame):
             slc_array (numpy.ndarray):
             slt_array (numpy.ndarray):
             sla_array (numpy.ndarray):
+            slc_variance_array (numpy.ndarray): if do_progressive_fields
+            slt_variance_array (numpy.ndarray): if do_progressive_fields
+            sla_variance_array (numpy.ndarray): if do_progressive_fields
             """
         self.print('\n**Trace begin**')  
         # Integrate streamlines downstream and upstream
@@ -110,7 +121,7 @@ class Trace(Core):
         data = Data( info=info, bbox=bbox, pad=pad,
                      mapping_array = mapping_array,
                      mask_array    = mask_array,
-                     uv_array      = self.preprocess.uv_array
+                     uv_array      = self.preprocess.uv_code_array
                      )
         trajectories = Trajectories( self.state.cl_platform, self.state.cl_device,
                                      cl_src_path         = self.state.cl_src_path,
@@ -119,7 +130,8 @@ class Trace(Core):
                                      do_trace_downstream = self.do_trace_downstream,
                                      do_trace_upstream   = self.do_trace_upstream,
                                      verbose             = self.state.verbose,
-                                     gpu_verbose         = self.state.gpu_verbose 
+                                     gpu_verbose         = self.state.gpu_verbose,
+                                     compute_backend     = self.state.compute_backend
                                      )
         trajectories.integrate()
         # Only preserve what we need from the trajectories class instance
@@ -131,6 +143,9 @@ class Trace(Core):
     def compute_fields(self):
         """
         Trace up or downstreamlines across region of interest (ROI) of DTM grid.
+        
+        If do_progressive_fields is set, the fields are instead estimated from
+        a growing sample of the seed points (see :meth:`estimate_fields`).
     
         """
         mask_array = self.state.merge_active_masks()
@@ -143,7 +158,7 @@ class Trace(Core):
         info.set_xy(bnx,bny, pad)
         data = Data( info=info, bbox=bbox, pad=pad,
                      mask_array    = mask_array,
-                     uv_array      = self.preprocess.uv_array,
+                     uv_array      = self.preprocess.uv_code_array,
                      mapping_array = mapping_array,
                      traj_stats_df = self.traj_stats_df 
                      )
@@ -152,16 +167,144 @@ class Trace(Core):
                          info        = info,
                          data        = data,
                          verbose     = self.state.verbose,
-                         gpu_verbose = self.state.gpu_verbose 
+                         gpu_verbose = self.state.gpu_verbose,
+                         compute_backend = self.state.compute_backend
                          )
+        if self.do_progressive_fields and info.fields_engine=='streamlines':
+            self.estimate_fields(fields, nxp, nyp)
+            return
         fields.integrate()
+        self.insert_fields(fields, nxp, nyp)
+        
+    def insert_fields(self, fields, nxp, nyp):
+        """
+        Args:
+            fields (obj): :class:`.Fields` instance holding post-processed fields
+            nxp (int): padded DTM ROI grid width
+            nyp (int): padded DTM ROI grid height
+        
+        Copy the slc, slt, sla fields into full (padded) DTM ROI grid arrays.
+        """
         # Only preserve what we need from the trajectories class instance
         self.slc_array = np.zeros((nxp,nyp,2), dtype=np.uint32)
         self.slt_array = np.zeros((nxp,nyp,2), dtype=np.float32)
         self.sla_array = np.zeros((nxp,nyp,2), dtype=np.float32)
         # Insert results back into full (padded) DTM ROI grid arrays
-        bounds = data.bounds_slx
+        bounds = fields.data.bounds_slx
         self.slc_array[bounds] = fields.data.slc_array
         self.slt_array[bounds] = fields.data.slt_array
         self.sla_array[bounds] = fields.data.sla_array
         
+    def estimate_fields(self, fields, nxp, nyp):
+        """
+        Args:
+            fields (obj): :class:`.Fields` instance
+            nxp (int): padded DTM ROI grid width
+            nyp (int): padded DTM ROI grid height
+        
+        Estimate the slc, slt, sla fields progressively, for interactive work, 
+        by tracing the seed points in rounds until the estimates are good enough.
+        
+        The seed points are split into progressive_n_rounds rounds, stratified by 
+        tiles progressive_stratum_size pixels wide (see :func:`.useful.stratify_seeds`),
+        and their streamlines jittered as usual. 
+        Each round r thus traces a random sample of 1/R of the seed points, 
+        and R times its raw slc, slt fields X_r are unbiased estimates of
+        the full raw fields. After k rounds, the estimates are the means of the X_r,
+        with variances s²/k*(1-k/R) given the sample variances s² of the X_r, 
+        which are propagated to the post-processed slc, slt, sla fields to first order.
+        After the first round, with no spread to go by, the variances are infinite.
+        After all R rounds, the estimates are the full fields.
+        
+        After each round, the estimated fields and their variances are written 
+        to slc_array, slt_array, sla_array and slc_variance_array, etc., 
+        and self.fields_round_callback, if set, is called: in an slm workflow, 
+        it reruns the analysis, mapping and/or plot steps listed in 
+        progressive_refresh_stages (see :func:`.slm._progressive_refresh`) 
+        on these intermediate grids.
+        The relative standard error of the estimates, i.e., the rms standard error
+        over the rms value of the worst of the slc, slt, sla fields, 
+        is recorded in fields_rel_error and the number of rounds in fields_n_rounds.
+        Refinement stops once this error is no greater than progressive_tolerance, 
+        or once progressive_time_budget seconds have been spent (if it is positive).
+        """
+        self.print('Estimating streamline fields progressively...')
+        t_start = time.perf_counter()
+        info = fields.info
+        data = fields.data
+        n_rounds = max(int(self.progressive_n_rounds),1)
+        seed_point_array, _, _ \
+            = create_seeds(data.mask_array, info.pad_width, info.n_work_items,
+                           do_shuffle=info.do_shuffle, rng_seed=info.shuffle_rng_seed,
+                           curve=info.seed_point_curve, verbose=self.state.verbose)
+        round_array = stratify_seeds(seed_point_array, n_rounds,
+                                     stratum_size=self.progressive_stratum_size,
+                                     rng_seed=info.shuffle_rng_seed)
+        # Running sums over rounds of estimates X (slc) & Y (slt), their squares & product
+        sum_x = sum_xx = sum_y = sum_yy = sum_xy = 0.0
+        for round_idx in range(n_rounds):
+            fields.integrate(seed_point_array=seed_point_array[round_array==round_idx],
+                             do_postprocess=False)
+            x_array = data.slc_array.astype(np.float64)*n_rounds
+            y_array = data.slt_array.astype(np.float64)*n_rounds
+            sum_x,  sum_y  = sum_x+x_array, sum_y+y_array
+            sum_xx, sum_yy = sum_xx+x_array**2, sum_yy+y_array**2
+            sum_xy = sum_xy+x_array*y_array
+            # Estimates: the means of the raw fields over the rounds so far
+            k = round_idx+1
+            x_mean, y_mean = sum_x/k, sum_y/k
+            # Post-process (in place) copies of the estimates
+            data.slc_array = x_mean.copy()
+            data.slt_array = y_mean.copy()
+            data.sla_array = np.zeros(x_mean.shape, dtype=np.float32)
+            fields.postprocess()
+            if k==1 and n_rounds>1:
+                # No spread between rounds to go by yet
+                slc_var = np.full(x_mean.shape, np.inf)
+                slt_var = np.full(x_mean.shape, np.inf)
+                sla_var = np.full(x_mean.shape, np.inf)
+                self.fields_rel_error = np.inf
+            else:
+                # Variances of the means of the raw fields (zero once all are traced)
+                fpc = (1.0-k/n_rounds)/(k*(k-1)) if k<n_rounds else 0.0
+                x_var  = np.maximum(sum_xx-k*x_mean**2, 0.0)*fpc
+                y_var  = np.maximum(sum_yy-k*y_mean**2, 0.0)*fpc
+                xy_cov = (sum_xy-k*x_mean*y_mean)*fpc
+                # Propagate them: relative errors scale by the transform exponents
+                is_traced = (x_mean>0) & (y_mean>0)
+                slc_var = np.zeros(x_mean.shape)
+                slt_var = np.zeros(x_mean.shape)
+                sla_var = np.zeros(x_mean.shape)
+                (x, y) = (x_mean[is_traced], y_mean[is_traced])
+                slc_var[is_traced] \
+                    = (2/3*data.slc_array[is_traced])**2*x_var[is_traced]/x**2
+                slt_var[is_traced] \
+                    = (1/2*data.slt_array[is_traced])**2*y_var[is_traced]/y**2
+                sla_var[is_traced] = data.sla_array[is_traced]**2*np.maximum(
+                                        x_var[is_traced]/x**2+y_var[is_traced]/y**2
+                                        -2*xy_cov[is_traced]/(x*y), 0.0)
+                rel_errors = [np.sqrt(np.mean(var_array[is_traced])
+                                      /np.mean(np.float64(array[is_traced])**2))
+                              if np.any(is_traced) else np.inf
+                              for array, var_array in ((data.slc_array,slc_var),
+                                                       (data.slt_array,slt_var),
+                                                       (data.sla_array,sla_var))]
+                self.fields_rel_error = max(rel_errors)
+            self.insert_fields(fields, nxp, nyp)
+            bounds = data.bounds_slx
+            for name, var_array in (('slc',slc_var),('slt',slt_var),('sla',sla_var)):
+                padded_var_array = np.zeros((nxp,nyp,2), dtype=np.float32)
+                padded_var_array[bounds] = var_array
+                setattr(self, name+'_variance_array', padded_var_array)
+            self.fields_n_rounds = k
+            t_elapsed = time.perf_counter()-t_start
+            self.print('Round {0}/{1}: {2:.1f}% of seed points, relative error {3:.3g}, {4:.1f}s'
+                       .format(k, n_rounds, 100*k/n_rounds, self.fields_rel_error, t_elapsed))
+            if self.fields_round_callback is not None:
+                self.fields_round_callback(self)
+            if self.fields_rel_error<=self.progressive_tolerance:
+                break
+            if self.progressive_time_budget>0 and t_elapsed>=self.progressive_time_budget:
+                break
+        self.print('...done')
+        
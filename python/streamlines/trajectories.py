@@ -7,9 +7,9 @@ Provides PyOpenCL-accelerated functions to integrate streamlines using
 2nd-order Runge-Kutta and (streamline tail-step only) Euler methods.
 Basins of interest can be delimited by masking. 
 
-Requires `PyOpenCL`_.
+Requires `PyOpenCL`_, unless the CPU (Numba) backend is chosen.
 
-Imports streamlines module :doc:`pocl`.
+Imports streamlines modules :doc:`pocl` and :doc:`cpukernels`.
 
 Imports functions from streamlines module :doc:`useful`.
 
@@ -24,17 +24,18 @@ Imports functions from streamlines module :doc:`useful`.
 
 import pyopencl as cl
 import numpy as np
+from collections import deque
+import time
 import os
 os.environ['PYTHONUNBUFFERED']='True'
-os.environ['PYOPENCL_NO_CACHE']='True'
 os.environ['PYOPENCL_COMPILER_OUTPUT']='0'
 
-from streamlines import pocl
-from streamlines.useful import neatly, vprint, create_seeds, compute_stats
+from streamlines import pocl, cpukernels, profiling
+from streamlines.useful import neatly, vprint, create_seeds, compute_stats, \
+                               StreamlineSet, pack_trajectories, decode_uv_field
 
 __all__ = ['Trajectories']
 
-import warnings
 pdebug = print
 
 class Trajectories():
@@ -47,7 +48,8 @@ class Trajectories():
                     do_trace_downstream = True,
                     do_trace_upstream   = True,
                     verbose             = False,
-                    gpu_verbose         = False ):
+                    gpu_verbose         = False,
+                    compute_backend     = 'opencl' ):
         """
         Initialize.
         
@@ -61,10 +63,15 @@ class Trajectories():
             do_trace_upstream (bool):
             verbose (bool):
             gpu_verbose (bool):
+            compute_backend (str): 'opencl' (GPU/OpenCL device) or 'numba' (CPU)
         """
-        self.platform, self.device, self.context \
-            = pocl.prepare_cl_context(which_cl_platform, which_cl_device)
-        self.queue = cl.CommandQueue(self.context,
+        if compute_backend not in ('opencl','numba'):
+            raise ValueError('Unknown compute backend "{}"'.format(compute_backend))
+        self.compute_backend = compute_backend
+        if compute_backend=='opencl':
+            self.platform, self.device, self.context \
+                = pocl.prepare_cl_context(which_cl_platform, which_cl_device)
+            self.queue = cl.CommandQueue(self.context,
                                 properties=cl.command_queue_properties.PROFILING_ENABLE)
         self.cl_src_path         = cl_src_path
         self.info                = info
@@ -104,15 +111,6 @@ class Trajectories():
         uv_array            = self.data.uv_array
         mapping_array       = self.data.mapping_array
 
-        # Prepare CL essentials
-        device        = self.device
-        context       = self.context
-        queue         = self.queue
-        cl_kernel_source \
-            = pocl.read_kernel_source(cl_src_path,['rng.cl','essentials.cl',
-                    'writearray.cl','updatetraj.cl','computestep.cl',
-                    'rungekutta.cl','trajectory.cl','integratetraj.cl'])
-                
         # Seed point selection, padding and shuffling
         n_trajectory_seed_points = info.n_trajectory_seed_points
         pad_width                = info.pad_width
@@ -123,6 +121,7 @@ class Trajectories():
             = create_seeds(mask_array, pad_width, n_work_items, 
                            n_seed_points=n_trajectory_seed_points, 
                            do_shuffle=do_shuffle, rng_seed=shuffle_rng_seed,
+                           curve=info.seed_point_curve,
                            verbose=self.verbose)
         info.n_seed_points        = n_seed_points
         info.n_padded_seed_points = n_padded_seed_points
@@ -132,12 +131,26 @@ class Trajectories():
             mapping_array = np.zeros_like(mask_array, dtype=np.uint32)
     
         # Chunkification
-        gpu_traj_memory_limit = (device.get_info(cl.device_info.GLOBAL_MEM_SIZE) 
-                                 *info.gpu_memory_limit_pc)//100
+        if self.compute_backend=='opencl':
+            memory_size = self.device.get_info(cl.device_info.GLOBAL_MEM_SIZE)
+        else:
+            memory_size = cpukernels.host_memory_size() or 2**33
+        gpu_traj_memory_limit = (int(memory_size)*int(info.gpu_memory_limit_pc))//100
         full_traj_memory_request = (n_seed_points*np.dtype(np.uint8).itemsize
                                     *info.max_n_steps*2)
-        n_chunks_required = max(1,int(np.ceil(
-                            full_traj_memory_request/gpu_traj_memory_limit)) )
+        # When pipelining, each of the chunk buffers must fit into the memory limit,
+        #   and there must be at least as many chunks as buffers to overlap
+        is_pipelined = (self.compute_backend=='opencl' and info.n_chunk_buffers>1)
+        n_chunk_buffers = int(info.n_chunk_buffers) if is_pipelined else 1
+        # When integrating bidirectionally, each chunk holds both the downstream
+        #   and the upstream trajectories of its seed points
+        self.is_bidirectional = (self.compute_backend=='opencl' 
+                                 and bool(info.do_trace_bidirectional)
+                                 and self.do_trace_downstream and self.do_trace_upstream)
+        n_directions = 2 if self.is_bidirectional else 1
+        n_chunks_required = max(n_chunk_buffers,int(np.ceil(
+                    full_traj_memory_request*n_directions*n_chunk_buffers
+                    /gpu_traj_memory_limit)) )
                 
         vprint(self.verbose,
                'GPU/OpenCL device global memory limit for streamline trajectories: {}' 
@@ -149,8 +162,21 @@ class Trajectories():
                         else 'need to split into {} chunks'.format(n_chunks_required) ))
         self.choose_chunks(n_chunks_required)
         
-        # Do integrations on the GPU
-        self.gpu_compute_trajectories( device, context, queue, cl_kernel_source )
+        # Do integrations on the GPU - or on the CPU
+        if self.compute_backend=='opencl':
+            # Prepare CL essentials
+            cl_kernel_source \
+                = pocl.read_kernel_source(cl_src_path,['rng.cl','essentials.cl',
+                        'writearray.cl','updatetraj.cl','computestep.cl',
+                        'rungekutta.cl','trajectory.cl','integratetraj.cl'])
+            if is_pipelined:
+                self.gpu_pipeline_trajectories( self.device, self.context, self.queue, 
+                                                cl_kernel_source )
+            else:
+                self.gpu_compute_trajectories( self.device, self.context, self.queue, 
+                                               cl_kernel_source )
+        else:
+            self.cpu_compute_trajectories()
             
         # Streamline stats
         pixel_size = info.pixel_size
@@ -167,6 +193,8 @@ class Trajectories():
         """
         Compute lists of parameters needed to carry out GPU/OpenCL device computations
         in chunks.
+        Each chunk entry lists the downstream (0) and/or upstream (1) trajectory indexes
+        it integrates: both, in one pass, if integrating bidirectionally.
         
         Args:
             n_chunks (int):
@@ -176,15 +204,22 @@ class Trajectories():
         n_padded_seed_points = self.info.n_padded_seed_points
         n_work_items         = self.info.n_work_items
         
-        self.chunk_size = int(np.round(n_padded_seed_points/n_chunks))
+        # Chunks must be whole numbers of work groups, lest the last work group
+        #   of a chunk overrun its chunk buffers
+        self.chunk_size = int(n_work_items*np.ceil(n_padded_seed_points
+                                                   /(n_chunks*n_work_items)))
         n_global = n_padded_seed_points
         chunk_list = [[chunk_idx, chunk,
                        min(n_seed_points,chunk+self.chunk_size)-chunk, self.chunk_size] 
                        for chunk_idx,chunk 
                         in enumerate(range(0,n_global,self.chunk_size))]            
     
-        trace_do_list = [[self.do_trace_downstream, 'Downstream:', 0, np.float32(+1.0)]]\
-                      + [[self.do_trace_upstream,   'Upstream:  ', 1, np.float32(-1.0)]]
+        if self.is_bidirectional:
+            trace_do_list = [[True, 'Down+upstream:', [0,1], np.float32(+1.0)]]
+        else:
+            trace_do_list \
+                = [[self.do_trace_downstream, 'Downstream:', [0], np.float32(+1.0)]]\
+                + [[self.do_trace_upstream,   'Upstream:  ', [1], np.float32(-1.0)]]
         self.trace_do_chunks = [td+chunk for td in trace_do_list for chunk in chunk_list]
             
         vprint(self.verbose,'Total number of kernel instances: {0:,}'
@@ -209,7 +244,7 @@ class Trajectories():
             3) enqueueing kernel events (inc. passing data to CL device via buffers)
             4) reporting kernel status
             5) enqueueing data returns from CL device to CPU
-            6) parsing returned streamline trajectories into master np array
+            6) packing returned streamline trajectories into CSR streamline sets
             7) parsing returned streamline array (slt, slc) chunks into master np arrays
     
         Args:
@@ -228,16 +263,19 @@ class Trajectories():
         mapping_array       = self.data.mapping_array
         
         # Prepare memory, buffers 
-        streamline_arrays_list = [[],[]]
+        #   - streamline steps are packed per chunk & later joined into CSR stores
+        streamline_steps_list = [[],[]]
         ns = info.n_seed_points
         nl = info.max_n_steps
         traj_nsteps_array  = np.zeros([ns,2], dtype=np.uint16)
         traj_length_array  = np.zeros([ns,2], dtype=np.float32)
         # Chunk-sized temporary arrays
         # Use "bag o' bytes" buffer for huge trajectories array. Write (by GPU) only.
-        chunk_trajcs_array = np.zeros([self.chunk_size,nl,2], dtype=np.int8)
-        chunk_nsteps_array = np.zeros([self.chunk_size], dtype=traj_nsteps_array.dtype)
-        chunk_length_array = np.zeros([self.chunk_size], dtype=traj_length_array.dtype)
+        #   - with a downstream and an upstream trajectory per seed if bidirectional
+        nd = 2 if self.is_bidirectional else 1
+        chunk_trajcs_array = np.zeros([self.chunk_size,nd,nl,2], dtype=np.int8)
+        chunk_nsteps_array = np.zeros([self.chunk_size,nd], dtype=traj_nsteps_array.dtype)
+        chunk_length_array = np.zeros([self.chunk_size,nd], dtype=traj_length_array.dtype)
         array_dict = { 'seed_point':   {'array': seed_point_array,  'rwf': 'RO'},
                        'mask':         {'array': mask_array,        'rwf': 'RO'}, 
                        'uv':           {'array': uv_array,          'rwf': 'RO'}, 
@@ -254,12 +292,12 @@ class Trajectories():
         n_work_items = info.n_work_items
         chunk_size_factor = info.chunk_size_factor
         max_time_per_kernel = info.max_time_per_kernel
-        for downup_str, downup_idx, downup_sign, chunk_idx, \
+        for downup_str, downup_idxs, downup_sign, chunk_idx, \
             seeds_chunk_offset, n_chunk_seeds, n_chunk_ki in [td[1:] \
                 for td in self.trace_do_chunks if td[0]]:
             vprint(self.verbose,
                    '{0} downup={1} sgn(uv)={2:+} chunk={3} seeds: {4}+{5} => {6:}'
-                       .format(downup_str, downup_idx, downup_sign, chunk_idx,
+                       .format(downup_str, downup_idxs, downup_sign, chunk_idx,
                                seeds_chunk_offset, n_chunk_seeds, 
                                seeds_chunk_offset+n_chunk_seeds))
     
@@ -274,21 +312,27 @@ class Trajectories():
             
             ##################################
             
-            # Compile the CL code
+            # Compile the CL code - only once per downup pass thanks to the cache
             compile_options = pocl.set_compile_options(info, 'INTEGRATE_TRAJECTORY', 
-                                                       downup_sign=downup_sign)
+                                                downup_sign=downup_sign,
+                                                is_bidirectional=self.is_bidirectional)
             vprint(self.gpu_verbose,'Compile options:\n',compile_options)
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                program = cl.Program(context,
-                                     cl_kernel_source).build(options=compile_options)
+            program = pocl.build_program(context, device, cl_kernel_source, 
+                                         compile_options,
+                                         cache_size=info.cl_program_cache_size,
+                                         cache_dir=info.cl_program_cache_dir,
+                                         verbose=self.gpu_verbose)
             pocl.report_build_log(program, device, self.gpu_verbose)
             # Set the GPU kernel
-            kernel = program.integrate_trajectory
+            kernel = cl.Kernel(program, 'integrate_trajectory')
             
-            # Designate buffered arrays
-            kernel.set_args(*list(buffer_dict.values()))
-            kernel.set_scalar_arg_dtypes( [None]*len(buffer_dict) )
+            # Designate buffered arrays, then the seed count & chunk offset scalars,
+            #   then the grid geometry
+            grid_buffer = pocl.prepare_grid_params_buffer(context, info, 
+                                                          downup_sign=downup_sign)
+            kernel.set_scalar_arg_dtypes( [None]*len(buffer_dict)+[np.uint32]*2+[None] )
+            kernel.set_args(*list(buffer_dict.values()), 
+                            info.n_seed_points, seeds_chunk_offset, grid_buffer)
             
             # Trace the streamlines on the GPU    
             vprint(self.gpu_verbose,
@@ -313,35 +357,299 @@ class Trajectories():
                     cl.enqueue_copy(queue, array_info[1]['array'], 
                                     buffer_dict[array_info[0]])
                     queue.finish()
+                    profiling.record_transfer('d2h', array_info[1]['array'].nbytes)
     
             ##################################
                             
-            # This is part going to be slow...
-            for traj_nsteps,traj_vec in \
-                zip(chunk_nsteps_array[:n_chunk_seeds], 
-                    chunk_trajcs_array[:n_chunk_seeds]): 
-                # Pair traj point counts with traj vectors
-                #   over the span of seed points in this chunk
-                streamline_arrays_list[downup_idx] += [  traj_vec[:traj_nsteps].copy()  ]
-                # Add this traj vector nparray to the list of streamline nparrays
+            self.unpack_chunk(chunk_trajcs_array, chunk_nsteps_array, 
+                              chunk_length_array, downup_idxs, 
+                              seeds_chunk_offset, n_chunk_seeds,
+                              streamline_steps_list, 
+                              traj_nsteps_array, traj_length_array)
+        
+        self.store_trajectories(streamline_steps_list, 
+                                traj_nsteps_array, traj_length_array)
+
+    def cpu_compute_trajectories(self):
+        """
+        Carry out CPU (Numba) computations in chunks, in the same way as
+        :meth:`gpu_compute_trajectories`, using the parallel kernel
+        :func:`.cpukernels.integrate_trajectory`.
+        """
+        # Shorthand
+        info                = self.info
+        seed_point_array    = self.data.seed_point_array
+        mask_array          = np.ascontiguousarray(self.data.mask_array).ravel()
+        # A compactly encoded uv field is decoded once, up front
+        uv_array            = np.ascontiguousarray(decode_uv_field(self.data.uv_array,
+                                                  info.uv_encoding)).reshape(-1,2)
+        
+        # Prepare memory
+        streamline_steps_list = [[],[]]
+        ns = info.n_seed_points
+        nl = info.max_n_steps
+        traj_nsteps_array  = np.zeros([ns,2], dtype=np.uint16)
+        traj_length_array  = np.zeros([ns,2], dtype=np.float32)
+        chunk_trajcs_array = np.zeros([self.chunk_size,nl,2], dtype=np.int8)
+        chunk_nsteps_array = np.zeros([self.chunk_size], dtype=traj_nsteps_array.dtype)
+        chunk_length_array = np.zeros([self.chunk_size], dtype=traj_length_array.dtype)
+        
+        # Downstream and upstream passes in chunks of seed points
+        for downup_str, downup_idxs, downup_sign, chunk_idx, \
+            seeds_chunk_offset, n_chunk_seeds, n_chunk_ki in [td[1:] \
+                for td in self.trace_do_chunks if td[0]]:
+            vprint(self.verbose,
+                   '{0} downup={1} sgn(uv)={2:+} chunk={3} seeds: {4}+{5} => {6:}'
+                       .format(downup_str, downup_idxs, downup_sign, chunk_idx,
+                               seeds_chunk_offset, n_chunk_seeds, 
+                               seeds_chunk_offset+n_chunk_seeds))
+            info.downup_sign = downup_sign
+            info.seeds_chunk_offset = seeds_chunk_offset
+            parameters = cpukernels.set_kernel_parameters(info, downup_sign)
+            with profiling.span('kernel', 'integrate_trajectory', backend='numba'):
+                cpukernels.integrate_trajectory(seed_point_array, mask_array, uv_array,
+                                                chunk_trajcs_array, chunk_nsteps_array,
+                                                chunk_length_array, int(n_chunk_seeds),
+                                                int(seeds_chunk_offset), parameters)
+            self.unpack_chunk(chunk_trajcs_array[:,np.newaxis], 
+                              chunk_nsteps_array[:,np.newaxis], 
+                              chunk_length_array[:,np.newaxis], downup_idxs, 
+                              seeds_chunk_offset, n_chunk_seeds,
+                              streamline_steps_list, 
+                              traj_nsteps_array, traj_length_array)
+        
+        self.store_trajectories(streamline_steps_list, 
+                                traj_nsteps_array, traj_length_array)
+
+    def gpu_pipeline_trajectories( self, device, context, queue, cl_kernel_source ):
+        """
+        Carry out GPU/OpenCL device computations in chunks, as does 
+        :meth:`gpu_compute_trajectories`, but pipelined so that the integration 
+        of a chunk overlaps the read back and packing of the chunks before it.
+        
+        Each of n_chunk_buffers (two or more) slots has its own set of chunk 
+        trajectory buffers, into which chunks are integrated in turn. 
+        Kernels are run on the compute queue, and the chunk results are read back 
+        on a separate transfer queue, each read waiting on its chunk's kernel events.
+        A slot is only reused once its previous chunk has been read back 
+        and packed on the host; meanwhile the device works on the chunk in the 
+        other slot(s). Only the chunk buffers are read back per chunk: 
+        the mapping grid is read back once at the end.
+    
+        Args:
+            device (pyopencl.Device):
+            context (pyopencl.Context):
+            queue (pyopencl.CommandQueue): compute queue
+            cl_kernel_source (str):
+        """
+        # Shorthand
+        info                = self.info
+        n_work_items        = int(info.n_work_items)
+        max_time_per_kernel = float(info.max_time_per_kernel)
+        
+        # Prepare memory, buffers 
+        #   - streamline steps are packed per chunk & later joined into CSR stores
+        streamline_steps_list = [[],[]]
+        ns = info.n_seed_points
+        nl = info.max_n_steps
+        traj_nsteps_array = np.zeros([ns,2], dtype=np.uint16)
+        traj_length_array = np.zeros([ns,2], dtype=np.float32)
+        array_dict = { 'seed_point': {'array': self.data.seed_point_array, 'rwf': 'RO'},
+                       'mask':       {'array': self.data.mask_array,       'rwf': 'RO'}, 
+                       'uv':         {'array': self.data.uv_array,         'rwf': 'RO'}, 
+                       'mapping':    {'array': self.data.mapping_array,    'rwf': 'RW'} }
+        buffer_dict = pocl.prepare_buffers(context, array_dict, self.verbose)
+        # Chunk-sized host arrays & device buffers, one set per slot
+        #   - with a downstream and an upstream trajectory per seed if bidirectional
+        nd = 2 if self.is_bidirectional else 1
+        slots = []
+        for slot_idx in range(int(info.n_chunk_buffers)):
+            chunk_arrays = {
+                'chunk_trajcs': np.zeros([self.chunk_size,nd,nl,2], dtype=np.int8),
+                'chunk_nsteps': np.zeros([self.chunk_size,nd], 
+                                         dtype=traj_nsteps_array.dtype),
+                'chunk_length': np.zeros([self.chunk_size,nd], 
+                                         dtype=traj_length_array.dtype)
+                }
+            chunk_buffers = {name: cl.Buffer(context, cl.mem_flags.WRITE_ONLY, 
+                                             array.nbytes)
+                             for name,array in chunk_arrays.items()}
+            slots += [{'arrays': chunk_arrays, 'buffers': chunk_buffers}]
+        vprint(self.verbose,'Pipelining chunks through {0} buffers of {1} each'
+               .format(len(slots), neatly(sum([array.nbytes for array 
+                                               in slots[0]['arrays'].values()]))))
+        transfer_queue = cl.CommandQueue(context, device,
+                                properties=cl.command_queue_properties.PROFILING_ENABLE)
+
+        # Kernels (and grid parameters) by downup pass - built only once thanks to
+        #   the program cache
+        kernels, grid_buffers = {}, {}
+        def get_kernel(downup_idxs, downup_sign):
+            downup_key = tuple(downup_idxs)
+            if downup_key not in kernels.keys():
+                info.downup_sign = downup_sign
+                compile_options = pocl.set_compile_options(info,'INTEGRATE_TRAJECTORY', 
+                                                downup_sign=downup_sign,
+                                                is_bidirectional=self.is_bidirectional)
+                vprint(self.gpu_verbose,'Compile options:\n',compile_options)
+                program = pocl.build_program(context, device, cl_kernel_source, 
+                                             compile_options,
+                                             cache_size=info.cl_program_cache_size,
+                                             cache_dir=info.cl_program_cache_dir,
+                                             verbose=self.gpu_verbose)
+                pocl.report_build_log(program, device, self.gpu_verbose)
+                kernel = cl.Kernel(program, 'integrate_trajectory')
+                kernel.set_scalar_arg_dtypes( [None]*7+[np.uint32]*2+[None] )
+                pocl.report_kernel_info(device,kernel,self.gpu_verbose)
+                kernels[downup_key] = kernel
+                grid_buffers[downup_key] \
+                    = pocl.prepare_grid_params_buffer(context, info, 
+                                                      downup_sign=downup_sign)
+            return kernels[downup_key], grid_buffers[downup_key]
+        
+        # Wait for a chunk's read back, then pack its trajectories etc
+        launch_size = n_work_items*int(info.chunk_size_factor)
+        def retire_chunk(chunk):
+            nonlocal launch_size
+            cl.wait_for_events(chunk['read_events'])
+            downup_idxs, seeds_chunk_offset, n_chunk_seeds \
+                = chunk['downup_idxs'], chunk['seeds_chunk_offset'], chunk['n_chunk_seeds']
+            chunk_arrays = chunk['slot']['arrays']
+            for name,array in chunk_arrays.items():
+                profiling.record_transfer('d2h', array.nbytes)
+            try:
+                device_time = 1e-9*sum([event.profile.end-event.profile.start
+                                        for event in chunk['kernel_events']])
+            except:
+                device_time = np.nan
+            profiling.record_span('kernel', 'integrate_trajectory', chunk['t_start'],
+                                  time.perf_counter()-chunk['t_start'],
+                                  device_time=device_time, 
+                                  n_work_items=int(chunk['n_items']))
+            # Size the next kernel launches from this chunk's timing
+            launch_size = pocl.kernel_launch_size(chunk['kernel_events'], 
+                                                  chunk['n_items'], n_work_items, 
+                                                  max_time_per_kernel, launch_size)
+            self.unpack_chunk(chunk_arrays['chunk_trajcs'], chunk_arrays['chunk_nsteps'], 
+                              chunk_arrays['chunk_length'], downup_idxs, 
+                              seeds_chunk_offset, n_chunk_seeds,
+                              streamline_steps_list, 
+                              traj_nsteps_array, traj_length_array)
+             
+        # Downstream and upstream passes in chunks of seed points
+        pending_chunks = deque()
+        for chunk_number, (downup_str, downup_idxs, downup_sign, chunk_idx, 
+                           seeds_chunk_offset, n_chunk_seeds, n_chunk_ki) \
+                in enumerate([td[1:] for td in self.trace_do_chunks if td[0]]):
+            vprint(self.verbose,
+                   '{0} downup={1} sgn(uv)={2:+} chunk={3} seeds: {4}+{5} => {6:}'
+                       .format(downup_str, downup_idxs, downup_sign, chunk_idx,
+                               seeds_chunk_offset, n_chunk_seeds, 
+                               seeds_chunk_offset+n_chunk_seeds))
+            # Free up this chunk's slot: the device meanwhile integrates the
+            #   chunk(s) enqueued since its previous chunk
+            if len(pending_chunks)==len(slots):
+                retire_chunk(pending_chunks.popleft())
+            slot = slots[chunk_number%len(slots)]
             
-            # Fetch number of steps (integration points) per trajectory, and the lengths,
-            #   and transfer the streamline trajectories to a compact np array of arrays
-            traj_nsteps_array[seeds_chunk_offset:(seeds_chunk_offset+n_chunk_seeds),
-                              downup_idx] = chunk_nsteps_array[:n_chunk_seeds].copy()
-            traj_length_array[seeds_chunk_offset:(seeds_chunk_offset+n_chunk_seeds),
-                              downup_idx] = chunk_length_array[:n_chunk_seeds].copy()
+            # Integrate the chunk on the compute queue...
+            kernel, grid_buffer = get_kernel(downup_idxs, downup_sign)
+            kernel.set_args(*list(buffer_dict.values()),
+                            *list(slot['buffers'].values()), 
+                            info.n_seed_points, seeds_chunk_offset, grid_buffer)
+            t_start = time.perf_counter()
+            kernel_events = pocl.enqueue_nd_range_kernel_split(queue, kernel, 
+                                                               [n_chunk_ki,1],
+                                                               [n_work_items,1], 
+                                                               n_work_items, 
+                                                               launch_size)
+            queue.flush()
+            # ...and read it back on the transfer queue once done
+            read_events = [cl.enqueue_copy(transfer_queue, slot['arrays'][name], 
+                                           slot['buffers'][name], is_blocking=False,
+                                           wait_for=kernel_events)
+                           for name in slot['arrays'].keys()]
+            transfer_queue.flush()
+            pending_chunks.append({'slot': slot, 'downup_idxs': downup_idxs, 
+                                   'seeds_chunk_offset': seeds_chunk_offset,
+                                   'n_chunk_seeds': n_chunk_seeds, 
+                                   'n_items': n_work_items*int(np.ceil(n_chunk_ki
+                                                                 /n_work_items)),
+                                   'kernel_events': kernel_events,
+                                   'read_events': read_events, 't_start': t_start})
+        while len(pending_chunks)>0:
+            retire_chunk(pending_chunks.popleft())
+        
+        # The mapping grid is only read back once, at the end
+        cl.enqueue_copy(queue, self.data.mapping_array, buffer_dict['mapping'])
+        queue.finish()
+        profiling.record_transfer('d2h', self.data.mapping_array.nbytes)
+        
+        self.store_trajectories(streamline_steps_list, 
+                                traj_nsteps_array, traj_length_array)
+        
+    def unpack_chunk(self, chunk_trajcs_array, chunk_nsteps_array, chunk_length_array,
+                     downup_idxs, seeds_chunk_offset, n_chunk_seeds,
+                     streamline_steps_list, traj_nsteps_array, traj_length_array):
+        """
+        Pack the valid steps of a chunk's trajectories back to back, 
+        in seed order, in one vectorized masked copy per direction, 
+        and fetch the number of steps (integration points) and the length
+        of each trajectory.
+        
+        Args:
+            chunk_trajcs_array (numpy.ndarray): chunk trajectories, 
+                                           shape (chunk_size,len(downup_idxs),nl,2)
+            chunk_nsteps_array (numpy.ndarray): shape (chunk_size,len(downup_idxs))
+            chunk_length_array (numpy.ndarray): shape (chunk_size,len(downup_idxs))
+            downup_idxs (list): downstream (0) and/or upstream (1) indexes of 
+                                the chunk's trajectories
+            seeds_chunk_offset (int): index of the chunk's first seed point
+            n_chunk_seeds (int): number of seed points in the chunk
+            streamline_steps_list (list): downstream & upstream lists of chunk steps
+            traj_nsteps_array (numpy.ndarray):
+            traj_length_array (numpy.ndarray):
+        """
+        seeds_slice = slice(seeds_chunk_offset,seeds_chunk_offset+n_chunk_seeds)
+        for direction_idx,downup_idx in enumerate(downup_idxs):
+            streamline_steps_list[downup_idx] \
+                += [pack_trajectories(chunk_trajcs_array[:n_chunk_seeds,direction_idx],
+                                      chunk_nsteps_array[:n_chunk_seeds,direction_idx])]
+            traj_nsteps_array[seeds_slice,downup_idx] \
+                = chunk_nsteps_array[:n_chunk_seeds,direction_idx]
+            traj_length_array[seeds_slice,downup_idx] \
+                = chunk_length_array[:n_chunk_seeds,direction_idx]
         
+    def store_trajectories(self, streamline_steps_list, 
+                           traj_nsteps_array, traj_length_array):
+        """
+        Join the packed steps of each chunk into downstream and upstream 
+        CSR streamline sets, and store them along with the trajectory step counts 
+        and lengths.
+        
+        Args:
+            streamline_steps_list (list): downstream & upstream lists of chunk steps
+            traj_nsteps_array (numpy.ndarray):
+            traj_length_array (numpy.ndarray):
+        """
+        ns = self.info.n_seed_points
         vprint(self.verbose,'Building streamlines compressed array')
+        streamline_arrays_list = [StreamlineSet(),StreamlineSet()]
         for downup_idx in [0,1]:
+            if len(streamline_steps_list[downup_idx])==0:
+                continue
+            offsets_array = np.zeros((ns+1,), dtype=np.int64)
+            np.cumsum(traj_nsteps_array[0:ns,downup_idx], out=offsets_array[1:])
             streamline_arrays_list[downup_idx] \
-                = np.array(streamline_arrays_list[downup_idx])
+                = StreamlineSet(np.concatenate(streamline_steps_list[downup_idx]),
+                                offsets_array)
+            streamline_steps_list[downup_idx] = None
         vprint(self.verbose,
                'Streamlines actual array allocation:  size={}'.format(neatly(
-           np.sum(traj_nsteps_array[:,:])*np.dtype(chunk_trajcs_array.dtype).itemsize)))
+           streamline_arrays_list[0].nbytes()+streamline_arrays_list[1].nbytes())))
        
        # Do copy() to force array truncation rather than return of a truncated view
-        self.data.streamline_arrays_list = streamline_arrays_list[0:ns].copy()
+        self.data.streamline_arrays_list = streamline_arrays_list
         self.data.traj_nsteps_array      = traj_nsteps_array[0:ns].copy()
         self.data.traj_length_array      = traj_length_array[0:ns].copy()
         
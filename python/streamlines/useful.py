@@ -1,7 +1,8 @@
 """
 ---------------------------------------------------------------------
 
-Module providing Data and Info classes, as well as a suite of useful functions.
+Module providing Data, Info and StreamlineSet classes, as well as a suite of 
+useful functions.
 
 Requires Python packages/modules:
   -  `GDAL`_  (see also `OSGeo`_)
@@ -28,9 +29,17 @@ import os
 os.environ['PYTHONUNBUFFERED']='True'
 import sys
 
-__all__ = ['Data', 'Info', 'get_bbox','check_sizes', 
-           'read_geotiff','write_geotiff','npamem','true_size','neatly','vprint',
-           'create_seeds','pick_seeds','compute_stats','dilate']
+__all__ = ['Data', 'Info', 'StreamlineSet', 'pack_trajectories',
+           'get_bbox','check_sizes', 
+           'open_geotiff','read_geotiff_window','read_geotiff_roi',
+           'read_geotiff','geotiff_creation_options','write_geotiff',
+           'create_tiled_geotiff','write_geotiff_window',
+           'npamem','true_size','neatly','vprint',
+           'create_seeds','space_filling_curve_index','stratify_seeds',
+           'pick_seeds','compute_stats',
+           'lookup_labels','compute_label_stats','dilate','decimate_grid',
+           'encode_uv_field','decode_uv_field','tile_grid',
+           'untile_grid']
 
 pdebug = print
 
@@ -81,7 +90,11 @@ class Data():
         if mapping_array is not None:
             self.mapping_array = mapping_array[bounds_grid].copy()
         if uv_array is not None:
-            self.uv_array  = uv_array[bounds_slx].copy()
+            # NB: 2d indexing so as to slice compactly encoded uv grids too
+            self.uv_array  = uv_array[bounds_grid].copy()
+            if info is not None and info.uv_is_tiled:
+                # Rearranged into square tiles for locality of kernel reads
+                self.uv_array = tile_grid(self.uv_array, info.uv_tile_size)
         else:
             self.uv_array  = None
         if sla_array is not None:
@@ -173,12 +186,17 @@ class Info():
         self.n_seed_points               = np.uint32(0)
         self.n_padded_seed_points        = np.uint32(0)
         self.do_shuffle                  = np.bool8(trace.do_shuffle_seed_points)
+        self.seed_point_curve            = trace.seed_point_curve
         self.shuffle_rng_seed            = np.uint32(trace.shuffle_rng_seed)
         self.downup_sign                 = np.float32(np.nan)
         self.gpu_memory_limit_pc         = np.uint32(state.gpu_memory_limit_pc)
         self.n_work_items                = np.uint32(state.n_work_items)
         self.chunk_size_factor           = np.uint32(state.chunk_size_factor)
+        self.n_chunk_buffers             = np.uint32(max(1,trace.n_chunk_buffers))
+        self.do_trace_bidirectional      = np.bool8(trace.do_trace_bidirectional)
         self.max_time_per_kernel         = np.float32(state.max_time_per_kernel)
+        self.cl_program_cache_size       = int(state.cl_program_cache_size)
+        self.cl_program_cache_dir        = state.cl_program_cache_dir
         self.integrator_step_factor      = np.float32(trace.integrator_step_factor)
         self.max_integration_step_error  = np.float32(trace.max_integration_step_error)
         self.adjusted_max_error          = 0.85*np.sqrt(trace.max_integration_step_error)
@@ -192,6 +210,22 @@ class Info():
         self.subpixel_seed_step          = np.float32(subpixel_seed_step)
         self.jitter_magnitude            = np.float32(trace.jitter_magnitude)
         self.interchannel_max_n_steps    = np.uint32(interchannel_max_n_steps)
+        self.uv_encoding                 = trace.preprocess.uv_encoding
+        self.uv_is_half                  = np.bool8(self.uv_encoding=='half')
+        self.uv_is_angle                 = np.bool8(self.uv_encoding=='angle')
+        # Tiling only suits the OpenCL kernels; the CPU kernels read row-major uv
+        self.uv_tile_size                = np.uint32(trace.uv_tile_size 
+                                            if state.compute_backend=='opencl' else 0)
+        self.uv_is_tiled                 = np.bool8(self.uv_tile_size>1)
+        # Streamline merging is only implemented in the OpenCL kernels
+        self.do_memoize_fields           = np.bool8(trace.do_memoize_fields
+                                            and state.compute_backend=='opencl')
+        self.memo_min_length             = np.float32(trace.memo_min_length/pixel_size)
+        self.memo_flow_scheme            = trace.memo_flow_scheme
+        self.fields_engine               = trace.fields_engine
+        self.mfd_exponent                = np.float32(trace.mfd_exponent)
+        self.do_privatize_accumulation   = np.bool8(trace.do_privatize_accumulation)
+        self.slt_scale                   = np.float32(trace.slt_scale)
         
         self.left_flank_addition = 2147483648
         self.set_flags(self)
@@ -267,6 +301,98 @@ class Info():
             ]
         [setattr(obj,flag,np.uint(2**idx)) for idx,flag in enumerate(flags)]
 
+class StreamlineSet():
+    """
+    Compact store of a set of streamline trajectories in CSR layout.
+    
+    All the trajectories are held back to back in one contiguous array of 
+    compressed (dx,dy) int8 step vectors, and the steps of trajectory ``i`` 
+    are ``steps_array[offsets_array[i]:offsets_array[i+1]]``. 
+    Indexing the set returns a zero-copy view of one trajectory, so the set can be 
+    used in place of the list of trajectory arrays it replaces.
+    
+    Args:
+        steps_array (numpy.ndarray): all trajectory steps, shape (n_steps,2), int8
+        offsets_array (numpy.ndarray): index of first step of each trajectory,
+                                       plus total, shape (n_trajectories+1,), int64
+    """
+    def __init__(self, steps_array=None, offsets_array=None):
+        """
+        Args:
+            steps_array (numpy.ndarray):
+            offsets_array (numpy.ndarray):
+        """
+        if steps_array is None:
+            steps_array = np.zeros((0,2), dtype=np.int8)
+        if offsets_array is None:
+            offsets_array = np.zeros((1,), dtype=np.int64)
+        offsets_array = offsets_array.astype(np.int64, copy=False)
+        if offsets_array[-1]!=steps_array.shape[0]:
+            raise ValueError('Mismatched streamline steps & offsets: {0} vs {1}'
+                             .format(steps_array.shape[0],offsets_array[-1]))
+        self.steps_array   = steps_array
+        self.offsets_array = offsets_array
+        
+    def __len__(self):
+        return self.offsets_array.shape[0]-1
+    
+    def __getitem__(self, idx):
+        """
+        Args:
+            idx (int): trajectory index
+        
+        Returns:
+            numpy.ndarray: 
+                view of the trajectory steps, shape (n_steps,2), int8
+        """
+        if idx<0:
+            idx += len(self)
+        if idx<0 or idx>=len(self):
+            raise IndexError('Streamline index {} out of range'.format(idx))
+        return self.steps_array[self.offsets_array[idx]:self.offsets_array[idx+1]]
+    
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+            
+    def nsteps(self):
+        """
+        Returns:
+            numpy.ndarray: number of steps in each trajectory
+        """
+        return np.diff(self.offsets_array)
+            
+    def nbytes(self):
+        """
+        Returns:
+            int: memory used by the steps and offsets arrays
+        """
+        return self.steps_array.nbytes+self.offsets_array.nbytes
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: steps and offsets arrays, e.g. for :func:`numpy.savez_compressed`
+        """
+        return {'steps': self.steps_array, 'offsets': self.offsets_array}
+
+def pack_trajectories(trajcs_array, nsteps_array):
+    """
+    Pack a block of padded trajectory arrays into one contiguous step array
+    (in trajectory order) without looping over trajectories.
+    
+    Args:
+        trajcs_array (numpy.ndarray): trajectories, shape (n_trajectories,max_n_steps,2)
+        nsteps_array (numpy.ndarray): number of valid steps in each trajectory
+    
+    Returns:
+        numpy.ndarray:
+            packed steps, shape (sum(nsteps_array),2)
+    """
+    is_step_array = (np.arange(trajcs_array.shape[1])[np.newaxis,:]
+                     < nsteps_array[:,np.newaxis])
+    return trajcs_array[is_step_array]
+
 def get_bbox(array):
     """
     Args:
@@ -303,7 +429,13 @@ def check_sizes(nx,ny,array_dict):
         array_name = ad_item[0]
         if array_name not in ('seed_point','subsegment_hsl'):
             array = ad_item[1]['array']
-            if array.shape[0]!=nx or array.shape[1]!=ny:
+            if array_name=='uv' and array.ndim>=4:
+                # Tiled grid (see tile_grid()): check the number of tiles instead
+                is_mismatched = (array.shape[0]!=-(-int(nx)//array.shape[2])
+                                 or array.shape[1]!=-(-int(ny)//array.shape[3]))
+            else:
+                is_mismatched = (array.shape[0]!=nx or array.shape[1]!=ny)
+            if is_mismatched:
                 # raise ValueError
                 pdebug('Array "{0}" size {1} vs mismatches info {2}'
                                  .format(array_name, array.shape, (nx,ny)) )
@@ -312,13 +444,13 @@ def check_sizes(nx,ny,array_dict):
 #                 pdebug('No such array: {}'.format(array_name))
 #             elif 
             
-def read_geotiff(path, filename):
+def open_geotiff(path, filename):
     """
     Args:
         path (str): Path to folder containing GeoTIFF file to be read
         filename (str): GeoTIFF filename
     
-    Import a pixel grid from a GeoTIFF file along with its metadata.
+    Open a GeoTIFF file and parse its metadata without reading its pixel grid.
     
     Assumes the file contains a single-band 2d grid of equal x-y dimension pixels.
 
@@ -326,8 +458,8 @@ def read_geotiff(path, filename):
         ValueError if file cannot be opened for reading.
         
     Returns:
-        numpy.ndarray, float: 
-        Imported GeoTIFF grid; size of a grid pixel in meters
+        gdal.Dataset, float: 
+        Opened GeoTIFF dataset; size of a grid pixel in meters
     """          
     fullpath_filename = os.path.join(path,filename)
     tiff=gdal.Open(fullpath_filename)
@@ -335,8 +467,6 @@ def read_geotiff(path, filename):
         raise ValueError('Cannot open GeoTIFF file "{}" for reading'
                          .format(fullpath_filename))
     geotransform = tiff.GetGeoTransform()
-    x_easting_bottomleft  = geotransform[0]
-    y_northing_bottomleft = geotransform[3]+geotransform[5]
     pixel_size = geotransform[1]
     vprint('DTM GeoTIFF coordinate "geotransform":',geotransform)
     if not np.isclose(pixel_size,geotransform[5]*(-1),rtol=1e-3):
@@ -344,48 +474,303 @@ def read_geotiff(path, filename):
             'Pixel x={0} and y={1} dimensions not equal in "{2}":'
             .format(pixel_size, (-1)*geotransform[5], fullpath_filename)
             +' cannot handle non-square pixels' )
-    return (tiff.GetRasterBand(1).ReadAsArray().astype(np.float32), tiff, pixel_size)
+    return (tiff, pixel_size)
+
+def read_geotiff_window(tiff, window=None):
+    """
+    Args:
+        tiff (gdal.Dataset): GeoTIFF dataset opened with :func:`open_geotiff`
+        window (list): read window [x_offset, y_offset, x_size, y_size] in GeoTIFF
+                       pixel coordinates (row 0 at the top); whole grid if None
+    
+    Read a pixel grid, or just a rectangular window of it, from an open GeoTIFF file.
+    Only the window is read from disk, so memory use is bounded by its size.
         
-def write_geotiff(path, file_name, array, nx,ny,npd, pslice, geodata):
+    Returns:
+        numpy.ndarray: 
+        Imported GeoTIFF (sub)grid as float32 in GeoTIFF orientation
+    """          
+    band = tiff.GetRasterBand(1)
+    if window is None:
+        return band.ReadAsArray().astype(np.float32)
+    return band.ReadAsArray(*[int(w) for w in window]).astype(np.float32)
+
+def read_geotiff_roi(tiff, window, no_data_values=(), roi_array=None, 
+                     strip_size=256):
+    """
+    Args:
+        tiff (gdal.Dataset): GeoTIFF dataset opened with :func:`open_geotiff`
+        window (list): read window [x_offset, y_offset, x_size, y_size] in GeoTIFF
+                       pixel coordinates (row 0 at the top)
+        no_data_values (list): grid values to be replaced by NaN
+        roi_array (numpy.ndarray): preallocated float32 grid of shape [x_size,y_size]
+                                   to read into; allocated here if None
+        strip_size (int): number of GeoTIFF rows read per GDAL call
+    
+    Read a window of a GeoTIFF grid straight into a float32 grid in slm 
+    orientation, i.e., indexed [x,y] with y increasing northwards.
+    
+    The window is read strip by strip into a small reused buffer (GDAL converts
+    the values to float32 as it reads), no-data values are set to NaN in the strip,
+    and the strip is then flipped and transposed into place.
+    Memory use is thus that of the window plus one strip: no full-size 
+    GeoTIFF-oriented or type-converted copies of the grid are made.
+    
+    Raises:
+        ValueError if the preallocated grid does not match the window.
+        
+    Returns:
+        numpy.ndarray: 
+        GeoTIFF (sub)grid as float32 in slm orientation
+    """          
+    x_offset, y_offset, x_size, y_size = [int(w) for w in window]
+    if roi_array is None:
+        roi_array = np.empty((x_size,y_size), dtype=np.float32)
+    elif roi_array.shape!=(x_size,y_size) or roi_array.dtype!=np.float32:
+        raise ValueError('Preallocated grid {0} {1} does not match read window {2}'
+                         .format(roi_array.shape, roi_array.dtype, window))
+    band = tiff.GetRasterBand(1)
+    strip_size = max(1,min(int(strip_size),y_size))
+    strip_buffer_array = np.empty((strip_size,x_size), dtype=np.float32)
+    for row in range(0,y_size,strip_size):
+        n_rows = min(strip_size,y_size-row)
+        strip_array = strip_buffer_array[:n_rows]
+        band.ReadAsArray(x_offset,y_offset+row,x_size,n_rows, buf_obj=strip_array)
+        for no_data_value in no_data_values:
+            strip_array[strip_array==no_data_value] = np.nan
+        # GeoTIFF rows run north to south: row r of the window is slm column y_size-1-r
+        roi_array[:,y_size-row-n_rows:y_size-row] = strip_array[::-1].T
+    return roi_array
+
+def read_geotiff(path, filename):
+    """
+    Args:
+        path (str): Path to folder containing GeoTIFF file to be read
+        filename (str): GeoTIFF filename
+    
+    Import a pixel grid from a GeoTIFF file along with its metadata.
+    
+    Assumes the file contains a single-band 2d grid of equal x-y dimension pixels.
+
+    Raises:
+        ValueError if file cannot be opened for reading.
+        
+    Returns:
+        numpy.ndarray, float: 
+        Imported GeoTIFF grid; size of a grid pixel in meters
+    """          
+    tiff, pixel_size = open_geotiff(path, filename)
+    return (read_geotiff_window(tiff), tiff, pixel_size)
+
+_np_to_gdal_type_dict = {
+    np.dtype('bool')    : gdal.GDT_Byte,
+    np.dtype('int8')    : gdal.GDT_Byte,
+    np.dtype('uint8')   : gdal.GDT_Byte,
+    np.dtype('int16')   : gdal.GDT_Int16,
+    np.dtype('uint16')  : gdal.GDT_UInt16,
+    np.dtype('int32')   : gdal.GDT_Int32,
+    np.dtype('uint32')  : gdal.GDT_UInt32,
+    np.dtype('float32') : gdal.GDT_Float32,
+    np.dtype('float64') : gdal.GDT_Float64
+    }
+        
+def geotiff_creation_options(dtype, compress='DEFLATE', predictor=True, 
+                             block_size=256, n_threads='ALL_CPUS'):
+    """
+    Args:
+        dtype (numpy.dtype): type of grid values
+        compress (str): GDAL GeoTIFF compression, e.g., 'DEFLATE', 'ZSTD', 'LZW'
+                        or 'NONE'
+        predictor (bool): apply horizontal differencing (integer grids) or 
+                          floating-point (float grids) predictor before compression
+        block_size (int): size of the internal square GeoTIFF tiles
+        n_threads (str): number of GDAL compression threads, e.g., 'ALL_CPUS' or '4'
+    
+    Generate GDAL creation options for an internally tiled, compressed GeoTIFF.
+    
+    Returns:
+        list: 
+        GDAL creation options
+    """          
+    options = ['TILED=YES', 'BIGTIFF=IF_SAFER',
+               'BLOCKXSIZE={}'.format(int(block_size)),
+               'BLOCKYSIZE={}'.format(int(block_size))]
+    compress = str(compress).upper()
+    if compress not in ('','NONE'):
+        options += ['COMPRESS={}'.format(compress),
+                    'NUM_THREADS={}'.format(n_threads)]
+        if predictor and compress in ('DEFLATE','ZSTD','LZW','LZMA'):
+            options += ['PREDICTOR={}'.format(3 if np.dtype(dtype).kind=='f' else 2)]
+    return options
+
+def write_geotiff(path, file_name, array, nx,ny,npd, pslice, geodata,
+                  compress='DEFLATE', predictor=True, block_size=256, 
+                  n_threads='ALL_CPUS', overview_levels=(), 
+                  overview_resampling='NEAREST', band_names=None):
     """
     Args:
         path (str): Path to folder containing GeoTIFF file to be read
         file_name (str): GeoTIFF filename
-        array (numpy.ndarray):  grid to be written
+        array (numpy.ndarray or list):  grid to be written, or list of grids
+                                        to be bundled as bands of one file;
+                                        a 3rd grid axis is written band by band
         nx (int): x dimension of grid
         ny (int): y dimension of grid
-        npd (int): depth (number of values) per pixel - not fully implemented
+        npd (int): depth (number of values) per pixel, i.e., number of bands 
         pslice (tuple): of form np.index_exp[xmin:xmax,ymin:ymax]
         geodata (obj): slm geodata object containing projection & transform metadata
+        compress (str): GDAL GeoTIFF compression, e.g., 'DEFLATE', 'ZSTD', 'LZW'
+                        or 'NONE'
+        predictor (bool): apply a predictor before compression
+        block_size (int): size of the internal square GeoTIFF tiles
+        n_threads (str): number of GDAL compression threads, e.g., 'ALL_CPUS'
+        overview_levels (list): decimation factors of internal overviews, e.g., 
+                                [2,4,8,16]; none are built if empty
+        overview_resampling (str): GDAL overview resampling method, e.g., 'NEAREST'
+        band_names (list): band descriptions
+    
+    Write an slm grid (or bundle of grids) of arbitrary type to an internally tiled, 
+    compressed GeoTIFF file with full geometadata and, optionally, 
+    internal overviews.
     
-    Write an slm grid of arbitrary type to a GeoTIFF file with full geometadata.
+    The grid is written strip by strip straight from strided views of the 
+    (padded) slm grid, so no full-size transposed copy is made.
+    A bundle is written with a common type that holds all its grids' values.
     
+    Raises:
+        ValueError if file cannot be opened for writing.
     """          
-#     Raises:
-#         ValueError if file cannot be opened for writing
+    array_list = list(array) if isinstance(array,(list,tuple)) else [array]
+    # One 2d slm-oriented view per band
+    band_list = []
+    for grid_array in array_list:
+        grid_array = grid_array[pslice]
+        if grid_array.ndim==2:
+            band_list += [grid_array]
+        else:
+            band_list += [grid_array[:,:,idx] for idx in range(grid_array.shape[2])]
+    dtype = np.result_type(*[np.uint8 if band_array.dtype==np.bool 
+                             else band_array.dtype for band_array in band_list])
     driver = gdal.GetDriverByName('GTiff')
-    np_to_gdal_type_dict = {
-        np.dtype('bool')    : gdal.GDT_Byte,
-        np.dtype('int8')    : gdal.GDT_Byte,
-        np.dtype('uint8')   : gdal.GDT_Byte,
-        np.dtype('int16')   : gdal.GDT_Int16,
-        np.dtype('uint16')  : gdal.GDT_UInt16,
-        np.dtype('int32')   : gdal.GDT_Int32,
-        np.dtype('uint32')  : gdal.GDT_UInt32,
-        np.dtype('float32') : gdal.GDT_Float32,
-        np.dtype('float64') : gdal.GDT_Float64
-        }
-    gdal_type = np_to_gdal_type_dict[array.dtype]
-    dataset = driver.Create(file_name,nx,ny,npd,gdal_type)
-    geotransform = geodata.tiff.GetGeoTransform()
+    options = geotiff_creation_options(dtype, compress=compress, predictor=predictor,
+                                       block_size=block_size, n_threads=n_threads)
+    dataset = driver.Create(file_name,int(nx),int(ny),len(band_list),
+                            _np_to_gdal_type_dict[np.dtype(dtype)], options=options)
+    if dataset is None:
+        raise ValueError('Cannot open GeoTIFF file "{}" for writing'.format(file_name))
     dataset.SetGeoTransform(geodata.roi_geotransform)
     dataset.SetProjection(geodata.tiff.GetProjection())
-    geotransform = geodata.tiff.GetGeoTransform()
-    rotated_array = np.flipud(array[pslice].T)
-    if array.dtype==np.bool:
-        dataset.GetRasterBand(1).WriteArray(rotated_array.astype(np.uint8))
-    else:
-        dataset.GetRasterBand(1).WriteArray(rotated_array)
+    for idx,band_array in enumerate(band_list):
+        band = dataset.GetRasterBand(idx+1)
+        _write_band_strips(band, band_array, 0, 0, dtype=dtype, 
+                           strip_size=block_size)
+        if band_names is not None and idx<len(band_names):
+            band.SetDescription(band_names[idx])
+    if len(overview_levels)>0:
+        # Overviews are compressed like the full-resolution grid
+        for option in options:
+            if option.startswith(('COMPRESS=','PREDICTOR=')):
+                key, value = option.split('=')
+                gdal.SetThreadLocalConfigOption(key+'_OVERVIEW', value)
+        gdal.SetThreadLocalConfigOption('GDAL_NUM_THREADS', str(n_threads))
+        try:
+            dataset.BuildOverviews(overview_resampling,
+                                   [int(level) for level in overview_levels])
+        finally:
+            for key in ('COMPRESS_OVERVIEW','PREDICTOR_OVERVIEW','GDAL_NUM_THREADS'):
+                gdal.SetThreadLocalConfigOption(key, None)
+    dataset.FlushCache()
+    # GDAL only completes writing when the dataset is dereferenced
+    del dataset
+
+def _write_band_strips(band, array, x_offset, y_offset_tiff, dtype=None, 
+                       strip_size=256):
+    """
+    Args:
+        band (gdal.Band): GeoTIFF band open for writing
+        array (numpy.ndarray): 2d (sub)grid in slm orientation, possibly a strided view
+        x_offset (int): x pixel offset of the window in the GeoTIFF grid
+        y_offset_tiff (int): y pixel offset of the window in the GeoTIFF grid,
+                             counted from the top (northern) edge
+        dtype (numpy.dtype): type to write (default: that of the grid, 
+                             or uint8 if boolean)
+        strip_size (int): number of GeoTIFF rows written per GDAL call
+    
+    Write an slm-oriented grid into a GeoTIFF band strip by strip of GeoTIFF rows,
+    flipping & transposing one strip at a time into a small reused buffer.
+    """
+    nx, ny = array.shape
+    if dtype is None:
+        dtype = np.uint8 if array.dtype==np.bool else array.dtype
+    strip_size = max(1,min(int(strip_size),ny))
+    strip_buffer_array = np.empty((strip_size,nx), dtype=dtype)
+    for row in range(0,ny,strip_size):
+        n_rows = min(strip_size,ny-row)
+        strip_array = strip_buffer_array[:n_rows]
+        # GeoTIFF rows run north to south: row r of the window is slm column ny-1-r
+        strip_array[...] = array[:,ny-row-n_rows:ny-row].T[::-1]
+        band.WriteArray(strip_array, int(x_offset), int(y_offset_tiff)+row)
+
+def create_tiled_geotiff(file_name, nx,ny,npd, dtype, geotransform, projection,
+                         block_size=256, options=None):
+    """
+    Args:
+        file_name (str): GeoTIFF filename (full path)
+        nx (int): x dimension of grid
+        ny (int): y dimension of grid
+        npd (int): number of bands
+        dtype (numpy.dtype): type of grid values
+        geotransform (list): GDAL geotransform of the grid
+        projection (str): GDAL projection (WKT) of the grid
+        block_size (int): size of the internal square GeoTIFF tiles
+        options (list): extra GDAL creation options
+    
+    Create an empty, internally tiled GeoTIFF file into which an slm grid 
+    can be written window by window with :func:`write_geotiff_window`.
+    
+    Raises:
+        ValueError if file cannot be opened for writing.
+
+    Returns:
+        gdal.Dataset: 
+        GeoTIFF dataset open for writing
+    """          
+    driver = gdal.GetDriverByName('GTiff')
+    creation_options = geotiff_creation_options(dtype, compress='NONE', 
+                                                block_size=block_size)
+    if options is not None:
+        creation_options += list(options)
+    dataset = driver.Create(file_name,int(nx),int(ny),int(npd),
+                            _np_to_gdal_type_dict[np.dtype(dtype)],
+                            options=creation_options)
+    if dataset is None:
+        raise ValueError('Cannot open GeoTIFF file "{}" for writing'.format(file_name))
+    dataset.SetGeoTransform(list(geotransform))
+    dataset.SetProjection(projection)
+    return dataset
+
+def write_geotiff_window(dataset, array, x_offset, y_offset):
+    """
+    Args:
+        dataset (gdal.Dataset): GeoTIFF dataset created by :func:`create_tiled_geotiff`
+        array (numpy.ndarray):  (sub)grid in slm orientation, i.e., indexed [x,y] 
+                                with y increasing northwards; a 3rd axis, if any,
+                                is written band by band
+        x_offset (int): x pixel offset of the window in the GeoTIFF grid
+        y_offset (int): y pixel offset of the window in the GeoTIFF grid,
+                        counted from the bottom (southern) edge as in slm
+    
+    Write an slm (sub)grid into a window of an open GeoTIFF file.
+    
+    """          
+    ny = dataset.RasterYSize
+    if array.ndim==2:
+        array = array[:,:,np.newaxis]
+    # GeoTIFF rows run north to south
+    y_offset_tiff = ny-int(y_offset)-array.shape[1]
+    for band in range(array.shape[2]):
+        _write_band_strips(dataset.GetRasterBand(band+1), array[:,:,band],
+                           x_offset, y_offset_tiff)
         
 def npamem(obj, name=None):  
     """
@@ -468,7 +853,7 @@ def vprint(verbose, *args, **kwargs):
         sys.stdout.flush()
 
 def create_seeds(mask, pad, n_work_items, n_seed_points=None,
-                 do_shuffle=True, rng_seed=1, verbose=False):
+                 do_shuffle=True, rng_seed=1, curve='none', verbose=False):
     """
     Args:
         mask (numpy.ndarray): pixel mask array
@@ -478,15 +863,20 @@ def create_seeds(mask, pad, n_work_items, n_seed_points=None,
         n_seed_points (int): number of seed points
         do_shuffle (bool): flag indicating whether to randomize the seed sequence
         rng_seed (int): initializer or "seed" value for RNG
+        curve (str): 'none', or 'morton' or 'hilbert' to order the seeds along
+                     that space-filling curve
         verbose (bool): verbose mode flag
 
     Generate a list (np array) of seed point coordinates defining the initial pixels
-    for each streamline trajectory. 
+    for each streamline trajectory.
     Only unmasked pixel locations are considered.
     If do_shuffle is True, the list of pixel coordinates is randomly ordered.
     The list length is set by n_seed_points; if not given, the default is to
     choose all unmasked pixels.
-    
+    If a space-filling curve is given, the (possibly randomly chosen) seed points
+    are then ordered along it, so that neighboring kernel instances trace from
+    neighboring pixels and thus read overlapping parts of the grids.
+
         
     Returns:
         numpy.ndarray, int, int: 
@@ -504,6 +894,10 @@ def create_seeds(mask, pad, n_work_items, n_seed_points=None,
         seed_point_array = seed_point_array[:n_seed_points].astype(np.float32)
     else:
         n_seed_points = seed_point_array.shape[0]
+    if curve!='none':
+        vprint(verbose,'ordering along {} curve...'.format(curve), end='')
+        seed_point_array = seed_point_array[np.argsort(
+            space_filling_curve_index(seed_point_array+pad, curve), kind='stable')]
 
     pad_length = (np.uint32(np.round(
                     n_seed_points/n_work_items+0.5))*n_work_items-n_seed_points)
@@ -516,6 +910,89 @@ def create_seeds(mask, pad, n_work_items, n_seed_points=None,
     vprint(verbose,'done')
     return seed_point_array.copy(), n_seed_points, n_padded_seed_points
 
+def space_filling_curve_index(xy_array, curve='hilbert'):
+    """
+    Args:
+        xy_array (numpy.ndarray): non-negative pixel coordinates, shape (n,2)
+        curve (str): 'morton' (Z-order) or 'hilbert'
+
+    Compute the position of each pixel along a space-filling curve spanning
+    the smallest power-of-two square enclosing the pixels.
+    Sorting by this index orders pixels such that those close along the curve
+    are close in the grid: a Morton curve jumps at each quadrant boundary,
+    whereas a Hilbert curve only ever steps to an adjacent pixel.
+
+    Raises:
+        ValueError if the curve is not recognized.
+
+    Returns:
+        numpy.ndarray:
+        curve index of each pixel, int64
+    """
+    x_array = np.round(xy_array[:,0]).astype(np.int64)
+    y_array = np.round(xy_array[:,1]).astype(np.int64)
+    n_bits = max(1,int(max(x_array.max(initial=0),y_array.max(initial=0))).bit_length())
+    if curve=='morton':
+        index_array = np.zeros_like(x_array)
+        for bit in range(n_bits):
+            index_array |= ((x_array>>bit)&1)<<(2*bit+1) | ((y_array>>bit)&1)<<(2*bit)
+        return index_array
+    elif curve!='hilbert':
+        raise ValueError('Unknown space-filling curve "{}"'.format(curve))
+    n = 1<<n_bits
+    index_array = np.zeros_like(x_array)
+    s = n//2
+    while s>0:
+        rx_array = ((x_array & s)>0).astype(np.int64)
+        ry_array = ((y_array & s)>0).astype(np.int64)
+        index_array += s*s*((3*rx_array)^ry_array)
+        # Rotate the quadrant
+        is_flip_array = (ry_array==0) & (rx_array==1)
+        x_array = np.where(is_flip_array, n-1-x_array, x_array)
+        y_array = np.where(is_flip_array, n-1-y_array, y_array)
+        is_swap_array = (ry_array==0)
+        x_array, y_array = (np.where(is_swap_array, y_array, x_array),
+                            np.where(is_swap_array, x_array, y_array))
+        s //= 2
+    return index_array
+
+def stratify_seeds(seed_point_array, n_rounds, stratum_size=8, rng_seed=1):
+    """
+    Args:
+        seed_point_array (numpy.ndarray): seed point coordinates array
+        n_rounds (int): number of rounds into which to split the seed points
+        stratum_size (int): width in pixels of the square strata (tiles)
+        rng_seed (int): initializer or "seed" value for RNG
+
+    Assign each seed point to one of n_rounds rounds of tracing, stratified by
+    square tiles of the grid such that each tile contributes as evenly as possible
+    to every round, i.e., such that the seed points of any round span the whole grid.
+    The seed points in each tile are randomly permuted and then dealt out to the rounds
+    in turn, starting from a random round: each seed point therefore falls in
+    any given round with probability 1/n_rounds, and the seed points of any k rounds
+    are a sample of k/n_rounds of them.
+    
+    Returns:
+        numpy.ndarray:
+        round index of each seed point, uint32
+    """
+    rng = np.random.RandomState(rng_seed)
+    n_seed_points = seed_point_array.shape[0]
+    tile_xy_array = (np.round(seed_point_array-seed_point_array.min(axis=0, initial=0))
+                     .astype(np.int64)//stratum_size)
+    tile_array = tile_xy_array[:,0]*(tile_xy_array[:,1].max(initial=0)+1)+tile_xy_array[:,1]
+    # Random order within each tile: sort by tile, then by a random key
+    order_array = np.lexsort((rng.random_sample(n_seed_points),tile_array))
+    tile_array = tile_array[order_array]
+    _, tile_start_array, tile_inverse_array \
+        = np.unique(tile_array, return_index=True, return_inverse=True)
+    rank_array = np.arange(n_seed_points)-tile_start_array[tile_inverse_array]
+    offset_array = rng.randint(n_rounds, size=tile_start_array.shape[0])
+    round_array = np.empty(n_seed_points, dtype=np.uint32)
+    round_array[order_array] \
+        = (rank_array+offset_array[tile_inverse_array])%n_rounds
+    return round_array
+
 def pick_seeds(mask=None, map=None, flag=None, pad=None):
     """
     Args:
@@ -570,6 +1047,66 @@ def compute_stats(traj_length_array, traj_nsteps_array, pixel_size, verbose):
     vprint(verbose,lnds_stats_df.T)
     return lnds_stats_df
 
+def lookup_labels(label_array, labels):
+    """
+    Args:
+        label_array (numpy.ndarray): labels to look up, e.g., a segment label grid
+        labels (numpy.ndarray): table of (unique) labels, in any order
+    
+    Find where each element of a label array appears in a table of labels,
+    using a binary search of the sorted table rather than one comparison
+    of the whole label array per table entry.
+
+    Returns:
+        numpy.ndarray, numpy.ndarray:
+        boolean array flagging elements whose label is in the table,
+        and table index of each such element
+    """  
+    labels = np.asarray(labels)
+    if labels.size==0:
+        return np.zeros(np.shape(label_array), dtype=np.bool), np.array([], dtype=np.intp)
+    sorter = np.argsort(labels, kind='stable')
+    sorted_labels = labels[sorter]
+    position_array = np.searchsorted(sorted_labels, label_array)
+    np.minimum(position_array, sorted_labels.size-1, out=position_array)
+    is_found_array = (sorted_labels[position_array]==label_array)
+    return is_found_array, sorter[position_array[is_found_array]]
+
+def compute_label_stats(label_array, value_array, labels):
+    """
+    Args:
+        label_array (numpy.ndarray): label of each value
+        value_array (numpy.ndarray): values to be summarized per label
+        labels (numpy.ndarray): labels for which to compute statistics
+    
+    Compute the count, mean and standard deviation of values grouped by label 
+    in a single pass of bin counts on table-indexed labels.
+    NaN values are ignored, and the standard deviation is that of a sample
+    (as for pandas groupby, which this replaces).
+
+    Returns:
+        numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray:
+        per-label flag for labels with any values, value count, mean 
+        and standard deviation 
+        (count is zero and mean, stddev are NaN for labels without values)
+    """  
+    n_labels = np.asarray(labels).size
+    is_found_array, index_array = lookup_labels(label_array, labels)
+    is_present_array = np.bincount(index_array, minlength=n_labels)>0
+    values = np.asarray(value_array)[is_found_array].astype(np.float64)
+    is_valid_array = ~np.isnan(values)
+    index_array, values = index_array[is_valid_array], values[is_valid_array]
+    count_array = np.bincount(index_array, minlength=n_labels)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_array = np.bincount(index_array, weights=values, 
+                                 minlength=n_labels)/count_array
+        # Second pass on deviations from the mean to avoid loss of precision
+        deviations = values-mean_array[index_array]
+        stddev_array = np.sqrt(np.bincount(index_array, weights=deviations**2, 
+                                           minlength=n_labels)/(count_array-1))
+    stddev_array[count_array<=1] = np.nan
+    return is_present_array, count_array, mean_array, stddev_array
+
 def dilate(array, n_iterations=1, out=None):
     """
     Args:
@@ -589,3 +1126,154 @@ def dilate(array, n_iterations=1, out=None):
     dilation_structure = generate_binary_structure(2, 2)
     return binary_dilation(array, structure=dilation_structure, 
                            iterations=n_iterations, output=out)
+
+def decimate_grid(array, factor, method='mean'):
+    """
+    Args:
+        array (numpy.ndarray): 2d pixel grid in slm [x,y] orientation
+        factor (int): decimation factor, i.e., number of pixels per coarse pixel
+                      along each axis
+        method (str): 'mean' to average each factor x factor block ignoring NaNs,
+                      or 'nearest' to take its first (bottom-left) pixel, e.g., 
+                      for labels and flags
+    
+    Downsample a grid by an integer factor. 
+    The coarse grid covers all of the grid, so its last row/column of blocks 
+    can be partial: when averaging, the grid is padded with NaNs up to a 
+    multiple of the factor. Blocks that are all NaN average to NaN.
+
+    Raises:
+        ValueError if the method is not recognized.
+
+    Returns:
+        numpy.ndarray: 
+        decimated grid of shape ceil(nx/factor) x ceil(ny/factor)
+    """  
+    factor = int(factor)
+    if factor<=1:
+        return array
+    nx, ny = array.shape
+    nx_coarse, ny_coarse = -(-nx//factor), -(-ny//factor)
+    if method=='nearest':
+        return array[::factor,::factor].copy()
+    elif method!='mean':
+        raise ValueError('Unknown decimation method "{}"'.format(method))
+    padded_array = np.full((nx_coarse*factor,ny_coarse*factor), np.nan, 
+                           dtype=np.result_type(array.dtype,np.float32))
+    padded_array[:nx,:ny] = array
+    block_array = padded_array.reshape(nx_coarse,factor,ny_coarse,factor)
+    is_valid_array = ~np.isnan(block_array)
+    count_array = np.count_nonzero(is_valid_array, axis=(1,3))
+    sum_array = np.sum(np.where(is_valid_array,block_array,0), axis=(1,3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sum_array/count_array).astype(padded_array.dtype)
+
+# Angle code marking a null (zero) flow vector, e.g., at a masked pixel
+UV_NULL_ANGLE = 0xFFFF
+
+def encode_uv_field(uv_array, uv_encoding='float32'):
+    """
+    Args:
+        uv_array (numpy.ndarray): flow velocity vector grid, shape (nx,ny,2), float32
+        uv_encoding (str): 'float32' (no encoding), 'half' to store each (u,v) 
+                           as a pair of float16, or 'angle' to store each 
+                           unit vector as its direction quantized to 16 bits
+    
+    Encode a flow velocity vector grid compactly for the tracing kernels, which
+    decode it on the fly (see ``essentials.cl``). 
+    Half precision halves, and angles quarter, the memory footprint and bandwidth 
+    of the grid; angle coding only makes sense for unit vectors 
+    (``do_normalize_speed``), and null vectors are coded as ``UV_NULL_ANGLE``.
+
+    Raises:
+        ValueError if the encoding is not recognized.
+
+    Returns:
+        numpy.ndarray: 
+        encoded grid, of shape (nx,ny,2) float32 or float16, or (nx,ny) uint16
+    """  
+    if uv_encoding=='float32':
+        return uv_array
+    elif uv_encoding=='half':
+        return uv_array.astype(np.float16)
+    elif uv_encoding!='angle':
+        raise ValueError('Unknown uv encoding "{}"'.format(uv_encoding))
+    u_array = uv_array[:,:,0].astype(np.float64)
+    v_array = uv_array[:,:,1].astype(np.float64)
+    angle_array = np.arctan2(v_array,u_array)+np.pi
+    code_array = np.round(angle_array*(UV_NULL_ANGLE/(2*np.pi))).astype(np.uint32)
+    code_array = (code_array%UV_NULL_ANGLE).astype(np.uint16)
+    code_array[(u_array==0) & (v_array==0)] = UV_NULL_ANGLE
+    return code_array
+
+def decode_uv_field(uv_code_array, uv_encoding='float32'):
+    """
+    Args:
+        uv_code_array (numpy.ndarray): flow velocity vector grid encoded by 
+                                       :func:`encode_uv_field`
+        uv_encoding (str): 'float32', 'half' or 'angle'
+    
+    Decode a compactly encoded flow velocity vector grid, as the tracing kernels do.
+
+    Raises:
+        ValueError if the encoding is not recognized.
+
+    Returns:
+        numpy.ndarray: 
+        flow velocity vector grid, shape (nx,ny,2), float32
+    """  
+    if uv_encoding=='float32':
+        return uv_code_array
+    elif uv_encoding=='half':
+        return uv_code_array.astype(np.float32)
+    elif uv_encoding!='angle':
+        raise ValueError('Unknown uv encoding "{}"'.format(uv_encoding))
+    angle_array = uv_code_array*np.float32(2*np.pi/UV_NULL_ANGLE)-np.float32(np.pi)
+    uv_array = np.stack([np.cos(angle_array),np.sin(angle_array)],axis=-1) \
+                .astype(np.float32)
+    uv_array[uv_code_array==UV_NULL_ANGLE] = 0.0
+    return uv_array
+
+def tile_grid(array, tile_size):
+    """
+    Args:
+        array (numpy.ndarray): grid, shape (nx,ny) or (nx,ny,...)
+        tile_size (int): width of the square tiles in pixels
+    
+    Rearrange a grid into square tiles, each stored contiguously, in row-major
+    order of tiles, for the tracing kernels (see ``UV_IDX`` in ``essentials.cl``).
+    A bilinear interpolation or a diagonal integration step then mostly reads 
+    from within one tile rather than from rows far apart in memory.
+    The grid is zero-padded to a whole number of tiles.
+
+    Returns:
+        numpy.ndarray: 
+        tiled grid, shape (ceil(nx/tile_size),ceil(ny/tile_size),
+        tile_size,tile_size,...)
+    """  
+    nx, ny, tile_size = array.shape[0], array.shape[1], int(tile_size)
+    n_tiles_x, n_tiles_y = -(-nx//tile_size), -(-ny//tile_size)
+    padded_array = np.zeros((n_tiles_x*tile_size,n_tiles_y*tile_size)+array.shape[2:],
+                            dtype=array.dtype)
+    padded_array[:nx,:ny] = array
+    return np.ascontiguousarray(padded_array.reshape((n_tiles_x,tile_size,
+                                                      n_tiles_y,tile_size)
+                                                     +array.shape[2:]).swapaxes(1,2))
+
+def untile_grid(tiled_array, nx, ny):
+    """
+    Args:
+        tiled_array (numpy.ndarray): grid tiled by :func:`tile_grid`
+        nx (int): number of grid rows before tiling
+        ny (int): number of grid columns before tiling
+    
+    Undo the rearrangement of a grid into square tiles by :func:`tile_grid`.
+
+    Returns:
+        numpy.ndarray: 
+        grid, shape (nx,ny,...)
+    """  
+    n_tiles_x, n_tiles_y, tile_size = tiled_array.shape[:3]
+    return np.ascontiguousarray(tiled_array.swapaxes(1,2).reshape(
+                                    (n_tiles_x*tile_size,n_tiles_y*tile_size)
+                                    +tiled_array.shape[4:])[:nx,:ny])
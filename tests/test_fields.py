@@ -0,0 +1,94 @@
+"""
+---------------------------------------------------------------------
+
+Tests of streamline field integration: merging downstream streamlines
+into the flow graph (memoization) must approximate brute-force integration.
+
+Requires Python packages/modules:
+  -  :mod:`pytest`
+  -  :mod:`PyOpenCL <pyopencl>`
+
+---------------------------------------------------------------------
+
+"""
+
+import os
+import json
+import numpy as np
+
+from streamlines.fields      import Fields
+from streamlines.useful      import Data, Info, get_bbox
+from streamlines.streamlining import Streamlining
+
+pdebug = print
+
+defaults_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..','json','defaults.json')
+
+def _make_uv(nx=60, ny=50, pad=2):
+    """
+    Build the unit flow vector field (padded) down a synthetic terrain of
+    winding valleys, along which streamlines converge, and its mask.
+    """
+    x = np.arange(nx, dtype=np.float64)[:,np.newaxis]
+    y = np.arange(ny, dtype=np.float64)[np.newaxis,:]
+    z_array = (40*np.abs(np.sin(x/22.0))+0.6*(ny-y)
+               +5*np.sin(y/9.0)*np.cos(x/13.0)+0.5*np.sin(x*y/37.0))
+    gx_array, gy_array = np.gradient(z_array)
+    speed_array = np.sqrt(gx_array**2+gy_array**2)
+    uv_array = np.zeros((nx+2*pad,ny+2*pad,2), dtype=np.float32)
+    uv_array[pad:-pad,pad:-pad,0] = -gx_array/speed_array
+    uv_array[pad:-pad,pad:-pad,1] = -gy_array/speed_array
+    mask_array = np.ones((nx+2*pad,ny+2*pad), dtype=bool)
+    mask_array[pad:-pad,pad:-pad] = False
+    return uv_array, mask_array
+
+def _integrate(trace_dict, monkeypatch):
+    """
+    Integrate the raw downstream slc, slt fields over the synthetic terrain,
+    recording the number of streamlines merged, if any.
+    """
+    override_dict = {'state' : {'cl_platform' : 0, 'cl_device' : 0,
+                                'do_git_info' : False},
+                     'trace' : trace_dict}
+    sl = Streamlining(parameters_file=defaults_file,
+                      override_parameters=json.dumps(override_dict))
+    pad = sl.geodata.pad_width
+    uv_array, mask_array = _make_uv(pad=pad)
+    bbox, bnx, bny = get_bbox(~mask_array)
+    info = Info(sl.state, sl.trace, 1.0)
+    info.set_xy(bnx,bny, pad)
+    data = Data(info=info, bbox=bbox, pad=pad, mask_array=mask_array,
+                uv_array=uv_array,
+                mapping_array=np.zeros(mask_array.shape, dtype=np.uint32))
+    fields = Fields(sl.state.cl_platform, sl.state.cl_device,
+                    cl_src_path=sl.state.cl_src_path, info=info, data=data)
+    n_merged_list = []
+    add_memo_remainders = Fields.add_memo_remainders
+    def record_memo_remainders(self, *args):
+        # Counts of streamlines merged at each pixel, then their lengths
+        n_merged_list.append(int(np.sum(args[-2], dtype=np.int64)))
+        add_memo_remainders(self, *args)
+    monkeypatch.setattr(Fields, 'add_memo_remainders', record_memo_remainders)
+    fields.integrate(do_postprocess=False)
+    n_streamlines = info.n_seed_points*info.subpixel_seed_point_density**2
+    return (fields.data.slc_array[:,:,0].astype(np.float64),
+            fields.data.slt_array[:,:,0].astype(np.float64),
+            sum(n_merged_list)/n_streamlines)
+
+def test_memo_fields_match_brute_force(monkeypatch):
+    reference_slc_array, reference_slt_array, _ \
+        = _integrate({'do_memoize_fields' : False}, monkeypatch)
+    slc_array, slt_array, merged_fraction \
+        = _integrate({'do_memoize_fields' : True, 'memo_min_length' : 5.0,
+                      'memo_flow_scheme'  : 'mfd', 'mfd_exponent' : 4.0}, monkeypatch)
+    # Most streamlines must have been merged for the test to mean anything
+    assert merged_fraction>0.5
+    is_traced_array = reference_slc_array>0
+    for array, reference_array in [[slc_array,reference_slc_array],
+                                   [slt_array,reference_slt_array]]:
+        error_array = (array-reference_array)[is_traced_array]
+        reference_rms = np.sqrt(np.mean(reference_array[is_traced_array]**2))
+        # Merging along single-pixel successor chains gives errors of ~70-100% here
+        assert np.sqrt(np.mean(error_array**2))/reference_rms<0.25
+        assert abs(np.sum(array)/np.sum(reference_array)-1.0)<0.05
@@ -0,0 +1,122 @@
+"""
+---------------------------------------------------------------------
+
+Tests of HSL mapping pass#2: serial and multithreaded mapping of the
+coarse subsegments must give the same results.
+
+Requires Python packages/modules:
+  -  :mod:`pytest`
+
+---------------------------------------------------------------------
+
+"""
+
+import numpy  as np
+import pandas as pd
+import time
+import types
+import pytest
+
+import streamlines.mapping as mapping
+from streamlines.mapping import Mapping
+from streamlines.useful  import Data
+
+pdebug = print
+
+class _State():
+    """
+    Stand-in for :class:`.State` providing just the masking used by pass#2.
+    """
+    def __init__(self, mask_array):
+        self.verbose = False
+        self.mask_array = mask_array
+        self.cl_src_path, self.cl_platform, self.cl_device = None, 0, 0
+    def add_active_mask(self, mask_dict):
+        pass
+    def reset_active_masks(self):
+        pass
+    def merge_active_masks(self):
+        return self.mask_array.copy()
+
+class _ClState():
+    """
+    Stand-in for :class:`.Initialize_cl`.
+    """
+    def __init__(self, *args):
+        self.buffer_pool = types.SimpleNamespace(release=lambda name=None: None)
+
+def _map_coarse_subsegment(self, coarse_subsegment, idx, n_segments,
+                           base_mask_array, mapping_array):
+    """
+    Deterministic stand-in for :meth:`.Mapping._map_coarse_subsegment`, whose
+    results depend on the mapping grid within the subsegment's real mapping window.
+    """
+    pad = self.geodata.pad_width
+    nxp, nyp = base_mask_array.shape
+    raw_mask_array     = np.zeros((nxp,nyp), dtype=bool)
+    dilated_mask_array = np.zeros((nxp,nyp), dtype=bool)
+    is_left_or_right = ('left' if coarse_subsegment<0 else 'right')
+    bbox, nxb,nyb \
+        = self.make_coarse_subsegment_masks(coarse_subsegment, is_left_or_right,
+                                            raw_mask_array, dilated_mask_array)
+    data = Data(bbox=bbox, pad=pad, mapping_array=mapping_array,
+                mask_array=base_mask_array|dilated_mask_array)
+    # Scramble the order in which subsegments complete
+    time.sleep(0.002*((7*idx)%5))
+    flags = int(np.bitwise_or.reduce(data.mapping_array.ravel()))
+    data.mapping_array |= np.uint32(1<<(idx%31))
+    bounds = data.bounds_grid
+    return {'bounds'         : bounds,
+            'keep_array'     : ~(base_mask_array|raw_mask_array)[bounds],
+            'hsl_array'      : np.full(data.mapping_array.shape,
+                                       float(flags%1009)+idx, dtype=np.float32),
+            'mapping_array'  : data.mapping_array,
+            'trace_mean_hsl' : float(flags%997),
+            'hsl_stats_df'   : pd.DataFrame({'count'    : [2+idx],
+                                             'mean [m]' : [10.0+flags%13]})}
+
+def _make_mapping(n_pass2_workers, nx=7, ny=6, size=9, pad=2):
+    """
+    Build a mapping instance ready for pass#2 on a grid of nx*ny square coarse
+    subsegments, alternately left and right flanks.
+    """
+    nxp, nyp = nx*size+2*pad, ny*size+2*pad
+    coarse_subsegment_array = np.zeros((nxp,nyp), dtype=np.int32)
+    for i in range(nx):
+        for j in range(ny):
+            label = (i*ny+j+1)*(-1 if (i+j)%2 else 1)
+            coarse_subsegment_array[pad+i*size:pad+(i+1)*size,
+                                    pad+j*size:pad+(j+1)*size] = label
+    mask_array = np.ones((nxp,nyp), dtype=bool)
+    mask_array[pad:-pad,pad:-pad] = False
+    mp = Mapping.__new__(Mapping)
+    mp.state = _State(mask_array)
+    mp.geodata = types.SimpleNamespace(pad_width=pad, roi_nx=nx*size, roi_ny=ny*size)
+    mp.verbose = mp.vbackup = mp.vprogress = False
+    mp.n_pass2_workers = n_pass2_workers
+    mp._thread_local = mapping.threading.local()
+    mp.cl_state = _ClState()
+    mp.coarse_subsegment_array = coarse_subsegment_array
+    mp.coarse_subsegments_list_array = np.unique(
+                            coarse_subsegment_array[coarse_subsegment_array!=0])
+    mp.n_coarse_subsegments = mp.coarse_subsegments_list_array.size
+    mp.merged_coarse_mask_array = mask_array.copy()
+    mp.mapping_array = np.zeros((nxp,nyp), dtype=np.uint32)
+    mp.find_coarse_subsegment_bboxes()
+    return mp
+
+@pytest.mark.parametrize('n_pass2_workers', [2,4,8])
+def test_pass2_workers_match_serial(monkeypatch, n_pass2_workers):
+    monkeypatch.setattr(mapping, 'Initialize_cl', _ClState)
+    monkeypatch.setattr(Mapping, '_map_coarse_subsegment', _map_coarse_subsegment)
+    serial_mp   = _make_mapping(1)
+    threaded_mp = _make_mapping(n_pass2_workers)
+    # Some subsegments depend on previous ones and some don't
+    last_dependency_array = threaded_mp.find_pass2_dependencies()
+    assert np.any(last_dependency_array<0) and np.any(last_dependency_array>=0)
+    serial_mp.pass2()
+    threaded_mp.pass2()
+    assert np.array_equal(serial_mp.hsl_array, threaded_mp.hsl_array)
+    assert np.array_equal(serial_mp.mapping_array, threaded_mp.mapping_array)
+    assert np.array_equal(serial_mp.hsl_mean_array, threaded_mp.hsl_mean_array)
+    pd.testing.assert_frame_equal(serial_mp.hsl_stats_df, threaded_mp.hsl_stats_df)
@@ -0,0 +1,38 @@
+"""
+---------------------------------------------------------------------
+
+Tests of building the ``slm`` workflow.
+
+Requires Python packages/modules:
+  -  :mod:`pytest`
+  -  :mod:`PyOpenCL <pyopencl>`
+
+---------------------------------------------------------------------
+
+"""
+
+import os
+import pyopencl as cl
+import pytest
+
+from streamlines import pocl
+from streamlines.streamlining import Streamlining
+
+pdebug = print
+
+defaults_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..','json','defaults.json')
+
+def test_numba_workflow_without_opencl(monkeypatch):
+    # No OpenCL platform, hence no device, is available
+    monkeypatch.setattr(cl, 'get_platforms', lambda: [])
+    monkeypatch.setattr(pocl, '_context_cache', {})
+    monkeypatch.setenv('_', 'pytest')
+    sl = Streamlining(parameters_file=defaults_file,
+                      override_parameters='{"state" : {"compute_backend" : "numba",'
+                                          ' "cl_device" : 2, "do_git_info" : false}}')
+    assert sl.state.compute_backend=='numba'
+    # No OpenCL state is created until a mapping kernel needs one
+    assert sl.mapping._cl_state is None
+    with pytest.raises(IndexError):
+        sl.mapping.cl_state